@@ -0,0 +1,321 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# This file runs the exporter against synthetic guilds (ds_fixtures.py) of a
+# few sizes and records wall time, peak RSS and allocations for each function.
+# Results can be compared against an earlier run, in which case the exit code
+# is 1 if any measurement got worse by more than its threshold.
+#
+# Example:
+#   python bench_export.py --tier small --tier medium --json bench.json
+#   python bench_export.py --baseline bench.json --threshold seconds=1.5
+
+import sys
+import json
+import time
+import logging
+import platform
+import argparse
+import resource
+import tempfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import discord_server_exporter as dse
+from ds_fixtures import generate_guild, guild_presets
+from ds_validation import SchemaRegistry
+
+LOG_LEVEL = logging.WARNING
+LOG_FORMAT = "[%(levelname)s] %(asctime)s %(name)s: %(message)s"
+LOG_DATE_FORMAT = "[%Y/%m/%d %H:%M:%S]"
+
+# Maximum ratio of new to baseline value before a measurement is a regression
+default_thresholds = {"seconds": 1.25, "rss_peak_kb": 1.25, "alloc_peak_bytes": 1.10}
+
+# Timings below this are mostly noise and are never reported as regressions
+min_seconds = 0.005
+
+
+def bench_dump_server(guild):
+    # Members are only exported to the schema file, so it is written too
+    with tempfile.TemporaryDirectory(prefix="bench_export_") as directory:
+        dse.dump_server(
+            guild,
+            export_emojis=False,
+            export_server_icon=False,
+            export_files_dir=directory,
+            export_members=True,
+        )
+
+
+def bench_dump_server_no_members(guild):
+    with tempfile.TemporaryDirectory(prefix="bench_export_") as directory:
+        dse.dump_server(
+            guild,
+            export_emojis=False,
+            export_server_icon=False,
+            export_files_dir=directory,
+        )
+
+
+def bench_dump_categories(guild):
+    dse.dump_categories(guild)
+
+
+def bench_get_permission_overrides(guild):
+    for channel in guild.channels:
+        dse.get_permission_overrides(channel)
+
+
+def bench_dump_members(guild):
+    dse.dump_members(guild)
+
+
+_exported = {}
+
+
+def _exported_server(guild) -> dict:
+    # Exported once, so the validation benchmarks measure only validation
+    if guild.id not in _exported:
+        with tempfile.TemporaryDirectory(prefix="bench_export_") as directory:
+            dse.dump_server(
+                guild,
+                export_emojis=False,
+                export_server_icon=False,
+                export_files_dir=directory,
+                export_members=True,
+            )
+            with open(f"{directory}/schemas/{guild.id}.json") as f:
+                _exported[guild.id] = json.load(f)
+    return _exported[guild.id]
+
+
+_registries = {
+    "generated": SchemaRegistry(generated=True),
+    "jsonschema": SchemaRegistry(generated=False),
+}
+
+
+def bench_validate_server(guild):
+    _registries["generated"].validate_server(_exported_server(guild))
+
+
+def bench_validate_server_jsonschema(guild):
+    _registries["jsonschema"].validate_server(_exported_server(guild))
+
+
+benchmarks = {
+    "dump_server": bench_dump_server,
+    # The same without members; the difference in peak is what members add
+    "dump_server_no_members": bench_dump_server_no_members,
+    "dump_categories": bench_dump_categories,
+    "get_permission_overrides": bench_get_permission_overrides,
+    "dump_members": bench_dump_members,
+    "validate_server": bench_validate_server,
+    # The same through jsonschema, to compare against
+    "validate_server_jsonschema": bench_validate_server_jsonschema,
+}
+
+
+"""
+Run one benchmark on a guild of the given tier in this process.
+
+Return: dict with
+    seconds -- best wall time out of `repeat` runs
+    rss_peak_kb -- peak RSS of the process after the runs, in KiB
+    rss_growth_kb -- how much the peak RSS grew while running the benchmark
+    alloc_peak_bytes -- peak memory allocated by Python during one run
+    alloc_blocks -- memory blocks still allocated after one run
+    alloc_peak_per_member -- `alloc_peak_bytes` over the members of the guild
+
+Arguments:
+    tier -- a key of ds_fixtures.guild_presets
+    name -- a key of `benchmarks`
+    repeat -- amount of timed runs
+    seed -- seed for the generated guild
+"""
+
+
+def measure(tier: str, name: str, repeat=3, seed=0) -> dict:
+    logging.getLogger().setLevel(LOG_LEVEL)
+    guild = generate_guild(seed=seed, **guild_presets[tier])
+    func = benchmarks[name]
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(guild)
+        times.append(time.perf_counter() - start)
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Tracing slows everything down, so it gets a run of its own
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        func(guild)
+        _, alloc_peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+
+    return {
+        "seconds": min(times),
+        "rss_peak_kb": rss_after,
+        "rss_growth_kb": rss_after - rss_before,
+        "alloc_peak_bytes": alloc_peak,
+        "alloc_blocks": blocks,
+        "alloc_peak_per_member": alloc_peak / max(len(guild.members), 1),
+    }
+
+
+"""
+Run benchmarks, each in a fresh process so peak RSS is not carried over from
+the one before.
+
+Return: dict of tier to dict of benchmark name to the result of `measure`
+"""
+
+
+def run_benchmarks(tiers, names, repeat=3, seed=0) -> dict:
+    results = {}
+    for tier in tiers:
+        results[tier] = {}
+        for name in names:
+            logging.info(f"Running {name} on the {tier} guild")
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                results[tier][name] = pool.submit(
+                    measure, tier, name, repeat, seed
+                ).result()
+    return results
+
+
+"""
+Compare results against a baseline.
+
+Return: list of regression descriptions, empty if there are none
+
+Arguments:
+    results -- the output of `run_benchmarks`
+    baseline -- an earlier output of `run_benchmarks`
+    thresholds -- dict of measurement to maximum ratio of new to old value.
+                  Measurements missing from it are not checked.
+"""
+
+
+def compare_results(
+    results: dict, baseline: dict, thresholds=default_thresholds
+) -> list:
+    regressions = []
+    for tier, tier_results in results.items():
+        for name, result in tier_results.items():
+            old = baseline.get(tier, {}).get(name)
+            if old is None:
+                continue
+            for key, limit in thresholds.items():
+                if key not in result or not old.get(key):
+                    continue
+                if key == "seconds" and result[key] < min_seconds:
+                    continue
+                ratio = result[key] / old[key]
+                if ratio > limit:
+                    regressions.append(
+                        f"{tier}/{name}: {key} went from {old[key]:.6g} to {result[key]:.6g} ({ratio:.2f}x, limit {limit}x)"
+                    )
+    return regressions
+
+
+def print_results(results: dict):
+    print(
+        f"{'tier':<8}{'function':<26}{'seconds':>10}{'peak RSS KiB':>14}{'alloc peak':>14}{'per member':>12}{'blocks':>10}"
+    )
+    for tier, tier_results in results.items():
+        for name, res in tier_results.items():
+            print(
+                f"{tier:<8}{name:<26}{res['seconds']:>10.4f}{res['rss_peak_kb']:>14}{res['alloc_peak_bytes']:>14}{res.get('alloc_peak_per_member', 0):>12.0f}{res['alloc_blocks']:>10}"
+            )
+
+
+def parse_threshold(value: str):
+    key, _, ratio = value.partition("=")
+    if key not in default_thresholds or not ratio:
+        raise argparse.ArgumentTypeError(
+            f"expected one of {', '.join(default_thresholds)} followed by =ratio"
+        )
+    return key, float(ratio)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the exporter against synthetic guilds"
+    )
+    parser.add_argument(
+        "--tier", action="append", choices=list(guild_presets), default=None
+    )
+    parser.add_argument(
+        "--function", action="append", choices=list(benchmarks), default=None
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run")
+    parser.add_argument(
+        "--threshold",
+        action="append",
+        type=parse_threshold,
+        default=[],
+        help="override a regression threshold, e.g. seconds=1.5",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+    tiers = args.tier or ["small", "medium"]
+    results = run_benchmarks(
+        tiers, args.function or list(benchmarks), args.repeat, args.seed
+    )
+    print_results(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "created": time.time(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        thresholds = dict(default_thresholds)
+        thresholds.update(args.threshold)
+        regressions = compare_results(results, baseline, thresholds)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# This file runs the importer against a fake Discord API (ds_fake_discord.py)
+# and reports how many requests, 429s and how much time each import strategy
+# takes.  No token or network access is needed.
+#
+# Example:
+#   python bench_import.py --roles 50 --categories 10 --emojis 20 --json bench.json
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+
+import discord_server_importer as dsi
+import ds_fanout
+from ds_fake_discord import FakeDiscordAPI, LatencyModel, fake_discord
+
+LOG_LEVEL = logging.WARNING
+LOG_FORMAT = "[%(levelname)s] %(asctime)s %(name)s: %(message)s"
+LOG_DATE_FORMAT = "[%Y/%m/%d %H:%M:%S]"
+
+# Smallest header discord.py accepts as a PNG
+png_header = b"\x89PNG\r\n\x1a\n"
+
+
+"""
+Generate a server dict following the server schema.  Emoji images are put on
+the fake CDN of `api`.
+
+Arguments:
+    api -- a started FakeDiscordAPI
+    roles -- amount of roles including @everyone
+    categories -- amount of categories, plus one for uncategorized channels
+    channels -- text and voice channels per category
+    emojis -- amount of emojis
+    overrides -- role permission overrides per channel
+"""
+
+
+def generate_server_dict(
+    api: FakeDiscordAPI,
+    roles=20,
+    categories=5,
+    channels=4,
+    emojis=10,
+    overrides=2,
+    seed=0,
+) -> dict:
+    rnd = random.Random(seed)
+    server = {
+        "name": "benchmark server",
+        "id": api.snowflake(),
+        "icon_url": "",
+        "voice_region": "us-west",
+        "join_broadcast": True,
+        "boost_broadcast": True,
+        "default_notifications": False,
+        "verification_level": 0,
+        "content_filter": 0,
+    }
+
+    server["roles"] = [
+        {
+            "name": "@everyone" if pos == 0 else f"role {pos}",
+            "color": rnd.randrange(1 << 24),
+            "mentionable": rnd.random() < 0.5,
+            "position": pos,
+            "id": api.snowflake(),
+            "hoist": rnd.random() < 0.2,
+            "permission_value": str(rnd.randrange(1 << 31)),
+        }
+        for pos in range(roles)
+    ]
+
+    def role_overrides():
+        res = []
+        for role in rnd.sample(server["roles"], min(overrides, roles)):
+            res.append(
+                {
+                    "id": role["id"],
+                    "name": role["name"],
+                    "position": role["position"],
+                    "permissions": {"read_messages": rnd.random() < 0.5},
+                }
+            )
+        return res
+
+    def text_channel(idx):
+        return {
+            "name": f"text-{idx}",
+            "slowmode": 0,
+            "nsfw": False,
+            "topic": f"topic {idx}",
+            "id": api.snowflake(),
+            "role_permission_overrides": role_overrides(),
+            "user_permission_overrides": [],
+        }
+
+    def voice_channel(idx):
+        return {
+            "name": f"voice-{idx}",
+            "bitrate": 64000,
+            "user_limit": 0,
+            "id": api.snowflake(),
+            "role_permission_overrides": role_overrides(),
+            "user_permission_overrides": [],
+        }
+
+    server["categories"] = []
+    for cat in range(categories + 1):
+        half = channels // 2
+        server["categories"].append(
+            {
+                # The first category holds the uncategorized channels
+                "name": "" if cat == 0 else f"category {cat}",
+                "text_channels": [text_channel(i) for i in range(channels - half)],
+                "voice_channels": [voice_channel(i) for i in range(half)],
+                "role_permission_overrides": role_overrides() if cat else [],
+                "user_permission_overrides": [],
+            }
+        )
+
+    server["emojis"] = []
+    for idx in range(emojis):
+        data = png_header + rnd.getrandbits(8 * 512).to_bytes(512, "little")
+        server["emojis"].append(
+            {"name": f"emoji_{idx}", "url": api.add_cdn_asset(data)}
+        )
+
+    return server
+
+
+# Strategies.  Each one gets a logged in client, the fake API and a server dict.
+
+
+async def strategy_create_server(bot, api, server):
+    await dsi.create_server(bot, server)
+
+
+async def strategy_create_server_from_file(bot, api, server):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "server.json")
+        with open(path, "w") as f:
+            json.dump(server, f)
+        await dsi.create_server_from_file(bot, path)
+
+
+async def _existing_copy(bot, api, server):
+    # Import once without counting, then sync again on top of it
+    guild = await dsi.create_server(bot, server)
+    return await bot.fetch_guild(guild.id)
+
+
+async def strategy_resync_roles(bot, api, server):
+    guild = await _existing_copy(bot, api, server)
+    api.reset_stats()
+    await dsi.write_roles(guild, server["roles"], overwrite_prompt=False)
+
+
+async def strategy_resync_emojis(bot, api, server):
+    guild = await _existing_copy(bot, api, server)
+    api.reset_stats()
+    await dsi.write_emojis(guild, server["emojis"], overwrite_prompt=False)
+
+
+async def strategy_clone_to_3_guilds(bot, api, server):
+    target_ids = [api.add_guild(f"target {i}")["id"] for i in range(3)]
+    await ds_fanout.clone_to_guilds(bot, server, target_ids)
+
+
+strategies = {
+    "create_server": strategy_create_server,
+    "create_server_from_file": strategy_create_server_from_file,
+    "resync_roles": strategy_resync_roles,
+    "resync_emojis": strategy_resync_emojis,
+    "clone_to_3_guilds": strategy_clone_to_3_guilds,
+}
+
+
+"""
+Run one strategy against a fresh fake API.
+
+Return: dict with requests, rate_limited (429s), seconds and requests per route
+"""
+
+
+async def run_strategy(name: str, args) -> dict:
+    latency = LatencyModel(args.latency, args.jitter, seed=args.seed)
+    api = FakeDiscordAPI(latency, window_scale=args.window_scale)
+
+    async with fake_discord(api) as bot:
+        server = generate_server_dict(
+            api,
+            args.roles,
+            args.categories,
+            args.channels,
+            args.emojis,
+            args.overrides,
+            args.seed,
+        )
+        api.reset_stats()
+        await strategies[name](bot, api, server)
+        # Strategies that need setup reset the stats after it
+        seconds = time.perf_counter() - api.stats["started"]
+
+    return {
+        "requests": api.stats["requests"],
+        "rate_limited": api.stats["rate_limited"],
+        "seconds": seconds,
+        "routes": dict(api.stats["routes"]),
+    }
+
+
+def print_results(results: dict):
+    print(f"{'strategy':<26}{'requests':>10}{'429s':>8}{'seconds':>10}")
+    for name, res in results.items():
+        print(
+            f"{name:<26}{res['requests']:>10}{res['rate_limited']:>8}{res['seconds']:>10.2f}"
+        )
+        for route, count in sorted(res["routes"].items(), key=lambda r: -r[1]):
+            print(f"    {count:>6}  {route}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the importer against a fake Discord API"
+    )
+    parser.add_argument("--roles", type=int, default=20)
+    parser.add_argument("--categories", type=int, default=5)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--emojis", type=int, default=10)
+    parser.add_argument("--overrides", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument(
+        "--window-scale",
+        type=float,
+        default=0.05,
+        help="multiplier for rate limit windows, 1 for Discord-like windows",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--strategy", action="append", choices=sorted(strategies), default=None
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+    results = {}
+    for name in args.strategy or strategies:
+        results[name] = asyncio.run(run_strategy(name, args))
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
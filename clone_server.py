@@ -20,12 +20,16 @@ import os
 import re
 import json
 import logging
+import contextlib
 
 import discord
 from discord.ext import commands
 
 import discord_server_exporter as dse
 import discord_server_importer as dsi
+import ds_fanout
+from ds_profile import Profiler
+from ds_trace import Tracer
 
 intents = discord.Intents.all()
 bot = discord.Client(intents=intents)
@@ -36,19 +40,47 @@ LOG_FILE_MODE = "w"
 LOG_FORMAT = "[%(levelname)s] %(asctime)s %(name)s: %(message)s"
 LOG_DATE_FORMAT = "[%Y/%m/%d %H:%M:%S]"
 
+# Set to a file name, e.g. "import_profile.json", to write a per-stage
+# timing and memory report there at the end of the run
+PROFILE_REPORT = None
+# Set to a file name, e.g. "import_trace.json", to write a Chrome trace of the
+# run there, which chrome://tracing or ui.perfetto.dev can open
+TRACE_FILE = None
+
 guildid = None
+# Any further lines of token.txt are IDs of existing servers to clone into
+target_ids = []
 # Events
 @bot.event
 async def on_ready():
     logging.info("Bot started")
 
     gld = bot.get_guild(guildid)
-    biswas = dse.dump_server(gld)
-    target = await dsi.create_server(bot, biswas)
+    profiler = Profiler() if PROFILE_REPORT else None
+    tracer = Tracer() if TRACE_FILE else None
+    with contextlib.ExitStack() as stack:
+        if profiler:
+            stack.enter_context(profiler.active())
+        if tracer:
+            stack.enter_context(tracer.active())
+            stack.enter_context(tracer.trace_client(bot))
+        biswas = dse.dump_server(gld)
+        if target_ids:
+            # The icon and emojis are downloaded once for every target
+            await ds_fanout.clone_to_guilds(bot, biswas, target_ids)
+        else:
+            target = await dsi.create_server(bot, biswas)
+
+    if profiler:
+        profiler.write_json(PROFILE_REPORT)
+        logging.info(f"Clone profile:\n{profiler.format_table()}")
+    if tracer:
+        tracer.write_json(TRACE_FILE)
     # await dsi.append_roles(target, biswas)
     # await dsi.write_roles(target, biswas["roles"])
     # await dsi.write_emojis(target, biswas['emojis'])
     # await dsi.append_categories( target, biswas['categories'])
+    # await dsi.write_member_roles(target, biswas["members"], biswas["roles"])
 
     logging.info("All OK")
 
@@ -57,6 +89,6 @@ if __name__ == "__main__":
     logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
 
     with open("token.txt") as f:
-        tok, gid = map(lambda a: a.strip(), f.readlines())
+        tok, gid, *target_ids = [a.strip() for a in f.readlines() if a.strip()]
     guildid = int(gid)
     bot.run(tok, bot=False)
@@ -0,0 +1,70 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Prints the differences between two server exports, e.g. two snapshots of
+# snapshot_daemon.py or two runs of dumpall.py:
+#
+#     python diff_servers.py snapshots/<id>/<old>/server.json snapshots/<id>/<new>/server.json
+
+import sys
+import json
+import logging
+import argparse
+
+from ds_diff import diff_files
+
+LOG_LEVEL = logging.WARNING
+LOG_FORMAT = "[%(levelname)s] %(asctime)s %(name)s: %(message)s"
+LOG_DATE_FORMAT = "[%Y/%m/%d %H:%M:%S]"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two server exports")
+    parser.add_argument("old", help="the older server export")
+    parser.add_argument("new", help="the newer server export")
+    parser.add_argument(
+        "--kind",
+        action="append",
+        default=None,
+        help="only show changes of this kind, e.g. role",
+    )
+    parser.add_argument(
+        "--shards", type=int, default=16, help="shard files the members are split into"
+    )
+    parser.add_argument(
+        "--guild", help="ID of the server to compare in export containers or lists"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="print one JSON object per change"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+    count = 0
+    for change in diff_files(args.old, args.new, args.shards, guild_id=args.guild):
+        if args.kind and change.kind not in args.kind:
+            continue
+        count += 1
+        print(json.dumps(change.as_dict()) if args.json else change)
+    # Like diff, exit with 1 if there are differences
+    sys.exit(1 if count else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -21,37 +21,49 @@ import logging
 import os
 import discord
 import time
-from urllib.request import Request, urlopen
 import threading
 import json
+import tempfile
 
-from ds_common_funcs import req_hdr, get_icon_under_10mb
+from ds_common_funcs import get_icon_under_10mb
+from ds_http import get_client
+from ds_profile import stage, record_stage, detached_context
+from ds_members import MemberArchiveWriter
+from ds_archive import ExportArchive, write_export_file
+from ds_trace import span, traced
+import ds_metrics
+import ds_model
 
 """
-Maps a role to a dictionary that conforms to the role schema.
+Maps a role to a record that conforms to the role schema.
 
 Arguments:
     role -- a discord.py role object
 """
 
 
-def conv_role_obj(role: discord.Role, export_perms=True) -> dict:
+@traced("export")
+def conv_role_obj(role: discord.Role, export_perms=True) -> ds_model.Role:
     logging.info(f"Dumping role '{role.name}' for server '{role.guild.name}'")
-    res = {}
-    res["name"] = role.name
-    # this is the colour integer
-    # a value of 0 means transparent
-    res["color"] = role.color.value
-    res["mentionable"] = role.mentionable
-    res["position"] = role.position
-    res["id"] = str(role.id)
-    res["hoist"] = role.hoist
+    res = ds_model.Role(
+        name=role.name,
+        # this is the colour integer
+        # a value of 0 means transparent
+        color=role.color.value,
+        mentionable=role.mentionable,
+        position=role.position,
+        id=role.id,
+        hoist=role.hoist,
+    )
     # this is the permission integer
     if export_perms:
         logging.info(
             f"Dumping role permissions for role '{role.name}' for server '{role.guild.name}'"
         )
-        res["permission_value"] = str(role.permissions.value)
+        res.permission_value = role.permissions.value
+    else:
+        # The schema requires a value; without permissions the role has none
+        res.permission_value = 0
     return res
 
 
@@ -64,6 +76,7 @@ Arguments:
 """
 
 
+@traced("export")
 def dump_roles(guild: discord.Guild, export_perms=True) -> list:
     logging.info(f"Dumping roles for server '{guild.name}'")
     res = []
@@ -75,74 +88,154 @@ def dump_roles(guild: discord.Guild, export_perms=True) -> list:
 
 
 """
-Maps a role to a dictionary that conforms to the role schema.
+Maps an emoji to a record that conforms to the emoji schema.
 
 Arguments:
-    role -- a discord.py role object
+    emoji -- a discord.py emoji object
 """
 
 
-def conv_emoji_obj(emoji: discord.Emoji) -> dict:
+@traced("export")
+def conv_emoji_obj(emoji: discord.Emoji) -> ds_model.Emoji:
     logging.info(f"Dumping emoji '{emoji.name}' for server '{emoji.guild.name}'")
-    res = {}
-    res["name"] = emoji.name
-    res["url"] = str(emoji.url)
-    return res
+    return ds_model.Emoji(name=emoji.name, url=str(emoji.url))
+
 
 """
-Return a list of the emojis in a guild as a bytes-like object
+Return a list of the emojis in a guild as a bytes-like object.
+Emojis that could not be downloaded are None.
 
 Arguments:
     guild -- a discord.py guild object
 """
 
-def get_emoji_bytes(guild: discord.Guild) -> list:
-  res_emojis = []
-  for emoji in guild.emojis:
-    logging.info(f"Downloading emoji '{emoji.name}' from server '{guild.name}'")
-    req = Request(str(emoji.url), None, req_hdr)
-    server_icon_req = urlopen(req)
 
-    # gets extension of the icon from the url
-    icon_ext = str(emoji.url).split(".")[-1].split("?")[0]
+@traced("export")
+def get_emoji_bytes(guild: discord.Guild) -> list:
+    logging.info(f"Downloading {len(guild.emojis)} emojis from server '{guild.name}'")
+    # All at once over the shared client's connection pool
+    responses = get_client().fetch_all(
+        [str(emoji.url) for emoji in guild.emojis], label="emoji"
+    )
+    res_emojis = []
+    for emoji, resp in zip(guild.emojis, responses):
+        if isinstance(resp, Exception):
+            logging.error(
+                f"Could not download emoji '{emoji.name}' from server '{guild.name}': {resp}"
+            )
+            res_emojis.append(None)
+        else:
+            res_emojis.append(resp.body)
+    return res_emojis
 
-    res_emojis.append(server_icon_req.read())
-  return res_emojis
 
 """
 Write a list of emojis from a guild to a directory
 
+Return: (amount of emoji files written, their size in bytes)
+
 Arguments:
     guild -- a discord.py guild object
+    dir_prefix -- the export folder, or a ds_archive.ExportArchive
 """
+
+
+@traced("export")
 def write_emojis_to_dir(guild: discord.Guild, dir_prefix="exported"):
-    guild_emoji_folder_path = f"{dir_prefix}/emojis/{guild.id}"
-    os.makedirs(guild_emoji_folder_path)
-    emojis_bytes = get_emoji_bytes(guild)
-    for idx, emoji in enumerate(guild.emojis):
-        emoji_bytes = emojis_bytes[idx]
-        icon_ext = str(emoji.url).split(".")[-1].split("?")[0]
-        with open(f"{guild_emoji_folder_path}/{emoji.name}.{icon_ext}", "wb") as f:
-            f.write(emoji_bytes)
-            
+    if not isinstance(dir_prefix, ExportArchive):
+        os.makedirs(f"{dir_prefix}/emojis/{guild.id}", exist_ok=True)
+    written = 0
+    size = 0
+    with stage("emoji_downloads") as st:
+        emojis_bytes = get_emoji_bytes(guild)
+        for idx, emoji in enumerate(guild.emojis):
+            emoji_bytes = emojis_bytes[idx]
+            if emoji_bytes is None:
+                continue
+            icon_ext = str(emoji.url).split(".")[-1].split("?")[0]
+            with span("write emoji", "io"):
+                write_export_file(
+                    dir_prefix,
+                    f"emojis/{guild.id}/{emoji.name}.{icon_ext}",
+                    emoji_bytes,
+                )
+            written += 1
+            size += len(emoji_bytes)
+            ds_metrics.bytes_written.inc(len(emoji_bytes), kind="emoji")
+        st.objects += written
+        st.bytes_written += size
+
     logging.info(f"Finished writing emojis from server '{guild.name}'")
+    return written, size
+
+
+"""
+The emoji files of a guild, downloaded and written on a thread of their own
+(see `dump_emojis`).  The thread runs without the caller's profiler, whose
+stages it would overlap; `join` records it as the "emoji_downloads" stage of
+the joining thread instead.
+
+Arguments:
+    guild -- a discord.py guild object
+    dir_prefix -- the export folder, or a ds_archive.ExportArchive
+"""
+
+
+class EmojiDownload:
+    def __init__(self, guild: discord.Guild, dir_prefix="exported"):
+        self.seconds = 0.0
+        self.written = 0
+        self.size = 0
+        self.thread = threading.Thread(
+            target=detached_context().run, args=(self._run, guild, dir_prefix)
+        )
+        self.thread.daemon = True
+
+    def _run(self, guild, dir_prefix):
+        start = time.perf_counter()
+        try:
+            self.written, self.size = write_emojis_to_dir(guild, dir_prefix)
+        finally:
+            self.seconds = time.perf_counter() - start
+
+    def start(self):
+        self.thread.start()
+
+    def join(self):
+        self.thread.join()
+        record_stage("emoji_downloads", self.seconds, self.written, self.size)
+
 
 """
 Return a list of roles of emojis in the guild.
 The schema for emoji is in the schemas folder, as with all other relevant structures
 
+With `export_emojis`, the emoji files are downloaded and written on a thread
+of their own while the caller goes on.  The files are only complete once that
+thread is joined: its EmojiDownload is added to `downloads` if given, and the
+thread is tracked by the archive if `dir_prefix` is an ExportArchive.
+
 Arguments:
     guild -- a discord.py guild object
+    dir_prefix -- the export folder, or a ds_archive.ExportArchive
+    downloads -- a list the EmojiDownload is added to
 """
 
 
-def dump_emojis(guild: discord.Guild, export_emojis=False, dir_prefix="exported") -> list:
+@traced("export")
+def dump_emojis(
+    guild: discord.Guild, export_emojis=False, dir_prefix="exported", downloads=None
+) -> list:
     logging.info(f"Dumping emojis for server '{guild.name}'")
     res = []
     if export_emojis:
-        thread = threading.Thread(target=write_emojis_to_dir, args=(guild, dir_prefix))
-        thread.daemon = True
-        thread.start()
+        download = EmojiDownload(guild, dir_prefix)
+        download.start()
+        if downloads is not None:
+            downloads.append(download)
+        if isinstance(dir_prefix, ExportArchive):
+            # The archive is only complete once the emojis are in it
+            dir_prefix.track(download.thread)
     for emoji in guild.emojis:
         res.append(conv_emoji_obj(emoji))
     return res
@@ -152,8 +245,8 @@ def dump_emojis(guild: discord.Guild, export_emojis=False, dir_prefix="exported"
 Return the permission overrides for a text or voice channel.
 Structure:
     Dict:
-        "roles": [ dict of role id, permission override list ]
-        "users": [ dict of user id, permission override list ]
+        "roles": [ ds_model.RoleOverride ]
+        "users": [ ds_model.UserOverride ]
 The schema for permission override list is in the schemas folder, as with all other relevant structures
 
 Arguments:
@@ -161,10 +254,18 @@ Arguments:
 """
 
 
+@traced("export")
 def get_permission_overrides(channel: discord.abc.ChannelType) -> dict:
     # roles: list of tuples (role position, permission override list)
     # users: list of tuples (user ID, permission override list)
     res = {"roles": [], "users": []}
+    with stage("overrides") as st:
+        _add_permission_overrides(channel, res)
+        st.objects += len(res["roles"]) + len(res["users"])
+    return res
+
+
+def _add_permission_overrides(channel: discord.abc.ChannelType, res: dict):
     for entity, overwrite in channel.overwrites.items():
         # This can also be found in permission_override_schemas.json
         valid_perm_set = overwrite.VALID_NAMES
@@ -182,51 +283,55 @@ def get_permission_overrides(channel: discord.abc.ChannelType) -> dict:
 
         if isinstance(entity, discord.Role):
             res["roles"].append(
-                {
-                    "id": str(entity.id),
-                    "name": entity.name,
-                    "position": entity.position,
-                    "permissions": permission_override_list,
-                }
+                ds_model.RoleOverride(
+                    id=entity.id,
+                    name=entity.name,
+                    position=entity.position,
+                    permissions=permission_override_list,
+                )
             )
-        elif isinstance(entity, discord.User):
+        # Members are not discord.User, but both are discord.abc.User
+        elif isinstance(entity, discord.abc.User):
             res["users"].append(
-                {"id": str(entity.id), "permissions": permission_override_list}
+                ds_model.UserOverride(
+                    id=entity.id, permissions=permission_override_list
+                )
             )
 
-    return res
-
 
 """
-Maps a text channel to a dictionary that conforms to the text channel schema.
+Maps a text channel to a record that conforms to the text channel schema.
 
 Arguments:
     channel -- a discord.py textchannel object
 """
 
 
+@traced("export")
 def conv_text_channel_obj(
     channel: discord.TextChannel, export_role_overrides=True, export_user_overrides=True
-):
+) -> ds_model.TextChannel:
     logging.info(f"Dumping text channel '{channel.name}' in '{channel.guild.name}'")
-    res = {}
-    res["name"] = channel.name
-    res["slowmode"] = channel.slowmode_delay
-    res["nsfw"] = channel.is_nsfw()
-    res["topic"] = channel.topic
-    res["id"] = str(channel.id)
+    res = ds_model.TextChannel(
+        name=channel.name,
+        slowmode=channel.slowmode_delay,
+        nsfw=channel.is_nsfw(),
+        news=channel.is_news(),
+        topic=channel.topic,
+        id=channel.id,
+    )
 
     perms = get_permission_overrides(channel)
     if export_role_overrides:
         logging.info(
             f"Dumping role permission overrides for text channel '{channel.name}' in '{channel.guild.name}'"
         )
-        res["role_permission_overrides"] = perms["roles"]
+        res.role_permission_overrides = perms["roles"]
     if export_user_overrides:
         logging.info(
             f"Dumping user permission overrides for text channel '{channel.name}' in '{channel.guild.name}'"
         )
-        res["user_permission_overrides"] = perms["users"]
+        res.user_permission_overrides = perms["users"]
 
     return res
 
@@ -240,6 +345,7 @@ Arguments:
 """
 
 
+@traced("export")
 def dump_text_channels(
     guild: discord.Guild, export_role_overrides=True, export_user_overrides=True
 ) -> list:
@@ -253,36 +359,38 @@ def dump_text_channels(
 
 
 """
-Maps a voice channel to a dictionary that conforms to the text channel schema.
+Maps a voice channel to a record that conforms to the voice channel schema.
 
 Arguments:
     channel -- a discord.py voicechannel object
 """
 
 
+@traced("export")
 def conv_voice_channel_obj(
     channel: discord.VoiceChannel,
     export_role_overrides=True,
     export_user_overrides=True,
-):
+) -> ds_model.VoiceChannel:
     logging.info(f"Dumping voice channel '{channel.name}' in '{channel.guild.name}'")
-    res = {}
-    res["name"] = channel.name
-    res["bitrate"] = channel.bitrate
-    res["user_limit"] = channel.user_limit
-    res["id"] = str(channel.id)
+    res = ds_model.VoiceChannel(
+        name=channel.name,
+        bitrate=channel.bitrate,
+        user_limit=channel.user_limit,
+        id=channel.id,
+    )
 
     perms = get_permission_overrides(channel)
     if export_role_overrides:
         logging.info(
             f"Dumping role permission overrides for voice channel '{channel.name}' in '{channel.guild.name}'"
         )
-        res["role_permission_overrides"] = perms["roles"]
+        res.role_permission_overrides = perms["roles"]
     if export_user_overrides:
         logging.info(
             f"Dumping user permission overrides for voice channel '{channel.name}' in '{channel.guild.name}'"
         )
-        res["user_permission_overrides"] = perms["users"]
+        res.user_permission_overrides = perms["users"]
 
     return res
 
@@ -296,6 +404,7 @@ Arguments:
 """
 
 
+@traced("export")
 def dump_voice_channels(
     guild: discord.Guild, export_role_overrides=True, export_user_overrides=True
 ) -> list:
@@ -311,32 +420,32 @@ def dump_voice_channels(
 
 
 """
-Maps a category to a dictionary that conforms to the category schema.
+Maps a category to a record that conforms to the category schema.
 
 Arguments:
-    channel -- a discord.py voicechannel object
+    category -- a discord.py category object
 """
 
 
+@traced("export")
 def conv_category_obj(
     category: discord.CategoryChannel,
     export_text_channels=True,
     export_voice_channels=True,
     export_role_overrides=True,
     export_user_overrides=True,
-):
+) -> ds_model.Category:
     guild = category.guild
     logging.info(f"Dumping category '{category.name}' for server '{guild.name}'")
-    res = {}
-    res["name"] = category.name
+    res = ds_model.Category(name=category.name)
 
     if export_text_channels:
         logging.info(
             f"Dumping text channels for category '{category.name}' in '{category.guild.name}'"
         )
-        res["text_channels"] = []
+        res.text_channels = []
         for channel in category.text_channels:
-            res["text_channels"].append(
+            res.text_channels.append(
                 conv_text_channel_obj(
                     channel, export_role_overrides, export_user_overrides
                 )
@@ -346,9 +455,9 @@ def conv_category_obj(
         logging.info(
             f"Dumping voice channels for category '{category.name}' in '{category.guild.name}'"
         )
-        res["voice_channels"] = []
+        res.voice_channels = []
         for channel in category.voice_channels:
-            res["voice_channels"].append(
+            res.voice_channels.append(
                 conv_voice_channel_obj(
                     channel, export_role_overrides, export_user_overrides
                 )
@@ -359,12 +468,12 @@ def conv_category_obj(
         logging.info(
             f"Dumping role overrides for category '{category.name}' in '{guild.name}'"
         )
-        res["role_permission_overrides"] = perms["roles"]
+        res.role_permission_overrides = perms["roles"]
     if export_user_overrides:
         logging.info(
             f"Dumping user overrides for category '{category.name}' in '{guild.name}'"
         )
-        res["user_permission_overrides"] = perms["users"]
+        res.user_permission_overrides = perms["users"]
 
     return res
 
@@ -378,6 +487,7 @@ Arguments:
 """
 
 
+@traced("export")
 def dump_categories(
     guild: discord.Guild,
     uncategorized=True,
@@ -389,24 +499,27 @@ def dump_categories(
 
     res = []
 
-    if len(guild.by_category()) <= 0:
+    by_category = guild.by_category()
+    if len(by_category) <= 0:
         return res
 
     if uncategorized:
         logging.info(f"Dumping uncategorized channels for server '{guild.name}'")
-        dummy_cat = {}
-        dummy_cat["name"] = ""
-        dummy_cat["text_channels"] = []
-        dummy_cat["voice_channels"] = []
-        for channel in guild.by_category()[0]:
+        dummy_cat = ds_model.Category(name="", text_channels=[], voice_channels=[])
+        # by_category lists (category, channels), with the channels that have
+        # no category first
+        category, channels = by_category[0]
+        if category is not None:
+            channels = []
+        for channel in channels:
             if isinstance(channel, discord.TextChannel):
-                dummy_cat["text_channels"].append(
+                dummy_cat.text_channels.append(
                     conv_text_channel_obj(
                         channel, export_role_overrides, export_user_overrides
                     )
                 )
             elif isinstance(channel, discord.VoiceChannel):
-                dummy_cat["voice_channels"].append(
+                dummy_cat.voice_channels.append(
                     conv_voice_channel_obj(
                         channel, export_role_overrides, export_user_overrides
                     )
@@ -428,29 +541,27 @@ def dump_categories(
 
 
 """
-Maps a member to a dictionary that conforms to the member schema.
+Maps a member to a record that conforms to the member schema.
 
 Arguments:
     guild -- a discord.py member object
 """
 
 
+@traced("export")
 def conv_member_obj(
     member: discord.Member, export_nickname=True, export_roles=True
-) -> dict:
+) -> ds_model.Member:
     logging.info(
         f"Dumping member '{member.name}#{member.discriminator}' ({member.id}) in server '{member.guild.name}'"
     )
-    res = {}
+    res = ds_model.Member(name=member.name, discrim=member.discriminator, id=member.id)
 
-    res["name"] = member.name
-    res["discrim"] = member.discriminator
-    res["id"] = str(member.id)
-
-    if export_nickname and member.nick is not None:
-        res["nickname"] = member.nick
+    if export_nickname:
+        res.nickname = member.nick
     if export_roles:
-        res["roles"] = [str(role.id) for role in member.roles]
+        # The IDs discord.py already has, not a new string per member and role
+        res.roles = tuple(role.id for role in member.roles)
 
     return res
 
@@ -464,6 +575,7 @@ Arguments:
 """
 
 
+@traced("export")
 def dump_members(guild: discord.Guild, export_nickname=True, export_roles=True) -> list:
     logging.info(f"Dumping members for server '{guild.name}'")
     res = []
@@ -471,71 +583,243 @@ def dump_members(guild: discord.Guild, export_nickname=True, export_roles=True)
         res.append(conv_member_obj(member, export_nickname, export_roles))
     return res
 
+
+"""
+Write the members of the guild to a columnar archive (see ds_members.py) in
+`<dir_prefix>/members/<guild id>/`.  Members are written in chunks as they are
+converted, so they are never all in memory.
+
+Return: amount of members written
+
+Arguments:
+    guild -- a discord.py guild object
+    dir_prefix -- the folder the archive folder goes in, or a
+                  ds_archive.ExportArchive. Member archives in an export
+                  archive have to be extracted to be memory mapped.
+"""
+
+
+@traced("export")
+def dump_member_archive(guild: discord.Guild, dir_prefix="exported") -> int:
+    logging.info(f"Writing member archive for server '{guild.name}'")
+    if isinstance(dir_prefix, ExportArchive):
+        with tempfile.TemporaryDirectory(prefix="ds_members_") as directory:
+            count = dump_member_archive(guild, directory)
+            dir_prefix.write_folder(
+                f"{directory}/members/{guild.id}", f"members/{guild.id}"
+            )
+        return count
+
+    directory = f"{dir_prefix}/members/{guild.id}"
+    with MemberArchiveWriter(directory, [role.id for role in guild.roles]) as writer:
+        for member in guild.members:
+            writer.add(conv_member_obj(member))
+    ds_metrics.bytes_written.inc(
+        sum(entry.stat().st_size for entry in os.scandir(directory)),
+        kind="member_archive",
+    )
+    return writer.count
+
+
 """
 
 """
+
+
+@traced("export")
 def dump_server_icon(guild: discord.Guild, dir_prefix="exported"):
     logging.info(f"Downloading server icon for server '{guild.name}'")
     iconurl = str(guild.icon_url)
 
     if not iconurl:
         return
-        
-    icon = get_icon_under_10mb(iconurl)
-    with open(f"{dir_prefix}/icons/{guild.id}.{icon[1]}", "wb") as f:
-        f.write(icon[0])
+
+    with stage("icon") as st:
+        icon = get_icon_under_10mb(iconurl)
+        with span("write icon", "io"):
+            write_export_file(dir_prefix, f"icons/{guild.id}.{icon[1]}", icon[0])
+        st.objects += 1
+        st.bytes_written += len(icon[0])
+        ds_metrics.bytes_written.inc(len(icon[0]), kind="icon")
+
+
+"""
+Encode a server as the JSON of its schema file, in pieces: the items of each
+list are encoded one at a time, and members are written as they are converted
+instead of all being in memory at once.  Joined, the pieces are the same as
+`json.dumps` of the server with its members.
+
+Return: generator of str
+
+Arguments:
+    server -- a server dict without members
+    members -- iterable of member records, None to leave the members out
+"""
+
+
+def encode_server(server: dict, members=None):
+    yield "{"
+    separator = ""
+    for key, value in server.items():
+        yield f"{separator}{json.dumps(key)}: "
+        separator = ", "
+        if isinstance(value, list):
+            yield from _encode_list(json.dumps(item) for item in value)
+        else:
+            yield json.dumps(value)
+    if members is not None:
+        # "members" is the last key of a server
+        yield f'{separator}"members": '
+        yield from _encode_list(json.dumps(member.to_dict()) for member in members)
+    yield "}"
+
+
+def _encode_list(items):
+    yield "["
+    separator = ""
+    for item in items:
+        yield separator + item
+        separator = ", "
+    yield "]"
+
+
+def _export_members(guild: discord.Guild, count: list):
+    logging.info(f"Dumping members for server '{guild.name}'")
+    with stage("members") as st:
+        for member in guild.members:
+            yield conv_member_obj(member)
+            count[0] += 1
+        st.objects += count[0]
 
 
 """
-Return a dict object representing a single server.
+Return a dict object representing a single server, without its members.
 The schema for server is in the schemas folder, as with all other relevant structures
 
-WARNING: Exporting members may increase the size of the resulting dictionary considerably.
+The entities are built as ds_model records and turned into one dict at the
+end, which is what the schema file is written from.  Members only go to the
+schema file: they are converted and written one at a time while the file
+is written (see `encode_server`), so they are never all in memory.  Without
+`export_schemas`, `export_members` has nothing to write them to.
+
+Emojis are downloaded while the rest is dumped, and waited for before
+returning, so every file of the export is written once this returns.
+
+Each stage (emojis, roles, categories, members, icon, schema file) is recorded
+by the ds_profile.Profiler active around the call, if any.
 
 Arguments:
     guild -- a discord.py guild object
+    export_files_dir -- the folder icons, emojis and schemas are written to, or
+                        a ds_archive.ExportArchive to write them to one file
+    export_member_archive -- also write the members to a columnar archive in
+                             `<export_files_dir>/members/<guild id>/`
+    schema_name -- path of the schema file in export_files_dir. Defaults to
+                   `schemas/<guild id>.json`.
 """
 
 
-def dump_server(guild: discord.Guild, export_emojis=True, export_server_icon=True, export_schemas=True, export_files_dir="exported", export_members=False) -> dict:
+@traced("export")
+def dump_server(
+    guild: discord.Guild,
+    export_emojis=True,
+    export_server_icon=True,
+    export_schemas=True,
+    export_files_dir="exported",
+    export_members=False,
+    export_member_archive=False,
+    schema_name=None,
+) -> dict:
     logging.info(f"Dumping server '{guild.name}'")
-    res = {}
-
-    res["name"] = guild.name
-    res["id"] = str(guild.id)
-    res["icon_url"] = str(guild.icon_url)
-    res["voice_region"] = guild.region.value
+    start = time.perf_counter()
+    downloads = []
+    server = ds_model.Server(
+        name=guild.name,
+        id=guild.id,
+        icon_url=str(guild.icon_url),
+        voice_region=guild.region.value,
+    )
 
     if guild.afk_channel:
-        res["inactive_channel"] = str(guild.afk_channel.id)
-        res["inactive_timeout"] = guild.afk_timeout
+        server.inactive_channel = guild.afk_channel.id
+        server.inactive_timeout = guild.afk_timeout
     else:
         logging.info(f"No AFK channel present in '{guild.name}'; omitting")
 
     if guild.system_channel:
-        res["system_message_channel"] = str(guild.system_channel.id)
+        server.system_message_channel = guild.system_channel.id
     else:
         logging.info(f"No system channel present in '{guild.name}'; omitting")
 
-    res["join_broadcast"] = guild.system_channel_flags.join_notifications
-    res["boost_broadcast"] = guild.system_channel_flags.premium_subscriptions
-    res["default_notifications"] = bool(guild.default_notifications.value)
-    res["verification_level"] = guild.verification_level.value
-    res["content_filter"] = guild.explicit_content_filter.value
-    res["emojis"] = dump_emojis(guild, export_emojis, export_files_dir)
-    res["roles"] = dump_roles(guild)
-    res["categories"] = dump_categories(guild)
+    server.join_broadcast = guild.system_channel_flags.join_notifications
+    server.boost_broadcast = guild.system_channel_flags.premium_subscriptions
+    server.default_notifications = bool(guild.default_notifications.value)
+    server.verification_level = guild.verification_level.value
+    server.content_filter = guild.explicit_content_filter.value
+    with stage("emojis") as st:
+        server.emojis = dump_emojis(guild, export_emojis, export_files_dir, downloads)
+        st.objects += len(server.emojis)
+    with stage("roles") as st:
+        server.roles = dump_roles(guild)
+        st.objects += len(server.roles)
+    with stage("categories") as st:
+        server.categories = dump_categories(guild)
+        st.objects += len(server.categories)
+
+    if export_members and not export_schemas:
+        logging.warning(
+            f"Members of '{guild.name}' are only exported to the schema file; omitting"
+        )
+        export_members = False
 
-    if export_members:
-        res["members"] = dump_members(guild)
+    if export_member_archive:
+        with stage("member_archive") as st:
+            st.objects += dump_member_archive(guild, export_files_dir)
 
     if export_server_icon:
-        os.makedirs(f"{export_files_dir}/icons", exist_ok=True)
         dump_server_icon(guild, export_files_dir)
 
+    # Recorded here as "emoji_downloads", see EmojiDownload
+    for download in downloads:
+        download.join()
+
+    res = server.to_dict()
+    member_count = [0]
+
     if export_schemas:
-        os.makedirs(f"{export_files_dir}/schemas", exist_ok=True)
-        with open(f"{export_files_dir}/schemas/{guild.id}.json", "w") as f:
-            json.dump(res, f)
+        if schema_name is None:
+            schema_name = f"schemas/{guild.id}.json"
+        members = _export_members(guild, member_count) if export_members else None
+        # Includes the "members" stage, which runs while the file is written
+        with stage("schema_file") as st, span("write schema", "io"):
+            size = write_export_file(
+                export_files_dir, schema_name, encode_server(res, members)
+            )
+            st.objects += 1
+            st.bytes_written += size
+            ds_metrics.bytes_written.inc(size, kind="schema")
 
+    _count_exported(res)
+    if export_members:
+        ds_metrics.entities_exported.inc(member_count[0], type="members")
+    ds_metrics.guild_export_duration.observe(
+        time.perf_counter() - start, guild=guild.id
+    )
     return res
+
+
+def _count_exported(server: dict):
+    counter = ds_metrics.entities_exported
+    for section in ("emojis", "roles", "categories"):
+        if section in server:
+            counter.inc(len(server[section]), type=section)
+    for category in server["categories"]:
+        for kind in ("text_channels", "voice_channels"):
+            channels = category.get(kind, [])
+            counter.inc(len(channels), type=kind)
+            for channel in channels:
+                counter.inc(
+                    len(channel.get("role_permission_overrides", []))
+                    + len(channel.get("user_permission_overrides", [])),
+                    type="permission_overrides",
+                )
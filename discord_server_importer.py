@@ -18,30 +18,238 @@
 
 import os
 import json
+import hashlib
 import logging
 import asyncio
 import threading
-from urllib.request import Request, urlopen
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 import discord
-import jsonschema
 
-from ds_common_funcs import req_hdr, get_icon_under_10mb, boost_emoji_count
+from ds_validation import get_registry
+from ds_profile import stage
+from ds_stream import FIELD, ITEM, SECTION_END
+from ds_container import iter_export_events
+from ds_archive import ArchiveReader, is_archive
+from ds_common_funcs import (
+    get_icon_under_10mb,
+    boost_emoji_count,
+    emoji_size_limit,
+    RateLimiter,
+    run_in_executor,
+)
+from ds_trace import traced
+from ds_http import get_client, ResponseTooLarge
+
+"""
+Index the emoji files in an import folder once, by name and by content hash.
+Files are written by the exporter as `<emoji name>.<ext>`.
+
+Return: dict with "by_name" and "by_hash", each mapping to a file path, and
+    "archive", the archive the paths are in if any
+
+Arguments:
+    emoji_dir -- the folder holding the emoji files of a single guild
+    archive -- a ds_archive.ArchiveReader if `emoji_dir` is a folder in it
+"""
+
+
+def index_emoji_folder(emoji_dir: str, archive=None) -> dict:
+    res = {"by_name": {}, "by_hash": {}, "archive": archive}
+    if archive is not None:
+        # Looked up in the archive's index, nothing is extracted
+        entries = [
+            (filename, f"{emoji_dir}/{filename}")
+            for filename in archive.listdir(emoji_dir)
+        ]
+    elif os.path.isdir(emoji_dir):
+        entries = [
+            (entry.name, entry.path)
+            for entry in os.scandir(emoji_dir)
+            if entry.is_file()
+        ]
+    else:
+        logging.warning(f"Emoji folder '{emoji_dir}' does not exist")
+        return res
+
+    for filename, path in entries:
+        name = os.path.splitext(filename)[0]
+        digest = hashlib.sha256(_read_indexed(res, path)).hexdigest()
+        res["by_name"].setdefault(name, path)
+        res["by_hash"].setdefault(digest, path)
+
+    logging.info(f"Indexed {len(res['by_name'])} emoji files in '{emoji_dir}'")
+    return res
+
+
+def _read_indexed(folder_index: dict, path: str) -> bytes:
+    if folder_index.get("archive") is not None:
+        return folder_index["archive"].read(path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+"""
+Open an import folder for everything read from it during one import.  An
+export archive is opened once and closed on exit; a folder, or an archive
+that is open already, is used as it is.
+
+Yields: the folder path or ds_archive.ArchiveReader, to pass on as `import_folder`
+
+Arguments:
+    import_folder -- the folder an export was written to, or its archive
+"""
+
+
+@contextlib.contextmanager
+def open_import_folder(import_folder):
+    if isinstance(import_folder, str) and is_archive(import_folder):
+        with ArchiveReader(import_folder) as archive:
+            yield archive
+    else:
+        yield import_folder
+
+
+"""
+Index the emoji files of a guild in an import folder or export archive.
+
+Return: see `index_emoji_folder`
+
+Arguments:
+    import_folder -- the folder an export was written to, or an open archive
+                     from `open_import_folder`
+    guild_id -- the ID of the exported guild
+
+Exceptions:
+    ValueError if `import_folder` is the path of an archive rather than an
+    open one, since nothing would close it
+"""
+
+
+def index_import_emojis(import_folder, guild_id) -> dict:
+    if isinstance(import_folder, ArchiveReader):
+        return index_emoji_folder(f"emojis/{guild_id}", import_folder)
+    if is_archive(import_folder):
+        raise ValueError(f"Open '{import_folder}' with open_import_folder first")
+    return index_emoji_folder(f"{import_folder}/emojis/{guild_id}")
+
+
+"""
+Get the bytes of a single emoji, either from an indexed import folder or by
+downloading it.  The size is checked against the 256kb limit before upload.
+
+Return: bytes-like object with the emoji, None if unavailable or too large
+
+Arguments:
+    emoji -- a dict following the emoji schema
+    folder_index -- the result of `index_emoji_folder`, None to download
+    prefetched -- dict of emoji URL to bytes that were already fetched, checked first
+"""
+
+
+@traced("cdn")
+def fetch_emoji_bytes(emoji: dict, folder_index=None, prefetched=None):
+    if prefetched is not None and emoji.get("url") in prefetched:
+        emoji_bytes = prefetched[emoji["url"]]
+    elif folder_index is not None:
+        path = folder_index["by_name"].get(emoji["name"])
+        if path is None:
+            logging.warning(
+                f"Emoji file for '{emoji['name']}' not found in import folder, skipping"
+            )
+            return None
+        emoji_bytes = _read_indexed(folder_index, path)
+    else:
+        # The download is skipped entirely if the CDN already tells us it is
+        # too big
+        try:
+            emoji_bytes = (
+                get_client()
+                .fetch(emoji["url"], max_size=emoji_size_limit, label="emoji")
+                .body
+            )
+        except ResponseTooLarge as e:
+            logging.info(
+                f"Emoji '{emoji['name']}' is {e.size}b > 256kb and will be skipped."
+            )
+            return None
+
+    if len(emoji_bytes) > emoji_size_limit:
+        logging.info(
+            f"Emoji '{emoji['name']}' is {len(emoji_bytes)}b > 256kb and will be skipped."
+        )
+        return None
+
+    return emoji_bytes
+
+
+"""
+Fetch the bytes of many emojis at once, so they can be shared between imports.
+
+Return: dict of emoji URL to bytes. Emojis that could not be fetched are absent.
+
+Arguments:
+    emojis -- a discord emoji list, each element following the emoji schema
+    folder_index -- the result of `index_emoji_folder`, None to download
+    max_workers -- amount of emojis fetched at once
+"""
+
+
+def prefetch_emojis(emojis: list, folder_index=None, max_workers=8) -> dict:
+    res = {}
+
+    def fetch(emoji):
+        try:
+            return fetch_emoji_bytes(emoji, folder_index)
+        except Exception as e:
+            logging.error(f"Could not get emoji '{emoji['name']}': {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # A context copy per call, a context cannot be entered by two threads
+        futures = [
+            pool.submit(contextvars.copy_context().run, fetch, emoji)
+            for emoji in emojis
+        ]
+        for emoji, future in zip(emojis, futures):
+            emoji_bytes = future.result()
+            if emoji_bytes is not None:
+                res[emoji["url"]] = emoji_bytes
+    logging.info(f"Prefetched {len(res)} of {len(emojis)} emojis")
+    return res
+
 
 """
 Append emojis to the end of the collection.
 This will not add the last emojis passed in if they cannot fit.
 This will append emojis in the order they are passed.
 
+Emoji bytes are prefetched concurrently (`prefetch` at a time) and handed to a
+single rate limited uploader through a bounded queue, so downloading the next
+emojis overlaps with uploading the current one.
+
 Arguments:
-    bot -- a discord.py client object.
     existing_guild -- the target guild.
     emojis -- a discord emoji list, each element following the emoji schema
+    import_folder -- the folder an export was written to, or its archive as a
+                     path or from `open_import_folder`. Empty to download.
+    source_guild_id -- the ID of the exported guild, used to find its emoji folder.
+    rate_limiter -- a RateLimiter for emoji creation. One is made if None.
+    prefetched -- dict of emoji URL to bytes, e.g. from `prefetch_emojis`
 """
 
 
 async def append_emojis(
-    existing_guild: discord.Guild, emojis: list, import_folder="", append_prompt=True
+    existing_guild: discord.Guild,
+    emojis: list,
+    import_folder="",
+    append_prompt=True,
+    source_guild_id=None,
+    prefetch=4,
+    rate_limiter=None,
+    prefetched=None,
 ):
     logging.info(f"Appending emojis for server '{existing_guild.name}'")
     amt_existing_emojis = len(existing_guild.emojis)
@@ -53,7 +261,7 @@ async def append_emojis(
         f"{free_spaces_left} emoji spaces available for server '{existing_guild.name}'"
     )
 
-    if append_prompt and amt_existing_emojis > free_spaces_left:
+    if append_prompt and len(emojis) > free_spaces_left:
         logging.warning(
             f"Not enough free emoji spaces left for server ' {existing_guild.name}'"
         )
@@ -71,61 +279,147 @@ async def append_emojis(
             logging.info(f"Abort append_emojis for server '{existing_guild.name}'")
             return None
 
-    emoji_download = None
+    emojis = emojis[: max(free_spaces_left, 0)]
 
-    for emoji in emojis:
+    if rate_limiter is None:
+        # Emoji creation has a strict per guild bucket
+        rate_limiter = RateLimiter(1, 1.0)
 
+    sem = asyncio.Semaphore(prefetch)
+    # Holds prefetch tasks in the order the emojis were passed
+    queue = asyncio.Queue(maxsize=prefetch)
+
+    async def prefetch_one(emoji):
+        async with sem:
+            return await run_in_executor(
+                fetch_emoji_bytes, emoji, folder_index, prefetched
+            )
+
+    async def feeder():
+        for emoji in emojis:
+            await queue.put((emoji, asyncio.ensure_future(prefetch_one(emoji))))
+        await queue.put(None)
+
+    # The archive is read from until the last emoji is uploaded
+    with open_import_folder(import_folder) as import_folder:
+        folder_index = None
         if import_folder:
-            gemojidir = f"{import_folder}/emojis/{existing_guild.id}/"
-            files = [f for f in os.listdir(gemojidir) if f.startwith(emoji["name"])]
-            if len(files) == 0:
-                logging.warning(f"Emoji file not found in import folder '{gemojidir}', skipping")
-                continue
-            with open(files[0]) as f:
-                emoji_download = f.read()
-        else:
-            req = Request(emoji["url"], None, req_hdr)
-            emoji_req = urlopen(req)
+            if source_guild_id is None:
+                source_guild_id = existing_guild.id
+            folder_index = index_import_emojis(import_folder, source_guild_id)
+
+        feeder_task = asyncio.ensure_future(feeder())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                emoji, fetch_task = item
+                try:
+                    emoji_bytes = await fetch_task
+                except Exception as e:
+                    logging.error(f"Could not get emoji '{emoji['name']}': {e}")
+                    continue
+                if emoji_bytes is None:
+                    continue
 
-            file_size = int(emoji_req.info()["Content-Length"])
-            # 256kb limit
-            if file_size > 256000:
                 logging.info(
-                    f"Emoji '{emoji['name']}' is {file_size}b > 256kb and will be skipped."
+                    f"Appending emoji '{emoji['name']}' ({len(emoji_bytes)}b) for server '{existing_guild.name}'"
                 )
-                continue
+                await rate_limiter.wait()
+                await existing_guild.create_custom_emoji(
+                    name=emoji["name"],
+                    image=emoji_bytes,
+                    reason="Automatic emoji appending",
+                )
+        finally:
+            feeder_task.cancel()
+            while not queue.empty():
+                item = queue.get_nowait()
+                if item is not None:
+                    item[1].cancel()
 
-            emoji_download = emoji_req.read()
 
+"""
+Work out the smallest set of changes that turns the existing emojis into the
+supplied ones.  Emojis are matched on image content hash; an exact name and
+hash match is kept, a hash match under another name is renamed, and whatever
+is left over is deleted or uploaded.
 
-        logging.info(
-            f"Downloaded and appending emoji '{emoji['name']}' ({file_size}b) for server '{existing_guild.name}'"
-        )
+Return: dict with "keep", "rename" (existing, new name), "delete" and "upload"
 
-        await existing_guild.create_custom_emoji(
-            name=emoji["name"], image=emoji_download, reason="Automatic emoji appending"
-        )
+Arguments:
+    existing -- list of (existing emoji, content hash) tuples
+    wanted -- list of (emoji dict, content hash) tuples, in the order to write
+"""
+
+
+def plan_emoji_sync(existing: list, wanted: list) -> dict:
+    res = {"keep": [], "rename": [], "delete": [], "upload": []}
+
+    # hash -> existing emojis with that image which are not claimed yet
+    by_hash = {}
+    for emoji, digest in existing:
+        by_hash.setdefault(digest, []).append(emoji)
+
+    unmatched = []
+    # Exact matches first so they are never stolen by a rename
+    for emoji, digest in wanted:
+        candidates = by_hash.get(digest, [])
+        same_name = next((e for e in candidates if e.name == emoji["name"]), None)
+        if same_name is not None:
+            candidates.remove(same_name)
+            res["keep"].append(same_name)
+        else:
+            unmatched.append((emoji, digest))
+
+    for emoji, digest in unmatched:
+        candidates = by_hash.get(digest, [])
+        if candidates:
+            res["rename"].append((candidates.pop(0), emoji["name"]))
+        else:
+            res["upload"].append(emoji)
+
+    for candidates in by_hash.values():
+        res["delete"].extend(candidates)
+
+    return res
 
 
 """
-Delete all emojis and then call `append_emojis`.
-This will write emojis in the order they are passed.
+Make the emojis of a guild match the supplied list, deleting, renaming and
+uploading only the differences instead of replacing every emoji.
+Uploads happen in the order the emojis are passed.  If the image of an emoji
+cannot be fetched, from the guild or from the export, emojis of that name are
+neither deleted nor uploaded; they are counted as "untouched".
+
+Return: dict with the plan counts, API calls made and API calls saved
 
 Arguments:
-    bot -- a discord.py client object.
     existing_guild -- the target guild.
     emojis -- a discord emoji list, each element following the emoji schema
+    import_folder -- the folder an export was written to, or its archive as a
+                     path or from `open_import_folder`. Empty to download.
+    source_guild_id -- the ID of the exported guild, used to find its emoji folder.
+    rate_limiter -- a RateLimiter for emoji creation. One is made if None.
+    prefetched -- dict of emoji URL to bytes, e.g. from `prefetch_emojis`
 """
 
 
 async def write_emojis(
-    existing_guild: discord.Guild, emojis: list, import_folder="", overwrite_prompt=True,
+    existing_guild: discord.Guild,
+    emojis: list,
+    import_folder="",
+    overwrite_prompt=True,
+    source_guild_id=None,
+    rate_limiter=None,
+    prefetched=None,
 ):
     logging.info(f"Writing emojis for server '{existing_guild.name}'")
     if overwrite_prompt:
         inp = input(
             f"""
-        Continuing to write emojis will destroy all emojis and replace them with the supplied list.
+        Continuing to write emojis will delete, rename and upload emojis until they match the supplied list.
         Use `append_emojis` to add emojis to the collection.
         Y/n : """
         ).lower()
@@ -138,12 +432,110 @@ async def write_emojis(
             logging.info(f"Abort write_emojis for server '{existing_guild.name}'")
             return None
 
-    for emoji in existing_guild.emojis:
+    if rate_limiter is None:
+        rate_limiter = RateLimiter(1, 1.0)
+
+    async def get_bytes(emoji: dict, index, prefetched=None):
+        try:
+            return await run_in_executor(fetch_emoji_bytes, emoji, index, prefetched)
+        except Exception as e:
+            logging.error(f"Could not get emoji '{emoji['name']}': {e}")
+            return None
+
+    with open_import_folder(import_folder) as import_folder:
+        folder_index = None
+        if import_folder:
+            if source_guild_id is None:
+                source_guild_id = existing_guild.id
+            folder_index = index_import_emojis(import_folder, source_guild_id)
+
+        existing_bytes = await asyncio.gather(
+            *(
+                get_bytes({"name": e.name, "url": str(e.url)}, None)
+                for e in existing_guild.emojis
+            )
+        )
+        wanted_bytes = await asyncio.gather(
+            *(get_bytes(emoji, folder_index, prefetched) for emoji in emojis)
+        )
+
+    # A failed download says nothing about an emoji, so every emoji of that
+    # name is left as it is instead of being deleted or uploaded again
+    failed = {e["name"] for e, b in zip(emojis, wanted_bytes) if b is None}
+    failed.update(
+        e.name for e, b in zip(existing_guild.emojis, existing_bytes) if b is None
+    )
+    untouched = [e for e in existing_guild.emojis if e.name in failed]
+    existing = [
+        (e, hashlib.sha256(b).hexdigest())
+        for e, b in zip(existing_guild.emojis, existing_bytes)
+        if e.name not in failed
+    ]
+    payloads = {}
+    wanted = []
+    for emoji, emoji_bytes in zip(emojis, wanted_bytes):
+        if emoji["name"] in failed:
+            continue
+        wanted.append((emoji, hashlib.sha256(emoji_bytes).hexdigest()))
+        payloads[id(emoji)] = emoji_bytes
+    if failed:
+        logging.warning(
+            f"Leaving emojis {sorted(failed)} of server '{existing_guild.name}' as they are, their images could not be fetched"
+        )
+
+    plan = plan_emoji_sync(existing, wanted)
+
+    # Deleting first frees up slots for the uploads
+    for emoji in plan["delete"]:
         logging.info(f"Delete emoji '{emoji.name}' for server '{existing_guild.name}'")
-        await emoji.delete()
+        await rate_limiter.wait()
+        await emoji.delete(reason="Automatic emoji writing")
+
+    for emoji, name in plan["rename"]:
+        logging.info(
+            f"Rename emoji '{emoji.name}' to '{name}' for server '{existing_guild.name}'"
+        )
+        await rate_limiter.wait()
+        await emoji.edit(name=name, reason="Automatic emoji writing")
+
+    free_spaces_left = boost_emoji_count[existing_guild.premium_tier] - (
+        len(plan["keep"]) + len(plan["rename"]) + len(untouched)
+    )
+    if len(plan["upload"]) > free_spaces_left:
+        logging.warning(
+            f"Only {free_spaces_left} of {len(plan['upload'])} emojis fit in server '{existing_guild.name}'"
+        )
+    uploads = plan["upload"][: max(free_spaces_left, 0)]
 
-    logging.info(f"Pass control to `append_emojis` for server '{existing_guild.name}'")
-    await append_emojis(existing_guild.emojis, import_folder, False)
+    for emoji in uploads:
+        logging.info(
+            f"Uploading emoji '{emoji['name']}' for server '{existing_guild.name}'"
+        )
+        await rate_limiter.wait()
+        await existing_guild.create_custom_emoji(
+            name=emoji["name"],
+            image=payloads[id(emoji)],
+            reason="Automatic emoji writing",
+        )
+
+    calls_made = len(plan["delete"]) + len(plan["rename"]) + len(uploads)
+    # Deleting every emoji and uploading the whole list again
+    calls_naive = len(existing) + min(
+        len(wanted), boost_emoji_count[existing_guild.premium_tier]
+    )
+    res = {
+        "kept": len(plan["keep"]),
+        "untouched": len(untouched),
+        "renamed": len(plan["rename"]),
+        "deleted": len(plan["delete"]),
+        "uploaded": len(uploads),
+        "api_calls": calls_made,
+        "api_calls_saved": calls_naive - calls_made,
+    }
+    logging.info(
+        f"Emoji sync for server '{existing_guild.name}': kept {res['kept']}, left {res['untouched']}, renamed {res['renamed']}, deleted {res['deleted']}, uploaded {res['uploaded']} ({res['api_calls_saved']} API calls saved)"
+    )
+    return res
 
 
 """
@@ -378,7 +770,8 @@ async def write_roles(
 
     # minus 1 because @everyone is included in the list of roles.
     amt_to_write = min(len(existing_guild.roles), len(sorted_server_roles)) - 1
-    everyonedict = role_dict_to_dpy(sorted_server_roles[0])
+    # @everyone has position 0 so it is last after sorting
+    everyonedict = role_dict_to_dpy(sorted_server_roles[-1])
     # del everyonedict['position']
     # Overwrite the @everyone role
     logging.info(f"Overwrite default role for server '{existing_guild.name}'")
@@ -436,6 +829,240 @@ async def write_roles(
             await role.delete()
 
 
+"""
+Map the role IDs of an export to roles of the target guild.
+Roles are matched by name; roles sharing a name are paired from the top of the
+heirarchy down.  @everyone maps to the default role of the target guild.
+
+Return: dict of source role ID (str) to discord.py role
+
+Arguments:
+    existing_guild -- the target guild.
+    roles -- a discord roles list, each element following the role schema
+"""
+
+
+def map_roles(existing_guild: discord.Guild, roles: list) -> dict:
+    res = {}
+    # name -> target roles with that name, top of the heirarchy first
+    by_name = {}
+    for role in reversed(existing_guild.roles[1:]):
+        by_name.setdefault(role.name, []).append(role)
+
+    for role in sorted(roles, key=lambda role: int(role["position"]), reverse=True):
+        if int(role["position"]) == 0:
+            res[role["id"]] = existing_guild.default_role
+            continue
+        candidates = by_name.get(role["name"])
+        if candidates:
+            res[role["id"]] = candidates.pop(0)
+        else:
+            logging.warning(
+                f"Role '{role['name']}' has no counterpart in server '{existing_guild.name}'"
+            )
+    return res
+
+
+"""
+Work out the roles a single member has to gain and lose.
+Only roles that are part of `role_map` are ever removed, other roles of the
+member are left alone.  Managed roles (bots, boosters) cannot be assigned.
+
+Return: (roles to add, roles to remove) as sets, both empty if nothing changes
+
+Arguments:
+    member -- a discord.py member of the target guild
+    member_dict -- a dict following the member schema
+    role_map -- the result of `map_roles`
+    mapped_roles -- the set of target roles in `role_map`
+"""
+
+
+def compute_member_role_change(
+    member: discord.Member, member_dict: dict, role_map: dict, mapped_roles: set
+):
+    default_role = member.guild.default_role
+    wanted = set()
+    for role_id in member_dict.get("roles", []):
+        role = role_map.get(role_id)
+        if role is not None and role != default_role and not role.managed:
+            wanted.add(role)
+
+    current = {role for role in member.roles if role != default_role}
+    to_add = wanted - current
+    to_remove = {role for role in (current & mapped_roles) - wanted if not role.managed}
+    return to_add, to_remove
+
+
+"""
+Give members of the target guild the roles they had in the export.
+Members missing from the target guild or already holding the right roles are
+left unchanged.  Each changed member costs a single API request, and up to
+`concurrency` requests are in flight at once, paced by `rate_limiter`.
+`members` may be any iterable of member dicts, e.g. the members of a server
+dict; ds_fanout runs this on every target guild of a clone.
+
+Return: dict with the amount of members "updated", "unchanged", "missing"
+    (not in the target guild) and "failed"
+
+Arguments:
+    existing_guild -- the target guild, with its member list cached
+    members -- an iterable of dicts following the member schema
+    roles -- the roles list of the export, each element following the role schema
+    concurrency -- amount of member edits in flight at once
+    rate_limiter -- a RateLimiter shared by all edits. One is made if None.
+"""
+
+
+async def write_member_roles(
+    existing_guild: discord.Guild,
+    members,
+    roles: list,
+    concurrency=16,
+    rate_limiter=None,
+) -> dict:
+    logging.info(f"Writing member roles for server '{existing_guild.name}'")
+
+    role_map = map_roles(existing_guild, roles)
+    mapped_roles = set(role_map.values()) - {existing_guild.default_role}
+
+    if rate_limiter is None:
+        # Roughly the global limit of 50 requests per second
+        rate_limiter = RateLimiter(50, 1.0)
+
+    stats = {"updated": 0, "unchanged": 0, "missing": 0, "failed": 0}
+    queue = asyncio.Queue(maxsize=concurrency * 4)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            member, new_roles = item
+            await rate_limiter.wait()
+            try:
+                await member.edit(
+                    roles=new_roles, reason="Automatic member role writing"
+                )
+                stats["updated"] += 1
+            except Exception as e:
+                # A worker that stopped would leave the producer blocked on the
+                # full queue
+                logging.error(
+                    f"Could not write roles of member '{member}' for server '{existing_guild.name}': {e}"
+                )
+                stats["failed"] += 1
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        for member_dict in members:
+            member = existing_guild.get_member(int(member_dict["id"]))
+            if member is None:
+                stats["missing"] += 1
+                continue
+
+            to_add, to_remove = compute_member_role_change(
+                member, member_dict, role_map, mapped_roles
+            )
+            if not to_add and not to_remove:
+                stats["unchanged"] += 1
+                continue
+
+            new_roles = [
+                role
+                for role in member.roles
+                if role != existing_guild.default_role and role not in to_remove
+            ]
+            new_roles.extend(to_add)
+            await queue.put((member, new_roles))
+
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+
+    logging.info(
+        f"Member roles for server '{existing_guild.name}': {stats['updated']} updated, {stats['unchanged']} unchanged, {stats['missing']} not in server, {stats['failed']} failed"
+    )
+    return stats
+
+
+"""
+Collect the IDs of every user that has a permission override anywhere in a
+list of categories, including the channels in them.
+
+Return: set of user IDs (str)
+
+Arguments:
+    categories -- a discord category list, each element following the category schema
+"""
+
+
+def collect_override_user_ids(categories: list) -> set:
+    res = set()
+    for category in categories:
+        abcchannels = (
+            [category]
+            + category.get("text_channels", [])
+            + category.get("voice_channels", [])
+        )
+        for abcchannel in abcchannels:
+            for user_override in abcchannel.get("user_permission_overrides", []):
+                res.add(user_override["id"])
+    return res
+
+
+"""
+Resolve user IDs to discord.py users or members in bulk.
+The client and guild caches are tried first, the rest is fetched from the target
+guild with member queries of up to `chunk_size` IDs each.
+
+Return: dict of user ID (str) to discord.py user or member. Unresolved IDs are absent.
+
+Arguments:
+    bot -- a discord.py client object.
+    existing_guild -- the target guild
+    user_ids -- an iterable of user IDs (str)
+    chunk_size -- IDs per member query. Discord allows at most 100.
+"""
+
+
+async def resolve_override_users(
+    bot: discord.Client, existing_guild: discord.Guild, user_ids, chunk_size=100
+) -> dict:
+    res = {}
+    missing = []
+    for user_id in set(user_ids):
+        usr = existing_guild.get_member(int(user_id)) or bot.get_user(int(user_id))
+        if usr:
+            res[user_id] = usr
+        else:
+            missing.append(user_id)
+
+    from_cache = len(res)
+    for idx in range(0, len(missing), chunk_size):
+        chunk = [int(user_id) for user_id in missing[idx : idx + chunk_size]]
+        try:
+            found = await existing_guild.query_members(
+                limit=len(chunk), user_ids=chunk, cache=True
+            )
+        except (discord.errors.ClientException, asyncio.TimeoutError) as e:
+            logging.warning(
+                f"Could not query members for server '{existing_guild.name}': {e}"
+            )
+            break
+        for member in found:
+            res[str(member.id)] = member
+
+    unresolved = len(set(user_ids)) - len(res)
+    logging.info(
+        f"Resolved {len(res)} override users for server '{existing_guild.name}' ({from_cache} from cache), {unresolved} unresolved"
+    )
+    return res
+
+
 """
 Converts a dict conforming to permission_override_schemas.json#/permission_override_list_schema
 to a dpy PermissionOverwrite object
@@ -459,19 +1086,31 @@ Arguments:
     bot -- a discord.py client object. needed for user overrides
     abcchannel -- either a category, text or voice channel as specified by the schema
     existing_guild -- a guild object with the roles in place
+    user_index -- the result of `resolve_override_users`. None to look users up in the client cache.
 """
 
 
 async def get_dpy_overrides(
-    bot: discord.Client, existing_guild: discord.Guild, abcchannel: dict
+    bot: discord.Client,
+    existing_guild: discord.Guild,
+    abcchannel: dict,
+    user_index=None,
 ):
+    with stage("overrides") as st:
+        overrides = await _get_dpy_overrides(
+            bot, existing_guild, abcchannel, user_index
+        )
+        st.objects += len(overrides)
+    return overrides
+
+
+async def _get_dpy_overrides(bot, existing_guild, abcchannel, user_index):
     overrides = {}
 
     # we need an actual api request to make sure the guild is updated
     existing_guild_roles = await existing_guild.fetch_roles()
-    # this returns @everyone followed by the role heirarchy, #1 role at idx 1
-    existing_guild_roles.append(existing_guild_roles.pop(0))
-    existing_guild_roles.reverse()
+    # The API does not promise any order, so index the roles by position
+    existing_guild_roles.sort(key=lambda role: role.position)
 
     for role_override in abcchannel["role_permission_overrides"]:
         role_pos = role_override["position"]
@@ -487,8 +1126,11 @@ async def get_dpy_overrides(
                 f"Skipping role override for abcchannel '{abcchannel['name']}' for server '{existing_guild.name}': candidate role '{candidate_role.name}' at position {role_pos} does not share the same name as override '{role_override['name']}'"
             )
 
-    for user_override in abcchannel["user_permission_overrides"]:
-        usr = bot.get_user(int(user_override["id"]))
+    for user_override in abcchannel.get("user_permission_overrides", []):
+        if user_index is not None:
+            usr = user_index.get(user_override["id"])
+        else:
+            usr = bot.get_user(int(user_override["id"]))
         if usr:
             logging.info(
                 f"Adding override for user '{usr.name}' for abcchannel '{abcchannel['name']}' for server '{existing_guild.name}'"
@@ -496,7 +1138,7 @@ async def get_dpy_overrides(
             overrides[usr] = override_to_dpy(user_override["permissions"])
         else:
             logging.warning(
-                f"Skipping user override for abcchannel '{abcchannel['name']}' for server '{existing_guild.name}': candidate user '{candidate_role.name}' does not exist"
+                f"Skipping user override for abcchannel '{abcchannel['name']}' for server '{existing_guild.name}': candidate user '{user_override['id']}' does not exist"
             )
     return overrides
 
@@ -508,6 +1150,8 @@ Arguments:
     bot -- a discord.py client object. needed for user overrides
     channel -- the text channel following the textchannel schema
     category -- the category which to add the channel to
+    user_index -- the result of `resolve_override_users`. None to look users up in the client cache.
+    existing_guild -- the target guild, needed when category is None
 
 """
 
@@ -517,13 +1161,20 @@ async def append_textchannel(
     textchannel: dict,
     category: discord.CategoryChannel,
     add_perms=True,
+    user_index=None,
+    existing_guild=None,
 ):
-    existing_guild = category.guild
+    # Uncategorized channels have no category to take the guild from
+    if category is not None:
+        existing_guild = category.guild
+    category_name = category.name if category is not None else ""
     logging.info(
-        f"Append text channel '{textchannel['name']}' for category '{category.name}' for server '{existing_guild.name}'"
+        f"Append text channel '{textchannel['name']}' for category '{category_name}' for server '{existing_guild.name}'"
     )
     overrides = (
-        await get_dpy_overrides(bot, existing_guild, textchannel) if add_perms else {}
+        await get_dpy_overrides(bot, existing_guild, textchannel, user_index)
+        if add_perms
+        else {}
     )
     await existing_guild.create_text_channel(
         name=textchannel["name"],
@@ -534,18 +1185,35 @@ async def append_textchannel(
     )
 
 
+"""
+Updates an existing dpy text channel to match a text channel from an export.
+The channel stays in its category.
+
+Arguments:
+    bot -- a discord.py client object. needed for user overrides
+    textchannel -- the text channel following the textchannel schema
+    existing_textchannel -- the dpy text channel to update
+    user_index -- the result of `resolve_override_users`. None to look users up in the client cache.
+"""
+
+
 async def write_textchannel(
     bot: discord.Client,
     textchannel: dict,
     existing_textchannel: discord.TextChannel,
     add_perms=True,
+    user_index=None,
 ):
-    existing_guild = category.guild
+    category = existing_textchannel.category
+    existing_guild = existing_textchannel.guild
+    category_name = category.name if category is not None else ""
     logging.info(
-        f"Write text channel '{textchannel['name']}' for category '{category.name}' for server '{existing_guild.name}'"
+        f"Write text channel '{textchannel['name']}' for category '{category_name}' for server '{existing_guild.name}'"
     )
     overrides = (
-        await get_dpy_overrides(bot, existing_guild, textchannel) if add_perms else {}
+        await get_dpy_overrides(bot, existing_guild, textchannel, user_index)
+        if add_perms
+        else {}
     )
     await existing_textchannel.edit(
         name=textchannel["name"],
@@ -563,6 +1231,8 @@ Arguments:
     bot -- a discord.py client object. needed for user overrides
     channel -- the voice channel following the voicechannel schema
     category -- the category which to add the channel to
+    user_index -- the result of `resolve_override_users`. None to look users up in the client cache.
+    existing_guild -- the target guild, needed when category is None
 
 """
 
@@ -572,13 +1242,20 @@ async def append_voicechannel(
     voicechannel: dict,
     category: discord.CategoryChannel,
     add_perms=True,
+    user_index=None,
+    existing_guild=None,
 ):
-    existing_guild = category.guild
+    # Uncategorized channels have no category to take the guild from
+    if category is not None:
+        existing_guild = category.guild
+    category_name = category.name if category is not None else ""
     logging.info(
-        f"Append voice channel '{voicechannel['name']}' for category '{category.name}' for server '{existing_guild.name}'"
+        f"Append voice channel '{voicechannel['name']}' for category '{category_name}' for server '{existing_guild.name}'"
     )
     overrides = (
-        await get_dpy_overrides(bot, existing_guild, voicechannel) if add_perms else {}
+        await get_dpy_overrides(bot, existing_guild, voicechannel, user_index)
+        if add_perms
+        else {}
     )
     ulimit = voicechannel["user_limit"] if voicechannel["user_limit"] != 0 else None
     bitrate = min(voicechannel["bitrate"], existing_guild.bitrate_limit)
@@ -603,6 +1280,9 @@ Arguments:
     bot -- a discord.py client object. needed for user overrides
     existing_guild -- the target guild
     categories -- a discord category list, each element following the category schema
+    existing_categories -- dict of category name to a category already in the
+                           guild; the channels of those are added to it instead
+                           of to a new category
 
 """
 
@@ -614,18 +1294,28 @@ async def append_categories(
     add_channels=True,
     add_perms=True,
     append_prompt=True,
+    existing_categories=None,
 ):
     logging.info(
         f"Appending categories roles for server '{existing_guild.name}' (add_channels={add_channels})"
     )
 
+    # Look every overridden user up once instead of once per override
+    user_index = None
+    if add_perms:
+        user_index = await resolve_override_users(
+            bot, existing_guild, collect_override_user_ids(categories)
+        )
+
     for category in categories:
         # Uncategorized channels have an empty category name
         created_category = None
 
-        if category["name"] != "":
+        if existing_categories and category["name"] in existing_categories:
+            created_category = existing_categories[category["name"]]
+        elif category["name"] != "":
             overrides = (
-                await get_dpy_overrides(bot, existing_guild, category)
+                await get_dpy_overrides(bot, existing_guild, category, user_index)
                 if add_perms
                 else {}
             )
@@ -639,70 +1329,90 @@ async def append_categories(
 
         if add_channels:
             for text_channel in category["text_channels"]:
-                await append_textchannel(bot, text_channel, created_category)
+                await append_textchannel(
+                    bot,
+                    text_channel,
+                    created_category,
+                    add_perms,
+                    user_index,
+                    existing_guild,
+                )
 
             for voice_channel in category["voice_channels"]:
-                await append_voicechannel(bot, voice_channel, created_category)
+                await append_voicechannel(
+                    bot,
+                    voice_channel,
+                    created_category,
+                    add_perms,
+                    user_index,
+                    existing_guild,
+                )
 
 
 """
-Creates a guild with a dictionary conforming to the server schema
-The schema for server is in the schemas folder, as with all other relevant structures
+Get the bytes of the server icon, either from an import folder or by downloading it.
 
-Arguments:
-    bot -- a discord.py client object. AutoShardedClient has not been tested.
-    server -- a discord server dict following the server schema
+Return: bytes-like object with the icon, None if there is none
 
-Exceptions:
-    Server unable to be created. Return value `None`
-    Invalid server dict. Exception thrown.
+Arguments:
+    server -- a discord server dict following the server schema, only the
+              header fields are needed
+    import_folder -- the folder an export was written to, or its archive as a
+                     path or from `open_import_folder`. Empty to download.
 """
 
 
-async def create_server(bot: discord.Client, server: dict, import_folder="", add_emojis=True):
-    logging.info("Validating server JSON...")
+def get_server_icon_bytes(server: dict, import_folder=""):
+    # The icon argument for create_guild takes a bytes-like object
+    if import_folder and server.get("id"):
+        logging.info("Trying to find server icon in import folder...")
 
-    server_schema_path = "schemas/server_schema.json"
-    with open(server_schema_path) as f:
-        server_schema = json.load(f)
+        # Icons are written as `<guild id>.<ext>`
+        with open_import_folder(import_folder) as import_folder:
+            if isinstance(import_folder, ArchiveReader):
+                for filename in import_folder.listdir("icons"):
+                    if os.path.splitext(filename)[0] == server["id"]:
+                        return import_folder.read(f"icons/{filename}")
+            elif os.path.isdir(f"{import_folder}/icons"):
+                icon_dir = f"{import_folder}/icons"
+                for filename in os.listdir(icon_dir):
+                    if os.path.splitext(filename)[0] == server["id"]:
+                        with open(f"{icon_dir}/{filename}", "rb") as f:
+                            return f.read()
+        logging.warning("Server icon not found in import folder")
+        return None
 
-    # We need this for the json pointers in the schemas to work
-    resolver = jsonschema.RefResolver(
-        "file:///" + os.getcwd() + "/schemas/", server_schema
-    )
+    if not server["icon_url"]:
+        return None
 
-    # Validate the server dict
-    jsonschema.validate(server, server_schema, resolver=resolver)
+    logging.info("Downloading server icon...")
+    try:
+        # Server icon cannot be over 10.240MB
+        # first element is the icon, second is the extension
+        return get_icon_under_10mb(server["icon_url"])[0]
+    except (discord.errors.HTTPException, OSError):
+        logging.error("Could not download server icon, falling back to default")
+        return None
 
-    logging.info(f"OK: server name \"{server['name']}\"")
 
-    server_icon_bytes = None
+"""
+Creates an empty guild from the header fields of a server dict.
 
-    # Download the server icon.  The icon argument for create_guild takes a
-    # bytes-like object
-    if import_folder and server["id"]:
-        logging.info("Trying to find server icon in import folder...")
-        candidate_path = f"{import_folder}/icons/{server['id']}"
+Return: the new guild, None if it could not be created
 
-        if os.path.exists(candidate_path):
-            with open(candidate_path, "rb") as f:
-                server_icon_bytes = f.read()
-    else:
-        logging.info("Downloading server icon...")
+Arguments:
+    bot -- a discord.py client object.
+    server -- a discord server dict following the server schema
+    server_icon_bytes -- the icon of the new guild, None for the default
+"""
 
-        try:
-            # Server icon cannot be over 10.240MB
-            # first element is the icon, second is the extension
-            server_icon_bytes = get_icon_under_10mb(server["icon_url"])[0]
-        except discord.errors.HTTPException:
-            logging.error("Could not download server icon, falling back to default")
-            server_icon_bytes = None
 
+async def create_guild(bot: discord.Client, server: dict, server_icon_bytes=None):
     # A bot account in over 10 guilds cannot create guilds and will throw an
     # HTTPException
     # We have no way of verifying if `bot` is a real bot or a user account
     try:
-        new_guild = await bot.create_guild(
+        return await bot.create_guild(
             server["name"],
             region=discord.VoiceRegion(server["voice_region"]),
             icon=server_icon_bytes,
@@ -721,19 +1431,79 @@ async def create_server(bot: discord.Client, server: dict, import_folder="", add
         )
         return None
 
-    # After the server is created, we can add the roles and stuff with other
-    # functions
-    # which can be used in `overwrite_server`
-    # first: roles
-    await append_roles(new_guild, server["roles"])
 
-    # second: categories, for synced perms
-    # this adds channels with their perm overrides.
-    await append_categories(bot, new_guild, server["categories"])
+"""
+Creates a guild with a dictionary conforming to the server schema
+The schema for server is in the schemas folder, as with all other relevant structures
+
+Arguments:
+    bot -- a discord.py client object. AutoShardedClient has not been tested.
+    server -- a discord server dict following the server schema
+    validation_workers -- processes used to validate members, 0 for serial
+
+Each stage (validation, icon, guild creation, roles, categories, emojis) is
+recorded by the ds_profile.Profiler active around the call, if any.
+
+Exceptions:
+    Server unable to be created. Return value `None`
+    Invalid server dict. Exception thrown.
+"""
+
+
+async def create_server(
+    bot: discord.Client,
+    server: dict,
+    import_folder="",
+    add_emojis=True,
+    validation_workers=0,
+):
+    logging.info("Validating server JSON...")
+
+    # Validate the server dict.  The schemas are loaded and compiled once.
+    with stage("validate") as st:
+        get_registry().validate_server(server, workers=validation_workers)
+        st.objects += 1
+
+    logging.info(f"OK: server name \"{server['name']}\"")
 
-    # third: emojis
-    if add_emojis:
-        await append_emojis(new_guild, server["emojis"], import_folder)
+    # An archive is opened once for the icon and the emojis
+    with open_import_folder(import_folder) as import_folder:
+        with stage("icon") as st:
+            server_icon_bytes = get_server_icon_bytes(server, import_folder)
+            if server_icon_bytes:
+                st.objects += 1
+                st.bytes_written += len(server_icon_bytes)
+
+        with stage("create_guild") as st:
+            new_guild = await create_guild(bot, server, server_icon_bytes)
+            if new_guild is None:
+                return None
+            st.objects += 1
+
+        # After the server is created, we can add the roles and stuff with other
+        # functions
+        # which can be used in `overwrite_server`
+        # first: roles
+        with stage("roles") as st:
+            await append_roles(new_guild, server["roles"])
+            st.objects += len(server["roles"])
+
+        # second: categories, for synced perms
+        # this adds channels with their perm overrides.
+        with stage("categories") as st:
+            await append_categories(bot, new_guild, server["categories"])
+            st.objects += len(server["categories"])
+
+        # third: emojis
+        if add_emojis:
+            with stage("emojis") as st:
+                await append_emojis(
+                    new_guild,
+                    server["emojis"],
+                    import_folder,
+                    source_guild_id=server["id"],
+                )
+                st.objects += len(server["emojis"])
     """
     await asyncio.gather(
         append_roles(bot, new_guild, server['roles']),
@@ -742,3 +1512,183 @@ async def create_server(bot: discord.Client, server: dict, import_folder="", add
     """
     # return the server
     return new_guild
+
+
+"""
+Creates a guild from a server export on disk without loading the whole file.
+The file is parsed incrementally on a worker thread: the guild is created as
+soon as the required header fields are read, roles and categories are created
+as soon as their sections are complete, and members are validated and handed
+to `member_handler` one at a time instead of being kept in memory.
+
+The header fields may be anywhere in the file.  Sections read before the
+header is complete wait for the guild, so an export with its keys sorted keeps
+the members before "name" in memory until then.
+
+Since the guild is created before the end of the file is read, an invalid item
+in a later section raises only after the earlier sections have been created.
+
+Arguments:
+    bot -- a discord.py client object. AutoShardedClient has not been tested.
+    path -- path to a server export following the server schema, a JSON list
+            of them, or an export container (see ds_container.py)
+    member_handler -- optional async callable, called with (guild, member dict)
+    queue_size -- amount of parsed events buffered between reader and importer
+    guild_id -- the server to import from a container or list, None for the first one
+
+Exceptions:
+    Server unable to be created. Return value `None`
+    Invalid server file. Exception thrown.
+"""
+
+
+async def create_server_from_file(
+    bot: discord.Client,
+    path: str,
+    import_folder="",
+    add_emojis=True,
+    member_handler=None,
+    queue_size=1024,
+    guild_id=None,
+):
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    registry = get_registry()
+
+    # Runs on a worker thread.  Blocks while the queue is full, which is what
+    # keeps memory bounded.
+    def reader():
+        try:
+            for event in iter_export_events(path, guild_id):
+                if stop.is_set():
+                    return
+                asyncio.run_coroutine_threadsafe(queue.put(event), loop).result()
+            asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+        except Exception as e:
+            asyncio.run_coroutine_threadsafe(queue.put(e), loop).result()
+
+    # An archive is opened once for the icon and the emojis
+    folder = contextlib.ExitStack()
+    import_folder = folder.enter_context(open_import_folder(import_folder))
+    reader_future = loop.run_in_executor(None, reader)
+
+    header = {}
+    required = registry.schemas["server_schema"].get("required", [])
+    sections = {"roles": [], "categories": [], "emojis": []}
+    new_guild = None
+    # Import steps run in order, each one chained after the previous
+    steps = []
+    member_count = 0
+    # Sections that ended and members that were read before the guild existed
+    ended = []
+    pending_members = []
+    late_fields = False
+
+    def chain(coro_factory):
+        previous = steps[-1] if steps else None
+
+        async def run():
+            if previous is not None:
+                await previous
+            await coro_factory()
+
+        steps.append(asyncio.ensure_future(run()))
+
+    def chain_section(key):
+        if key == "roles":
+            chain(lambda: append_roles(new_guild, sections["roles"]))
+        elif key == "categories":
+            chain(lambda: append_categories(bot, new_guild, sections["categories"]))
+
+    async def start_guild():
+        nonlocal new_guild
+        logging.info("Validating server header...")
+        registry.validate(header, "server_schema")
+        logging.info(f"OK: server name \"{header['name']}\"")
+        icon = await run_in_executor(get_server_icon_bytes, header, import_folder)
+        new_guild = await create_guild(bot, header, icon)
+        if new_guild is None:
+            return False
+        for key in ended:
+            chain_section(key)
+        if member_handler is not None:
+            for member in pending_members:
+                await member_handler(new_guild, member)
+        pending_members.clear()
+        return True
+
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            if isinstance(event, Exception):
+                raise event
+            kind, key, value = event
+
+            if kind == FIELD:
+                header[key] = value
+                if new_guild is not None:
+                    late_fields = True
+                continue
+
+            # The header is complete once every required field was read, which
+            # is before the first section in exports of this tool but not in
+            # exports with sorted keys
+            if new_guild is None and all(field in header for field in required):
+                if not await start_guild():
+                    return None
+
+            if kind == ITEM:
+                if key == "members":
+                    registry.validate_section_items(key, [value], member_count)
+                    member_count += 1
+                    if member_handler is None:
+                        continue
+                    if new_guild is None:
+                        pending_members.append(value)
+                    else:
+                        await member_handler(new_guild, value)
+                else:
+                    registry.validate_section_items(key, [value], len(sections[key]))
+                    sections[key].append(value)
+            elif kind == SECTION_END:
+                logging.info(f"Read {value} {key} from '{path}'")
+                if new_guild is None:
+                    ended.append(key)
+                else:
+                    chain_section(key)
+
+        if new_guild is None:
+            # An export without sections, or with required fields missing,
+            # which fails validation here
+            if not await start_guild():
+                return None
+        elif late_fields:
+            # Optional fields after the sections
+            registry.validate(header, "server_schema")
+
+        if add_emojis and sections["emojis"]:
+            chain(
+                lambda: append_emojis(
+                    new_guild,
+                    sections["emojis"],
+                    import_folder,
+                    source_guild_id=header.get("id"),
+                )
+            )
+        if steps:
+            await steps[-1]
+    finally:
+        stop.set()
+        # Unblock the reader if it is waiting on a full queue
+        while not queue.empty():
+            queue.get_nowait()
+        for step in steps:
+            if not step.done():
+                step.cancel()
+        folder.close()
+
+    await reader_future
+    return new_guild
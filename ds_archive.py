@@ -0,0 +1,293 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Single file exports.
+#
+# Instead of a folder of schemas, icons and emojis, an export can be written
+# to one zip file with the same layout inside (`icons/<guild id>.<ext>`,
+# `emojis/<guild id>/<name>.<ext>`, `schemas/<guild id>.json`).  Files are
+# added as they are produced, and the zip central directory written at the end
+# is the index: a reader looks a file up there and reads it in place, without
+# extracting anything.  Images are stored as they are, since they are already
+# compressed; JSON is deflated.
+#
+# Every file written with `write_export_file` is also listed with its SHA-256
+# in `SHA256SUMS` at the top of the export, in the format of `sha256sum`, so a
+# later check can tell a damaged file from a good one (see ds_verify.py).  In
+# a folder the lines are appended as files are written; an archive adds the
+# whole list when it is closed.
+
+import os
+import hashlib
+import logging
+import time
+import zipfile
+import threading
+
+_compressed_exts = (".json",)
+
+checksums_file = "SHA256SUMS"
+# Serializes appends to the checksum files of export folders
+_checksums_lock = threading.Lock()
+
+
+"""
+Return: a line of a checksum file
+"""
+
+
+def checksum_line(name: str, digest: str) -> str:
+    return f"{digest}  {name}\n"
+
+
+"""
+Parse a checksum file.  A file listed more than once, e.g. after a server was
+exported to the same folder again, has the digest of its last line.
+
+Return: dict of file path -> hex SHA-256
+"""
+
+
+def parse_checksums(text: str) -> dict:
+    res = {}
+    for line in text.splitlines():
+        digest, sep, name = line.partition("  ")
+        if sep and name:
+            res[name] = digest
+    return res
+
+
+"""
+Writes the files of an export to a zip file.  Safe to use from several
+threads at once.
+
+Arguments:
+    path -- the zip file
+"""
+
+
+class ExportArchive:
+    def __init__(self, path: str):
+        self.path = path
+        self._zip = zipfile.ZipFile(path, "w")
+        self._lock = threading.Lock()
+        self._pending = []
+        # file path -> SHA-256, written to the checksum file on close
+        self._digests = {}
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __str__(self):
+        return self.path
+
+    """
+    Add a file.
+
+    Arguments:
+        name -- path of the file inside the archive, e.g. "icons/1234.png"
+        data -- bytes or str, or an iterable of them to write a file in
+                chunks, e.g. one member at a time
+
+    Return: amount of bytes written
+    """
+
+    def write(self, name: str, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        compression = zipfile.ZIP_STORED
+        if name.endswith(_compressed_exts):
+            compression = zipfile.ZIP_DEFLATED
+        if not isinstance(data, bytes):
+            return self._write_chunks(name, data, compression)
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._zip.writestr(name, data, compress_type=compression)
+            self._digests[name] = digest
+            self.count += 1
+        return len(data)
+
+    def _write_chunks(self, name: str, chunks, compression) -> int:
+        digest = hashlib.sha256()
+        size = 0
+        info = zipfile.ZipInfo(name, time.localtime()[:6])
+        info.compress_type = compression
+        # Other threads wait until the file is complete, a zip can only be
+        # written one file at a time
+        with self._lock, self._zip.open(info, "w", force_zip64=True) as f:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        with self._lock:
+            self._digests[name] = digest.hexdigest()
+            self.count += 1
+        return size
+
+    """
+    Add every file of a folder, e.g. a member archive written to a temporary
+    folder.
+
+    Arguments:
+        directory -- the folder to add
+        prefix -- path of the folder inside the archive
+    """
+
+    def write_folder(self, directory: str, prefix: str):
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if entry.is_file():
+                with open(entry.path, "rb") as f:
+                    self.write(f"{prefix}/{entry.name}", f.read())
+
+    """
+    Have `close` wait for a thread still adding files, like the emoji
+    downloads of `dump_emojis`.
+    """
+
+    def track(self, thread: threading.Thread):
+        self._pending.append(thread)
+
+    """
+    Wait for tracked threads, then write the checksum file and the index.
+    """
+
+    def close(self):
+        for thread in self._pending:
+            thread.join()
+        self._pending = []
+        with self._lock:
+            if self._zip is None:
+                return
+            checksums = "".join(
+                checksum_line(name, digest) for name, digest in self._digests.items()
+            )
+            self._zip.writestr(
+                checksums_file, checksums, compress_type=zipfile.ZIP_DEFLATED
+            )
+            self._zip.close()
+            self._zip = None
+        logging.info(f"Wrote {self.count} files to export archive '{self.path}'")
+
+
+"""
+Write one file of an export, to a folder or an ExportArchive, and list it in
+the export's checksum file.
+
+Return: amount of bytes written
+
+Arguments:
+    target -- an export folder or an ExportArchive
+    name -- path of the file relative to the export, e.g. "icons/1234.png"
+    data -- bytes or str, or an iterable of them, written as they come
+"""
+
+
+def write_export_file(target, name: str, data) -> int:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if isinstance(target, ExportArchive):
+        return target.write(name, data)
+
+    if isinstance(data, bytes):
+        data = (data,)
+    path = os.path.join(target, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as f:
+        for chunk in data:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            digest.update(chunk)
+            f.write(chunk)
+            size += len(chunk)
+    line = checksum_line(name, digest.hexdigest())
+    with _checksums_lock, open(os.path.join(target, checksums_file), "a") as f:
+        f.write(line)
+    return size
+
+
+"""
+Return: whether `path` is an export archive rather than an export folder
+"""
+
+
+def is_archive(path: str) -> bool:
+    return bool(path) and os.path.isfile(path) and zipfile.is_zipfile(path)
+
+
+"""
+Reads files from an export archive by looking them up in its index.  Safe to
+read from several threads at once.
+
+Arguments:
+    path -- the zip file
+"""
+
+
+class ArchiveReader:
+    def __init__(self, path: str):
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        # folder -> file names in it, from the central directory
+        self._folders = {}
+        for info in self._zip.infolist():
+            if not info.is_dir():
+                folder, _, filename = info.filename.rpartition("/")
+                self._folders.setdefault(folder, []).append(filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._zip.close()
+
+    """
+    Return: names of the files in a folder of the archive, [] if there is none
+    """
+
+    def listdir(self, folder: str) -> list:
+        return list(self._folders.get(folder.strip("/"), []))
+
+    """
+    Return: whether the archive has a folder, directly or in a subfolder
+    """
+
+    def has_folder(self, folder: str) -> bool:
+        folder = folder.strip("/")
+        prefix = folder + "/"
+        return any(name == folder or name.startswith(prefix) for name in self._folders)
+
+    """
+    Return: the bytes of a file in the archive
+
+    Exceptions:
+        KeyError if the archive has no such file
+    """
+
+    def read(self, name: str) -> bytes:
+        return self._zip.read(name)
@@ -0,0 +1,426 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Generated validators and encoders.
+#
+# jsonschema interprets a schema on every call: for each value it looks up the
+# keywords of the schema, dispatches to a function per keyword and collects
+# errors through generators.  The schemas here never change while running, so
+# instead each one is turned into Python source once, with the checks of every
+# keyword written out inline, and compiled.  $refs become calls to the
+# function generated for their target, and checks that can never fail (like
+# the items of the server sections, which point at a `properties` object) are
+# left out entirely.
+#
+# The validators follow draft 7 as implemented by jsonschema, which is what the
+# schemas are validated with otherwise, and raise the same
+# jsonschema.ValidationError with the same message and path.  They stop at the
+# first error instead of picking the best match out of all of them.  Schemas
+# using a keyword not handled here raise UnsupportedSchema when generated, and
+# are left to jsonschema (see ds_validation.py).
+#
+# The encoders are the `to_dict` of the ds_model records, written out field by
+# field instead of looping over `_fields`.
+#
+# `python ds_codegen.py` prints the generated source.
+
+import re
+import logging
+
+from jsonschema import ValidationError
+
+# Draft 7 keywords that validate something but are not handled.  Besides these
+# and the ones in `_check`, keywords are annotations or unknown, and ignored
+# like jsonschema does.
+_unhandled = {
+    "$id",
+    "additionalItems",
+    "additionalProperties",
+    "allOf",
+    "anyOf",
+    "const",
+    "contains",
+    "dependencies",
+    "enum",
+    "if",
+    "maxItems",
+    "maxProperties",
+    "minItems",
+    "minProperties",
+    "multipleOf",
+    "not",
+    "oneOf",
+    "pattern",
+    "patternProperties",
+    "propertyNames",
+}
+_drafts = (
+    None,
+    "http://json-schema.org/draft-07/schema#",
+    "http://json-schema.org/draft-07/schema",
+)
+
+_type_tests = {
+    "object": "isinstance({0}, dict)",
+    "array": "isinstance({0}, list)",
+    "string": "isinstance({0}, str)",
+    "boolean": "isinstance({0}, bool)",
+    "null": "{0} is None",
+    "number": "(isinstance({0}, (int, float)) and not isinstance({0}, bool))",
+    # Draft 7 counts 1.0 as an integer
+    "integer": "((isinstance({0}, int) and not isinstance({0}, bool)) or (isinstance({0}, float) and {0}.is_integer()))",
+}
+_numeric = {
+    "minimum": ("<", "%r is less than the minimum of %r"),
+    "maximum": (">", "%r is greater than the maximum of %r"),
+    "exclusiveMinimum": ("<=", "%r is less than or equal to the minimum of %r"),
+    "exclusiveMaximum": (">=", "%r is greater than or equal to the maximum of %r"),
+}
+
+
+class UnsupportedSchema(Exception):
+    pass
+
+
+def _error(message: str, path: tuple, validator: str, instance):
+    return ValidationError(message, validator=validator, path=path, instance=instance)
+
+
+def _tuple(items: list) -> str:
+    if len(items) == 1:
+        return f"({items[0]},)"
+    return f"({', '.join(items)})"
+
+
+"""
+Generates the source of validator functions for schemas of a SchemaRegistry.
+Functions are added with `add` and shared between everything referring to the
+same (sub-)schema.
+
+Arguments:
+    schemas -- dict of schema name (file name without .json) -> schema
+"""
+
+
+class ValidatorGenerator:
+    def __init__(self, schemas: dict):
+        self.schemas = schemas
+        # (schema name, JSON pointer) -> function name
+        self._functions = {}
+        self._sources = []
+        # Functions that never raise
+        self._empty = set()
+        self._variables = 0
+
+    """
+    Generate the function validating a schema, or a part of one.
+
+    Return: the name of the function
+
+    Arguments:
+        name -- the schema, e.g. "role_schema"
+        pointer -- JSON pointer into it, "" for the whole schema
+
+    Exceptions:
+        UnsupportedSchema if the schema uses a keyword that is not handled
+    """
+
+    def add(self, name: str, pointer="") -> str:
+        key = (name, pointer)
+        if key in self._functions:
+            return self._functions[key]
+        if self.schemas.get(name, {}).get("$schema") not in _drafts:
+            raise UnsupportedSchema(f"{name} is not a draft 7 schema")
+
+        function = "_validate_" + re.sub(r"\W", "_", name + pointer)
+        while function in self._functions.values():
+            function += "_"
+        self._functions[key] = function
+
+        body = []
+        self._check(body, self._node(name, pointer), name, "value", [], 1)
+        if not body:
+            self._empty.add(function)
+            body = ["    pass"]
+        self._sources.append("\n".join([f"def {function}(value):", *body]))
+        return function
+
+    """
+    Return: the source of every function added so far
+    """
+
+    def source(self) -> str:
+        return "\n\n\n".join(self._sources) + "\n"
+
+    """
+    Compile the functions added so far.
+
+    Return: dict of function name -> function
+    """
+
+    def compile(self) -> dict:
+        namespace = {"ValidationError": ValidationError, "_error": _error}
+        exec(compile(self.source(), "<generated validators>", "exec"), namespace)
+        return {function: namespace[function] for function in self._functions.values()}
+
+    def _node(self, name: str, pointer: str):
+        try:
+            node = self.schemas[name]
+            for part in pointer.split("/")[1:]:
+                part = part.replace("~1", "/").replace("~0", "~")
+                node = node[int(part)] if isinstance(node, list) else node[part]
+        except (KeyError, IndexError, ValueError):
+            raise UnsupportedSchema(f"Cannot resolve '{name}#{pointer}'") from None
+        return node
+
+    def _resolve(self, name: str, ref: str) -> tuple:
+        filename, _, pointer = ref.partition("#")
+        if filename:
+            if (
+                not filename.endswith(".json")
+                or filename[: -len(".json")] not in self.schemas
+            ):
+                raise UnsupportedSchema(f"Cannot resolve $ref '{ref}'")
+            name = filename[: -len(".json")]
+        return name, pointer
+
+    def _variable(self) -> str:
+        self._variables += 1
+        return f"v{self._variables}"
+
+    def _fail(self, lines, indent, message, args, path, keyword, var):
+        pad = "    " * indent
+        lines.append(
+            f"{pad}raise _error({message!r} % {_tuple(args)}, {_tuple(path)}, {keyword!r}, {var})"
+        )
+
+    # Append to `lines` the checks of `node` on the value in the variable `var`.
+    # `path` lists expressions for the path to that value from the function's.
+    def _check(self, lines: list, node, name: str, var: str, path: list, indent: int):
+        pad = "    " * indent
+        if node is True:
+            return
+        if node is False:
+            self._fail(
+                lines, indent, "False schema does not allow %r", [var], path, None, var
+            )
+            return
+        if not isinstance(node, dict):
+            raise UnsupportedSchema(f"{node!r} in {name} is not a schema")
+
+        if "$ref" in node:
+            # Everything next to a $ref is ignored in draft 7
+            function = self.add(*self._resolve(name, node["$ref"]))
+            if function in self._empty:
+                return
+            if not path:
+                lines.append(f"{pad}{function}({var})")
+                return
+            lines += [
+                f"{pad}try:",
+                f"{pad}    {function}({var})",
+                f"{pad}except ValidationError as e:",
+                f"{pad}    e.path.extendleft(reversed({_tuple(path)}))",
+                f"{pad}    raise",
+            ]
+            return
+
+        unhandled = sorted(_unhandled.intersection(node))
+        if unhandled:
+            raise UnsupportedSchema(f"{name} uses {', '.join(unhandled)}")
+
+        types = node.get("type")
+        if isinstance(types, str):
+            types = [types]
+        if types is not None:
+            if any(t not in _type_tests for t in types):
+                raise UnsupportedSchema(f"Unknown type in {name}: {types}")
+            test = " or ".join(_type_tests[t].format(var) for t in types)
+            lines.append(f"{pad}if not ({test}):")
+            message = "%r is not of type " + ", ".join(repr(t) for t in types)
+            self._fail(lines, indent + 1, message, [var], path, "type", var)
+        # A single type is known to hold past this point
+        only = types[0] if types is not None and len(types) == 1 else None
+
+        def guarded(kind: str, body: list):
+            if not body:
+                return
+            if only == kind or (kind == "number" and only == "integer"):
+                lines.extend(body)
+                return
+            lines.append(f"{pad}if {_type_tests[kind].format(var)}:")
+            lines.extend("    " + line for line in body)
+
+        body = []
+        for key in node.get("required", ()):
+            body.append(f"{pad}if {key!r} not in {var}:")
+            self._fail(
+                body,
+                indent + 1,
+                "%r is a required property",
+                [repr(key)],
+                path,
+                "required",
+                var,
+            )
+        for key, subschema in node.get("properties", {}).items():
+            item = self._variable()
+            checks = []
+            self._check(checks, subschema, name, item, path + [repr(key)], indent + 1)
+            if checks:
+                body.append(f"{pad}if {key!r} in {var}:")
+                body.append(f"{pad}    {item} = {var}[{key!r}]")
+                body.extend(checks)
+        guarded("object", body)
+
+        if "items" in node:
+            if isinstance(node["items"], list):
+                raise UnsupportedSchema(f"{name} uses items as an array")
+            index, item = self._variable(), self._variable()
+            checks = []
+            self._check(checks, node["items"], name, item, path + [index], indent + 1)
+            if checks:
+                guarded(
+                    "array", [f"{pad}for {index}, {item} in enumerate({var}):", *checks]
+                )
+
+        body = []
+        for keyword, (operator, message) in _numeric.items():
+            if keyword in node:
+                limit = node[keyword]
+                body.append(f"{pad}if {var} {operator} {limit!r}:")
+                self._fail(
+                    body, indent + 1, message, [var, repr(limit)], path, keyword, var
+                )
+        guarded("number", body)
+
+        body = []
+        if "minLength" in node:
+            body.append(f"{pad}if len({var}) < {node['minLength']!r}:")
+            self._fail(
+                body, indent + 1, "%r is too short", [var], path, "minLength", var
+            )
+        if "maxLength" in node:
+            body.append(f"{pad}if len({var}) > {node['maxLength']!r}:")
+            self._fail(
+                body, indent + 1, "%r is too long", [var], path, "maxLength", var
+            )
+        guarded("string", body)
+
+
+"""
+Generate and compile the validator of one (sub-)schema.
+
+Return: a function taking the value to validate
+
+Arguments:
+    schemas -- dict of schema name -> schema
+    name -- the schema, e.g. "role_schema"
+    pointer -- JSON pointer into it, "" for the whole schema
+
+Exceptions:
+    UnsupportedSchema if the schema uses a keyword that is not handled
+"""
+
+
+def compile_validator(schemas: dict, name: str, pointer=""):
+    generator = ValidatorGenerator(schemas)
+    function = generator.add(name, pointer)
+    return generator.compile()[function]
+
+
+"""
+Generate the source of the `to_dict` of record classes (see ds_model.py).
+Fields whose codec has a `record` are encoded with the function of that
+record class, which has to be generated along.
+
+Return: dict of record class -> function name, and the source
+"""
+
+
+def generate_encoders(classes) -> tuple:
+    functions = {cls: f"_encode_{cls.__name__}" for cls in classes}
+    codecs = {}
+    sources = []
+    for cls, function in functions.items():
+        lines = [f"def {function}(self):"]
+        fixed = []
+        body = []
+        for name, codec, omitted in cls._fields:
+            if codec is None:
+                expression = "{0}"
+            elif getattr(codec, "record", None) is not None:
+                expression = f"[{functions[codec.record]}(item) for item in {{0}}]"
+            elif codec[0] is str:
+                expression = "str({0})"
+            else:
+                codecs[f"_dump_{cls.__name__}_{name}"] = codec[0]
+                expression = f"_dump_{cls.__name__}_{name}({{0}})"
+
+            if not omitted and codec is None and not body:
+                # Leading fields that are always there go in the dict display
+                fixed.append(f"{name!r}: self.{name}")
+                continue
+            if omitted:
+                body += [
+                    f"    value = self.{name}",
+                    "    if value is not None:",
+                    f"        res[{name!r}] = {expression.format('value')}",
+                ]
+            elif codec is None:
+                body += [f"    res[{name!r}] = self.{name}"]
+            else:
+                body += [
+                    f"    value = self.{name}",
+                    f"    res[{name!r}] = None if value is None else {expression.format('value')}",
+                ]
+        lines.append(f"    res = {{{', '.join(fixed)}}}")
+        lines += body
+        lines.append("    return res")
+        sources.append("\n".join(lines))
+    return functions, "\n\n\n".join(sources) + "\n", codecs
+
+
+"""
+Generate and compile the `to_dict` of record classes.
+
+Return: dict of record class -> function
+"""
+
+
+def compile_encoders(classes) -> dict:
+    functions, source, namespace = generate_encoders(classes)
+    exec(compile(source, "<generated encoders>", "exec"), namespace)
+    logging.debug(f"Generated encoders for {len(functions)} records")
+    return {cls: namespace[function] for cls, function in functions.items()}
+
+
+if __name__ == "__main__":
+    import ds_model
+    from ds_validation import get_registry, server_sections
+
+    registry = get_registry()
+    generator = ValidatorGenerator(registry.schemas)
+    for name in sorted(registry.schemas):
+        if name != "permission_override_schemas":
+            generator.add(name)
+    for section in server_sections:
+        generator.add("server_schema", f"/properties/{section}/items")
+    print(generator.source())
+    print()
+    print(generate_encoders(ds_model.records)[1])
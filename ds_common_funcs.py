@@ -16,23 +16,98 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import time
+import asyncio
 import logging
-from urllib.request import Request, urlopen
-
-# This header is needed or else we get 403 forbidden '-'
-# The user agent and accept* are copied from a random Chrome request
-req_hdr = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.104 Safari/537.36",
-    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
-    "Accept-Charset": "ISO-8859-1,utf-8;q=0.7,*;q=0.3",
-    "Accept-Encoding": "gzip, deflate, br",
-    "Accept-Language": "en-US,en;q=0.9",
-    "Connection": "keep-alive",
-}
+import contextlib
+import contextvars
+
+from ds_trace import span, traced
+from ds_http import get_client, req_hdr, ResponseTooLarge
 
 # emoji slot count lookup table
 boost_emoji_count = {0: 50, 1: 100, 2: 150, 3: 250}
 
+# emojis cannot be larger than 256kb
+emoji_size_limit = 256000
+
+
+"""
+Spaces out awaited calls so at most `rate` of them start every `per` seconds.
+discord.py already retries on 429, this just keeps us from hitting them.
+
+Arguments:
+    rate -- amount of calls allowed in a window
+    per -- the window length in seconds
+"""
+
+
+class RateLimiter:
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self._allowance = float(rate)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        with span("rate_limit_wait", "ratelimit"):
+            await self._wait()
+
+    async def _wait(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._allowance = min(
+                    self.rate,
+                    self._allowance + (now - self._last) * self.rate / self.per,
+                )
+                self._last = now
+                if self._allowance >= 1:
+                    self._allowance -= 1
+                    return
+                await asyncio.sleep((1 - self._allowance) * self.per / self.rate)
+
+
+"""
+Make every REST request of a discord.py client wait on a RateLimiter first, so
+several imports running on one client share a single request budget.
+The original request method is restored on exit.
+
+Arguments:
+    bot -- a discord.py client object.
+    rate_limiter -- the RateLimiter every request waits on
+"""
+
+
+@contextlib.contextmanager
+def limit_client_requests(bot, rate_limiter: RateLimiter):
+    original = bot.http.request
+
+    async def request(*args, **kwargs):
+        await rate_limiter.wait()
+        return await original(*args, **kwargs)
+
+    bot.http.request = request
+    try:
+        yield
+    finally:
+        bot.http.request = original
+
+
+"""
+Run a blocking function on the event loop's default executor.  The function
+runs in a copy of the current context, so an active tracer or profiler still
+sees what it does.
+
+Return: an awaitable for the function's result
+"""
+
+
+def run_in_executor(func, *args):
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(None, contextvars.copy_context().run, func, *args)
+
 
 """
 Gets a server icon under 10mb if the original is over
@@ -44,6 +119,7 @@ Arguments:
 """
 
 
+@traced("cdn")
 def get_icon_under_10mb(url: str):
     icon_sizes = (2048, 1024, 512, 256, 128)
 
@@ -65,17 +141,16 @@ def get_icon_under_10mb(url: str):
     # The URL without an extension or size.
     icon_url_no_ext = ".".join(url.split(".")[:-1])
 
-    # Try original first
-    req = Request(url, None, req_hdr)
-    server_icon_req = urlopen(req)
+    client = get_client()
 
+    # Try original first
     # file cannot be larger than 10240.0 kb
-    if int(server_icon_req.info()["Content-Length"]) > 10240000:
+    try:
+        return client.fetch(url, max_size=10240000, label="icon").body, icon_ext
+    except ResponseTooLarge:
         logging.warning(
             "Original server icon larger than 10.240MB limit. Searching for smaller..."
         )
-    else:
-        return server_icon_req.read(), icon_ext
 
     # We want the highest resolution images, so try 2048 on all formats and
     # then the next highest size 1024 and so on
@@ -84,13 +159,14 @@ def get_icon_under_10mb(url: str):
             logging.info(f"Trying {format} and {icon_size}")
 
             candidate_icon_url = f"{icon_url_no_ext}.{format}?size={icon_size}"
-            req = Request(candidate_icon_url, None, req_hdr)
-            server_icon_req = urlopen(req)
-
-            file_size = int(server_icon_req.info()["Content-Length"])
             # not <= just to be safe '-'
-            if file_size < 10240000:
-                logging.info(
-                    f"Found suitable icon with extension {format}, resolution {icon_size} ({file_size}b)"
-                )
-                return server_icon_req.read(), icon_ext
\ No newline at end of file
+            try:
+                icon = client.fetch(
+                    candidate_icon_url, max_size=10240000 - 1, label="icon"
+                ).body
+            except ResponseTooLarge:
+                continue
+            logging.info(
+                f"Found suitable icon with extension {format}, resolution {icon_size} ({len(icon)}b)"
+            )
+            return icon, icon_ext
@@ -0,0 +1,437 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# A container file for server exports with random access to their sections.
+#
+# The file starts with `magic`, followed by sections of UTF-8 JSON back to
+# back, then a table of contents and a trailer:
+#
+#     magic | section | section | ... | table of contents | trailer
+#
+# Every server in the file has its header (the scalar fields), roles and
+# emojis as one section each, every category as a section of its own, and its
+# members split into shards of `member_shard_size`.  The table of contents is
+# JSON too, listing where each section of each server is, and which category
+# each channel is in.  The trailer is the offset and length of the table of
+# contents as little endian uint64, then `magic` again.
+#
+# The reader memory maps the file and decodes only the sections asked for, so
+# getting one channel out of an export of hundreds of servers reads one
+# category.  Functions at the bottom open either a container or a plain JSON
+# export, which is what the importer, the diff and the analysis tools use.
+
+import os
+import json
+import mmap
+import struct
+import logging
+
+from ds_stream import iter_server_file, FIELD, SECTION_START, ITEM, SECTION_END
+from ds_validation import server_sections
+
+magic = b"DSEXPRT1"
+container_version = 1
+_trailer = struct.Struct("<QQ8s")
+# Sections kept whole; categories and members are split
+_list_sections = ("roles", "emojis")
+
+
+"""
+Writes server dicts to a container file.  Each server is written as it is
+added; the table of contents is written by `close`.
+
+Arguments:
+    path -- the container file
+    member_shard_size -- members in each member shard
+"""
+
+
+class ContainerWriter:
+    def __init__(self, path: str, member_shard_size=10000):
+        self.path = path
+        self.member_shard_size = member_shard_size
+        self.servers = []
+        self._f = open(path, "wb")
+        self._f.write(magic)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _section(self, value) -> list:
+        data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        offset = self._f.tell()
+        self._f.write(data)
+        return [offset, len(data)]
+
+    """
+    Add a server dict following the server schema.
+    """
+
+    def add_server(self, server: dict):
+        entry = {
+            "id": server.get("id"),
+            "name": server.get("name"),
+            "order": list(server),
+        }
+        header = {}
+        for key, value in server.items():
+            if key in _list_sections:
+                entry[key] = self._section(value)
+            elif key == "categories":
+                entry["categories"] = []
+                entry["channels"] = {}
+                for idx, category in enumerate(value):
+                    entry["categories"].append(self._section(category))
+                    for section in ("text_channels", "voice_channels"):
+                        for channel in category.get(section, []):
+                            entry["channels"][str(channel["id"])] = idx
+            elif key == "members":
+                entry["members"] = []
+                for start in range(0, len(value), self.member_shard_size):
+                    shard = value[start : start + self.member_shard_size]
+                    entry["members"].append(self._section(shard) + [len(shard)])
+            else:
+                header[key] = value
+        entry["header"] = self._section(header)
+        self.servers.append(entry)
+
+    def close(self):
+        if self._f is None:
+            return
+        toc = self._section({"version": container_version, "servers": self.servers})
+        self._f.write(_trailer.pack(toc[0], toc[1], magic))
+        self._f.close()
+        self._f = None
+        logging.info(f"Wrote {len(self.servers)} servers to container '{self.path}'")
+
+
+"""
+Write server dicts to a container file in one go.
+
+Arguments:
+    servers -- list of server dicts, or a single one
+    path -- the container file
+    member_shard_size -- members in each member shard
+"""
+
+
+def write_container(servers, path: str, member_shard_size=10000):
+    if isinstance(servers, dict):
+        servers = [servers]
+    with ContainerWriter(path, member_shard_size) as writer:
+        for server in servers:
+            writer.add_server(server)
+
+
+"""
+Return: whether the file at `path` is a container
+"""
+
+
+def is_container(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(magic)) == magic
+
+
+"""
+Reads a container file.  Sections are decoded when asked for and not kept,
+so reading one twice decodes it twice.
+
+Most methods take the ID of the server to read from; None is the first
+server in the file.
+
+Arguments:
+    path -- the container file
+
+Exceptions:
+    ValueError if the file is not a container or of an unknown version
+"""
+
+
+class ContainerReader:
+    def __init__(self, path: str):
+        self.path = path
+        self._f = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            self._f.close()
+            raise ValueError(f"'{path}' is not an export container") from None
+        if (
+            len(self._map) < len(magic) + _trailer.size
+            or self._map[: len(magic)] != magic
+        ):
+            self.close()
+            raise ValueError(f"'{path}' is not an export container")
+        toc_offset, toc_length, end_magic = _trailer.unpack(self._map[-_trailer.size :])
+        if end_magic != magic:
+            self.close()
+            raise ValueError(f"'{path}' is truncated")
+
+        toc = self._decode([toc_offset, toc_length])
+        if toc.get("version") != container_version:
+            self.close()
+            raise ValueError(
+                f"'{path}' is version {toc.get('version')}, expected {container_version}"
+            )
+        self._servers = toc["servers"]
+        self._by_id = {entry["id"]: entry for entry in self._servers}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._f.close()
+
+    def _decode(self, location):
+        offset, length = location[0], location[1]
+        return json.loads(self._map[offset : offset + length])
+
+    def _entry(self, guild_id) -> dict:
+        if guild_id is None:
+            if not self._servers:
+                raise KeyError(f"'{self.path}' has no servers")
+            return self._servers[0]
+        try:
+            return self._by_id[str(guild_id)]
+        except KeyError:
+            raise KeyError(f"No server with ID {guild_id} in '{self.path}'") from None
+
+    """
+    Return: list of (ID, name) of the servers in the file
+    """
+
+    def guilds(self) -> list:
+        return [(entry["id"], entry["name"]) for entry in self._servers]
+
+    """
+    Return: the scalar fields of a server
+    """
+
+    def header(self, guild_id=None) -> dict:
+        return self._decode(self._entry(guild_id)["header"])
+
+    """
+    Return: the roles, emojis or categories of a server, None if the server
+        was exported without them
+
+    Arguments:
+        section -- "roles", "emojis" or "categories"
+    """
+
+    def section(self, section: str, guild_id=None):
+        entry = self._entry(guild_id)
+        if section not in entry:
+            return None
+        if section == "categories":
+            return [self._decode(location) for location in entry["categories"]]
+        if section == "members":
+            return list(self.members(guild_id))
+        return self._decode(entry[section])
+
+    """
+    Return: the category at a position
+    """
+
+    def category(self, idx: int, guild_id=None) -> dict:
+        return self._decode(self._entry(guild_id)["categories"][idx])
+
+    """
+    Return: a text or voice channel by ID, decoding only its category
+
+    Exceptions:
+        KeyError if the server has no such channel
+    """
+
+    def channel(self, channel_id, guild_id=None) -> dict:
+        entry = self._entry(guild_id)
+        idx = entry.get("channels", {}).get(str(channel_id))
+        if idx is None:
+            raise KeyError(f"No channel with ID {channel_id} in server {entry['id']}")
+        category = self._decode(entry["categories"][idx])
+        for section in ("text_channels", "voice_channels"):
+            for channel in category.get(section, []):
+                if str(channel["id"]) == str(channel_id):
+                    return channel
+
+    """
+    Return: amount of members of a server, None if it was exported without them
+    """
+
+    def member_count(self, guild_id=None):
+        entry = self._entry(guild_id)
+        if "members" not in entry:
+            return None
+        return sum(shard[2] for shard in entry["members"])
+
+    """
+    Yields: the members of a server, one shard decoded at a time
+    """
+
+    def members(self, guild_id=None):
+        for location in self._entry(guild_id).get("members", []):
+            yield from self._decode(location)
+
+    """
+    Return: a whole server dict, as it was written
+
+    Arguments:
+        guild_id -- ID of the server
+        members -- whether to include the members
+    """
+
+    def server(self, guild_id=None, members=True) -> dict:
+        entry = self._entry(guild_id)
+        header = self._decode(entry["header"])
+        res = {}
+        for key in entry["order"]:
+            if key in header:
+                res[key] = header[key]
+            elif key != "members" or members:
+                res[key] = self.section(key, entry["id"])
+        return res
+
+    """
+    Yields: the events of `ds_stream.iter_server_events` for a server, so
+        anything reading an export as a stream can read a container too
+    """
+
+    def iter_events(self, guild_id=None):
+        entry = self._entry(guild_id)
+        header = self._decode(entry["header"])
+        for key in entry["order"]:
+            if key in header:
+                yield FIELD, key, header[key]
+                continue
+            yield SECTION_START, key, None
+            if key == "members":
+                items = self.members(entry["id"])
+            elif key == "categories":
+                items = (self._decode(location) for location in entry["categories"])
+            else:
+                items = self._decode(entry[key])
+            count = 0
+            for item in items:
+                yield ITEM, key, item
+                count += 1
+            yield SECTION_END, key, count
+
+
+def _is_json_list(path: str) -> bool:
+    with open(path, encoding="utf-8") as f:
+        while True:
+            chunk = f.read(4096)
+            if not chunk:
+                return False
+            chunk = chunk.lstrip()
+            if chunk:
+                return chunk[0] == "["
+
+
+def _iter_dict_events(server: dict):
+    for key, value in server.items():
+        if key in server_sections and isinstance(value, list):
+            yield SECTION_START, key, None
+            for item in value:
+                yield ITEM, key, item
+            yield SECTION_END, key, len(value)
+        else:
+            yield FIELD, key, value
+
+
+"""
+Stream a server export, which can be a container, a JSON file of one server,
+or a JSON list of servers like `my_servers/<bot user id>.json`.  Only a JSON
+file of one server read without `guild_id` is parsed incrementally; for a
+JSON list, or to pick a server by ID, the file is loaded like `load_server`
+does.
+
+Yields: the events of `ds_stream.iter_server_events`
+
+Arguments:
+    path -- the export
+    guild_id -- ID of the server to read, None for the first one
+
+Exceptions:
+    KeyError -- there is no server with that ID in the export
+"""
+
+
+def iter_export_events(path: str, guild_id=None):
+    if is_container(path):
+        logging.info(f"Streaming server export container '{path}'")
+        with ContainerReader(path) as reader:
+            yield from reader.iter_events(guild_id)
+        return
+    if guild_id is None and not _is_json_list(path):
+        yield from iter_server_file(path)
+        return
+    yield from _iter_dict_events(load_server(path, guild_id))
+
+
+"""
+Load every server of an export: a container, a JSON file of one server, or a
+JSON list of servers like `my_servers/<bot user id>.json`.
+
+Return: list of server dicts
+"""
+
+
+def load_servers(path: str) -> list:
+    if is_container(path):
+        with ContainerReader(path) as reader:
+            return [reader.server(guild_id) for guild_id, _ in reader.guilds()]
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return data if isinstance(data, list) else [data]
+
+
+"""
+Load one server of an export.  For a container, only that server's sections
+are decoded.
+
+Return: a server dict
+
+Arguments:
+    path -- a container or JSON export
+    guild_id -- ID of the server, None for the first one
+    members -- whether to include the members
+"""
+
+
+def load_server(path: str, guild_id=None, members=True) -> dict:
+    if is_container(path):
+        with ContainerReader(path) as reader:
+            return reader.server(guild_id, members)
+
+    for server in load_servers(path):
+        if guild_id is None or server.get("id") == str(guild_id):
+            if not members:
+                server.pop("members", None)
+            return server
+    raise KeyError(f"No server with ID {guild_id} in '{os.path.basename(path)}'")
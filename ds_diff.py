@@ -0,0 +1,458 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Differences between two server exports.
+#
+# Entities are matched by ID, not by their place in a list, so reordering a
+# list is not a change and one added role does not shift every role after it.
+# Each side is indexed once into a dict, which makes a diff linear in the size
+# of the exports.  Members can be diffed through temporary shard files, so only
+# a fraction of them is in memory at once.
+
+import os
+import json
+import logging
+import tempfile
+
+import discord
+
+from ds_store import (
+    SERVER,
+    ROLE,
+    EMOJI,
+    CATEGORY,
+    TEXT_CHANNEL,
+    VOICE_CHANNEL,
+    ROLE_OVERRIDE,
+    USER_OVERRIDE,
+    MEMBER,
+)
+from ds_stream import FIELD, ITEM
+from ds_container import iter_export_events
+from ds_validation import server_sections
+from ds_model import Member, as_dict
+
+# Change types
+ADDED = "added"
+REMOVED = "removed"
+RENAMED = "renamed"
+MOVED = "moved"
+PERMISSIONS = "permissions"
+CHANGED = "changed"
+
+_channel_sections = {"text_channels": TEXT_CHANNEL, "voice_channels": VOICE_CHANNEL}
+_override_sections = {
+    "role_permission_overrides": ROLE_OVERRIDE,
+    "user_permission_overrides": USER_OVERRIDE,
+}
+_nested_sections = {*server_sections, *_channel_sections, *_override_sections}
+
+# Fields that are reported by their own change type
+_moved_fields = ("parent", "position")
+_permission_fields = ("permission_value", "permissions")
+# Role overrides repeat the role's name and position, which are reported on
+# the role itself
+_ignored_fields = {ROLE_OVERRIDE: {"name", "position"}}
+# List fields whose order does not matter
+_unordered_fields = {MEMBER: {"roles"}}
+
+# Permission bits and one name for each, without aliases such as view_channel
+_permission_bits = {}
+for _name, _bit in discord.Permissions.VALID_FLAGS.items():
+    _permission_bits.setdefault(_bit, _name)
+
+
+"""
+One difference between two exports.
+
+Arguments:
+    kind -- the entity kind, one of the ds_store kinds
+    entity_id -- ID of the entity. Categories without an ID go by name.
+    change -- one of the change types
+    detail -- dict of what changed, name -> (before, after). Empty for added
+              and removed entities.
+    before -- the entity in the old export, None if it was added
+    after -- the entity in the new export, None if it was removed
+"""
+
+
+class Change:
+    __slots__ = ("kind", "entity_id", "change", "detail", "before", "after")
+
+    def __init__(
+        self, kind: str, entity_id: str, change: str, detail: dict, before, after
+    ):
+        self.kind = kind
+        self.entity_id = entity_id
+        self.change = change
+        self.detail = detail
+        self.before = before
+        self.after = after
+
+    def as_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            "id": self.entity_id,
+            "change": self.change,
+            "detail": {key: list(value) for key, value in self.detail.items()},
+        }
+
+    def __repr__(self):
+        return f"<Change {self.change} {self.kind} {self.entity_id} {self.detail}>"
+
+    def __str__(self):
+        entity = self.after if self.after is not None else self.before
+        name = f" '{entity['name']}'" if "name" in entity else ""
+        res = f"{self.kind} {self.entity_id}{name} {self.change}"
+        if self.detail:
+            res += ": " + ", ".join(
+                f"{key} {before!r} -> {after!r}"
+                for key, (before, after) in self.detail.items()
+            )
+        return res
+
+
+def _item_id(item: dict) -> str:
+    if "id" in item:
+        return str(item["id"])
+    # Exported emojis only have their URL, which ends in their ID
+    return item["url"].rsplit("/", 1)[-1].split(".", 1)[0]
+
+
+def _strip(item: dict) -> dict:
+    return {key: value for key, value in item.items() if key not in _nested_sections}
+
+
+def _add(index: dict, kind: str, entity_id: str, parent, value: dict):
+    key = (kind, entity_id)
+    if key in index:
+        # Only categories without an ID can collide, e.g. two with one name
+        count = 2
+        while (kind, f"{entity_id}#{count}") in index:
+            count += 1
+        key = (kind, f"{entity_id}#{count}")
+    index[key] = (parent, value)
+
+
+def _add_overrides(index: dict, owner: dict, owner_id: str):
+    for section, kind in _override_sections.items():
+        for override in owner.get(section, []):
+            _add(index, kind, f"{owner_id}/{override['id']}", owner_id, override)
+
+
+"""
+Index the entities of a server dict by kind and ID.
+
+Return: dict of (kind, entity id) -> (parent entity id, entity), with nested
+    lists left out of the entities
+
+Arguments:
+    server -- a discord server dict following the server schema, or a
+              ds_model.Server
+    members -- whether to index the members too
+"""
+
+
+def index_server(server: dict, members=True) -> dict:
+    index = {}
+    _add(index, SERVER, str(server.get("id", "")), None, _strip(server))
+    for section, kind in (("roles", ROLE), ("emojis", EMOJI)):
+        for item in server.get(section, []):
+            _add(index, kind, _item_id(item), None, item)
+
+    for category in server.get("categories", []):
+        # Exports do not give categories an ID; their names are unique enough
+        cat_id = str(category.get("id", category["name"]))
+        _add(index, CATEGORY, cat_id, None, _strip(category))
+        _add_overrides(index, category, cat_id)
+        for section, kind in _channel_sections.items():
+            for channel in category.get(section, []):
+                channel_id = str(channel["id"])
+                _add(index, kind, channel_id, cat_id, _strip(channel))
+                _add_overrides(index, channel, channel_id)
+
+    if members:
+        for member in server.get("members", []):
+            _add(index, MEMBER, str(member["id"]), None, member)
+    return index
+
+
+def _permission_detail(before: dict, after: dict) -> dict:
+    detail = {}
+    if "permission_value" in before or "permission_value" in after:
+        old = int(before.get("permission_value", 0))
+        new = int(after.get("permission_value", 0))
+        for bit, name in _permission_bits.items():
+            if (old ^ new) & bit:
+                detail[name] = (bool(old & bit), bool(new & bit))
+    if "permissions" in before or "permissions" in after:
+        # Override permissions are allowed, denied or not set (None)
+        old = before.get("permissions", {})
+        new = after.get("permissions", {})
+        for name in {**old, **new}:
+            if old.get(name) != new.get(name):
+                detail[name] = (old.get(name), new.get(name))
+    return detail
+
+
+"""
+Compare one entity between two exports.
+
+Return: list of Change
+
+Arguments:
+    kind -- the entity kind
+    entity_id -- ID of the entity
+    old -- (parent, entity) in the old export, None if it is not in it
+    new -- (parent, entity) in the new export, None if it is not in it
+"""
+
+
+def compare_entity(kind: str, entity_id: str, old, new) -> list:
+    if old is None:
+        return [Change(kind, entity_id, ADDED, {}, None, new[1])]
+    if new is None:
+        return [Change(kind, entity_id, REMOVED, {}, old[1], None)]
+
+    (old_parent, before), (new_parent, after) = old, new
+    if before == after and old_parent == new_parent:
+        return []
+
+    res = []
+    ignored = _ignored_fields.get(kind, ())
+    if "name" not in ignored and before.get("name") != after.get("name"):
+        res.append(
+            Change(
+                kind,
+                entity_id,
+                RENAMED,
+                {"name": (before.get("name"), after.get("name"))},
+                before,
+                after,
+            )
+        )
+
+    moved = {}
+    if old_parent != new_parent:
+        moved["parent"] = (old_parent, new_parent)
+    if "position" not in ignored and before.get("position") != after.get("position"):
+        moved["position"] = (before.get("position"), after.get("position"))
+    if moved:
+        res.append(Change(kind, entity_id, MOVED, moved, before, after))
+
+    permissions = _permission_detail(before, after)
+    if permissions:
+        res.append(Change(kind, entity_id, PERMISSIONS, permissions, before, after))
+
+    changed = {}
+    unordered = _unordered_fields.get(kind, ())
+    for key in {**before, **after}:
+        if (
+            key == "name"
+            or key in _moved_fields
+            or key in _permission_fields
+            or key in ignored
+        ):
+            continue
+        old_value, new_value = before.get(key), after.get(key)
+        if key in unordered:
+            if set(old_value or ()) != set(new_value or ()):
+                changed[key] = (sorted(old_value or ()), sorted(new_value or ()))
+        elif old_value != new_value:
+            changed[key] = (old_value, new_value)
+    if changed:
+        res.append(Change(kind, entity_id, CHANGED, changed, before, after))
+    return res
+
+
+"""
+Compare two indexes from `index_server`.
+
+Yields: Change, for removed and changed entities in the old export's order,
+    then for added entities
+"""
+
+
+def diff_indexes(old: dict, new: dict):
+    for key, old_value in old.items():
+        yield from compare_entity(key[0], key[1], old_value, new.get(key))
+    for key, new_value in new.items():
+        if key not in old:
+            yield from compare_entity(key[0], key[1], None, new_value)
+
+
+"""
+Members split into shard files by ID, so one shard can be loaded at a time.
+
+Arguments:
+    directory -- the folder the shard files are written to
+    shards -- amount of shard files
+"""
+
+
+class MemberShards:
+    def __init__(self, directory: str, shards: int):
+        self.shards = shards
+        self.paths = [os.path.join(directory, f"{idx}.jsonl") for idx in range(shards)]
+        self._files = [open(path, "w", encoding="utf-8") for path in self.paths]
+        self.count = 0
+
+    def shard_of(self, member_id: str) -> int:
+        # Snowflakes have a timestamp in their high bits, the low ones are
+        # spread evenly
+        return (
+            int(member_id) % self.shards
+            if member_id.isdigit()
+            else hash(member_id) % self.shards
+        )
+
+    def add(self, member: dict):
+        self._files[self.shard_of(str(member["id"]))].write(
+            json.dumps(as_dict(member)) + "\n"
+        )
+        self.count += 1
+
+    def close(self):
+        for f in self._files:
+            f.close()
+
+    def read(self, shard: int):
+        with open(self.paths[shard], encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+"""
+Compare two streams of members.  The old members of one shard are kept in
+memory at a time, as ds_model.Member records; the new members are streamed
+past them.
+
+Yields: Change for each added, removed and changed member
+
+Arguments:
+    old_members -- iterable of member dicts or ds_model.Member
+    new_members -- iterable of member dicts or ds_model.Member
+    shards -- amount of shards the members are split into. 1 keeps every old
+              member in memory and needs no temporary files.
+    tmp_dir -- where the shard files go. Defaults to the system's.
+"""
+
+
+def diff_members(old_members, new_members, shards=1, tmp_dir=None):
+    if shards <= 1:
+        old = {}
+        for member in old_members:
+            member = Member.coerce(member)
+            old[str(member.id)] = (None, member)
+        for member in new_members:
+            member = Member.coerce(member)
+            member_id = str(member.id)
+            yield from compare_entity(
+                MEMBER, member_id, old.pop(member_id, None), (None, member)
+            )
+        for member_id, value in old.items():
+            yield from compare_entity(MEMBER, member_id, value, None)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="ds_diff_", dir=tmp_dir) as directory:
+        sides = []
+        for name, members in (("old", old_members), ("new", new_members)):
+            os.mkdir(os.path.join(directory, name))
+            side = MemberShards(os.path.join(directory, name), shards)
+            try:
+                for member in members:
+                    side.add(member)
+            finally:
+                side.close()
+            sides.append(side)
+
+        old_side, new_side = sides
+        for shard in range(shards):
+            yield from diff_members(old_side.read(shard), new_side.read(shard))
+
+
+"""
+Compare two server dicts or ds_model.Server records.
+
+Yields: Change for every difference
+
+Arguments:
+    old -- the older server dict
+    new -- the newer server dict
+    member_shards -- see `diff_members`
+"""
+
+
+def diff_servers(old: dict, new: dict, member_shards=1):
+    yield from diff_indexes(index_server(old, False), index_server(new, False))
+    yield from diff_members(
+        old.get("members", []), new.get("members", []), member_shards
+    )
+
+
+def _read_export(path: str, guild_id, shards: MemberShards) -> dict:
+    server = {}
+    for event, key, value in iter_export_events(path, guild_id):
+        if event == FIELD:
+            server[key] = value
+        elif event == ITEM:
+            if key == "members":
+                shards.add(value)
+            else:
+                server.setdefault(key, []).append(value)
+    return server
+
+
+"""
+Compare two server export files, JSON or containers.  The files are streamed
+and their members are written to shard files, so neither export is in memory
+as a whole.
+
+Yields: Change for every difference
+
+Arguments:
+    old_path -- the older export, e.g. a snapshot's server.json
+    new_path -- the newer export
+    member_shards -- amount of shards the members are split into
+    tmp_dir -- where the shard files go. Defaults to the system's.
+    guild_id -- the server to compare in containers or lists, None for the first one
+"""
+
+
+def diff_files(
+    old_path: str, new_path: str, member_shards=16, tmp_dir=None, guild_id=None
+):
+    member_shards = max(member_shards, 1)
+    with tempfile.TemporaryDirectory(prefix="ds_diff_", dir=tmp_dir) as directory:
+        servers = []
+        sides = []
+        for name, path in (("old", old_path), ("new", new_path)):
+            os.mkdir(os.path.join(directory, name))
+            side = MemberShards(os.path.join(directory, name), member_shards)
+            try:
+                servers.append(_read_export(path, guild_id, side))
+            finally:
+                side.close()
+            sides.append(side)
+
+        logging.info(
+            f"Diffing '{old_path}' and '{new_path}' with {sides[0].count} and {sides[1].count} members"
+        )
+        yield from diff_indexes(index_server(servers[0]), index_server(servers[1]))
+        for shard in range(member_shards):
+            yield from diff_members(sides[0].read(shard), sides[1].read(shard))
@@ -0,0 +1,554 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# An in-process stand-in for the Discord REST endpoints the importer uses,
+# served over localhost with aiohttp so discord.py talks to it unmodified.
+# Nothing here is persisted and no gateway is emulated.
+
+import time
+import json
+import base64
+import random
+import asyncio
+import logging
+import contextlib
+from collections import Counter
+
+import discord
+from aiohttp import web
+
+# Requests per window for each route, keyed by "METHOD template".
+# These are approximations of what Discord hands out; the real limits are not
+# documented and change over time.
+default_route_limits = {
+    "POST /api/v7/guilds": (5, 10.0),
+    "PATCH /api/v7/guilds/{guild_id}": (5, 5.0),
+    "GET /api/v7/guilds/{guild_id}/roles": (10, 5.0),
+    "POST /api/v7/guilds/{guild_id}/roles": (10, 10.0),
+    "PATCH /api/v7/guilds/{guild_id}/roles/{role_id}": (10, 10.0),
+    "DELETE /api/v7/guilds/{guild_id}/roles/{role_id}": (10, 10.0),
+    "GET /api/v7/guilds/{guild_id}/channels": (10, 5.0),
+    "POST /api/v7/guilds/{guild_id}/channels": (10, 10.0),
+    "POST /api/v7/guilds/{guild_id}/emojis": (5, 10.0),
+    "PATCH /api/v7/guilds/{guild_id}/emojis/{emoji_id}": (5, 10.0),
+    "DELETE /api/v7/guilds/{guild_id}/emojis/{emoji_id}": (5, 10.0),
+    "PATCH /api/v7/guilds/{guild_id}/members/{user_id}": (10, 10.0),
+}
+# Used for any route missing from the table above
+default_limit = (5, 5.0)
+# Discord's global limit for bots
+default_global_limit = (50, 1.0)
+
+discord_epoch = 1420070400000
+
+
+# discord.py only decodes a body whose content type is exactly
+# "application/json", without a charset
+def _json_response(data, status=200, headers=None):
+    return web.Response(
+        body=json.dumps(data).encode(),
+        status=status,
+        headers=headers,
+        content_type="application/json",
+    )
+
+
+"""
+How long the fake API takes to answer a request: `base` seconds plus a uniform
+random `jitter`, plus `per_kb` seconds for every kilobyte of request body.
+
+Arguments:
+    base -- fixed delay in seconds
+    jitter -- maximum random extra delay in seconds
+    per_kb -- extra delay per kilobyte uploaded
+    seed -- seed for the jitter, for repeatable runs
+"""
+
+
+class LatencyModel:
+    def __init__(self, base=0.0, jitter=0.0, per_kb=0.0, seed=None):
+        self.base = base
+        self.jitter = jitter
+        self.per_kb = per_kb
+        self._random = random.Random(seed)
+
+    def delay(self, body_size: int) -> float:
+        return (
+            self.base
+            + self._random.uniform(0, self.jitter)
+            + self.per_kb * body_size / 1024
+        )
+
+
+"""
+A fixed window bucket that fills the X-RateLimit-* headers the way Discord does.
+"""
+
+
+class _Bucket:
+    def __init__(self, name: str, limit: int, per: float):
+        self.name = name
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def take(self, now: float) -> bool:
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.per
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+    def headers(self, now: float) -> dict:
+        return {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": f"{time.time() + self.reset_at - now:.3f}",
+            "X-RateLimit-Reset-After": f"{self.reset_at - now:.3f}",
+            "X-RateLimit-Bucket": self.name,
+        }
+
+
+"""
+The fake Discord API.  Keeps guilds, roles, channels, emojis and members in
+memory and counts every request per route.
+
+Arguments:
+    latency -- a LatencyModel, None for no added latency
+    route_limits -- dict of "METHOD template" to (limit, window seconds)
+    global_limit -- (limit, window seconds) over all routes, None to disable
+    window_scale -- multiplier for every window, to run Discord-like limits faster
+"""
+
+
+class FakeDiscordAPI:
+    def __init__(
+        self,
+        latency=None,
+        route_limits=None,
+        global_limit=default_global_limit,
+        window_scale=1.0,
+    ):
+        self.latency = latency or LatencyModel()
+        route_limits = {**default_route_limits, **(route_limits or {})}
+        self.route_limits = {
+            route: (limit, per * window_scale)
+            for route, (limit, per) in route_limits.items()
+        }
+        self.default_limit = (default_limit[0], default_limit[1] * window_scale)
+        if global_limit:
+            global_limit = (global_limit[0], global_limit[1] * window_scale)
+        self.global_limit = global_limit
+
+        self.guilds = {}
+        self.cdn = {}
+        self.base_url = None
+        self._ids = 0
+        self._buckets = {}
+        self._global_bucket = _Bucket("global", *global_limit) if global_limit else None
+        self._runner = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            "requests": 0,
+            "rate_limited": 0,
+            "routes": Counter(),
+            "started": time.perf_counter(),
+        }
+
+    def snowflake(self) -> str:
+        self._ids += 1
+        return str(((int(time.time() * 1000) - discord_epoch) << 22) + self._ids)
+
+    """
+    Serve a blob from the fake CDN.
+
+    Return: the URL of the blob
+    """
+
+    def add_cdn_asset(self, data: bytes, ext="png") -> str:
+        asset_id = self.snowflake()
+        self.cdn[f"{asset_id}.{ext}"] = data
+        return f"{self.base_url}/cdn/{asset_id}.{ext}"
+
+    """
+    Add an existing guild, e.g. to act as a clone target.
+
+    Return: the guild payload
+    """
+
+    def add_guild(self, name: str, owner_id="1") -> dict:
+        guild_id = self.snowflake()
+        guild = {
+            "id": guild_id,
+            "name": name,
+            "icon": None,
+            "region": "us-west",
+            "owner_id": owner_id,
+            "afk_timeout": 300,
+            "verification_level": 0,
+            "default_message_notifications": 0,
+            "explicit_content_filter": 0,
+            "system_channel_flags": 0,
+            "mfa_level": 0,
+            "premium_tier": 0,
+            "features": [],
+            # @everyone shares the ID of the guild
+            "roles": [self._role_payload(guild_id, "@everyone", 0, {})],
+            "emojis": [],
+            "channels": [],
+            "members": {},
+        }
+        self.guilds[guild_id] = guild
+        return guild
+
+    def add_member(self, guild_id: str, user_id: str, name: str, roles=()):
+        self.guilds[guild_id]["members"][user_id] = {
+            "user": {"id": user_id, "username": name, "discriminator": "0001"},
+            "roles": list(roles),
+            "nick": None,
+        }
+
+    def add_channel(
+        self, guild_id: str, name: str, channel_type=0, parent_id=None
+    ) -> dict:
+        guild = self.guilds[guild_id]
+        channel = {
+            "id": self.snowflake(),
+            "guild_id": guild_id,
+            "type": channel_type,
+            "name": name,
+            "position": len(guild["channels"]),
+            "permission_overwrites": [],
+            "parent_id": parent_id,
+        }
+        guild["channels"].append(channel)
+        return channel
+
+    def _role_payload(self, role_id: str, name: str, position: int, fields: dict):
+        return {
+            "id": role_id,
+            "name": name,
+            "color": fields.get("color", 0),
+            "hoist": fields.get("hoist", False),
+            "position": position,
+            # v7 sends the permissions as an int and as a string
+            "permissions": int(fields.get("permissions", 0)),
+            "permissions_new": str(fields.get("permissions", 0)),
+            "managed": False,
+            "mentionable": fields.get("mentionable", False),
+        }
+
+    def _guild_payload(self, guild: dict) -> dict:
+        return {k: v for k, v in guild.items() if k not in ("channels", "members")}
+
+    # handlers
+
+    async def get_me(self, request):
+        return _json_response(
+            {"id": "1", "username": "fake", "discriminator": "0001", "bot": True}
+        )
+
+    async def create_guild(self, request):
+        payload = await request.json()
+        guild = self.add_guild(payload["name"])
+        guild["region"] = payload.get("region") or guild["region"]
+        guild["icon"] = "icon" if payload.get("icon") else None
+        return _json_response(self._guild_payload(guild))
+
+    async def get_guild(self, request):
+        guild = self._guild(request)
+        return _json_response(self._guild_payload(guild))
+
+    async def edit_guild(self, request):
+        guild = self._guild(request)
+        payload = await request.json()
+        if "icon" in payload:
+            guild["icon"] = "icon" if payload["icon"] else None
+        if "name" in payload:
+            guild["name"] = payload["name"]
+        return _json_response(self._guild_payload(guild))
+
+    async def get_roles(self, request):
+        guild = self._guild(request)
+        return _json_response(sorted(guild["roles"], key=lambda r: r["position"]))
+
+    async def create_role(self, request):
+        guild = self._guild(request)
+        payload = await request.json()
+        # New roles go right above @everyone
+        for role in guild["roles"]:
+            if role["position"] > 0:
+                role["position"] += 1
+        role = self._role_payload(
+            self.snowflake(), payload.get("name", "new role"), 1, payload
+        )
+        guild["roles"].append(role)
+        return _json_response(role)
+
+    async def edit_role(self, request):
+        role = self._find(self._guild(request)["roles"], request.match_info["role_id"])
+        payload = await request.json()
+        for key in ("name", "color", "hoist", "mentionable"):
+            if key in payload:
+                role[key] = payload[key]
+        if "permissions" in payload:
+            role["permissions"] = int(payload["permissions"])
+            role["permissions_new"] = str(payload["permissions"])
+        return _json_response(role)
+
+    async def delete_role(self, request):
+        guild = self._guild(request)
+        role = self._find(guild["roles"], request.match_info["role_id"])
+        guild["roles"].remove(role)
+        for other in guild["roles"]:
+            if other["position"] > role["position"]:
+                other["position"] -= 1
+        return web.Response(status=204)
+
+    async def get_channels(self, request):
+        return _json_response(self._guild(request)["channels"])
+
+    async def create_channel(self, request):
+        guild = self._guild(request)
+        payload = await request.json()
+        channel = {
+            "id": self.snowflake(),
+            "guild_id": guild["id"],
+            "type": payload.get("type", 0),
+            "name": payload["name"],
+            "position": len(guild["channels"]),
+            "permission_overwrites": payload.get("permission_overwrites", []),
+            # Snowflakes are sent back as strings
+            "parent_id": str(payload["parent_id"])
+            if payload.get("parent_id")
+            else None,
+            "topic": payload.get("topic"),
+            "nsfw": payload.get("nsfw", False),
+            "rate_limit_per_user": payload.get("rate_limit_per_user", 0),
+            "bitrate": payload.get("bitrate", 64000),
+            "user_limit": payload.get("user_limit", 0),
+        }
+        guild["channels"].append(channel)
+        return _json_response(channel)
+
+    async def create_emoji(self, request):
+        guild = self._guild(request)
+        payload = await request.json()
+        emoji = {
+            "id": self.snowflake(),
+            "name": payload["name"],
+            "roles": [],
+            "require_colons": True,
+            "managed": False,
+            "animated": payload["image"].startswith("data:image/gif"),
+            "available": True,
+        }
+        # Keep the bytes so the emoji can be downloaded again from the CDN
+        image = payload["image"].split(",", 1)[-1]
+        self.cdn[f"emojis/{emoji['id']}.png"] = base64.b64decode(image)
+        guild["emojis"].append(emoji)
+        return _json_response(emoji)
+
+    async def edit_emoji(self, request):
+        emoji = self._find(
+            self._guild(request)["emojis"], request.match_info["emoji_id"]
+        )
+        payload = await request.json()
+        emoji["name"] = payload.get("name", emoji["name"])
+        return _json_response(emoji)
+
+    async def delete_emoji(self, request):
+        guild = self._guild(request)
+        guild["emojis"].remove(
+            self._find(guild["emojis"], request.match_info["emoji_id"])
+        )
+        return web.Response(status=204)
+
+    async def edit_member(self, request):
+        guild = self._guild(request)
+        member = guild["members"].get(request.match_info["user_id"])
+        if member is None:
+            raise web.HTTPNotFound(
+                text=json.dumps({"message": "Unknown Member", "code": 10007}),
+                content_type="application/json",
+            )
+        payload = await request.json()
+        if "roles" in payload:
+            member["roles"] = [str(role_id) for role_id in payload["roles"]]
+        if "nick" in payload:
+            member["nick"] = payload["nick"]
+        return web.Response(status=204)
+
+    async def get_cdn(self, request):
+        data = self.cdn.get(request.match_info["path"])
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=data, content_type="image/png")
+
+    def _guild(self, request) -> dict:
+        guild = self.guilds.get(request.match_info["guild_id"])
+        if guild is None:
+            raise web.HTTPNotFound(
+                text=json.dumps({"message": "Unknown Guild", "code": 10004}),
+                content_type="application/json",
+            )
+        return guild
+
+    def _find(self, items: list, item_id: str) -> dict:
+        for item in items:
+            if item["id"] == item_id:
+                return item
+        raise web.HTTPNotFound(
+            text=json.dumps({"message": "Unknown", "code": 10000}),
+            content_type="application/json",
+        )
+
+    # rate limiting, latency and counting
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        resource = request.match_info.route.resource
+        template = resource.canonical if resource is not None else request.path
+        if template.startswith("/cdn/"):
+            self.stats["routes"]["GET /cdn"] += 1
+            return await handler(request)
+
+        route = f"{request.method} {template}"
+        self.stats["requests"] += 1
+        self.stats["routes"][route] += 1
+
+        body = await request.read()
+        await asyncio.sleep(self.latency.delay(len(body)))
+
+        now = time.monotonic()
+        # Like Discord, buckets are per route and per guild
+        key = (route, request.match_info.get("guild_id"))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = _Bucket(route, *self.route_limits.get(route, self.default_limit))
+            self._buckets[key] = bucket
+
+        limited = None
+        if self._global_bucket is not None and not self._global_bucket.take(now):
+            limited = self._global_bucket
+        elif not bucket.take(now):
+            limited = bucket
+
+        if limited is not None:
+            self.stats["rate_limited"] += 1
+            retry_after = max(limited.reset_at - now, 0.0)
+            headers = bucket.headers(now)
+            # discord.py treats a 429 without Via as a Cloudflare ban
+            headers["Via"] = "1.1 google"
+            headers["Retry-After"] = f"{retry_after:.3f}"
+            if limited is self._global_bucket:
+                headers["X-RateLimit-Global"] = "true"
+            return _json_response(
+                {
+                    "message": "You are being rate limited.",
+                    # v7 of the API reports milliseconds
+                    "retry_after": retry_after * 1000,
+                    "global": limited is self._global_bucket,
+                },
+                status=429,
+                headers=headers,
+            )
+
+        response = await handler(request)
+        response.headers.update(bucket.headers(now))
+        return response
+
+    def _app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        api = "/api/v7"
+        app.router.add_route("GET", f"{api}/users/@me", self.get_me)
+        app.router.add_route("POST", f"{api}/guilds", self.create_guild)
+        app.router.add_route("GET", f"{api}/guilds/{{guild_id}}", self.get_guild)
+        app.router.add_route("PATCH", f"{api}/guilds/{{guild_id}}", self.edit_guild)
+        roles = f"{api}/guilds/{{guild_id}}/roles"
+        app.router.add_route("GET", roles, self.get_roles)
+        app.router.add_route("POST", roles, self.create_role)
+        app.router.add_route("PATCH", roles + "/{role_id}", self.edit_role)
+        app.router.add_route("DELETE", roles + "/{role_id}", self.delete_role)
+        app.router.add_route(
+            "GET", f"{api}/guilds/{{guild_id}}/channels", self.get_channels
+        )
+        app.router.add_route(
+            "POST", f"{api}/guilds/{{guild_id}}/channels", self.create_channel
+        )
+        emojis = f"{api}/guilds/{{guild_id}}/emojis"
+        app.router.add_route("POST", emojis, self.create_emoji)
+        app.router.add_route("PATCH", emojis + "/{emoji_id}", self.edit_emoji)
+        app.router.add_route("DELETE", emojis + "/{emoji_id}", self.delete_emoji)
+        app.router.add_route(
+            "PATCH", f"{api}/guilds/{{guild_id}}/members/{{user_id}}", self.edit_member
+        )
+        app.router.add_route("GET", "/cdn/{path:.+}", self.get_cdn)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._runner = web.AppRunner(self._app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        logging.info(f"Fake Discord API listening on {self.base_url}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+"""
+Start a fake API and log a discord.py client into it.  The client only has
+REST access; no gateway is connected, so guild caches are not updated by
+events.  discord.py's API and CDN base URLs are restored on exit.
+
+Usage:
+    async with fake_discord(api) as bot:
+        await dsi.create_server(bot, server)
+
+Arguments:
+    api -- a FakeDiscordAPI, started and stopped by this context manager
+"""
+
+
+@contextlib.asynccontextmanager
+async def fake_discord(api: FakeDiscordAPI):
+    await api.start()
+    original_base = discord.http.Route.BASE
+    original_cdn = discord.asset.Asset.BASE
+    discord.http.Route.BASE = f"{api.base_url}/api/v7"
+    # Emoji and icon URLs handed out by discord.py point at the fake CDN
+    discord.asset.Asset.BASE = f"{api.base_url}/cdn"
+    bot = discord.Client()
+    try:
+        await bot.http.static_login("fake-token", bot=True)
+        yield bot
+    finally:
+        await bot.http.close()
+        discord.http.Route.BASE = original_base
+        discord.asset.Asset.BASE = original_cdn
+        await api.stop()
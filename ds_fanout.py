@@ -0,0 +1,246 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import logging
+
+import discord
+
+import discord_server_importer as dsi
+from ds_validation import get_registry
+from ds_common_funcs import RateLimiter, limit_client_requests, run_in_executor
+
+# The steps applied to every target guild, in order
+stamp_steps = ("icon", "roles", "member_roles", "categories", "emojis")
+
+
+"""
+Download or read everything that is the same for every target once: the server
+icon and the bytes of every emoji.
+
+Return: dict with "icon" (bytes or None) and "emojis" (dict of emoji URL to bytes)
+
+Arguments:
+    server -- a discord server dict following the server schema
+    import_folder -- the folder an export was written to, or its archive. Empty
+                     to download.
+"""
+
+
+def prepare_shared_assets(server: dict, import_folder="") -> dict:
+    logging.info(f"Preparing shared assets for server '{server['name']}'")
+    with dsi.open_import_folder(import_folder) as import_folder:
+        folder_index = None
+        if import_folder and server.get("id"):
+            folder_index = dsi.index_import_emojis(import_folder, server["id"])
+
+        return {
+            "icon": dsi.get_server_icon_bytes(server, import_folder),
+            "emojis": dsi.prefetch_emojis(server.get("emojis", []), folder_index),
+        }
+
+
+"""
+Work out which categories and channels of a server dict a guild does not have
+yet.  Categories are matched by name, channels by name and type within their
+category; a guild made in the Discord client, with its default "general"
+channels, gets every category of the dict.
+
+Return: (category dicts holding only the missing channels, dict of category
+    name to the existing category for those already in the guild)
+
+Arguments:
+    categories -- the categories of a server dict
+    channels -- the channels of the guild, e.g. from `Guild.fetch_channels`
+"""
+
+
+def missing_categories(categories: list, channels: list) -> tuple:
+    existing = {
+        channel.name: channel
+        for channel in channels
+        if isinstance(channel, discord.CategoryChannel)
+    }
+    # (parent category ID, kind, name) of every channel.  Fetched channels do
+    # not resolve `category` without the guild cache, so the ID is used.
+    present = set()
+    for channel in channels:
+        if isinstance(channel, discord.TextChannel):
+            present.add((channel.category_id, "text", channel.name))
+        elif isinstance(channel, discord.VoiceChannel):
+            present.add((channel.category_id, "voice", channel.name))
+
+    res = []
+    parents = {}
+    for category in categories:
+        name = category["name"]
+        if name and name not in existing:
+            res.append(category)
+            continue
+        parent = existing.get(name)
+        parent_id = parent.id if parent is not None else None
+        text = [
+            c
+            for c in category["text_channels"]
+            if (parent_id, "text", c["name"]) not in present
+        ]
+        voice = [
+            c
+            for c in category["voice_channels"]
+            if (parent_id, "voice", c["name"]) not in present
+        ]
+        if text or voice:
+            res.append(dict(category, text_channels=text, voice_channels=voice))
+            if parent is not None:
+                parents[name] = parent
+    return res, parents
+
+
+"""
+Write a server dict onto one existing guild: icon, roles, the roles of members
+that are in the guild (if the dict has members), categories, emojis.
+`progress` is updated after every step.
+
+Roles and emojis are synced with the `write_*` functions, and only the
+categories and channels the guild does not have are created (see
+`missing_categories`), so writing the same dict again changes nothing.
+Channels that are there already are left as they are.
+
+Arguments:
+    bot -- a discord.py client object.
+    existing_guild -- the target guild
+    server -- a discord server dict following the server schema, already validated
+    assets -- the result of `prepare_shared_assets`
+    progress -- the progress dict of this target
+"""
+
+
+async def stamp_guild(
+    bot: discord.Client,
+    existing_guild: discord.Guild,
+    server: dict,
+    assets: dict,
+    progress: dict,
+):
+    for step in stamp_steps:
+        progress["step"] = step
+        logging.info(
+            f"[{existing_guild.name}] step {len(progress['done']) + 1}/{len(stamp_steps)}: {step}"
+        )
+
+        if step == "icon":
+            if assets["icon"] is not None:
+                await existing_guild.edit(
+                    icon=assets["icon"], reason="Automatic cloning"
+                )
+        elif step == "roles":
+            await dsi.write_roles(
+                existing_guild, server["roles"], overwrite_prompt=False
+            )
+        elif step == "member_roles":
+            if server.get("members"):
+                await dsi.write_member_roles(
+                    existing_guild, server["members"], server["roles"]
+                )
+        elif step == "categories":
+            # There is no sync for channels, appending again would duplicate them
+            channels = await existing_guild.fetch_channels()
+            categories, parents = missing_categories(server["categories"], channels)
+            if categories:
+                await dsi.append_categories(
+                    bot, existing_guild, categories, existing_categories=parents
+                )
+        elif step == "emojis":
+            await dsi.write_emojis(
+                existing_guild,
+                server.get("emojis", []),
+                overwrite_prompt=False,
+                prefetched=assets["emojis"],
+            )
+
+        progress["done"].append(step)
+
+    progress["step"] = None
+
+
+"""
+Clone one server dict onto many existing guilds at once.
+The dict is validated and the shared assets are prepared once, then up to
+`concurrency` targets are written concurrently.  Every REST request of the
+client goes through one RateLimiter of `rate` requests per `per` seconds, so
+the targets share a global budget.  A failing target does not stop the others.
+
+Return: dict of target guild ID to its progress dict:
+    "status" -- "pending", "running", "ok" or "failed"
+    "step" -- the step being run, None when finished
+    "done" -- the steps finished so far
+    "error" -- the exception if the target failed
+
+Arguments:
+    bot -- a discord.py client object.
+    server -- a discord server dict following the server schema
+    target_ids -- IDs of the guilds to write to
+    import_folder -- the folder an export was written to, or its archive. Empty
+                     to download.
+"""
+
+
+async def clone_to_guilds(
+    bot: discord.Client,
+    server: dict,
+    target_ids: list,
+    import_folder="",
+    concurrency=4,
+    rate=40,
+    per=1.0,
+) -> dict:
+    logging.info(f"Cloning server '{server['name']}' to {len(target_ids)} servers")
+    get_registry().validate_server(server)
+
+    assets = await run_in_executor(prepare_shared_assets, server, import_folder)
+
+    progress = {
+        target_id: {"status": "pending", "step": None, "done": [], "error": None}
+        for target_id in target_ids
+    }
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run(target_id):
+        target_progress = progress[target_id]
+        async with sem:
+            target_progress["status"] = "running"
+            try:
+                existing_guild = bot.get_guild(int(target_id))
+                if existing_guild is None:
+                    # Not in the cache, e.g. when there is no gateway connection
+                    existing_guild = await bot.fetch_guild(int(target_id))
+                await stamp_guild(bot, existing_guild, server, assets, target_progress)
+                target_progress["status"] = "ok"
+            except Exception as e:
+                logging.exception(f"Cloning to server {target_id} failed")
+                target_progress["status"] = "failed"
+                target_progress["error"] = e
+
+    with limit_client_requests(bot, RateLimiter(rate, per)):
+        await asyncio.gather(*(run(target_id) for target_id in target_ids))
+
+    failed = [t for t, p in progress.items() if p["status"] == "failed"]
+    logging.info(
+        f"Cloned server '{server['name']}' to {len(target_ids) - len(failed)} of {len(target_ids)} servers"
+    )
+    return progress
@@ -0,0 +1,357 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Synthetic guilds for running the exporter without a token or a connection.
+# The classes below subclass the discord.py models so isinstance checks in the
+# exporter still hold, but they are filled in directly instead of from gateway
+# payloads and carry only what the exporter reads.
+
+import os
+import random
+import logging
+
+import discord
+from discord.abc import _Overwrites
+from discord.utils import SnowflakeList
+
+# 2015-01-01, the Discord epoch, in snowflake form.  IDs count up from here.
+first_snowflake = 1 << 22
+
+# Permission bits that can appear in an override
+valid_permission_bits = sorted(discord.Permissions.VALID_FLAGS.values())
+
+# Smallest header discord.py accepts as a PNG
+png_header = b"\x89PNG\r\n\x1a\n"
+
+# generate_guild arguments for guilds of increasing size, used by the benchmarks
+guild_presets = {
+    "small": dict(
+        roles=10, categories=3, text_channels=10, voice_channels=5, members=50
+    ),
+    "medium": dict(
+        roles=100,
+        categories=20,
+        text_channels=150,
+        voice_channels=50,
+        members=5000,
+        role_overrides=4,
+        user_overrides=2,
+    ),
+    # Close to Discord's limits for roles and channels
+    "huge": dict(
+        roles=250,
+        categories=50,
+        text_channels=350,
+        voice_channels=100,
+        members=100000,
+        role_overrides=10,
+        user_overrides=5,
+        member_roles=8,
+    ),
+}
+
+
+class FakeRole(discord.Role):
+    __slots__ = ()
+
+    def __init__(self, guild, role_id, name, position, colour=0, permissions=0):
+        self._state = None
+        self.guild = guild
+        self.id = role_id
+        self.name = name
+        self.position = position
+        self._colour = colour
+        self._permissions = permissions
+        self.hoist = False
+        self.mentionable = False
+        self.managed = False
+        self.tags = None
+
+
+class FakeEmoji(discord.Emoji):
+    # The real ones look these up through the connection state
+    __slots__ = ("guild", "url")
+
+    def __init__(self, guild, emoji_id, name, url):
+        self._state = None
+        self.guild = guild
+        self.guild_id = guild.id
+        self.id = emoji_id
+        self.name = name
+        self.url = url
+        self.animated = False
+        self.managed = False
+        self.require_colons = True
+        self.available = True
+        self.user = None
+        self._roles = SnowflakeList([])
+
+
+class FakeTextChannel(discord.TextChannel):
+    __slots__ = ()
+
+    def __init__(self, guild, channel_id, name, position, category_id, overwrites):
+        self._state = None
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.position = position
+        self.category_id = category_id
+        self._overwrites = overwrites
+        self._type = discord.ChannelType.text.value
+        self.topic = f"Topic of {name}"
+        self.nsfw = False
+        self.slowmode_delay = 0
+        self.last_message_id = None
+
+
+class FakeVoiceChannel(discord.VoiceChannel):
+    __slots__ = ()
+
+    def __init__(self, guild, channel_id, name, position, category_id, overwrites):
+        self._state = None
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.position = position
+        self.category_id = category_id
+        self._overwrites = overwrites
+        self.bitrate = 64000
+        self.user_limit = 0
+
+
+class FakeCategoryChannel(discord.CategoryChannel):
+    __slots__ = ()
+
+    def __init__(self, guild, channel_id, name, position, overwrites):
+        self._state = None
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.position = position
+        self.category_id = None
+        self._overwrites = overwrites
+        self.nsfw = False
+
+
+class FakeMember(discord.Member):
+    # The real ones proxy these to a separate User object; keeping them on
+    # the member saves an object per member.
+    __slots__ = ("id", "name", "discriminator")
+
+    def __init__(self, guild, member_id, name, discriminator, nick, role_ids):
+        self._state = None
+        self.guild = guild
+        self.id = member_id
+        self.name = name
+        self.discriminator = discriminator
+        self.nick = nick
+        self._roles = SnowflakeList(role_ids)
+        self.joined_at = None
+        self.premium_since = None
+        self.activities = ()
+        self.pending = False
+
+    def __str__(self):
+        return f"{self.name}#{self.discriminator}"
+
+    def __repr__(self):
+        return f"<FakeMember id={self.id} name={self.name!r}>"
+
+    def __hash__(self):
+        # Same as discord.User
+        return self.id >> 22
+
+
+class FakeGuild(discord.Guild):
+    __slots__ = ()
+
+    def __init__(self, guild_id, name):
+        self._state = None
+        self.id = guild_id
+        self.name = name
+        self.icon = None
+        self.region = discord.VoiceRegion.us_west
+        self.afk_channel = None
+        self.afk_timeout = 300
+        self._system_channel_id = None
+        self._system_channel_flags = 0
+        self.default_notifications = discord.NotificationLevel.only_mentions
+        self.verification_level = discord.VerificationLevel.none
+        self.explicit_content_filter = discord.ContentFilter.disabled
+        self.premium_tier = 0
+        self.features = []
+        self.unavailable = False
+        self.emojis = ()
+        self._roles = {}
+        self._channels = {}
+        self._members = {}
+        self._member_count = 0
+        self._large = False
+
+    def __repr__(self):
+        return f"<FakeGuild id={self.id} name={self.name!r}>"
+
+
+"""
+Generate a synthetic guild that the exporter and the schema tests accept.
+
+Return: a FakeGuild
+
+Arguments:
+    roles -- amount of roles, including @everyone (at most 250)
+    categories -- amount of categories
+    text_channels -- amount of text channels, spread over the categories
+    voice_channels -- amount of voice channels, spread over the categories
+    members -- amount of members
+    emojis -- amount of emojis
+    role_overrides -- role permission overrides per channel and category
+    user_overrides -- user permission overrides per channel and category
+    member_roles -- roles per member
+    uncategorized -- every `uncategorized`th channel has no category, 0 for none
+    seed -- seed for the random choices, for repeatable guilds
+    asset_dir -- if set, emoji images are written here and the emoji URLs point
+                 to them, so exporting emojis works offline
+    first_id -- the guild's ID; every other ID follows it. Guilds that are
+                exported together need IDs far enough apart.
+"""
+
+
+def generate_guild(
+    roles=20,
+    categories=5,
+    text_channels=20,
+    voice_channels=10,
+    members=100,
+    emojis=10,
+    role_overrides=2,
+    user_overrides=1,
+    member_roles=3,
+    uncategorized=7,
+    seed=0,
+    asset_dir=None,
+    first_id=first_snowflake,
+) -> FakeGuild:
+    rnd = random.Random(seed)
+    next_id = iter(range(first_id, 1 << 63)).__next__
+
+    guild = FakeGuild(next_id(), f"Synthetic guild {seed}")
+    logging.info(f"Generating guild '{guild.name}'")
+
+    # @everyone shares its ID with the guild
+    guild._roles[guild.id] = FakeRole(
+        guild, guild.id, "@everyone", 0, permissions=104324673
+    )
+    for pos in range(1, roles):
+        role = FakeRole(
+            guild,
+            next_id(),
+            f"Role {pos}",
+            pos,
+            colour=rnd.randrange(1 << 24),
+            permissions=rnd.getrandbits(31),
+        )
+        guild._roles[role.id] = role
+    role_ids = list(guild._roles)
+    # Members never list @everyone
+    assignable_role_ids = role_ids[1:]
+
+    for idx in range(members):
+        member = FakeMember(
+            guild,
+            next_id(),
+            f"user{idx}",
+            f"{rnd.randrange(1, 10000):04}",
+            f"nick{idx}" if idx % 4 == 0 else None,
+            rnd.sample(
+                assignable_role_ids, min(member_roles, len(assignable_role_ids))
+            ),
+        )
+        guild._members[member.id] = member
+    guild._member_count = members
+    member_ids = list(guild._members)
+
+    def overwrites():
+        res = []
+        for role_id in rnd.sample(role_ids, min(role_overrides, len(role_ids))):
+            res.append(_random_overwrite(rnd, role_id, "role"))
+        for member_id in rnd.sample(member_ids, min(user_overrides, len(member_ids))):
+            res.append(_random_overwrite(rnd, member_id, "member"))
+        return res
+
+    category_ids = []
+    for idx in range(categories):
+        category = FakeCategoryChannel(
+            guild, next_id(), f"Category {idx}", idx, overwrites()
+        )
+        guild._channels[category.id] = category
+        category_ids.append(category.id)
+
+    def category_for(idx):
+        if not category_ids or (uncategorized and idx % uncategorized == 0):
+            return None
+        return category_ids[idx % len(category_ids)]
+
+    for idx in range(text_channels):
+        channel = FakeTextChannel(
+            guild, next_id(), f"text-{idx}", idx, category_for(idx), overwrites()
+        )
+        guild._channels[channel.id] = channel
+
+    for idx in range(voice_channels):
+        channel = FakeVoiceChannel(
+            guild, next_id(), f"voice-{idx}", idx, category_for(idx), overwrites()
+        )
+        guild._channels[channel.id] = channel
+        if guild.afk_channel is None:
+            guild.afk_channel = channel
+
+    if text_channels:
+        guild._system_channel_id = guild.text_channels[0].id
+        guild._system_channel_flags = 3
+
+    if asset_dir is not None:
+        os.makedirs(asset_dir, exist_ok=True)
+    guild_emojis = []
+    for idx in range(emojis):
+        emoji_id = next_id()
+        if asset_dir is not None:
+            path = os.path.abspath(os.path.join(asset_dir, f"{emoji_id}.png"))
+            with open(path, "wb") as f:
+                f.write(png_header + rnd.getrandbits(8 * 256).to_bytes(256, "little"))
+            url = f"file://{path}"
+        else:
+            url = f"https://cdn.discordapp.com/emojis/{emoji_id}.png"
+        guild_emojis.append(FakeEmoji(guild, emoji_id, f"emoji_{idx}", url))
+    guild.emojis = tuple(guild_emojis)
+
+    logging.info(
+        f"Generated guild '{guild.name}': {len(guild._roles)} roles, {len(guild._channels)} channels, {members} members, {emojis} emojis"
+    )
+    return guild
+
+
+def _random_overwrite(rnd: random.Random, target_id: int, target_type: str):
+    allow = 0
+    deny = 0
+    for bit in rnd.sample(valid_permission_bits, 6):
+        if rnd.random() < 0.5:
+            allow |= bit
+        else:
+            deny |= bit
+    return _Overwrites(id=target_id, allow=allow, deny=deny, type=target_type)
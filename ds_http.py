@@ -0,0 +1,389 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# The HTTP client every asset download (icons, emojis) goes through.
+#
+# It runs an aiohttp session on an event loop of its own, in a background
+# thread, so connections are pooled and kept alive across callers whether they
+# are sync code on worker threads (`fetch`) or coroutines on any other event
+# loop (`fetch_async`).  Requests have timeouts, are retried with jittered
+# exponential backoff and can be hedged: if a response takes longer than
+# `hedge_after`, a second identical request is sent and whichever finishes
+# first is used.
+
+import os
+import atexit
+import random
+import asyncio
+import logging
+import threading
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import aiohttp
+
+from ds_trace import span
+
+# This header is needed or else we get 403 forbidden '-'
+# The user agent and accept* are copied from a random Chrome request
+req_hdr = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.104 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
+    "Accept-Charset": "ISO-8859-1,utf-8;q=0.7,*;q=0.3",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Connection": "keep-alive",
+}
+
+# Only advertise what can be decoded: aiohttp decodes gzip and deflate
+# itself, brotli only if it is installed
+try:
+    import brotli  # noqa: F401
+
+    accept_encoding = "gzip, deflate, br"
+except ImportError:
+    accept_encoding = "gzip, deflate"
+
+# Statuses worth trying again
+retry_statuses = {408, 429, 500, 502, 503, 504}
+
+
+"""
+A download failed.  Subclasses OSError, like the urllib errors it replaces.
+
+Arguments:
+    message -- what went wrong
+    url -- the requested URL
+    status -- the HTTP status, None if there was no response
+    retryable -- whether trying again may help
+    retry_after -- seconds the server asked to wait, if it did
+"""
+
+
+class FetchError(OSError):
+    def __init__(
+        self, message: str, url: str, status=None, retryable=False, retry_after=None
+    ):
+        super().__init__(message)
+        self.url = url
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+"""
+The response is larger than the `max_size` it was requested with.  The body
+is not downloaded if the server announces its size.
+"""
+
+
+class ResponseTooLarge(FetchError):
+    def __init__(self, url: str, size: int, max_size: int):
+        super().__init__(f"{url} is {size}b, more than {max_size}b", url)
+        self.size = size
+        self.max_size = max_size
+
+
+class Response:
+    __slots__ = ("url", "status", "headers", "body")
+
+    def __init__(self, url: str, status: int, headers: dict, body: bytes):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+"""
+A pooled HTTP client for GET requests.
+
+Arguments:
+    timeout -- seconds allowed for a whole request, including reading the body
+    connect_timeout -- seconds allowed for connecting
+    retries -- attempts after the first one for retryable failures
+    backoff -- base delay in seconds; attempt n waits up to backoff * 2**n
+    max_backoff -- upper bound of the delay between attempts
+    hedge_after -- seconds after which a second request is raced against a
+                   slow first one. None to never hedge.
+    pool_size -- maximum open connections
+    per_host -- maximum open connections to one host
+    headers -- headers sent with every request
+"""
+
+
+class HTTPClient:
+    def __init__(
+        self,
+        timeout=30.0,
+        connect_timeout=10.0,
+        retries=3,
+        backoff=0.25,
+        max_backoff=8.0,
+        hedge_after=None,
+        pool_size=32,
+        per_host=8,
+        headers=None,
+    ):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+        self.pool_size = pool_size
+        self.per_host = per_host
+        if headers is None:
+            headers = {**req_hdr, "Accept-Encoding": accept_encoding}
+        self.headers = headers
+        self.stats = {"requests": 0, "retries": 0, "hedged": 0, "hedge_wins": 0}
+
+        self._loop = None
+        self._thread = None
+        self._session = None
+        # The process the loop runs in
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is not None and self._pid == os.getpid():
+                return
+            # A forked process, e.g. a worker of a process pool, inherits the
+            # loop and session but not the thread running them
+            self._session = None
+            self._pid = os.getpid()
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._loop.run_forever, name="ds_http", daemon=True
+            )
+            self._thread.start()
+
+    def _submit(self, coro):
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.pool_size, limit_per_host=self.per_host
+                ),
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(
+                    total=self.timeout, sock_connect=self.connect_timeout
+                ),
+            )
+        return self._session
+
+    async def _attempt(self, url: str, max_size) -> Response:
+        self.stats["requests"] += 1
+        if url.startswith("file://"):
+            return await self._read_file(url, max_size)
+
+        session = await self._get_session()
+        try:
+            async with session.get(url) as resp:
+                if resp.status >= 400:
+                    retry_after = resp.headers.get("Retry-After")
+                    raise FetchError(
+                        f"GET {url} returned {resp.status}",
+                        url,
+                        resp.status,
+                        resp.status in retry_statuses,
+                        float(retry_after) if retry_after else None,
+                    )
+                if max_size is not None and (resp.content_length or 0) > max_size:
+                    raise ResponseTooLarge(url, resp.content_length, max_size)
+                body = await resp.read()
+                if max_size is not None and len(body) > max_size:
+                    raise ResponseTooLarge(url, len(body), max_size)
+                return Response(url, resp.status, dict(resp.headers), body)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise FetchError(f"GET {url} failed: {e!r}", url, retryable=True) from e
+
+    # urllib served file:// URLs too, so keep doing that
+    async def _read_file(self, url: str, max_size) -> Response:
+        path = url2pathname(urlparse(url).path)
+
+        def read():
+            size = os.path.getsize(path)
+            if max_size is not None and size > max_size:
+                raise ResponseTooLarge(url, size, max_size)
+            with open(path, "rb") as f:
+                return f.read()
+
+        try:
+            body = await asyncio.get_event_loop().run_in_executor(None, read)
+        except FileNotFoundError as e:
+            raise FetchError(f"{path} does not exist", url, 404) from e
+        return Response(url, 200, {"Content-Length": str(len(body))}, body)
+
+    async def _hedged(self, url: str, max_size, hedge_after) -> Response:
+        first = asyncio.ensure_future(self._attempt(url, max_size))
+        if hedge_after is None:
+            return await first
+
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        self.stats["hedged"] += 1
+        second = asyncio.ensure_future(self._attempt(url, max_size))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _fetch(self, url: str, max_size, hedge_after, label: str) -> Response:
+        with span(f"GET {label}", "cdn", url=url):
+            for attempt in range(self.retries + 1):
+                try:
+                    return await self._hedged(url, max_size, hedge_after)
+                except FetchError as e:
+                    if not e.retryable or attempt == self.retries:
+                        raise
+                    delay = random.uniform(
+                        0, min(self.max_backoff, self.backoff * 2 ** attempt)
+                    )
+                    if e.retry_after is not None:
+                        delay = max(delay, min(e.retry_after, self.max_backoff))
+                    logging.warning(f"{e}, retrying in {delay:.2f}s")
+                    self.stats["retries"] += 1
+                    await asyncio.sleep(delay)
+
+    """
+    Download a URL, blocking until it is done.  Must not be called from the
+    client's own event loop.
+
+    Return: a Response
+
+    Arguments:
+        url -- an http(s) or file URL
+        max_size -- raise ResponseTooLarge for bodies larger than this
+        hedge_after -- overrides the client's hedge_after for this request
+        label -- shown in traces, e.g. "emoji"
+
+    Exceptions:
+        FetchError if the download failed after all retries
+    """
+
+    def fetch(
+        self, url: str, max_size=None, hedge_after=..., label="asset"
+    ) -> Response:
+        if hedge_after is ...:
+            hedge_after = self.hedge_after
+        return self._submit(self._fetch(url, max_size, hedge_after, label)).result()
+
+    """
+    Same as `fetch`, but awaitable from any event loop.
+    """
+
+    async def fetch_async(
+        self, url: str, max_size=None, hedge_after=..., label="asset"
+    ):
+        if hedge_after is ...:
+            hedge_after = self.hedge_after
+        future = self._submit(self._fetch(url, max_size, hedge_after, label))
+        return await asyncio.wrap_future(future)
+
+    """
+    Download several URLs concurrently, blocking until all are done.
+
+    Return: list with a Response or the FetchError for each URL, in order
+    """
+
+    def fetch_all(self, urls, max_size=None, hedge_after=..., label="asset") -> list:
+        if hedge_after is ...:
+            hedge_after = self.hedge_after
+
+        async def run():
+            return await asyncio.gather(
+                *(self._fetch(url, max_size, hedge_after, label) for url in urls),
+                return_exceptions=True,
+            )
+
+        return self._submit(run()).result()
+
+    """
+    Close the pooled connections and stop the client's event loop.
+    """
+
+    def close(self):
+        with self._start_lock:
+            if self._loop is None or self._pid != os.getpid():
+                return
+            if self._session is not None:
+                asyncio.run_coroutine_threadsafe(
+                    self._session.close(), self._loop
+                ).result()
+                self._session = None
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+"""
+Return the shared client, creating it on first use.
+"""
+
+
+def get_client() -> HTTPClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HTTPClient()
+        return _client
+
+
+"""
+Replace the shared client with one made with the given HTTPClient arguments,
+e.g. `configure(hedge_after=0.5, retries=5)`.
+"""
+
+
+def configure(**kwargs) -> HTTPClient:
+    global _client
+    with _client_lock:
+        old, _client = _client, HTTPClient(**kwargs)
+    if old is not None:
+        old.close()
+    return _client
+
+
+@atexit.register
+def _close_client():
+    if _client is not None:
+        _client.close()
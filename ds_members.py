@@ -0,0 +1,350 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# A columnar archive of the members of a guild.
+#
+# Each field is a file of its own in the archive folder, so a query reads only
+# the columns it needs, straight from a memory map:
+#
+#     meta.json       amount of members and the role ID of each bitmap column
+#     ids.u64         member IDs, little endian uint64
+#     discrims.u16    discriminators, little endian uint16
+#     roles.bits      one row of bits per member, bit n set if the member has
+#                     role n (packed little endian, rows padded to whole bytes)
+#     names.off       uint64 offsets into names.dat, one more than members
+#     names.dat       UTF-8 usernames, back to back
+#     nicknames.off   same as names, an empty nickname is no nickname
+#     nicknames.dat
+#
+# Members are written in chunks, so a guild's members never have to be in
+# memory all at once.
+
+import os
+import json
+import logging
+
+import numpy as np
+
+from ds_model import Member
+
+archive_version = 1
+meta_file = "meta.json"
+
+_id_dtype = np.dtype("<u8")
+_discrim_dtype = np.dtype("<u2")
+_offset_dtype = np.dtype("<u8")
+_string_columns = ("names", "nicknames")
+
+
+"""
+Writes the members of a guild to a columnar archive.  Members are buffered
+and written `chunk_size` at a time.
+
+Arguments:
+    directory -- the archive folder, created if needed
+    roles -- role IDs, in the order of the bitmap columns
+    chunk_size -- members buffered before they are written
+"""
+
+
+class MemberArchiveWriter:
+    def __init__(self, directory: str, roles, chunk_size=1 << 16):
+        self.directory = directory
+        self.roles = [str(role_id) for role_id in roles]
+        self.chunk_size = chunk_size
+        self._role_index = {int(role_id): idx for idx, role_id in enumerate(self.roles)}
+        self._pending = []
+        self._offsets = {column: 0 for column in _string_columns}
+        self.count = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._files = {}
+        for name in ("ids.u64", "discrims.u16", "roles.bits"):
+            self._files[name] = open(os.path.join(directory, name), "wb")
+        for column in _string_columns:
+            for ext in ("off", "dat"):
+                self._files[f"{column}.{ext}"] = open(
+                    os.path.join(directory, f"{column}.{ext}"), "wb"
+                )
+            self._files[f"{column}.off"].write(np.zeros(1, _offset_dtype).tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    """
+    Add a ds_model.Member, or a member dict following the member schema.
+    """
+
+    def add(self, member):
+        self._pending.append(Member.coerce(member))
+        if len(self._pending) >= self.chunk_size:
+            self._flush()
+
+    def add_all(self, members):
+        for member in members:
+            self.add(member)
+
+    def _write_strings(self, column: str, values: list):
+        encoded = [value.encode("utf-8") for value in values]
+        lengths = np.fromiter(
+            (len(value) for value in encoded), _offset_dtype, len(encoded)
+        )
+        offsets = self._offsets[column] + np.cumsum(lengths, dtype=_offset_dtype)
+        self._files[f"{column}.off"].write(offsets.tobytes())
+        self._files[f"{column}.dat"].write(b"".join(encoded))
+        if len(offsets):
+            self._offsets[column] = int(offsets[-1])
+
+    def _flush(self):
+        members = self._pending
+        if not members:
+            return
+        self._pending = []
+
+        ids = np.fromiter((m.id for m in members), _id_dtype, len(members))
+        discrims = np.fromiter(
+            (int(m.discrim) for m in members), _discrim_dtype, len(members)
+        )
+        bits = np.zeros((len(members), len(self.roles)), dtype=bool)
+        for row, member in enumerate(members):
+            for role_id in member.roles or ():
+                column = self._role_index.get(role_id)
+                if column is None:
+                    logging.warning(
+                        f"Member {member.id} has unknown role {role_id}; omitting"
+                    )
+                else:
+                    bits[row, column] = True
+
+        self._files["ids.u64"].write(ids.tobytes())
+        self._files["discrims.u16"].write(discrims.tobytes())
+        self._files["roles.bits"].write(
+            np.packbits(bits, axis=1, bitorder="little").tobytes()
+        )
+        self._write_strings("names", [m.name for m in members])
+        self._write_strings("nicknames", [m.nickname or "" for m in members])
+        self.count += len(members)
+
+    """
+    Write the remaining members and the metadata.  The archive can only be
+    read once this is done.
+    """
+
+    def close(self):
+        if self._files is None:
+            return
+        self._flush()
+        for f in self._files.values():
+            f.close()
+        self._files = None
+        with open(os.path.join(self.directory, meta_file), "w") as f:
+            json.dump(
+                {"version": archive_version, "count": self.count, "roles": self.roles},
+                f,
+            )
+        logging.info(f"Wrote {self.count} members to archive '{self.directory}'")
+
+
+"""
+Write members to a columnar archive in one go.
+
+Return: amount of members written
+
+Arguments:
+    members -- iterable of ds_model.Member or member dicts
+    directory -- the archive folder
+    roles -- role IDs, in the order of the bitmap columns
+"""
+
+
+def write_member_archive(members, directory: str, roles) -> int:
+    with MemberArchiveWriter(directory, roles) as writer:
+        writer.add_all(members)
+    return writer.count
+
+
+def _map(path: str, dtype, shape):
+    # Memory maps of empty files are not allowed
+    if 0 in shape:
+        return np.zeros(shape, dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+"""
+Reads a columnar member archive.  Every column is memory mapped, so opening
+an archive reads only its metadata and queries only touch the columns they
+use.
+
+Arguments:
+    directory -- the archive folder
+
+Exceptions:
+    ValueError if the archive is of an unknown version
+"""
+
+
+class MemberArchive:
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, meta_file)) as f:
+            meta = json.load(f)
+        if meta.get("version") != archive_version:
+            raise ValueError(
+                f"Member archive '{directory}' is version {meta.get('version')}, expected {archive_version}"
+            )
+        self.count = meta["count"]
+        self.roles = meta["roles"]
+        self._role_index = {role_id: idx for idx, role_id in enumerate(self.roles)}
+
+        def path(name):
+            return os.path.join(directory, name)
+
+        self.ids = _map(path("ids.u64"), _id_dtype, (self.count,))
+        self.discrims = _map(path("discrims.u16"), _discrim_dtype, (self.count,))
+        self.role_bits = _map(
+            path("roles.bits"), np.uint8, (self.count, (len(self.roles) + 7) // 8)
+        )
+        self._strings = {}
+        for column in _string_columns:
+            offsets = _map(path(f"{column}.off"), _offset_dtype, (self.count + 1,))
+            size = int(offsets[-1]) if self.count else 0
+            self._strings[column] = (
+                offsets,
+                _map(path(f"{column}.dat"), np.uint8, (size,)),
+            )
+
+    def __len__(self):
+        return self.count
+
+    def _role(self, role_id) -> int:
+        try:
+            return self._role_index[str(role_id)]
+        except KeyError:
+            raise KeyError(f"No role with ID {role_id} in the archive") from None
+
+    """
+    Return: boolean array, True for the members having a role
+    """
+
+    def role_mask(self, role_id) -> np.ndarray:
+        column = self._role(role_id)
+        return (self.role_bits[:, column // 8] & (1 << (column % 8))) != 0
+
+    """
+    Return: amount of members having a role
+    """
+
+    def role_count(self, role_id) -> int:
+        return int(np.count_nonzero(self.role_mask(role_id)))
+
+    """
+    Return: dict of role ID -> amount of members having it
+
+    Arguments:
+        chunk_size -- members unpacked at a time
+    """
+
+    def role_counts(self, chunk_size=1 << 16) -> dict:
+        totals = np.zeros(len(self.roles), dtype=np.int64)
+        for start in range(0, self.count, chunk_size):
+            bits = np.unpackbits(
+                self.role_bits[start : start + chunk_size],
+                axis=1,
+                count=len(self.roles),
+                bitorder="little",
+            )
+            totals += bits.sum(axis=0, dtype=np.int64)
+        return dict(zip(self.roles, totals.tolist()))
+
+    """
+    Return: IDs of the members having a role, as a uint64 array
+    """
+
+    def members_with(self, role_id) -> np.ndarray:
+        return self.ids[self.role_mask(role_id)]
+
+    """
+    Return: position of a member in the archive
+
+    Exceptions:
+        KeyError if the member is not in the archive
+    """
+
+    def index_of(self, member_id) -> int:
+        found = np.flatnonzero(self.ids == np.uint64(int(member_id)))
+        if not len(found):
+            raise KeyError(f"No member with ID {member_id} in the archive")
+        return int(found[0])
+
+    """
+    Return: whether a member has a role
+    """
+
+    def has_role(self, member_id, role_id) -> bool:
+        row = self.index_of(member_id)
+        column = self._role(role_id)
+        return bool(self.role_bits[row, column // 8] & (1 << (column % 8)))
+
+    def _string(self, column: str, idx: int) -> str:
+        offsets, data = self._strings[column]
+        return bytes(data[offsets[idx] : offsets[idx + 1]]).decode("utf-8")
+
+    """
+    Return: the usernames, or nicknames with None for members without one,
+        in archive order
+
+    Arguments:
+        column -- "names" or "nicknames"
+    """
+
+    def strings(self, column: str) -> list:
+        offsets, data = self._strings[column]
+        blob = bytes(data)
+        bounds = offsets.tolist()
+        res = [
+            blob[bounds[i] : bounds[i + 1]].decode("utf-8") for i in range(self.count)
+        ]
+        if column == "nicknames":
+            res = [value or None for value in res]
+        return res
+
+    """
+    Return: the member at a position as a dict following the member schema
+    """
+
+    def member(self, idx: int) -> dict:
+        res = {
+            "name": self._string("names", idx),
+            "discrim": f"{int(self.discrims[idx]):04d}",
+            "id": str(int(self.ids[idx])),
+        }
+        nickname = self._string("nicknames", idx)
+        if nickname:
+            res["nickname"] = nickname
+        bits = np.unpackbits(
+            self.role_bits[idx], count=len(self.roles), bitorder="little"
+        )
+        res["roles"] = [self.roles[column] for column in np.flatnonzero(bits)]
+        return res
+
+    def __iter__(self):
+        for idx in range(self.count):
+            yield self.member(idx)
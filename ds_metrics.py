@@ -0,0 +1,292 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Counters and histograms in the Prometheus text exposition format, served
+# from a local HTTP endpoint so long running exports can be scraped and
+# alerted on.  Nothing here needs a Prometheus client library.
+#
+#   runner = await start_metrics_server(9464)
+#   with instrument_client(bot):
+#       dse.dump_server(guild)
+#   ...
+#   await runner.cleanup()
+
+import math
+import time
+import logging
+import threading
+import contextlib
+
+import discord
+from aiohttp import web
+
+# Seconds, for request latencies
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+"""
+A counter that only goes up, with one value per combination of label values.
+
+Arguments:
+    name -- the metric name, e.g. "ds_http_requests_total"
+    help -- one line description
+    labels -- tuple of label names
+"""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labels, key), value
+
+
+"""
+A histogram of observed values with cumulative buckets, a sum and a count,
+per combination of label values.
+
+Arguments:
+    name -- the metric name, e.g. "ds_http_request_duration_seconds"
+    help -- one line description
+    labels -- tuple of label names
+    buckets -- ascending upper bounds; +Inf is added
+"""
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=default_buckets):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[idx] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        key = tuple(str(labels[name]) for name in self.labels)
+        return sum(self._values.get(key, ((), 0))[0])
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(c), t)) for key, (c, t) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = (("le", _format_value(bound)),)
+                yield f"{self.name}_bucket", _format_labels(
+                    self.labels, key, le
+                ), cumulative
+            labels = _format_labels(self.labels, key)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+"""
+A set of metrics rendered together.
+"""
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(
+        self, name: str, help: str, labels=(), buckets=default_buckets
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    """
+    Return: every metric in the text exposition format
+    """
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# The metrics the exporter and importer report to
+registry = Registry()
+
+entities_exported = registry.counter(
+    "ds_export_entities_total", "Entities exported, by type", ("type",)
+)
+bytes_written = registry.counter(
+    "ds_export_bytes_written_total", "Bytes written to disk, by kind of file", ("kind",)
+)
+http_requests = registry.counter(
+    "ds_http_requests_total",
+    "Discord REST requests, by route and status",
+    ("route", "status"),
+)
+http_request_duration = registry.histogram(
+    "ds_http_request_duration_seconds",
+    "Discord REST request latency including retries, by route",
+    ("route",),
+)
+http_rate_limited = registry.counter(
+    "ds_http_rate_limited_total", "429 responses from Discord, by route", ("route",)
+)
+guild_export_duration = registry.histogram(
+    "ds_guild_export_duration_seconds",
+    "Time taken by dump_server, by guild",
+    ("guild",),
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 600),
+)
+
+
+# discord.py retries 429s inside HTTPClient.request and only logs them, so
+# they are counted from its log records.
+class _RateLimitCounter(logging.Handler):
+    def emit(self, record):
+        message = record.getMessage()
+        if message.startswith("We are being rate limited"):
+            # The bucket is "<channel id>:<guild id>:<route path>"
+            route = str(record.args[1]).split(":", 2)[-1]
+            http_rate_limited.inc(route=route)
+        elif message.startswith("Global rate limit"):
+            http_rate_limited.inc(route="global")
+
+
+"""
+Count and time every REST request of a discord.py client, and count the 429s
+it gets.  The original request method is restored on exit.
+
+Arguments:
+    bot -- a discord.py client object.
+"""
+
+
+@contextlib.contextmanager
+def instrument_client(bot):
+    original = bot.http.request
+
+    async def request(route, **kwargs):
+        status = "ok"
+        start = time.perf_counter()
+        try:
+            return await original(route, **kwargs)
+        except discord.HTTPException as e:
+            status = str(e.status)
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            route_name = f"{route.method} {route.path}"
+            http_requests.inc(route=route_name, status=status)
+            http_request_duration.observe(time.perf_counter() - start, route=route_name)
+
+    handler = _RateLimitCounter(logging.WARNING)
+    discord_logger = logging.getLogger("discord.http")
+    discord_logger.addHandler(handler)
+    bot.http.request = request
+    try:
+        yield
+    finally:
+        bot.http.request = original
+        discord_logger.removeHandler(handler)
+
+
+"""
+Serve a registry at http://host:port/metrics from the running event loop.
+
+Return: the aiohttp AppRunner; `await runner.cleanup()` stops the server
+
+Arguments:
+    port -- the port to listen on
+    host -- the address to listen on. Local only by default.
+    metrics_registry -- the registry to serve
+"""
+
+
+async def start_metrics_server(port: int, host="127.0.0.1", metrics_registry=registry):
+    async def handle(request):
+        return web.Response(
+            text=metrics_registry.render(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
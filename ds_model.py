@@ -0,0 +1,357 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Typed records of the entities of a server export.
+#
+# A record has one slot per field of its schema and no per-object dict.  Values
+# are kept in their natural type: snowflakes and permission values are ints,
+# member roles a tuple of role IDs, nested lists are lists of records.  The
+# exporter can store the ints discord.py already has instead of making a new
+# string for every ID, which is where most of the memory of a member dict goes.
+#
+# Records turn into dicts following the schemas with `to_dict`, which is only
+# done when a server is serialized.  Until then a record can be read like one
+# of those dicts (`record["id"]`, `record.get("roles")`, `**record`), so code
+# written for dicts from an export file works on records too.  Reading through
+# the dict view converts the value each time; use the attributes where that
+# matters.
+
+from collections import namedtuple
+from collections.abc import Mapping
+
+from ds_codegen import compile_encoders
+
+# How a field is turned into its schema form and back.  `record` is the record
+# type of the items of a list of records.
+Codec = namedtuple("Codec", "dump load record", defaults=(None,))
+
+
+def _snowflake_list_dump(value) -> list:
+    return [str(item) for item in value]
+
+
+def _snowflake_list_load(value) -> tuple:
+    return tuple(int(item) for item in value)
+
+
+_snowflake = Codec(str, int)
+_snowflake_list = Codec(_snowflake_list_dump, _snowflake_list_load)
+
+
+def _records(cls) -> Codec:
+    def dump(value) -> list:
+        return [item.to_dict() for item in value]
+
+    def load(value) -> list:
+        return [cls.coerce(item) for item in value]
+
+    return Codec(dump, load, cls)
+
+
+"""
+Base class of the records.  Subclasses list their fields in `_fields` as
+(name, codec, omitted) tuples, in the order the keys appear in an export:
+
+    codec -- a Codec, None for values that are the same in both forms
+    omitted -- whether the key is left out of the dict when the value is None.
+               Otherwise None is kept, like the topic of a channel without one.
+
+Records are built with keyword arguments; fields not given are None.
+
+Every record class in `records` gets a generated `to_dict` (see ds_codegen.py)
+doing the same as the one here.
+"""
+
+
+class Record(Mapping):
+    __slots__ = ()
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._by_name = {field[0]: field for field in cls._fields}
+
+    def __init__(self, **kwargs):
+        for name, _, _ in self._fields:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError(
+                f"{type(self).__name__} has no field {next(iter(kwargs))!r}"
+            )
+
+    """
+    Return: a dict following the record's schema, ready for json.dumps
+    """
+
+    def to_dict(self) -> dict:
+        res = {}
+        for name, codec, omitted in self._fields:
+            value = getattr(self, name)
+            if value is None:
+                if not omitted:
+                    res[name] = None
+            elif codec is None:
+                res[name] = value
+            else:
+                res[name] = codec[0](value)
+        return res
+
+    """
+    Build a record from a dict following its schema.  Keys that are not fields
+    of the record are ignored.
+    """
+
+    @classmethod
+    def from_dict(cls, data):
+        kwargs = {}
+        for name, codec, _ in cls._fields:
+            value = data.get(name)
+            if value is not None and codec is not None:
+                value = codec[1](value)
+            kwargs[name] = value
+        return cls(**kwargs)
+
+    """
+    Return: `value` if it is a record of this type, else a record built from
+        it with `from_dict`
+    """
+
+    @classmethod
+    def coerce(cls, value):
+        if type(value) is cls:
+            return value
+        return cls.from_dict(value)
+
+    def __getitem__(self, key):
+        field = self._by_name.get(key)
+        if field is None:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None:
+            if field[2]:
+                raise KeyError(key)
+            return None
+        return value if field[1] is None else field[1][0](value)
+
+    def __iter__(self):
+        for name, _, omitted in self._fields:
+            if not omitted or getattr(self, name) is not None:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        if type(other) is type(self):
+            return all(
+                getattr(self, name) == getattr(other, name)
+                for name, _, _ in self._fields
+            )
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(
+            f"{name}={getattr(self, name)!r}"
+            for name, _, _ in self._fields
+            if getattr(self, name) is not None
+        )
+        return f"{type(self).__name__}({fields})"
+
+
+"""
+Return: `value` as a dict if it is a record, else `value` itself
+"""
+
+
+def as_dict(value):
+    return value.to_dict() if isinstance(value, Record) else value
+
+
+"""
+A permission override of a role, see permission_override_schemas.json.
+`permissions` is a dict of permission name -> True (allowed) or False (denied).
+"""
+
+
+class RoleOverride(Record):
+    _fields = (
+        ("id", _snowflake, False),
+        ("name", None, True),
+        ("position", None, True),
+        ("permissions", None, False),
+    )
+    __slots__ = tuple(field[0] for field in _fields)
+
+
+"""
+A permission override of a user, see permission_override_schemas.json.
+"""
+
+
+class UserOverride(Record):
+    _fields = (("id", _snowflake, False), ("permissions", None, False))
+    __slots__ = tuple(field[0] for field in _fields)
+
+
+_role_overrides = ("role_permission_overrides", _records(RoleOverride), True)
+_user_overrides = ("user_permission_overrides", _records(UserOverride), True)
+
+
+"""
+A text channel, see text_channel_schema.json.
+"""
+
+
+class TextChannel(Record):
+    _fields = (
+        ("name", None, False),
+        ("slowmode", None, False),
+        ("nsfw", None, False),
+        ("news", None, False),
+        ("topic", None, False),
+        ("id", _snowflake, False),
+        _role_overrides,
+        _user_overrides,
+    )
+    __slots__ = tuple(field[0] for field in _fields)
+
+
+"""
+A voice channel, see voice_channel_schema.json.
+"""
+
+
+class VoiceChannel(Record):
+    _fields = (
+        ("name", None, False),
+        ("bitrate", None, False),
+        ("user_limit", None, False),
+        ("id", _snowflake, True),
+        _role_overrides,
+        _user_overrides,
+    )
+    __slots__ = tuple(field[0] for field in _fields)
+
+
+"""
+A category and its channels, see category_schema.json.  The channels that are
+in no category are exported as a category named "".
+"""
+
+
+class Category(Record):
+    _fields = (
+        ("name", None, False),
+        ("id", _snowflake, True),
+        ("text_channels", _records(TextChannel), True),
+        ("voice_channels", _records(VoiceChannel), True),
+        _role_overrides,
+        _user_overrides,
+    )
+    __slots__ = tuple(field[0] for field in _fields)
+
+
+"""
+A role, see role_schema.json.  `color` and `permission_value` are the integers
+discord.py uses.
+"""
+
+
+class Role(Record):
+    _fields = (
+        ("name", None, False),
+        ("color", None, False),
+        ("mentionable", None, False),
+        ("position", None, False),
+        ("id", _snowflake, True),
+        ("hoist", None, True),
+        ("permission_value", Codec(str, int), False),
+    )
+    __slots__ = tuple(field[0] for field in _fields)
+
+
+"""
+An emoji, see emoji_schema.json.
+"""
+
+
+class Emoji(Record):
+    _fields = (("name", None, False), ("url", None, False), ("id", _snowflake, True))
+    __slots__ = tuple(field[0] for field in _fields)
+
+
+"""
+A member, see member_schema.json.  `roles` is a tuple of role IDs.
+"""
+
+
+class Member(Record):
+    _fields = (
+        ("name", None, False),
+        ("discrim", None, False),
+        ("id", _snowflake, False),
+        ("nickname", None, True),
+        ("roles", _snowflake_list, True),
+    )
+    __slots__ = tuple(field[0] for field in _fields)
+
+
+"""
+A whole server, see server_schema.json.  `emojis`, `roles`, `categories` and
+`members` are lists of records.
+"""
+
+
+class Server(Record):
+    _fields = (
+        ("name", None, False),
+        ("id", _snowflake, True),
+        ("icon_url", None, False),
+        ("voice_region", None, False),
+        ("inactive_channel", _snowflake, True),
+        ("inactive_timeout", None, True),
+        ("system_message_channel", _snowflake, True),
+        ("join_broadcast", None, False),
+        ("boost_broadcast", None, False),
+        ("default_notifications", None, False),
+        ("verification_level", None, False),
+        ("content_filter", None, False),
+        ("emojis", _records(Emoji), True),
+        ("roles", _records(Role), True),
+        ("categories", _records(Category), True),
+        ("members", _records(Member), True),
+    )
+    __slots__ = tuple(field[0] for field in _fields)
+
+
+records = (
+    RoleOverride,
+    UserOverride,
+    TextChannel,
+    VoiceChannel,
+    Category,
+    Role,
+    Emoji,
+    Member,
+    Server,
+)
+
+for _cls, _encoder in compile_encoders(records).items():
+    _cls.to_dict = _encoder
@@ -0,0 +1,285 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Effective permissions of every role in every channel of a server export.
+#
+# An export is loaded into NumPy arrays: the guild permissions of each role,
+# and the allow and deny masks of the role overrides of each channel.  The
+# role x channel matrix is then worked out with bitwise operations on whole
+# arrays, following the same rules as discord.py's `permissions_for`: @everyone
+# is part of every role, administrators can do everything, the @everyone
+# override applies before the role's own, and a channel that cannot be viewed
+# grants nothing.
+#
+# Only text and voice channels are in the matrix.  Discord does not apply the
+# overrides of a category to its channels; a synced channel has copies of them,
+# which are exported with the channel.
+
+import logging
+
+import numpy as np
+import discord
+
+from ds_container import load_server
+
+TEXT = 0
+VOICE = 1
+
+_channel_sections = {"text_channels": TEXT, "voice_channels": VOICE}
+
+# Permission name -> bit, aliases such as read_messages included
+permission_bits = dict(discord.Permissions.VALID_FLAGS)
+
+_all = np.uint64(discord.Permissions.all().value)
+_all_channel = np.uint64(discord.Permissions.all_channel().value)
+_voice = np.uint64(discord.Permissions.voice().value)
+_voice_denied = np.uint64(
+    discord.Permissions.voice().value
+    | discord.Permissions(manage_channels=True, manage_roles=True).value
+)
+_needs_send = np.uint64(
+    discord.Permissions(
+        send_tts_messages=True,
+        mention_everyone=True,
+        embed_links=True,
+        attach_files=True,
+    ).value
+)
+
+
+def _bit(permission: str) -> np.uint64:
+    try:
+        return np.uint64(permission_bits[permission])
+    except KeyError:
+        raise ValueError(f"'{permission}' is not a permission") from None
+
+
+def _override_masks(permissions: dict) -> tuple:
+    allow = deny = 0
+    for name, value in permissions.items():
+        if value is True:
+            allow |= permission_bits[name]
+        elif value is False:
+            deny |= permission_bits[name]
+    return allow, deny
+
+
+"""
+Apply the channel rules to guild permissions.  All arrays broadcast against
+each other, so this works on a whole role x channel matrix at once.
+
+Return: the effective permissions
+
+Arguments:
+    base -- guild permissions, @everyone included
+    everyone_allow, everyone_deny -- the channel's @everyone override
+    allow, deny -- the channel's overrides of the roles, OR'd together
+    kinds -- TEXT or VOICE per channel
+"""
+
+
+def resolve(base, everyone_allow, everyone_deny, allow, deny, kinds):
+    res = (base & ~everyone_deny) | everyone_allow
+    res = (res & ~deny) | allow
+
+    sends = (res & _bit("send_messages")) != 0
+    res = np.where(sends, res, res & ~_needs_send)
+    res = np.where(kinds == TEXT, res & ~_voice, res)
+    connects = (res & _bit("connect")) != 0
+    res = np.where((kinds == VOICE) & ~connects, res & ~_voice_denied, res)
+    views = (res & _bit("view_channel")) != 0
+    res = np.where(views, res, res & ~_all_channel)
+
+    admin = (base & _bit("administrator")) != 0
+    return np.where(admin, _all, res)
+
+
+"""
+The effective permissions of every role in every channel of a server.
+
+Build one with `PermissionMatrix.from_server`.  `matrix[c, r]` holds the
+permission value of role `roles[r]` in channel `channels[c]`, for a member
+having only that role.
+
+Arguments:
+    roles -- role IDs, @everyone first
+    channels -- channel IDs
+    kinds -- TEXT or VOICE for each channel
+    base -- guild permission value of each role
+    everyone_allow, everyone_deny -- @everyone override masks of each channel
+    allow, deny -- override masks of each channel and role, 0 without one
+"""
+
+
+class PermissionMatrix:
+    def __init__(
+        self, roles, channels, kinds, base, everyone_allow, everyone_deny, allow, deny
+    ):
+        self.roles = list(roles)
+        self.channels = list(channels)
+        self.kinds = np.asarray(kinds, dtype=np.uint8)
+        self.base = np.asarray(base, dtype=np.uint64)
+        self.everyone_allow = np.asarray(everyone_allow, dtype=np.uint64)
+        self.everyone_deny = np.asarray(everyone_deny, dtype=np.uint64)
+        self.allow = np.asarray(allow, dtype=np.uint64)
+        self.deny = np.asarray(deny, dtype=np.uint64)
+        self._role_index = {role_id: idx for idx, role_id in enumerate(self.roles)}
+        self._channel_index = {
+            channel_id: idx for idx, channel_id in enumerate(self.channels)
+        }
+
+        # Every role includes @everyone, whose own row has no role override
+        # beyond the @everyone one
+        guild_base = self.base | self.base[0]
+        self.matrix = resolve(
+            guild_base[np.newaxis, :],
+            self.everyone_allow[:, np.newaxis],
+            self.everyone_deny[:, np.newaxis],
+            self.allow,
+            self.deny,
+            self.kinds[:, np.newaxis],
+        )
+
+    """
+    Load the roles and channel overrides of a server export.
+
+    Arguments:
+        server -- a discord server dict following the server schema
+    """
+
+    @classmethod
+    def from_server(cls, server: dict):
+        roles = server.get("roles", [])
+        # The @everyone role has the guild's ID
+        everyone = next(
+            (role for role in roles if role["id"] == server.get("id")),
+            next((role for role in roles if role["name"] == "@everyone"), None),
+        )
+        others = [role for role in roles if role is not everyone]
+        # Row 0 is @everyone, without any permissions if it is missing
+        role_ids = [everyone["id"] if everyone else server.get("id")]
+        role_ids += [role["id"] for role in others]
+        base = [int(everyone.get("permission_value", 0)) if everyone else 0]
+        base += [int(role.get("permission_value", 0)) for role in others]
+        role_index = {role_id: idx for idx, role_id in enumerate(role_ids)}
+
+        channels, kinds, overrides = [], [], []
+        for category in server.get("categories", []):
+            for section, kind in _channel_sections.items():
+                for channel in category.get(section, []):
+                    channels.append(channel["id"])
+                    kinds.append(kind)
+                    overrides.append(channel.get("role_permission_overrides", []))
+
+        everyone_allow = np.zeros(len(channels), dtype=np.uint64)
+        everyone_deny = np.zeros(len(channels), dtype=np.uint64)
+        allow = np.zeros((len(channels), len(role_ids)), dtype=np.uint64)
+        deny = np.zeros((len(channels), len(role_ids)), dtype=np.uint64)
+        for channel_idx, channel_overrides in enumerate(overrides):
+            for override in channel_overrides:
+                role_idx = role_index.get(override["id"])
+                if role_idx is None:
+                    # An override of a role that was deleted
+                    continue
+                masks = _override_masks(override["permissions"])
+                if role_idx == 0:
+                    everyone_allow[channel_idx], everyone_deny[channel_idx] = masks
+                else:
+                    allow[channel_idx, role_idx], deny[channel_idx, role_idx] = masks
+
+        logging.info(
+            f"Loaded permissions of {len(role_ids)} roles in {len(channels)} channels of server '{server.get('name')}'"
+        )
+        return cls(
+            role_ids, channels, kinds, base, everyone_allow, everyone_deny, allow, deny
+        )
+
+    """
+    Load a server from an export file, JSON or container, without its members.
+
+    Arguments:
+        path -- the export
+        guild_id -- ID of the server, None for the first one
+    """
+
+    @classmethod
+    def from_file(cls, path: str, guild_id=None):
+        return cls.from_server(load_server(path, guild_id, members=False))
+
+    def _role(self, role_id) -> int:
+        try:
+            return self._role_index[str(role_id)]
+        except KeyError:
+            raise KeyError(f"No role with ID {role_id}") from None
+
+    def _channel(self, channel_id) -> int:
+        try:
+            return self._channel_index[str(channel_id)]
+        except KeyError:
+            raise KeyError(f"No channel with ID {channel_id}") from None
+
+    """
+    Return: discord.Permissions of a role in a channel
+    """
+
+    def permissions(self, role_id, channel_id) -> discord.Permissions:
+        return discord.Permissions(
+            int(self.matrix[self._channel(channel_id), self._role(role_id)])
+        )
+
+    """
+    Return: whether a role has a permission, e.g. "send_messages", in a channel
+    """
+
+    def has(self, role_id, channel_id, permission: str) -> bool:
+        value = self.matrix[self._channel(channel_id), self._role(role_id)]
+        return bool(value & _bit(permission))
+
+    """
+    Return: IDs of the roles having a permission in a channel
+    """
+
+    def roles_with(self, channel_id, permission: str) -> list:
+        row = self.matrix[self._channel(channel_id)]
+        return [self.roles[idx] for idx in np.flatnonzero(row & _bit(permission))]
+
+    """
+    Return: IDs of the channels where a role has a permission
+    """
+
+    def channels_with(self, role_id, permission: str) -> list:
+        column = self.matrix[:, self._role(role_id)]
+        return [self.channels[idx] for idx in np.flatnonzero(column & _bit(permission))]
+
+    """
+    Return: the permission values of a member with several roles in every
+        channel, as an array in the order of `channels`
+
+    Arguments:
+        role_ids -- IDs of the member's roles. @everyone is always included.
+    """
+
+    def for_member(self, role_ids) -> np.ndarray:
+        indices = [0] + [self._role(role_id) for role_id in role_ids]
+        base = np.bitwise_or.reduce(self.base[indices])
+        # The @everyone column has no overrides, so it can be OR'd in too
+        allow = np.bitwise_or.reduce(self.allow[:, indices], axis=1)
+        deny = np.bitwise_or.reduce(self.deny[:, indices], axis=1)
+        return resolve(
+            base, self.everyone_allow, self.everyone_deny, allow, deny, self.kinds
+        )
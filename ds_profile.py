@@ -0,0 +1,285 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Per-stage profiling of exports and imports.  The exporter and importer wrap
+# their stages in `stage(...)`, which does nothing unless a Profiler is active:
+#
+#   profiler = Profiler()
+#   with profiler.active():
+#       dse.dump_server(guild)
+#   profiler.write_json("profile.json")
+#   print(profiler.format_table())
+
+import json
+import time
+import logging
+import contextlib
+import threading
+import contextvars
+import tracemalloc
+
+from ds_trace import span
+
+# The profiler of the current run and the stages entered so far.  Context
+# variables, so concurrent asyncio tasks each keep their own stage nesting.
+_current = contextvars.ContextVar("ds_profile_current", default=None)
+_stack = contextvars.ContextVar("ds_profile_stack", default=())
+
+
+"""
+Measurements of one stage, summed over every time the stage was entered.
+Code running inside the stage may add to `objects` and `bytes_written`.
+
+The tracemalloc peak is process wide, so it says nothing about one stage
+while another runs at the same time, e.g. in a concurrent asyncio task.
+Such calls are counted in `mem_overlapped` and left out of `mem_peak`.
+"""
+
+
+class StageRecord:
+    __slots__ = (
+        "name",
+        "calls",
+        "seconds",
+        "objects",
+        "bytes_written",
+        "mem_peak",
+        "mem_overlapped",
+    )
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.objects = 0
+        self.bytes_written = 0
+        self.mem_peak = 0
+        self.mem_overlapped = 0
+
+    def as_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+# Handed out when no profiler is active; whatever is added to it is ignored
+_discard = StageRecord("")
+
+
+class _Frame:
+    __slots__ = ("record", "start", "mem_start", "mem_peak", "epoch", "overlapped")
+
+
+"""
+Collects stage records while active.  Nested stages are recorded under
+"outer/inner" names.
+
+Arguments:
+    trace_memory -- also record the tracemalloc peak of each stage. Starts
+                    tracemalloc while active if it is not running already.
+"""
+
+
+class Profiler:
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.seconds = 0.0
+        # Stages open in every context, and how often one was entered while
+        # stages of another context were open
+        self._lock = threading.Lock()
+        self._open = 0
+        self._epoch = 0
+
+    @contextlib.contextmanager
+    def active(self):
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        current_token = _current.set(self)
+        stack_token = _stack.set(())
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.seconds += time.perf_counter() - start
+            _stack.reset(stack_token)
+            _current.reset(current_token)
+            if started_tracing:
+                tracemalloc.stop()
+
+    def _tracing(self) -> bool:
+        return self.trace_memory and tracemalloc.is_tracing()
+
+    def _enter(self, name: str) -> _Frame:
+        stack = _stack.get()
+        if stack:
+            name = f"{stack[-1].record.name}/{name}"
+        if name not in self.stages:
+            self.stages[name] = StageRecord(name)
+
+        frame = _Frame()
+        frame.record = self.stages[name]
+        frame.mem_start = 0
+        frame.mem_peak = 0
+        with self._lock:
+            self._open += 1
+            # Alone, only this context's own stages are open
+            frame.overlapped = self._open != len(stack) + 1
+            if frame.overlapped:
+                self._epoch += 1
+            frame.epoch = self._epoch
+        if self._tracing():
+            # The peak so far belongs to the enclosing stage
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].mem_peak = max(stack[-1].mem_peak, peak)
+            tracemalloc.reset_peak()
+            frame.mem_start = current
+            frame.mem_peak = current
+
+        _stack.set(stack + (frame,))
+        frame.start = time.perf_counter()
+        return frame
+
+    def _exit(self, frame: _Frame):
+        seconds = time.perf_counter() - frame.start
+        stack = _stack.get()
+        _stack.set(stack[:-1])
+
+        with self._lock:
+            overlapped = frame.overlapped or frame.epoch != self._epoch
+            self._open -= 1
+
+        record = frame.record
+        record.calls += 1
+        record.seconds += seconds
+        if self._tracing():
+            peak = max(frame.mem_peak, tracemalloc.get_traced_memory()[1])
+            if overlapped:
+                record.mem_overlapped += 1
+            else:
+                record.mem_peak = max(record.mem_peak, peak - frame.mem_start)
+            if len(stack) > 1:
+                stack[-2].mem_peak = max(stack[-2].mem_peak, peak)
+            tracemalloc.reset_peak()
+
+    """
+    Return: dict with the total seconds profiled and a list of stage records
+    """
+
+    def report(self) -> dict:
+        return {
+            "seconds": self.seconds,
+            "stages": [record.as_dict() for record in self.stages.values()],
+        }
+
+    def write_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        logging.info(f"Wrote profile report to '{path}'")
+
+    def format_table(self) -> str:
+        lines = [
+            f"{'stage':<32}{'calls':>7}{'seconds':>10}{'objects':>9}{'bytes written':>15}{'mem peak':>12}"
+        ]
+        overlapped = False
+        for record in self.stages.values():
+            mem_peak = str(record.mem_peak)
+            if record.mem_overlapped:
+                overlapped = True
+                mem_peak = (
+                    "-" if record.mem_overlapped == record.calls else f"{mem_peak}*"
+                )
+            lines.append(
+                f"{record.name:<32}{record.calls:>7}{record.seconds:>10.4f}{record.objects:>9}{record.bytes_written:>15}{mem_peak:>12}"
+            )
+        lines.append(f"{'total':<32}{'':>7}{self.seconds:>10.4f}")
+        if overlapped:
+            lines.append(
+                "* some calls ran alongside other stages, their memory is left out"
+            )
+        return "\n".join(lines)
+
+
+"""
+Record a stage that ran where the profiler cannot follow it, e.g. on a thread
+started with `detached_context`, from the thread that waited for it.  It is
+recorded under the stage active in that thread, without a memory peak.
+
+Arguments:
+    name -- the stage name, e.g. "emoji_downloads"
+    seconds -- how long the stage took
+    objects -- objects handled in the stage
+    bytes_written -- bytes written in the stage
+"""
+
+
+def record_stage(name: str, seconds: float, objects=0, bytes_written=0):
+    profiler = _current.get()
+    if profiler is None:
+        return
+    stack = _stack.get()
+    if stack:
+        name = f"{stack[-1].record.name}/{name}"
+    if name not in profiler.stages:
+        profiler.stages[name] = StageRecord(name)
+    record = profiler.stages[name]
+    record.calls += 1
+    record.seconds += seconds
+    record.objects += objects
+    record.bytes_written += bytes_written
+
+
+"""
+Return: a copy of the current context without the active profiler, to run
+code on another thread in.  Stages entered there are not recorded, since they
+would overlap the stages of the starting thread and reset the memory peak
+under them; use `record_stage` once the thread is joined.  Tracing still
+sees the code.
+"""
+
+
+def detached_context() -> contextvars.Context:
+    context = contextvars.copy_context()
+    context.run(_current.set, None)
+    return context
+
+
+"""
+Context manager around one stage of an export or import.  Yields the stage's
+StageRecord so the caller can add to `objects` and `bytes_written`.  Does
+nothing when no profiler is active.  Stages also show up as spans in an active
+ds_trace.Tracer.
+
+Arguments:
+    name -- the stage name, e.g. "roles"
+"""
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    with span(name, "stage"):
+        profiler = _current.get()
+        if profiler is None:
+            yield _discard
+            return
+
+        frame = profiler._enter(name)
+        try:
+            yield frame.record
+        finally:
+            profiler._exit(frame)
@@ -0,0 +1,384 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Periodic snapshots of every guild a client is in.  See snapshot_daemon.py
+# for the script running it.
+#
+# Snapshots are written to `<snapshot dir>/<guild id>/<UTC timestamp>/`, with
+# the server dict in `server.json` next to the usual icons and emojis folders.
+
+import os
+import time
+import heapq
+import random
+import shutil
+import asyncio
+import logging
+import datetime
+
+import discord_server_exporter as dse
+from ds_common_funcs import run_in_executor
+
+snapshot_time_format = "%Y%m%dT%H%M%SZ"
+# Suffix of snapshots still being written
+partial_suffix = ".partial"
+
+
+"""
+Return the snapshot folder name for a time.
+"""
+
+
+def snapshot_name(when: datetime.datetime) -> str:
+    return when.strftime(snapshot_time_format)
+
+
+"""
+Return the time a snapshot folder was taken at, None if it is not a snapshot.
+"""
+
+
+def parse_snapshot_name(name: str):
+    try:
+        return datetime.datetime.strptime(name, snapshot_time_format).replace(
+            tzinfo=datetime.timezone.utc
+        )
+    except ValueError:
+        return None
+
+
+"""
+Which snapshots of a guild to keep.
+
+Arguments:
+    keep_last -- the newest snapshots always kept
+    keep_daily -- for this many days back, the newest snapshot of each day is kept
+    keep_weekly -- for this many weeks back, the newest snapshot of each ISO week
+                   is kept
+"""
+
+
+class RetentionPolicy:
+    def __init__(self, keep_last=24, keep_daily=7, keep_weekly=4):
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+
+    """
+    Return: the snapshot times from `times` that are no longer kept
+
+    Arguments:
+        times -- datetimes of the existing snapshots
+        now -- the current time, as an aware datetime
+    """
+
+    def expired(self, times: list, now: datetime.datetime) -> list:
+        newest_first = sorted(times, reverse=True)
+        keep = set(newest_first[: self.keep_last])
+
+        for period, amount, key in (
+            (datetime.timedelta(days=1), self.keep_daily, lambda t: t.date()),
+            (
+                datetime.timedelta(weeks=1),
+                self.keep_weekly,
+                lambda t: t.isocalendar()[:2],
+            ),
+        ):
+            seen = set()
+            for when in newest_first:
+                if now - when > period * amount:
+                    break
+                if key(when) not in seen:
+                    seen.add(key(when))
+                    keep.add(when)
+
+        return [when for when in newest_first if when not in keep]
+
+
+"""
+Delete the snapshots of one guild that the policy no longer keeps, and any
+snapshot left half written by an interrupted export.
+
+Return: amount of snapshots deleted
+
+Arguments:
+    guild_dir -- the folder holding the guild's snapshots
+    policy -- a RetentionPolicy
+    now -- the current time, as an aware datetime. Defaults to now.
+"""
+
+
+def apply_retention(guild_dir: str, policy: RetentionPolicy, now=None) -> int:
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    if not os.path.isdir(guild_dir):
+        return 0
+
+    snapshots = {}
+    deleted = 0
+    for name in os.listdir(guild_dir):
+        if name.endswith(partial_suffix):
+            shutil.rmtree(os.path.join(guild_dir, name), ignore_errors=True)
+            deleted += 1
+            continue
+        when = parse_snapshot_name(name)
+        if when is not None:
+            snapshots[when] = name
+
+    for when in policy.expired(list(snapshots), now):
+        logging.info(f"Deleting expired snapshot '{snapshots[when]}' in '{guild_dir}'")
+        shutil.rmtree(os.path.join(guild_dir, snapshots[when]), ignore_errors=True)
+        deleted += 1
+    return deleted
+
+
+"""
+Write one snapshot of a guild.  The snapshot is written to a partial folder
+and renamed once complete, so a snapshot folder is never half written.
+
+Return: path of the snapshot folder
+
+Arguments:
+    guild -- a discord.py guild object
+    snapshot_dir -- the folder holding the snapshots of every guild
+    dump_kwargs -- extra arguments for dump_server
+"""
+
+
+def write_snapshot(guild, snapshot_dir: str, dump_kwargs=None) -> str:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    guild_dir = os.path.join(snapshot_dir, str(guild.id))
+    final = os.path.join(guild_dir, snapshot_name(now))
+    partial = final + partial_suffix
+    os.makedirs(partial, exist_ok=True)
+
+    # The server is written as the schema file, which has the members too.
+    # Returns once the emoji downloads are written as well.
+    dse.dump_server(
+        guild,
+        export_files_dir=partial,
+        **(dump_kwargs or {}),
+        schema_name="server.json",
+    )
+
+    if os.path.exists(final):
+        # Two snapshots within a second
+        shutil.rmtree(final)
+    os.rename(partial, final)
+    return final
+
+
+"""
+Snapshots every guild of a client on an interval.
+
+Each guild is due `interval` seconds (± `jitter` of it) after its last
+snapshot, and the first snapshots are spread over the first interval, so
+hundreds of guilds do not all export at once.  A change event for a guild
+(see `mark_changed`) makes it due `change_delay` seconds later if that is
+sooner, and changed guilds go before unchanged ones that are due at the same
+time.  At most `max_concurrent` exports run at once.
+
+Arguments:
+    bot -- a discord.py client object
+    snapshot_dir -- the folder snapshots are written to
+    interval -- seconds between snapshots of a guild
+    jitter -- fraction of the interval each delay is randomly moved by
+    change_delay -- seconds after a change event a guild is snapshotted, so a
+                    burst of events results in one snapshot
+    max_concurrent -- exports running at once
+    retention -- a RetentionPolicy, None to keep everything
+    dump_kwargs -- extra arguments for dump_server
+    export -- the function writing a snapshot, for testing. Defaults to
+              `write_snapshot`.
+"""
+
+
+class SnapshotScheduler:
+    def __init__(
+        self,
+        bot,
+        snapshot_dir="snapshots",
+        interval=3600.0,
+        jitter=0.1,
+        change_delay=60.0,
+        max_concurrent=2,
+        retention=None,
+        dump_kwargs=None,
+        export=write_snapshot,
+    ):
+        self.bot = bot
+        self.snapshot_dir = snapshot_dir
+        self.interval = interval
+        self.jitter = jitter
+        self.change_delay = change_delay
+        self.max_concurrent = max_concurrent
+        self.retention = retention
+        self.dump_kwargs = dump_kwargs
+        self.export = export
+
+        # guild id -> (due time, changed); the heap may hold stale entries,
+        # which are skipped when they do not match this
+        self.due = {}
+        self._heap = []
+        self._running = set()
+        self._wake = None
+        self._sem = None
+        self._stopped = False
+        self.stats = {"exports": 0, "failures": 0, "deleted": 0, "max_running": 0}
+
+    def _schedule(self, guild_id: int, when: float, changed=False):
+        self.due[guild_id] = (when, changed)
+        # Changed guilds sort before unchanged ones due at the same time
+        heapq.heappush(self._heap, (when, not changed, guild_id))
+        if self._wake is not None:
+            self._wake.set()
+
+    def _next_delay(self) -> float:
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    """
+    Schedule a guild the client joined.  Its first snapshot is spread over the
+    first interval.
+    """
+
+    def add_guild(self, guild_id: int):
+        if guild_id not in self.due and guild_id not in self._running:
+            self._schedule(
+                guild_id, time.monotonic() + random.uniform(0, self.interval)
+            )
+
+    """
+    Stop scheduling a guild the client left.
+    """
+
+    def remove_guild(self, guild_id: int):
+        self.due.pop(guild_id, None)
+
+    """
+    Record a change event for a guild, e.g. from on_guild_channel_update.
+    """
+
+    def mark_changed(self, guild_id: int):
+        if guild_id in self._running:
+            # Snapshot again once the running export is done
+            self.due[guild_id] = (time.monotonic() + self.change_delay, True)
+            return
+        when = time.monotonic() + self.change_delay
+        current = self.due.get(guild_id)
+        if current is None or when < current[0] or not current[1]:
+            self._schedule(guild_id, min(when, current[0]) if current else when, True)
+
+    def _pop_due(self, now: float):
+        while self._heap:
+            when, unchanged, guild_id = self._heap[0]
+            if self.due.get(guild_id) != (when, not unchanged):
+                heapq.heappop(self._heap)
+                continue
+            if when > now:
+                return None, when - now
+            heapq.heappop(self._heap)
+            del self.due[guild_id]
+            return guild_id, 0
+        return None, None
+
+    async def _export(self, guild_id: int):
+        try:
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                logging.warning(f"Guild {guild_id} is gone, no longer snapshotting it")
+                return
+
+            logging.info(f"Snapshotting server '{guild.name}'")
+            start = time.perf_counter()
+            try:
+                path = await run_in_executor(
+                    self.export, guild, self.snapshot_dir, self.dump_kwargs
+                )
+            except Exception:
+                logging.exception(f"Snapshot of server '{guild.name}' failed")
+                self.stats["failures"] += 1
+            else:
+                self.stats["exports"] += 1
+                logging.info(
+                    f"Snapshot of server '{guild.name}' written to '{path}' in {time.perf_counter() - start:.1f}s"
+                )
+                if self.retention is not None:
+                    self.stats["deleted"] += await run_in_executor(
+                        apply_retention,
+                        os.path.join(self.snapshot_dir, str(guild_id)),
+                        self.retention,
+                    )
+
+            # A change seen while exporting is kept, otherwise wait an interval
+            pending = self.due.pop(guild_id, None)
+            if pending is not None and pending[1]:
+                self._schedule(guild_id, pending[0], True)
+            else:
+                self._schedule(guild_id, time.monotonic() + self._next_delay())
+        finally:
+            self._running.discard(guild_id)
+            self._sem.release()
+
+    """
+    Run until `stop` is called.  Guilds the client is in are added when this
+    starts; others can be added with `add_guild`.
+    """
+
+    async def run(self):
+        self._wake = asyncio.Event()
+        self._sem = asyncio.Semaphore(self.max_concurrent)
+        self._stopped = False
+        tasks = set()
+
+        for guild in self.bot.guilds:
+            self.add_guild(guild.id)
+        logging.info(
+            f"Snapshotting {len(self.due)} servers every {self.interval:.0f}s to '{self.snapshot_dir}'"
+        )
+
+        try:
+            while not self._stopped:
+                await self._sem.acquire()
+                guild_id, wait = self._pop_due(time.monotonic())
+                if guild_id is None:
+                    self._sem.release()
+                    self._wake.clear()
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                self._running.add(guild_id)
+                self.stats["max_running"] = max(
+                    self.stats["max_running"], len(self._running)
+                )
+                task = asyncio.ensure_future(self._export(guild_id))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    """
+    Make `run` return once the exports in progress are done.
+    """
+
+    def stop(self):
+        self._stopped = True
+        if self._wake is not None:
+            self._wake.set()
@@ -0,0 +1,464 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Exports of a bot split over processes by shard.
+#
+# Discord puts guild `g` of a bot on shard `(g >> 22) % shard_count`.  A single
+# process exporting every guild has one event loop and one interpreter lock
+# for all of them.  Here the shards are split into contiguous ranges, one per
+# worker process.  Each worker connects an AutoShardedClient for its own shards
+# only, snapshots each of its guilds with `write_snapshot` (the usual
+# `dump_server`), and writes a manifest of what it exported to
+# `<snapshot dir>/manifests/`.  The coordinator waits for the workers and
+# merges their manifests into one index of the run, `<snapshot dir>/index.json`.
+#
+# A worker that dies leaves its shards out of the index, listed under
+# "missing_shards", instead of failing the whole run.  See dumpall_sharded.py
+# for the script running it.
+#
+# Discord lets a bot start `max_concurrency` sessions per 5 seconds, shard `s`
+# being in rate limit bucket `s % max_concurrency`.  A client only spaces the
+# IDENTIFYs of its own shards, so the workers share an `IdentifyGate` that
+# spaces them over every process.
+
+import os
+import json
+import time
+import asyncio
+import logging
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import discord
+
+from ds_scheduler import write_snapshot
+
+manifest_version = 1
+index_version = 1
+manifest_dir = "manifests"
+index_file = "index.json"
+# Seconds between session starts of one rate limit bucket
+identify_interval = 5.0
+
+
+"""
+Return: the shard a guild is on
+"""
+
+
+def shard_of(guild_id: int, shard_count: int) -> int:
+    return (int(guild_id) >> 22) % shard_count
+
+
+"""
+Split shards into contiguous ranges, one per worker, as even as possible.
+
+Return: list of lists of shard IDs
+
+Arguments:
+    shard_count -- amount of shards of the bot
+    workers -- amount of worker processes. There are never more ranges than
+               shards.
+"""
+
+
+def shard_ranges(shard_count: int, workers: int) -> list:
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    res = []
+    start = 0
+    for idx in range(workers):
+        end = start + size + (1 if idx < extra else 0)
+        res.append(list(range(start, end)))
+        start = end
+    return res
+
+
+def _write_json(path: str, value):
+    # Written next to the file and renamed, so it is never half written
+    partial = path + ".partial"
+    with open(partial, "w") as f:
+        json.dump(value, f)
+    os.replace(partial, path)
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+"""
+Return: path of the manifest of a shard range
+"""
+
+
+def manifest_path(snapshot_dir: str, shard_ids) -> str:
+    return os.path.join(
+        snapshot_dir, manifest_dir, f"shards_{min(shard_ids)}-{max(shard_ids)}.json"
+    )
+
+
+"""
+Snapshot guilds of a shard range and write the range's manifest.  A guild that
+fails is recorded in the manifest with its error; the others are still
+exported.
+
+Return: the manifest
+
+Arguments:
+    guilds -- discord.py guild objects of the shards
+    snapshot_dir -- the folder snapshots are written to
+    shard_ids -- the shards of this worker
+    shard_count -- amount of shards of the bot
+    dump_kwargs -- extra arguments for dump_server
+    export -- the function writing a snapshot, for testing. Defaults to
+              `write_snapshot`.
+"""
+
+
+def export_guilds(
+    guilds,
+    snapshot_dir: str,
+    shard_ids,
+    shard_count: int,
+    dump_kwargs=None,
+    export=write_snapshot,
+) -> dict:
+    shard_ids = sorted(shard_ids)
+    manifest = {
+        "version": manifest_version,
+        "shard_ids": shard_ids,
+        "shard_count": shard_count,
+        "pid": os.getpid(),
+        "started": _now(),
+        "guilds": [],
+    }
+    wanted = set(shard_ids)
+    for guild in guilds:
+        shard = getattr(guild, "shard_id", None)
+        if shard is None:
+            shard = shard_of(guild.id, shard_count)
+        if shard not in wanted:
+            logging.warning(
+                f"Server '{guild.name}' is on shard {shard}, not exporting it here"
+            )
+            continue
+
+        entry = {"id": str(guild.id), "name": guild.name, "shard": shard}
+        start = time.perf_counter()
+        try:
+            path = export(guild, snapshot_dir, dump_kwargs)
+        except Exception as e:
+            logging.exception(f"Snapshot of server '{guild.name}' failed")
+            entry["error"] = f"{type(e).__name__}: {e}"
+        else:
+            entry["snapshot"] = os.path.relpath(path, snapshot_dir)
+        entry["seconds"] = time.perf_counter() - start
+        manifest["guilds"].append(entry)
+
+    manifest["finished"] = _now()
+    path = manifest_path(snapshot_dir, shard_ids)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_json(path, manifest)
+    logging.info(
+        f"Shards {shard_ids[0]}-{shard_ids[-1]}: exported {len(manifest['guilds'])} servers, manifest in '{path}'"
+    )
+    return manifest
+
+
+"""
+Spaces IDENTIFYs of shards over processes.  Made by the coordinator with
+objects of a `multiprocessing.Manager`, and handed to each worker, which calls
+`wait` before each of its shards identifies.
+
+Arguments:
+    manager -- a started multiprocessing.Manager
+    max_concurrency -- session starts Discord allows at once, from the bot's
+                       session_start_limit
+    interval -- seconds between session starts of one bucket
+"""
+
+
+class IdentifyGate:
+    def __init__(
+        self, manager, max_concurrency: int = 1, interval: float = identify_interval
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.interval = interval
+        self._locks = [manager.Lock() for _ in range(self.max_concurrency)]
+        # Bucket -> time.time() of its last session start
+        self._started = manager.dict()
+
+    """
+    Block until shard `shard_id` may identify, and count it as started.
+    """
+
+    def wait(self, shard_id: int):
+        bucket = shard_id % self.max_concurrency
+        with self._locks[bucket]:
+            delay = self._started.get(bucket, 0.0) + self.interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self._started[bucket] = time.time()
+
+
+"""
+Run one worker: connect to the shards of a range, export their guilds once
+every shard is ready, then disconnect.  Meant to run in a process of its own,
+which it does under `export_sharded`.
+
+Return: path of the manifest
+
+Arguments:
+    token -- the bot token
+    shard_ids -- the shards of this worker
+    shard_count -- amount of shards of the bot
+    snapshot_dir -- the folder snapshots are written to
+    dump_kwargs -- extra arguments for dump_server
+    gate -- IdentifyGate shared with the other workers. Without one, only the
+            shards of this worker are spaced.
+"""
+
+
+def run_worker(
+    token: str,
+    shard_ids,
+    shard_count: int,
+    snapshot_dir: str,
+    dump_kwargs=None,
+    gate=None,
+) -> str:
+    client = discord.AutoShardedClient(
+        intents=discord.Intents.all(),
+        shard_ids=list(shard_ids),
+        shard_count=shard_count,
+    )
+    failure = []
+
+    if gate is not None:
+        # Replaces the client's own 5 second wait between its shards
+        async def before_identify_hook(shard_id, *, initial=False):
+            await client.loop.run_in_executor(None, gate.wait, shard_id)
+
+        client.before_identify_hook = before_identify_hook
+
+    @client.event
+    async def on_ready():
+        logging.info(
+            f"Shards {shard_ids[0]}-{shard_ids[-1]} ready with {len(client.guilds)} servers"
+        )
+        try:
+            await client.loop.run_in_executor(
+                None,
+                export_guilds,
+                list(client.guilds),
+                snapshot_dir,
+                shard_ids,
+                shard_count,
+                dump_kwargs,
+            )
+        except Exception as e:
+            failure.append(e)
+        finally:
+            await client.close()
+
+    client.run(token)
+    if failure:
+        raise failure[0]
+    return manifest_path(snapshot_dir, shard_ids)
+
+
+"""
+Return: the amount of shards Discord recommends for a bot, and how many
+sessions it may start at once (max_concurrency)
+"""
+
+
+def recommended_shard_count(token: str) -> tuple:
+    async def fetch():
+        http = discord.http.HTTPClient()
+        try:
+            await http.static_login(token, bot=True)
+            data = await http.request(discord.http.Route("GET", "/gateway/bot"))
+            limit = data.get("session_start_limit", {})
+            return data["shards"], limit.get("max_concurrency", 1)
+        finally:
+            await http.close()
+
+    return asyncio.run(fetch())
+
+
+"""
+Merge the manifests of the shard ranges of a run into one index, and write it
+to `<snapshot dir>/index.json`.  When a guild is in more than one manifest,
+e.g. after a range was run again, the manifest that finished last wins.
+
+Return: the index, a dict of
+    shard_count -- amount of shards of the bot
+    shards -- shard ID -> manifest (relative path), servers and failures
+    missing_shards -- shards no manifest covers
+    guilds -- guild ID -> name, shard, snapshot (relative path) and seconds
+    failed -- guild ID -> name, shard and error, for guilds without a snapshot
+
+Arguments:
+    snapshot_dir -- the folder snapshots are written to
+    paths -- the manifests to merge. Defaults to every manifest in the folder.
+    shard_count -- amount of shards of the bot. Defaults to the manifests'.
+"""
+
+
+def merge_manifests(snapshot_dir: str, paths=None, shard_count=None) -> dict:
+    if paths is None:
+        folder = os.path.join(snapshot_dir, manifest_dir)
+        paths = []
+        if os.path.isdir(folder):
+            for name in sorted(os.listdir(folder)):
+                if name.endswith(".json"):
+                    paths.append(os.path.join(folder, name))
+
+    manifests = []
+    for path in paths:
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != manifest_version:
+            raise ValueError(
+                f"Manifest '{path}' is version {manifest.get('version')}, expected {manifest_version}"
+            )
+        if shard_count is None:
+            shard_count = manifest["shard_count"]
+        elif manifest["shard_count"] != shard_count:
+            raise ValueError(
+                f"Manifest '{path}' is for {manifest['shard_count']} shards, expected {shard_count}"
+            )
+        manifests.append((manifest["finished"], path, manifest))
+    # ISO timestamps of one time zone sort by time
+    manifests.sort(key=lambda item: item[0])
+
+    index = {
+        "version": index_version,
+        "created": _now(),
+        "shard_count": shard_count,
+        "shards": {},
+        "missing_shards": [],
+        "guilds": {},
+        "failed": {},
+    }
+    for _, path, manifest in manifests:
+        for shard in manifest["shard_ids"]:
+            index["shards"][str(shard)] = {
+                "manifest": os.path.relpath(path, snapshot_dir),
+                "servers": 0,
+                "failures": 0,
+            }
+        for entry in manifest["guilds"]:
+            guild_id = entry["id"]
+            index["guilds"].pop(guild_id, None)
+            index["failed"].pop(guild_id, None)
+            summary = index["shards"][str(entry["shard"])]
+            summary["servers"] += 1
+            if "error" in entry:
+                summary["failures"] += 1
+                index["failed"][guild_id] = {
+                    "name": entry["name"],
+                    "shard": entry["shard"],
+                    "error": entry["error"],
+                }
+            else:
+                index["guilds"][guild_id] = {
+                    "name": entry["name"],
+                    "shard": entry["shard"],
+                    "snapshot": entry["snapshot"],
+                    "seconds": entry["seconds"],
+                }
+
+    index["missing_shards"] = [
+        shard for shard in range(shard_count or 0) if str(shard) not in index["shards"]
+    ]
+    _write_json(os.path.join(snapshot_dir, index_file), index)
+    logging.info(
+        f"Indexed {len(index['guilds'])} snapshots from {len(manifests)} manifests, {len(index['failed'])} failed, {len(index['missing_shards'])} shards missing"
+    )
+    return index
+
+
+"""
+Export every guild of a bot with one worker process per shard range, then
+merge the workers' manifests into the snapshot index.
+
+Return: the index, see `merge_manifests`
+
+Arguments:
+    token -- the bot token
+    snapshot_dir -- the folder snapshots are written to
+    shard_count -- amount of shards of the bot. Asked from Discord if None.
+    workers -- amount of worker processes. Defaults to the amount of CPUs.
+    dump_kwargs -- extra arguments for dump_server
+    worker -- the function run in each process, called like `run_worker`, for
+              testing
+    max_concurrency -- sessions the bot may start at once. Asked from Discord
+                       along with shard_count; 1 otherwise, which is always
+                       allowed.
+"""
+
+
+def export_sharded(
+    token: str,
+    snapshot_dir="snapshots",
+    shard_count=None,
+    workers=None,
+    dump_kwargs=None,
+    worker=run_worker,
+    max_concurrency=None,
+) -> dict:
+    if shard_count is None:
+        shard_count, recommended_concurrency = recommended_shard_count(token)
+        if max_concurrency is None:
+            max_concurrency = recommended_concurrency
+    ranges = shard_ranges(shard_count, workers or os.cpu_count() or 1)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    logging.info(f"Exporting {shard_count} shards with {len(ranges)} worker processes")
+
+    paths = []
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(
+        max_workers=len(ranges)
+    ) as pool:
+        gate = IdentifyGate(manager, max_concurrency or 1)
+        futures = [
+            (
+                shard_ids,
+                pool.submit(
+                    worker,
+                    token,
+                    shard_ids,
+                    shard_count,
+                    snapshot_dir,
+                    dump_kwargs,
+                    gate,
+                ),
+            )
+            for shard_ids in ranges
+        ]
+        for shard_ids, future in futures:
+            try:
+                paths.append(future.result())
+            except Exception:
+                logging.exception(
+                    f"Worker for shards {shard_ids[0]}-{shard_ids[-1]} failed"
+                )
+
+    return merge_manifests(snapshot_dir, paths, shard_count)
@@ -0,0 +1,531 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# A SQLite store of server snapshots, one row per entity version.
+#
+# A server dict is split into entities: the server header, roles, emojis,
+# categories, text and voice channels, permission overrides and members.
+# Every distinct entity value is stored once in `blobs`, keyed by its hash.
+# `versions` has a row per entity per stretch of snapshots it stayed the same
+# in: `valid_from` is the first snapshot it appeared in, `valid_to` the last
+# one (NULL while it is still current).  A snapshot where nothing changed only
+# adds a row to `snapshots`.
+#
+# `ordinal` orders the entities of one list (e.g. the members).  Ordinals are
+# sparse, so adding or removing an entity does not move the ones around it and
+# they keep their rows.
+
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+
+# Entity kinds
+SERVER = "server"
+ROLE = "role"
+EMOJI = "emoji"
+CATEGORY = "category"
+TEXT_CHANNEL = "text_channel"
+VOICE_CHANNEL = "voice_channel"
+ROLE_OVERRIDE = "role_override"
+USER_OVERRIDE = "user_override"
+MEMBER = "member"
+
+# Server sections and the entity kind of their items
+_server_sections = {"roles": ROLE, "emojis": EMOJI, "members": MEMBER}
+_channel_sections = {"text_channels": TEXT_CHANNEL, "voice_channels": VOICE_CHANNEL}
+_override_sections = {
+    "role_permission_overrides": ROLE_OVERRIDE,
+    "user_permission_overrides": USER_OVERRIDE,
+}
+
+_schema = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    guild_id TEXT NOT NULL,
+    taken_at REAL NOT NULL,
+    entities INTEGER NOT NULL,
+    changed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_guild ON snapshots (guild_id, taken_at);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS versions (
+    id INTEGER PRIMARY KEY,
+    guild_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    parent TEXT,
+    ordinal REAL NOT NULL,
+    blob TEXT NOT NULL REFERENCES blobs (hash),
+    valid_from INTEGER NOT NULL REFERENCES snapshots (id),
+    valid_to INTEGER REFERENCES snapshots (id)
+);
+CREATE INDEX IF NOT EXISTS versions_entity
+    ON versions (guild_id, kind, entity_id, valid_from);
+CREATE INDEX IF NOT EXISTS versions_range ON versions (guild_id, valid_from);
+CREATE INDEX IF NOT EXISTS versions_current
+    ON versions (guild_id) WHERE valid_to IS NULL;
+"""
+
+
+# Longest strictly increasing subsequence, as a set of indices into `values`.
+# None values are skipped.
+def _increasing_indices(values: list) -> set:
+    tails = []  # index of the smallest tail of each length
+    previous = {}
+    for idx, value in enumerate(values):
+        if value is None:
+            continue
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if values[tails[mid]] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        previous[idx] = tails[lo - 1] if lo else None
+        if lo == len(tails):
+            tails.append(idx)
+        else:
+            tails[lo] = idx
+
+    res = set()
+    idx = tails[-1] if tails else None
+    while idx is not None:
+        res.add(idx)
+        idx = previous[idx]
+    return res
+
+
+"""
+Choose ordinals for the entities of one list.  The longest run of entities
+still in the same relative order keeps their ordinals; the others get ordinals
+between their neighbours.
+
+Return: list of ordinals, one per entity
+
+Arguments:
+    old -- the current ordinal of each entity, in the new order. None for
+           entities that are new to the list.
+"""
+
+
+def assign_ordinals(old: list) -> list:
+    keep = _increasing_indices(old)
+    res = [old[idx] if idx in keep else None for idx in range(len(old))]
+
+    idx = 0
+    while idx < len(res):
+        if res[idx] is not None:
+            idx += 1
+            continue
+        end = idx
+        while end < len(res) and res[end] is None:
+            end += 1
+        low = res[idx - 1] if idx > 0 else None
+        high = res[end] if end < len(res) else None
+        amount = end - idx
+        for step in range(amount):
+            if low is None and high is None:
+                res[idx + step] = float(step)
+            elif high is None:
+                res[idx + step] = low + step + 1
+            elif low is None:
+                res[idx + step] = high - amount + step
+            else:
+                res[idx + step] = low + (high - low) * (step + 1) / (amount + 1)
+        idx = end
+
+    # Out of float precision between two neighbours: start over
+    if any(a >= b for a, b in zip(res, res[1:])):
+        return [float(idx) for idx in range(len(old))]
+    return res
+
+
+def _encode(value) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def _add_overrides(rows: list, owner: dict, parent: str, res: dict):
+    for section, kind in _override_sections.items():
+        if section not in owner:
+            continue
+        # The owner keeps an empty list so the section comes back
+        res[section] = []
+        for idx, override in enumerate(owner[section]):
+            rows.append((kind, f"{parent}/{override['id']}", parent, idx, override))
+
+
+"""
+Split a server dict into entity rows.
+
+Return: list of (kind, entity id, parent entity id, ordinal, value).
+    Values have their nested entities taken out, leaving empty lists.
+
+Arguments:
+    server -- a discord server dict following the server schema
+"""
+
+
+def flatten_server(server: dict) -> list:
+    rows = []
+    header = {}
+    for key, value in server.items():
+        if key in _server_sections or key == "categories":
+            header[key] = []
+        else:
+            header[key] = value
+    rows.append((SERVER, server.get("id", ""), None, 0, header))
+
+    for section, kind in _server_sections.items():
+        for idx, item in enumerate(server.get(section, [])):
+            # Emojis are only sure to have a URL
+            entity_id = item.get("id") or item.get("url") or str(idx)
+            rows.append((kind, str(entity_id), None, idx, item))
+
+    for cat_idx, category in enumerate(server.get("categories", [])):
+        # Exports do not give categories an ID, so they go by position and name
+        cat_id = (
+            str(category["id"]) if "id" in category else f"{cat_idx}:{category['name']}"
+        )
+        cat_value = {}
+        for key, value in category.items():
+            if key not in _channel_sections and key not in _override_sections:
+                cat_value[key] = value
+        _add_overrides(rows, category, cat_id, cat_value)
+
+        for section, kind in _channel_sections.items():
+            if section not in category:
+                continue
+            cat_value[section] = []
+            for idx, channel in enumerate(category[section]):
+                channel_value = {}
+                for key, value in channel.items():
+                    if key not in _override_sections:
+                        channel_value[key] = value
+                channel_id = str(channel["id"])
+                _add_overrides(rows, channel, channel_id, channel_value)
+                rows.append((kind, channel_id, cat_id, idx, channel_value))
+
+        rows.append((CATEGORY, cat_id, None, cat_idx, cat_value))
+    return rows
+
+
+"""
+Put entity rows from `flatten_server` back together.
+
+Return: a server dict following the server schema
+
+Arguments:
+    rows -- iterable of (kind, entity id, parent entity id, ordinal, value)
+"""
+
+
+def assemble_server(rows) -> dict:
+    by_kind = {}
+    for kind, entity_id, parent, ordinal, value in rows:
+        by_kind.setdefault(kind, []).append((parent, ordinal, entity_id, value))
+    for items in by_kind.values():
+        items.sort(key=lambda item: item[1])
+
+    def children(kind):
+        res = {}
+        for parent, _, _, value in by_kind.get(kind, []):
+            res.setdefault(parent, []).append(value)
+        return res
+
+    overrides = {
+        section: children(kind) for section, kind in _override_sections.items()
+    }
+
+    def fill_overrides(value, entity_id):
+        for section in _override_sections:
+            if section in value:
+                value[section] = overrides[section].get(entity_id, [])
+
+    channels = {section: children(kind) for section, kind in _channel_sections.items()}
+    for section, kind in _channel_sections.items():
+        for _, _, entity_id, value in by_kind.get(kind, []):
+            fill_overrides(value, entity_id)
+
+    server = dict(by_kind[SERVER][0][3])
+    for section, kind in _server_sections.items():
+        if section in server:
+            server[section] = [value for _, _, _, value in by_kind.get(kind, [])]
+    if "categories" in server:
+        server["categories"] = []
+        for _, _, cat_id, value in by_kind.get(CATEGORY, []):
+            fill_overrides(value, cat_id)
+            for section in _channel_sections:
+                if section in value:
+                    value[section] = channels[section].get(cat_id, [])
+            server["categories"].append(value)
+    return server
+
+
+"""
+Snapshots of servers in a SQLite database.  Safe to use from several threads.
+
+Arguments:
+    path -- the database file, created if missing
+"""
+
+
+class SnapshotStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(_schema)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    """
+    Add a snapshot of a server.  Entities that did not change since the last
+    snapshot of the same guild get no new rows.
+
+    Return: the snapshot ID
+
+    Arguments:
+        server -- a discord server dict following the server schema
+        taken_at -- unix time of the snapshot. Defaults to now.
+    """
+
+    def add_snapshot(self, server: dict, taken_at=None) -> int:
+        taken_at = time.time() if taken_at is None else taken_at
+        guild_id = str(server["id"])
+        rows = flatten_server(server)
+
+        with self._lock, self._db:
+            previous = self._db.execute(
+                "SELECT id, taken_at FROM snapshots WHERE guild_id = ? ORDER BY taken_at DESC, id DESC LIMIT 1",
+                (guild_id,),
+            ).fetchone()
+            if previous is not None and previous[1] > taken_at:
+                raise ValueError(
+                    f"Snapshots of guild {guild_id} must be added oldest first"
+                )
+
+            current = {
+                (kind, entity_id): (version_id, parent, ordinal, blob)
+                for version_id, kind, entity_id, parent, ordinal, blob in self._db.execute(
+                    "SELECT id, kind, entity_id, parent, ordinal, blob FROM versions WHERE guild_id = ? AND valid_to IS NULL",
+                    (guild_id,),
+                )
+            }
+
+            cur = self._db.execute(
+                "INSERT INTO snapshots (guild_id, taken_at, entities, changed) VALUES (?, ?, ?, 0)",
+                (guild_id, taken_at, len(rows)),
+            )
+            snapshot_id = cur.lastrowid
+
+            # Entities keep their ordinal if they are in the same list and
+            # order as before
+            lists = {}
+            for idx, (kind, entity_id, parent, _, _) in enumerate(rows):
+                lists.setdefault((kind, parent), []).append(idx)
+            ordinals = [None] * len(rows)
+            for (kind, parent), indices in lists.items():
+                old = []
+                for idx in indices:
+                    version = current.get((kind, rows[idx][1]))
+                    same_list = version is not None and version[1] == parent
+                    old.append(version[2] if same_list else None)
+                for idx, ordinal in zip(indices, assign_ordinals(old)):
+                    ordinals[idx] = ordinal
+
+            blobs = {}
+            inserts = []
+            closed = []
+            for (kind, entity_id, parent, _, value), ordinal in zip(rows, ordinals):
+                data = _encode(value)
+                blob = hashlib.sha1(data.encode()).hexdigest()
+                blobs[blob] = data
+
+                old = current.pop((kind, entity_id), None)
+                if old is not None and old[1:] == (parent, ordinal, blob):
+                    continue
+                if old is not None:
+                    closed.append(old[0])
+                inserts.append(
+                    (guild_id, kind, entity_id, parent, ordinal, blob, snapshot_id)
+                )
+            # Whatever is left was deleted
+            closed.extend(version_id for version_id, *_ in current.values())
+
+            self._db.executemany(
+                "INSERT OR IGNORE INTO blobs (hash, data) VALUES (?, ?)", blobs.items()
+            )
+            if previous is not None:
+                self._db.executemany(
+                    "UPDATE versions SET valid_to = ? WHERE id = ?",
+                    ((previous[0], version_id) for version_id in closed),
+                )
+            self._db.executemany(
+                "INSERT INTO versions (guild_id, kind, entity_id, parent, ordinal, blob, valid_from) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                inserts,
+            )
+            self._db.execute(
+                "UPDATE snapshots SET changed = ? WHERE id = ?",
+                (len(inserts) + len(closed), snapshot_id),
+            )
+
+        logging.info(
+            f"Stored snapshot {snapshot_id} of server '{server['name']}': {len(inserts)} new and {len(closed)} superseded entity versions"
+        )
+        return snapshot_id
+
+    """
+    Add a server export file, e.g. from dumpall.py or a snapshot folder.  A
+    file holding a list of servers adds a snapshot for each.
+
+    Return: list of snapshot IDs
+
+    Arguments:
+        path -- the JSON file
+        taken_at -- unix time of the snapshot. Defaults to the file's mtime.
+    """
+
+    def add_file(self, path: str, taken_at=None) -> list:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if taken_at is None:
+            taken_at = os.path.getmtime(path)
+        servers = data if isinstance(data, list) else [data]
+        return [self.add_snapshot(server, taken_at) for server in servers]
+
+    """
+    Return: list of (snapshot ID, taken at) of a guild, oldest first
+    """
+
+    def snapshots(self, guild_id) -> list:
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, taken_at FROM snapshots WHERE guild_id = ? ORDER BY taken_at, id",
+                (str(guild_id),),
+            ).fetchall()
+
+    """
+    Return: the ID of the newest snapshot of a guild taken at or before a unix
+    time, None if there is none
+    """
+
+    def snapshot_at(self, guild_id, when: float):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM snapshots WHERE guild_id = ? AND taken_at <= ? ORDER BY taken_at DESC, id DESC LIMIT 1",
+                (str(guild_id), when),
+            ).fetchone()
+        return row[0] if row else None
+
+    """
+    Rebuild the server dict of a snapshot.
+
+    Return: a server dict following the server schema
+
+    Exceptions:
+        KeyError if there is no such snapshot
+    """
+
+    def load_snapshot(self, snapshot_id: int) -> dict:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT guild_id FROM snapshots WHERE id = ?", (snapshot_id,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(snapshot_id)
+            rows = self._db.execute(
+                """
+                SELECT v.kind, v.entity_id, v.parent, v.ordinal, b.data
+                FROM versions v JOIN blobs b ON b.hash = v.blob
+                WHERE v.guild_id = ? AND v.valid_from <= ?
+                    AND (v.valid_to IS NULL OR v.valid_to >= ?)
+                """,
+                (row[0], snapshot_id, snapshot_id),
+            ).fetchall()
+        return assemble_server(
+            (kind, entity_id, parent, ordinal, json.loads(data))
+            for kind, entity_id, parent, ordinal, data in rows
+        )
+
+    """
+    Return the values an entity had over time, e.g. to find when a role's
+    permissions changed.
+
+    Return: list of dicts with "snapshot_id" and "taken_at" of the first
+        snapshot with a new value, and "value", None if the entity was gone
+
+    Arguments:
+        guild_id -- the guild ID
+        kind -- an entity kind, e.g. ds_store.ROLE
+        entity_id -- the entity's ID, as in the export
+    """
+
+    def entity_history(self, guild_id, kind: str, entity_id) -> list:
+        guild_id = str(guild_id)
+        with self._lock:
+            rows = self._db.execute(
+                """
+                SELECT v.valid_from, v.valid_to, b.data
+                FROM versions v JOIN blobs b ON b.hash = v.blob
+                WHERE v.guild_id = ? AND v.kind = ? AND v.entity_id = ?
+                ORDER BY v.valid_from
+                """,
+                (guild_id, kind, str(entity_id)),
+            ).fetchall()
+        snapshots = self.snapshots(guild_id)
+        position = {snapshot_id: idx for idx, (snapshot_id, _) in enumerate(snapshots)}
+        taken_at = dict(snapshots)
+
+        history = []
+        for idx, (valid_from, valid_to, data) in enumerate(rows):
+            value = json.loads(data)
+            # Moving within a list makes a new version with the same value
+            if not history or history[-1]["value"] != value:
+                history.append(
+                    {
+                        "snapshot_id": valid_from,
+                        "taken_at": taken_at[valid_from],
+                        "value": value,
+                    }
+                )
+            if valid_to is None:
+                continue
+            # Gone in the snapshot after `valid_to`, unless a new version
+            # starts there
+            after = position[valid_to] + 1
+            next_from = rows[idx + 1][0] if idx + 1 < len(rows) else None
+            if after < len(snapshots) and snapshots[after][0] != next_from:
+                gone_id, gone_at = snapshots[after]
+                history.append(
+                    {"snapshot_id": gone_id, "taken_at": gone_at, "value": None}
+                )
+        return history
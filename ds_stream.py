@@ -0,0 +1,148 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+
+from ds_validation import server_sections
+
+# Events yielded by `iter_server_events`
+FIELD = "field"
+SECTION_START = "section_start"
+ITEM = "item"
+SECTION_END = "section_end"
+
+_decoder = json.JSONDecoder()
+_whitespace = " \t\n\r"
+
+
+"""
+A read buffer over a text file that decodes one JSON value at a time,
+reading more of the file only when a value is not complete yet.
+"""
+
+
+class _JSONBuffer:
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop what was already consumed so the buffer stays small
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON file")
+
+    def expect(self, chars: str) -> str:
+        ch = self.peek()
+        if ch not in chars:
+            raise ValueError(f"Expected one of {chars!r} but found {ch!r}")
+        self.pos += 1
+        return ch
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number at the very end of the buffer might continue in the
+            # next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+"""
+Parse a server export incrementally.  Only the value currently being read is
+kept in memory, so this works for exports of any size.
+
+Yields one of:
+    (FIELD, key, value) for a scalar field of the server
+    (SECTION_START, section, None) when an array section (roles, members...) starts
+    (ITEM, section, item) for every element of an array section
+    (SECTION_END, section, amount of items) when an array section ends
+
+Arguments:
+    f -- a text file object positioned at the start of a server dict
+    chunk_size -- amount of characters read from the file at a time
+"""
+
+
+def iter_server_events(f, chunk_size=1 << 16):
+    buf = _JSONBuffer(f, chunk_size)
+    buf.expect("{")
+    if buf.peek() == "}":
+        buf.pos += 1
+        return
+
+    while True:
+        key = buf.decode()
+        buf.expect(":")
+
+        if key in server_sections and buf.peek() == "[":
+            buf.pos += 1
+            yield SECTION_START, key, None
+            count = 0
+            if buf.peek() == "]":
+                buf.pos += 1
+            else:
+                while True:
+                    yield ITEM, key, buf.decode()
+                    count += 1
+                    if buf.expect(",]") == "]":
+                        break
+            yield SECTION_END, key, count
+        else:
+            yield FIELD, key, buf.decode()
+
+        if buf.expect(",}") == "}":
+            return
+
+
+"""
+Same as `iter_server_events`, but opens the export at `path`.
+"""
+
+
+def iter_server_file(path: str, chunk_size=1 << 16):
+    logging.info(f"Streaming server export '{path}'")
+    with open(path, encoding="utf-8") as f:
+        yield from iter_server_events(f, chunk_size)
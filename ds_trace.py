@@ -0,0 +1,204 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Timeline tracing of exports and imports in the Chrome trace event format,
+# which chrome://tracing and https://ui.perfetto.dev open offline.
+#
+#   tracer = Tracer()
+#   with tracer.active(), tracer.trace_client(bot):
+#       await dsi.create_server(bot, server)
+#   tracer.write_json("trace.json")
+#
+# Spans of sync code are put on a lane per thread and spans of async code on
+# a lane per asyncio task, so overlapping requests show up side by side.
+
+import os
+import json
+import time
+import asyncio
+import logging
+import functools
+import contextlib
+import contextvars
+import threading
+
+_current = contextvars.ContextVar("ds_trace_current", default=None)
+
+
+"""
+Collects spans while active.
+"""
+
+
+class Tracer:
+    def __init__(self):
+        self.events = []
+        self.pid = os.getpid()
+        self._start = time.perf_counter_ns()
+        self._lanes = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def active(self):
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    """
+    Record every REST request of a discord.py client as a span.  The original
+    request method is restored on exit.
+    """
+
+    @contextlib.contextmanager
+    def trace_client(self, bot):
+        original = bot.http.request
+
+        async def request(route, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return await original(route, **kwargs)
+            finally:
+                self.add(
+                    f"{route.method} {route.path}",
+                    "http",
+                    start,
+                    time.perf_counter_ns(),
+                    {"url": route.url},
+                )
+
+        bot.http.request = request
+        try:
+            yield
+        finally:
+            bot.http.request = original
+
+    def _lane(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = (
+            ("task", id(task))
+            if task is not None
+            else ("thread", threading.get_ident())
+        )
+
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = len(self._lanes) + 1
+                self._lanes[key] = lane
+                if task is not None:
+                    label = f"task {task.get_name()}"
+                else:
+                    label = f"thread {threading.current_thread().name}"
+                self.events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": self.pid,
+                        "tid": lane,
+                        "args": {"name": label},
+                    }
+                )
+        return lane
+
+    """
+    Record a finished span.
+
+    Arguments:
+        name -- what the span shows as
+        cat -- a category to filter spans by, e.g. "http"
+        start -- time.perf_counter_ns() at the start of the span
+        end -- time.perf_counter_ns() at the end of the span
+        args -- optional dict shown with the span
+    """
+
+    def add(self, name: str, cat: str, start: int, end: int, args=None):
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": (start - self._start) / 1000,
+            "dur": (end - start) / 1000,
+            "pid": self.pid,
+            "tid": self._lane(),
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def write_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        logging.info(f"Wrote {len(self.events)} trace events to '{path}'")
+
+
+"""
+Context manager recording a span on the active tracer, if any.
+
+Arguments:
+    name -- what the span shows as
+    cat -- a category to filter spans by, e.g. "io"
+    args -- shown with the span
+"""
+
+
+@contextlib.contextmanager
+def span(name: str, cat="", **args):
+    tracer = _current.get()
+    if tracer is None:
+        yield
+        return
+
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        tracer.add(name, cat, start, time.perf_counter_ns(), args)
+
+
+"""
+Decorator recording every call of a sync function as a span on the active
+tracer, if any.
+
+Arguments:
+    cat -- the category of the spans
+"""
+
+
+def traced(cat: str):
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _current.get()
+            if tracer is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                tracer.add(name, cat, start, time.perf_counter_ns())
+
+        return wrapper
+
+    return decorator
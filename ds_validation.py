@@ -0,0 +1,272 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import time
+import pathlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import jsonschema
+
+from ds_model import as_dict
+from ds_codegen import compile_validator, UnsupportedSchema
+
+# The schemas folder next to this file, so validation does not depend on the
+# current working directory.
+schema_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schemas")
+
+# Array sections of a server dict that are validated on their own
+server_sections = ("roles", "categories", "emojis", "members")
+
+
+"""
+Loads every schema in a folder once and keeps a compiled validator for each.
+The meta-schema check is done once at load time instead of on every validation.
+
+Validation goes through validators generated from the schemas (see
+ds_codegen.py).  A schema the generator does not handle, or a registry made
+with `generated=False`, is validated by jsonschema instead.
+
+Arguments:
+    directory -- the folder holding the `*.json` schemas
+    generated -- whether to use generated validators
+"""
+
+
+class SchemaRegistry:
+    def __init__(self, directory=schema_dir, generated=True):
+        self.directory = directory
+        self.generated = generated
+        self.base_uri = pathlib.Path(directory).absolute().as_uri() + "/"
+        self.schemas = {}
+
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith(".json"):
+                continue
+            with open(os.path.join(directory, filename)) as f:
+                self.schemas[filename[: -len(".json")]] = json.load(f)
+
+        # Every schema is put in the resolver store so $refs never hit the disk
+        self._store = {
+            self.base_uri + name + ".json": schema
+            for name, schema in self.schemas.items()
+        }
+        self._validators = {}
+        # Same keys as _validators; None where jsonschema has to be used
+        self._generated = {}
+        logging.info(f"Loaded {len(self.schemas)} schemas from '{directory}'")
+
+    """
+    Return a compiled validator for a schema dict, which may be a sub-schema of
+    one of the loaded schemas.
+
+    Arguments:
+        schema -- the schema dict
+        name -- the schema it belongs to, used for resolving relative $refs
+    """
+
+    def compile(self, schema: dict, name: str):
+        cls = jsonschema.validators.validator_for(schema)
+        cls.check_schema(schema)
+        resolver = jsonschema.RefResolver(
+            self.base_uri + name + ".json", schema, store=self._store
+        )
+        return cls(schema, resolver=resolver)
+
+    """
+    Return the compiled validator for a loaded schema, e.g. "role_schema".
+    """
+
+    def validator(self, name: str):
+        if name not in self._validators:
+            self._validators[name] = self.compile(self.schemas[name], name)
+        return self._validators[name]
+
+    """
+    Return the generated validator for a (sub-)schema, None if it has to be
+    validated by jsonschema.  Generated validators raise the first error found.
+
+    Arguments:
+        key -- the key of the schema in `_validators`
+        name -- the schema it is in
+        pointer -- JSON pointer to it, "" for the whole schema
+    """
+
+    def generated_validator(self, key: str, name: str, pointer=""):
+        if not self.generated:
+            return None
+        if key not in self._generated:
+            # Compiling the jsonschema validator checks the schema itself
+            if "#" in key:
+                self.section_validator(key.partition("#")[2])
+            else:
+                self.validator(key)
+            try:
+                self._generated[key] = compile_validator(self.schemas, name, pointer)
+            except UnsupportedSchema as e:
+                logging.warning(f"Validating {key} with jsonschema: {e}")
+                self._generated[key] = None
+        return self._generated[key]
+
+    """
+    Validate an instance against a loaded schema.  Records of ds_model are
+    validated as the dicts they serialize to.
+
+    Exceptions:
+        jsonschema.ValidationError if the instance is invalid.
+    """
+
+    def validate(self, instance, name: str):
+        check = self.generated_validator(name, name)
+        if check is not None:
+            check(as_dict(instance))
+            return
+        error = jsonschema.exceptions.best_match(
+            self.validator(name).iter_errors(as_dict(instance))
+        )
+        if error is not None:
+            raise error
+
+    """
+    Return the compiled validator for the items of an array section of the
+    server schema, e.g. "members".
+    """
+
+    def section_validator(self, section: str):
+        key = f"server_schema#{section}"
+        if key not in self._validators:
+            items = self.schemas["server_schema"]["properties"][section]["items"]
+            self._validators[key] = self.compile(items, "server_schema")
+        return self._validators[key]
+
+    """
+    Validate a list of items of one server section.
+
+    Exceptions:
+        jsonschema.ValidationError if any item is invalid.
+    """
+
+    def validate_section_items(self, section: str, items: list, offset=0):
+        check = self.generated_validator(
+            f"server_schema#{section}", "server_schema", f"/properties/{section}/items"
+        )
+        if check is not None:
+            for idx, item in enumerate(items):
+                try:
+                    check(as_dict(item))
+                except jsonschema.ValidationError as error:
+                    error.path.appendleft(offset + idx)
+                    error.path.appendleft(section)
+                    raise
+            return
+
+        validator = self.section_validator(section)
+        for idx, item in enumerate(items):
+            error = jsonschema.exceptions.best_match(
+                validator.iter_errors(as_dict(item))
+            )
+            if error is not None:
+                error.path.appendleft(offset + idx)
+                error.path.appendleft(section)
+                raise error
+
+    """
+    Validate a server dict or ds_model.Server section by section.  The header (everything but the
+    array sections) is checked against the server schema, then each section is
+    checked item by item.  Members are checked in chunks of `chunk_size`,
+    spread over `workers` processes when `workers` is more than 1.
+
+    Return: dict of section name to seconds spent validating it
+
+    Arguments:
+        server -- a discord server dict following the server schema
+        chunk_size -- amount of members validated per chunk
+        workers -- processes to validate member chunks with, 0 or 1 for serial
+
+    Exceptions:
+        jsonschema.ValidationError if the server dict is invalid.
+    """
+
+    def validate_server(self, server: dict, chunk_size=10000, workers=0) -> dict:
+        timings = {}
+        server = as_dict(server)
+
+        start = time.perf_counter()
+        header = {k: v for k, v in server.items() if k not in server_sections}
+        self.validate(header, "server_schema")
+        # The array sections still have to be arrays
+        for section in server_sections:
+            if section in server and not isinstance(server[section], list):
+                raise jsonschema.ValidationError(
+                    f"{server[section]!r} is not of type 'array'", path=[section]
+                )
+        timings["header"] = time.perf_counter() - start
+
+        for section in server_sections:
+            items = server.get(section)
+            if items is None:
+                continue
+
+            start = time.perf_counter()
+            chunks = [
+                (offset, items[offset : offset + chunk_size])
+                for offset in range(0, len(items), chunk_size)
+            ]
+            if workers and workers > 1 and len(chunks) > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    futures = [
+                        pool.submit(
+                            _validate_chunk, self.directory, section, chunk, offset
+                        )
+                        for offset, chunk in chunks
+                    ]
+                    for future in futures:
+                        future.result()
+            else:
+                for offset, chunk in chunks:
+                    self.validate_section_items(section, chunk, offset)
+            timings[section] = time.perf_counter() - start
+
+        for section, seconds in timings.items():
+            logging.info(f"Validated {section} in {seconds * 1000:.1f}ms")
+
+        return timings
+
+
+_registries = {}
+
+
+"""
+Return the registry for a schema folder, creating it on first use.
+
+Arguments:
+    directory -- the folder holding the schemas. Defaults to the package schemas.
+"""
+
+
+def get_registry(directory=schema_dir) -> SchemaRegistry:
+    if directory not in _registries:
+        _registries[directory] = SchemaRegistry(directory)
+    return _registries[directory]
+
+
+# Runs in a worker process; each worker compiles its own registry once.
+def _validate_chunk(directory: str, section: str, items: list, offset: int):
+    get_registry(directory).validate_section_items(section, items, offset)
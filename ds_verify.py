@@ -0,0 +1,264 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Lesser General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Verification of finished exports, folders or archives.
+#
+# Every `schemas/<guild id>.json` is validated against the server schema, and
+# the icon and emojis it references have to be in the export.  Every file in
+# the export's checksum file (see ds_archive.py) has to be there with the same
+# SHA-256.  Schemas are validated one per task and files hashed in batches,
+# spread over worker processes; each worker loads the schema registry once
+# (`get_registry`) and opens an archive once, and keeps both for the tasks
+# that follow.
+#
+# Icons are only looked for in exports that have an `icons/` folder, and
+# emojis only in exports with an `emojis/` folder, since both are optional
+# when exporting.
+
+import os
+import json
+import logging
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import jsonschema
+
+from ds_archive import ArchiveReader, is_archive, checksums_file, parse_checksums
+from ds_validation import get_registry, schema_dir
+
+"""
+Something wrong with an export.
+
+    kind -- "invalid" for a schema that is no valid server, "missing" for a
+            file that is referenced or listed but not there, "corrupt" for a
+            file that differs from its checksum or is empty
+    path -- path of the file relative to the export
+    detail -- what is wrong with it
+"""
+Problem = namedtuple("Problem", "kind path detail")
+
+# export path -> ArchiveReader, or None for a folder; per process
+_readers = {}
+
+
+def _reader(export: str):
+    if export not in _readers:
+        _readers[export] = ArchiveReader(export) if is_archive(export) else None
+    return _readers[export]
+
+
+"""
+Return: the bytes of a file of an export, None if it is not there
+
+Arguments:
+    export -- an export folder or archive
+    name -- path of the file relative to the export
+"""
+
+
+def read_export_file(export: str, name: str):
+    archive = _reader(export)
+    if archive is not None:
+        try:
+            return archive.read(name)
+        except KeyError:
+            return None
+    try:
+        with open(os.path.join(export, name), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _listdir(export: str, folder: str) -> list:
+    archive = _reader(export)
+    if archive is not None:
+        return sorted(archive.listdir(folder))
+    path = os.path.join(export, folder)
+    if not os.path.isdir(path):
+        return []
+    return sorted(entry.name for entry in os.scandir(path) if entry.is_file())
+
+
+def _has_folder(export: str, folder: str) -> bool:
+    archive = _reader(export)
+    if archive is not None:
+        return archive.has_folder(folder)
+    return os.path.isdir(os.path.join(export, folder))
+
+
+"""
+Return: path of the emoji file of an emoji dict, as the exporter names it
+"""
+
+
+def emoji_file(guild_id: str, emoji: dict) -> str:
+    ext = emoji["url"].split(".")[-1].split("?")[0]
+    return f"emojis/{guild_id}/{emoji['name']}.{ext}"
+
+
+"""
+Validate one schema file of an export.  Runs in a worker process.
+
+Return: (problems, guild ID, emoji files, whether the server has an icon);
+    the guild ID is None if the file is no server
+"""
+
+
+def _check_schema(export: str, name: str, directory: str):
+    data = read_export_file(export, name)
+    if data is None:
+        return [Problem("missing", name, "schema file is gone")], None, [], False
+    try:
+        server = json.loads(data)
+    except ValueError as e:
+        return [Problem("invalid", name, f"not JSON: {e}")], None, [], False
+
+    try:
+        get_registry(directory).validate_server(server)
+    except jsonschema.ValidationError as e:
+        where = "/".join(str(part) for part in e.path)
+        return [Problem("invalid", name, f"{e.message} at '{where}'")], None, [], False
+
+    guild_id = server.get("id") or os.path.splitext(os.path.basename(name))[0]
+    emojis = [emoji_file(guild_id, emoji) for emoji in server.get("emojis", [])]
+    return [], guild_id, emojis, bool(server.get("icon_url"))
+
+
+"""
+Hash files of an export.  Runs in a worker process.
+
+Return: list of (path, hex SHA-256, size), with None for both if the file is
+    not there
+"""
+
+
+def _hash_files(export: str, names: list) -> list:
+    res = []
+    for name in names:
+        data = read_export_file(export, name)
+        if data is None:
+            res.append((name, None, None))
+        else:
+            res.append((name, hashlib.sha256(data).hexdigest(), len(data)))
+    return res
+
+
+"""
+Verify one export.
+
+Return: list of Problems, sorted by path; empty if the export is intact
+
+Arguments:
+    export -- an export folder or archive
+    workers -- processes to validate and hash with, 0 or 1 for serial
+    batch_size -- amount of files hashed per task
+    directory -- the folder holding the schemas
+"""
+
+
+def verify_export(export: str, workers=0, batch_size=64, directory=schema_dir) -> list:
+    problems = []
+    checksums = {}
+    data = read_export_file(export, checksums_file)
+    if data is None:
+        logging.warning(
+            f"Export '{export}' has no {checksums_file}, only checking references"
+        )
+    else:
+        checksums = parse_checksums(data.decode("utf-8"))
+
+    schemas = [
+        f"schemas/{name}"
+        for name in _listdir(export, "schemas")
+        if name.endswith(".json")
+    ]
+    check_icons = _has_folder(export, "icons")
+    check_emojis = _has_folder(export, "emojis")
+    icons = {
+        os.path.splitext(name)[0]: f"icons/{name}" for name in _listdir(export, "icons")
+    }
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+    try:
+        if pool is None:
+            results = [_check_schema(export, name, directory) for name in schemas]
+        else:
+            futures = [
+                pool.submit(_check_schema, export, name, directory) for name in schemas
+            ]
+            results = [future.result() for future in futures]
+
+        referenced = set()
+        for (schema_problems, guild_id, emojis, has_icon), name in zip(
+            results, schemas
+        ):
+            problems.extend(schema_problems)
+            if guild_id is None:
+                continue
+            if check_emojis:
+                referenced.update(emojis)
+            if check_icons and has_icon:
+                if guild_id in icons:
+                    referenced.add(icons[guild_id])
+                else:
+                    problems.append(
+                        Problem("missing", f"icons/{guild_id}", f"icon of '{name}'")
+                    )
+
+        names = sorted(referenced | set(checksums))
+        batches = [
+            names[idx : idx + batch_size] for idx in range(0, len(names), batch_size)
+        ]
+        if pool is None:
+            hashed = [_hash_files(export, batch) for batch in batches]
+        else:
+            futures = [pool.submit(_hash_files, export, batch) for batch in batches]
+            hashed = [future.result() for future in futures]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        # The export may change before it is verified again
+        archive = _readers.pop(export, None)
+        if archive is not None:
+            archive.close()
+
+    for batch in hashed:
+        for name, digest, size in batch:
+            if digest is None:
+                detail = (
+                    "referenced by a schema"
+                    if name in referenced
+                    else f"listed in {checksums_file}"
+                )
+                problems.append(Problem("missing", name, detail))
+            elif name in checksums and digest != checksums[name]:
+                problems.append(
+                    Problem(
+                        "corrupt", name, f"SHA-256 {digest}, expected {checksums[name]}"
+                    )
+                )
+            elif size == 0:
+                problems.append(Problem("corrupt", name, "empty file"))
+
+    problems.sort(key=lambda problem: problem.path)
+    logging.info(
+        f"Verified {len(schemas)} schemas and {len(names)} files of '{export}', {len(problems)} problems"
+    )
+    return problems
@@ -39,11 +39,19 @@ import re
 import json
 import time
 import logging
+import contextlib
+import functools
 
 import discord
 from discord.ext import commands
 
 import discord_server_exporter as dse
+from ds_profile import Profiler
+from ds_container import write_container
+from ds_archive import ExportArchive
+from ds_trace import Tracer, span
+from ds_common_funcs import run_in_executor
+import ds_metrics
 
 intents = discord.Intents.all()
 bot = discord.Client(intents=intents)
@@ -54,30 +62,80 @@ LOG_FILE_MODE = "w"
 LOG_FORMAT = "[%(levelname)s] %(asctime)s %(name)s: %(message)s"
 LOG_DATE_FORMAT = "[%Y/%m/%d %H:%M:%S]"
 
+# Set to a file name, e.g. "export_profile.json", to write a per-stage
+# timing and memory report there at the end of the run
+PROFILE_REPORT = None
+# Set to a file name, e.g. "export_trace.json", to write a Chrome trace of the
+# run there, which chrome://tracing or ui.perfetto.dev can open
+TRACE_FILE = None
+# Set to True to write the icons, emojis and schemas to one file,
+# exported_<timestamp>.zip, instead of a folder.  discord_server_importer.py
+# reads it as an import folder without extracting it.
+EXPORT_ARCHIVE = False
+# Set to True to also write every server to my_servers/<bot user id>.dsx, a
+# container that can be read one section at a time (see ds_container.py)
+EXPORT_CONTAINER = False
+# Set to a port, e.g. 9464, to serve Prometheus metrics on
+# http://127.0.0.1:<port>/metrics while the bot runs
+METRICS_PORT = None
+
 guildid = None
+metrics_runner = None
 # Events
 @bot.event
 async def on_ready():
     logging.info("Bot started")
 
+    # on_ready runs again after reconnects
+    global metrics_runner
+    if METRICS_PORT and metrics_runner is None:
+        metrics_runner = await ds_metrics.start_metrics_server(METRICS_PORT)
+
     if not os.path.exists("my_servers"):
         os.mkdir("my_servers")
 
     servers = []
     export_files_dir = f"exported_{int(time.time())}"
-    for gld in bot.guilds:
-        biswas = dse.dump_server(
-            gld, export_files_dir=export_files_dir
-        )  # Exporting members does not work due to intents      "
-        servers.append(biswas)
-        srv_name_clean = re.sub(
-            r"\W+", "", biswas["name"]
-        )  # To clean out any characters except alphanumeric and _
-        with open(f"my_servers/{srv_name_clean}.json", "w") as f:
-            f.write(json.dumps(biswas))
+    profiler = Profiler() if PROFILE_REPORT else None
+    tracer = Tracer() if TRACE_FILE else None
+    with contextlib.ExitStack() as stack:
+        if profiler:
+            stack.enter_context(profiler.active())
+        if tracer:
+            stack.enter_context(tracer.active())
+        if METRICS_PORT:
+            stack.enter_context(ds_metrics.instrument_client(bot))
+        if EXPORT_ARCHIVE:
+            export_files_dir = stack.enter_context(
+                ExportArchive(f"{export_files_dir}.zip")
+            )
+        for gld in bot.guilds:
+            # In an executor, so the loop keeps serving the metrics meanwhile
+            biswas = await run_in_executor(
+                functools.partial(
+                    dse.dump_server, gld, export_files_dir=export_files_dir
+                )
+            )  # Exporting members does not work due to intents      "
+            servers.append(biswas)
+            srv_name_clean = re.sub(
+                r"\W+", "", biswas["name"]
+            )  # To clean out any characters except alphanumeric and _
+            with span("write server", "io"), open(
+                f"my_servers/{srv_name_clean}.json", "w"
+            ) as f:
+                f.write(json.dumps(biswas))
+                ds_metrics.bytes_written.inc(f.tell(), kind="server")
+
+    if profiler:
+        profiler.write_json(PROFILE_REPORT)
+        logging.info(f"Export profile:\n{profiler.format_table()}")
+    if tracer:
+        tracer.write_json(TRACE_FILE)
 
     with open(f"my_servers/{bot.user.id}.json", "w") as f:
         f.write(json.dumps(servers))
+    if EXPORT_CONTAINER:
+        write_container(servers, f"my_servers/{bot.user.id}.dsx")
 
     logging.info("All OK")
 
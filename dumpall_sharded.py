@@ -0,0 +1,62 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# This file exports every server of a bot like dumpall.py, with one process per
+# range of shards instead of one process for everything.  See ds_shards.py.
+
+# Once ran, every server has a snapshot in SNAPSHOT_DIR/<server id>/<UTC
+# timestamp>/ and SNAPSHOT_DIR/index.json lists them all.
+
+# Token is to be supplied in token.txt on the first line.  Sharding is only
+# for bots.
+
+# Amount of shards; None asks Discord for the recommended amount
+SHARD_COUNT = None
+# Worker processes; None for one per CPU
+WORKERS = None
+SNAPSHOT_DIR = "snapshots"
+EXPORT_MEMBERS = True
+
+import logging
+
+from ds_shards import export_sharded
+
+LOG_LEVEL = logging.INFO
+LOG_FORMAT = "[%(levelname)s] %(asctime)s %(name)s: %(message)s"
+LOG_DATE_FORMAT = "[%Y/%m/%d %H:%M:%S]"
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+    with open("token.txt") as f:
+        tok = f.readline().strip()
+    index = export_sharded(
+        tok,
+        SNAPSHOT_DIR,
+        shard_count=SHARD_COUNT,
+        workers=WORKERS,
+        dump_kwargs={"export_members": EXPORT_MEMBERS},
+    )
+    for guild_id, failure in index["failed"].items():
+        logging.error(
+            f"Server '{failure['name']}' ({guild_id}) failed: {failure['error']}"
+        )
+    if index["missing_shards"]:
+        logging.error(f"Shards not exported: {index['missing_shards']}")
+    logging.info(f"Exported {len(index['guilds'])} servers")
@@ -0,0 +1,187 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# This file keeps snapshots of every server the account is in, exporting each
+# one on an interval and sooner after it changes.  Unlike dumpall.py it keeps
+# running.
+
+# Token is to be supplied in token.txt on the first line
+# Change below variables accordingly.
+IS_BOT_TOKEN = False
+
+# Snapshots are written to SNAPSHOT_DIR/<server id>/<UTC timestamp>/
+SNAPSHOT_DIR = "snapshots"
+# Seconds between snapshots of a server, moved by up to JITTER of it
+INTERVAL = 6 * 3600
+JITTER = 0.1
+# Seconds after a change to a server before it is snapshotted
+CHANGE_DELAY = 120
+# Servers exported at once
+MAX_CONCURRENT = 2
+# Snapshots kept per server
+KEEP_LAST = 12
+KEEP_DAILY = 14
+KEEP_WEEKLY = 8
+# Set to a path, e.g. "snapshots.db", to also record every snapshot in a
+# SQLite snapshot store (see ds_store.py)
+STORE_PATH = None
+# Set to a port, e.g. 9464, to serve Prometheus metrics on
+# http://127.0.0.1:<port>/metrics
+METRICS_PORT = None
+
+import os
+import asyncio
+import logging
+
+import discord
+
+import ds_metrics
+from ds_store import SnapshotStore
+from ds_scheduler import SnapshotScheduler, RetentionPolicy, write_snapshot
+
+intents = discord.Intents.all()
+bot = discord.Client(intents=intents)
+
+LOG_FILENAME = "snapshot_log.log"
+LOG_LEVEL = logging.INFO
+LOG_FILE_MODE = "a"
+LOG_FORMAT = "[%(levelname)s] %(asctime)s %(name)s: %(message)s"
+LOG_DATE_FORMAT = "[%Y/%m/%d %H:%M:%S]"
+
+store = SnapshotStore(STORE_PATH) if STORE_PATH else None
+
+
+def export(guild, snapshot_dir, dump_kwargs):
+    path = write_snapshot(guild, snapshot_dir, dump_kwargs)
+    if store is not None:
+        store.add_file(os.path.join(path, "server.json"))
+    return path
+
+
+scheduler = SnapshotScheduler(
+    bot,
+    snapshot_dir=SNAPSHOT_DIR,
+    interval=INTERVAL,
+    jitter=JITTER,
+    change_delay=CHANGE_DELAY,
+    max_concurrent=MAX_CONCURRENT,
+    retention=RetentionPolicy(KEEP_LAST, KEEP_DAILY, KEEP_WEEKLY),
+    # Exporting members does not work with user tokens
+    dump_kwargs={"export_members": IS_BOT_TOKEN},
+    export=export,
+)
+scheduler_task = None
+
+# Events
+@bot.event
+async def on_ready():
+    global scheduler_task
+    # on_ready runs again after reconnects
+    if scheduler_task is not None:
+        for guild in bot.guilds:
+            scheduler.add_guild(guild.id)
+        return
+
+    logging.info("Bot started")
+    if METRICS_PORT:
+        await ds_metrics.start_metrics_server(METRICS_PORT)
+    scheduler_task = asyncio.ensure_future(scheduler.run())
+
+
+@bot.event
+async def on_guild_join(guild):
+    scheduler.add_guild(guild.id)
+
+
+@bot.event
+async def on_guild_remove(guild):
+    scheduler.remove_guild(guild.id)
+
+
+# Anything that changes what an export contains makes the server due sooner
+@bot.event
+async def on_guild_update(before, after):
+    scheduler.mark_changed(after.id)
+
+
+@bot.event
+async def on_guild_channel_create(channel):
+    scheduler.mark_changed(channel.guild.id)
+
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    scheduler.mark_changed(channel.guild.id)
+
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    scheduler.mark_changed(after.guild.id)
+
+
+@bot.event
+async def on_guild_role_create(role):
+    scheduler.mark_changed(role.guild.id)
+
+
+@bot.event
+async def on_guild_role_delete(role):
+    scheduler.mark_changed(role.guild.id)
+
+
+@bot.event
+async def on_guild_role_update(before, after):
+    scheduler.mark_changed(after.guild.id)
+
+
+@bot.event
+async def on_guild_emojis_update(guild, before, after):
+    scheduler.mark_changed(guild.id)
+
+
+@bot.event
+async def on_member_join(member):
+    scheduler.mark_changed(member.guild.id)
+
+
+@bot.event
+async def on_member_remove(member):
+    scheduler.mark_changed(member.guild.id)
+
+
+@bot.event
+async def on_member_update(before, after):
+    # Presence and activity updates come through here too
+    if before.roles != after.roles or before.nick != after.nick:
+        scheduler.mark_changed(after.guild.id)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        format=LOG_FORMAT,
+        datefmt=LOG_DATE_FORMAT,
+        handlers=[
+            logging.FileHandler(LOG_FILENAME, LOG_FILE_MODE),
+            logging.StreamHandler(),
+        ],
+    )
+
+    with open("token.txt") as f:
+        tok = f.readline().strip()
+    bot.run(tok, bot=IS_BOT_TOKEN)
@@ -0,0 +1,177 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import zipfile
+
+import discord_server_exporter as dse
+import discord_server_importer as dsi
+import ds_fanout
+from ds_archive import (
+    ExportArchive,
+    ArchiveReader,
+    is_archive,
+    write_export_file,
+    parse_checksums,
+    checksums_file,
+)
+from ds_common_funcs import RateLimiter
+from ds_members import MemberArchive
+
+
+class _Guild:
+    def __init__(self):
+        self.id = 1
+        self.name = "archive import test"
+        self.emojis = []
+        self.premium_tier = 3
+        self.created = []
+
+    async def create_custom_emoji(self, name, image, reason=None):
+        self.created.append((name, image))
+
+
+def test_export_to_archive(gld, tmp_path):
+    logging.info("Exporting a server to a single archive file")
+    path = str(tmp_path / "export.zip")
+    with ExportArchive(path) as archive:
+        server = dse.dump_server(
+            gld,
+            export_emojis=True,
+            export_server_icon=False,
+            export_files_dir=archive,
+            export_members=True,
+            export_member_archive=True,
+        )
+        # Icons are written the same way as the rest
+        write_export_file(archive, f"icons/{gld.id}.png", b"icon")
+
+    assert is_archive(path)
+    assert not os.path.exists("exported")
+    with zipfile.ZipFile(path) as f:
+        names = set(f.namelist())
+        # The members are streamed into the schema file, not returned
+        data = f.read(f"schemas/{gld.id}.json")
+        schema = json.loads(data)
+        assert len(schema.pop("members")) == len(gld.members)
+        assert schema == server
+        digests = parse_checksums(f.read(checksums_file).decode())
+        assert digests[f"schemas/{gld.id}.json"] == hashlib.sha256(data).hexdigest()
+        assert f.getinfo(f"icons/{gld.id}.png").compress_type == zipfile.ZIP_STORED
+    assert {f"emojis/{gld.id}/{e.name}.png" for e in gld.emojis} <= names
+
+    with ArchiveReader(path) as reader:
+        assert len(reader.listdir(f"emojis/{gld.id}")) == len(gld.emojis)
+        assert reader.read(f"icons/{gld.id}.png") == b"icon"
+        # The member archive can be used once extracted
+        for name in reader.listdir(f"members/{gld.id}"):
+            target = tmp_path / "members" / name
+            target.parent.mkdir(exist_ok=True)
+            target.write_bytes(reader.read(f"members/{gld.id}/{name}"))
+    assert len(MemberArchive(str(tmp_path / "members"))) == len(gld.members)
+    logging.info("OK")
+
+
+def test_import_from_archive(gld, tmp_path):
+    logging.info("Importing icon and emojis straight from an archive")
+    path = str(tmp_path / "export.zip")
+    with ExportArchive(path) as archive:
+        server = dse.dump_server(
+            gld, export_emojis=True, export_server_icon=False, export_files_dir=archive
+        )
+        write_export_file(archive, f"icons/{gld.id}.png", b"icon")
+
+    assert dsi.get_server_icon_bytes(server, path) == b"icon"
+
+    with dsi.open_import_folder(path) as archive:
+        index = dsi.index_import_emojis(archive, gld.id)
+        assert set(index["by_name"]) == {e.name for e in gld.emojis}
+
+    guild = _Guild()
+    asyncio.run(
+        dsi.append_emojis(
+            guild,
+            server["emojis"][:3],
+            path,
+            append_prompt=False,
+            source_guild_id=gld.id,
+            rate_limiter=RateLimiter(1000, 1.0),
+        )
+    )
+    with zipfile.ZipFile(path) as f:
+        expected = [
+            (e["name"], f.read(f"emojis/{gld.id}/{e['name']}.png"))
+            for e in server["emojis"][:3]
+        ]
+    assert guild.created == expected
+    logging.info("OK")
+
+
+def test_import_closes_archive(gld, tmp_path, monkeypatch):
+    logging.info("Closing the archive after importing emojis from it")
+    path = str(tmp_path / "export.zip")
+    with ExportArchive(path) as archive:
+        server = dse.dump_server(
+            gld, export_emojis=True, export_server_icon=False, export_files_dir=archive
+        )
+
+    opened = []
+
+    class Reader(ArchiveReader):
+        def __init__(self, path):
+            super().__init__(path)
+            opened.append(self)
+
+    monkeypatch.setattr(dsi, "ArchiveReader", Reader)
+    for _ in range(2):
+        asyncio.run(
+            dsi.append_emojis(
+                _Guild(),
+                server["emojis"][:2],
+                path,
+                append_prompt=False,
+                source_guild_id=gld.id,
+                rate_limiter=RateLimiter(1000, 1.0),
+            )
+        )
+        asyncio.run(
+            dsi.write_emojis(
+                _Guild(),
+                server["emojis"][:2],
+                path,
+                overwrite_prompt=False,
+                source_guild_id=gld.id,
+                rate_limiter=RateLimiter(1000, 1.0),
+            )
+        )
+    assets = ds_fanout.prepare_shared_assets(server, path)
+    assert len(assets["emojis"]) == len(server["emojis"])
+
+    assert len(opened) == 5
+    assert all(reader._zip.fp is None for reader in opened)
+    try:
+        dsi.index_import_emojis(path, gld.id)
+    except ValueError:
+        pass
+    else:
+        assert False, "indexed an archive nothing would close"
+    logging.info("OK")
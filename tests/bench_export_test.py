@@ -0,0 +1,71 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+
+import bench_export
+
+
+def test_measure_small_tier():
+    logging.info("Measuring every export benchmark on the small tier")
+    for name in bench_export.benchmarks:
+        res = bench_export.measure("small", name, repeat=1)
+        assert res["seconds"] > 0
+        assert res["rss_peak_kb"] > 0
+        assert res["alloc_peak_bytes"] > 0
+    logging.info("OK")
+
+
+def test_dump_server_member_peak():
+    logging.info("Measuring what members add to the memory peak of dump_server")
+    with_members = bench_export.measure("medium", "dump_server", repeat=1)
+    without = bench_export.measure("medium", "dump_server_no_members", repeat=1)
+    records = bench_export.measure("medium", "dump_members", repeat=1)
+    added = with_members["alloc_peak_bytes"] - without["alloc_peak_bytes"]
+    logging.info(
+        f"Members add {added} bytes, their records take {records['alloc_peak_bytes']}"
+    )
+    # Members are written as they are converted, never all held at once
+    assert added < records["alloc_peak_bytes"] / 4
+    logging.info("OK")
+
+
+def test_compare_results_flags_regressions():
+    logging.info("Comparing benchmark results against a baseline")
+    baseline = {
+        "small": {
+            "dump_members": {"seconds": 0.1, "alloc_peak_bytes": 1000},
+            "dump_categories": {"seconds": 0.001, "alloc_peak_bytes": 1000},
+        }
+    }
+    results = {
+        "small": {
+            "dump_members": {"seconds": 0.2, "alloc_peak_bytes": 1050},
+            # Slower, but too fast to tell from noise
+            "dump_categories": {"seconds": 0.002, "alloc_peak_bytes": 1000},
+            # Not in the baseline
+            "dump_server": {"seconds": 5.0, "alloc_peak_bytes": 1},
+        }
+    }
+
+    regressions = bench_export.compare_results(results, baseline)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("small/dump_members: seconds")
+
+    assert bench_export.compare_results(results, baseline, {"seconds": 3.0}) == []
+    logging.info("OK")
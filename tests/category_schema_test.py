@@ -16,30 +16,23 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os
-import json
-import jsonschema
 import logging
 
 import discord
 import discord_server_exporter as dse
+from ds_fixtures import generate_guild
+from ds_validation import get_registry
 
 
 def test_category_schema_validation(gld: discord.Guild):
     logging.info("Running categories schema validation test")
 
-    category_schema_path = "schemas/category_schema.json"
-    with open(category_schema_path) as f:
-        category_schema = json.load(f)
-
-    resolver = jsonschema.RefResolver(
-        "file:///" + os.getcwd() + "/schemas/", category_schema
-    )
+    registry = get_registry()
 
     biswas = dse.dump_categories(gld)
 
     for category in biswas:
-        jsonschema.validate(category, category_schema, resolver=resolver)
+        registry.validate(category, "category_schema")
 
     logging.info("OK")
     logging.info("Validate categories foregoing role permissions export")
@@ -47,7 +40,7 @@ def test_category_schema_validation(gld: discord.Guild):
     biswas = dse.dump_categories(gld, False, True)
 
     for category in biswas:
-        jsonschema.validate(category, category_schema, resolver=resolver)
+        registry.validate(category, "category_schema")
 
     logging.info("OK")
     logging.info("Validate categories foregoing user permissions export")
@@ -55,7 +48,7 @@ def test_category_schema_validation(gld: discord.Guild):
     biswas = dse.dump_categories(gld, True, False)
 
     for category in biswas:
-        jsonschema.validate(category, category_schema, resolver=resolver)
+        registry.validate(category, "category_schema")
 
     logging.info("OK")
     logging.info("Validate categories foregoing both permissions export")
@@ -63,6 +56,34 @@ def test_category_schema_validation(gld: discord.Guild):
     biswas = dse.dump_categories(gld, False, False)
 
     for category in biswas:
-        jsonschema.validate(category, category_schema, resolver=resolver)
+        registry.validate(category, "category_schema")
+
+    logging.info("OK")
+
+
+def test_uncategorized_channels():
+    logging.info("Dumping the channels that have no category")
+    guild = generate_guild(text_channels=14, voice_channels=7, uncategorized=7)
+    uncategorized = [
+        c
+        for c in guild.channels
+        if c.category is None and c.type != discord.ChannelType.category
+    ]
+    assert uncategorized
+
+    categories = dse.dump_categories(guild)
+    dummy = categories[0]
+    assert dummy["name"] == ""
+    dumped = {
+        channel["id"] for channel in dummy["text_channels"] + dummy["voice_channels"]
+    }
+    assert dumped == {str(channel.id) for channel in uncategorized}
+    assert len(categories) == len(guild.categories) + 1
+
+    logging.info("OK")
+    logging.info("Dumping a guild where every channel has a category")
+    guild = generate_guild(text_channels=14, voice_channels=7, uncategorized=0)
+    dummy = dse.dump_categories(guild)[0]
+    assert dummy["text_channels"] == [] and dummy["voice_channels"] == []
 
     logging.info("OK")
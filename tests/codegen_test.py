@@ -0,0 +1,197 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import copy
+import json
+import shutil
+import time
+import logging
+
+import jsonschema
+
+import discord_server_exporter as dse
+import ds_model
+from ds_model import Record, Server
+from ds_validation import SchemaRegistry, schema_dir, server_sections
+
+# Record class -> (schema, JSON pointer to its object schema)
+record_schemas = {
+    ds_model.RoleOverride: (
+        "permission_override_schemas",
+        "/role_permission_override_schema",
+    ),
+    ds_model.UserOverride: (
+        "permission_override_schemas",
+        "/user_permission_override_schema",
+    ),
+    ds_model.TextChannel: ("text_channel_schema", ""),
+    ds_model.VoiceChannel: ("voice_channel_schema", ""),
+    ds_model.Category: ("category_schema", ""),
+    ds_model.Role: ("role_schema", ""),
+    ds_model.Emoji: ("emoji_schema", ""),
+    ds_model.Member: ("member_schema", ""),
+    ds_model.Server: ("server_schema", ""),
+}
+
+
+def dump(gld):
+    # Members are only exported to the schema file
+    dse.dump_server(
+        gld, export_emojis=False, export_server_icon=False, export_members=True
+    )
+    with open(f"exported/schemas/{gld.id}.json") as f:
+        return json.load(f)
+
+
+def outcome(registry, instance, name):
+    try:
+        registry.validate(instance, name)
+    except jsonschema.ValidationError as e:
+        return e.message, list(e.path)
+    return None
+
+
+def test_generated_matches_jsonschema(gld):
+    logging.info("Comparing generated validators with jsonschema")
+    generated = SchemaRegistry(generated=True)
+    interpreted = SchemaRegistry(generated=False)
+    server = dump(gld)
+    role = server["roles"][1]
+    member = server["members"][0]
+    channel = server["categories"][1]["text_channels"][0]
+
+    def changed(value, **fields):
+        res = copy.deepcopy(value)
+        for key, new in fields.items():
+            if new is None:
+                res.pop(key)
+            else:
+                res[key] = new
+        return res
+
+    cases = [
+        ("role_schema", role),
+        ("role_schema", changed(role, color="red")),
+        ("role_schema", changed(role, color=-1)),
+        ("role_schema", changed(role, color=16777216)),
+        ("role_schema", changed(role, color=5.0)),
+        ("role_schema", changed(role, position=True)),
+        ("role_schema", changed(role, position=251)),
+        ("role_schema", changed(role, name=None)),
+        ("role_schema", "not a role"),
+        ("member_schema", member),
+        ("member_schema", changed(member, name="a")),
+        ("member_schema", changed(member, name="a" * 33)),
+        ("member_schema", changed(member, discrim="12345")),
+        ("member_schema", changed(member, roles=["1", 2])),
+        ("member_schema", changed(member, id=None)),
+        ("text_channel_schema", channel),
+        ("text_channel_schema", changed(channel, slowmode=-1)),
+        ("text_channel_schema", changed(channel, news=None)),
+        ("text_channel_schema", changed(channel, role_permission_overrides={})),
+        (
+            "server_schema",
+            {key: server[key] for key in server if key not in server_sections},
+        ),
+        ("server_schema", changed(server, inactive_timeout=10)),
+        ("server_schema", changed(server, voice_region=None)),
+        ("server_schema", changed(server, roles="roles")),
+        ("category_schema", changed(server["categories"][1], id="1")),
+    ]
+    for name, instance in cases:
+        expected = outcome(interpreted, instance, name)
+        assert outcome(generated, instance, name) == expected, (name, expected)
+    assert generated.validate_server(server) is not None
+    logging.info("OK")
+
+
+def test_section_item_paths(tmp_path):
+    logging.info("Checking the path of an error in a section item")
+    # The package schemas point section items at a properties object, which
+    # does not check anything; point members at the member schema instead
+    for filename in os.listdir(schema_dir):
+        shutil.copy(os.path.join(schema_dir, filename), tmp_path)
+    with open(tmp_path / "server_schema.json") as f:
+        schema = json.load(f)
+    schema["properties"]["members"]["items"] = {"$ref": "member_schema.json"}
+    with open(tmp_path / "server_schema.json", "w") as f:
+        json.dump(schema, f)
+
+    good = {"name": "name", "discrim": "0001", "id": "1"}
+    bad = {"name": 1, "discrim": "0001", "id": "2"}
+    for generated in (True, False):
+        registry = SchemaRegistry(str(tmp_path), generated=generated)
+        try:
+            registry.validate_section_items("members", [good, bad], 5)
+        except jsonschema.ValidationError as e:
+            assert list(e.path) == ["members", 6, "name"]
+            assert e.message == "1 is not of type 'string'"
+        else:
+            raise AssertionError("invalid member passed")
+    logging.info("OK")
+
+
+def test_generated_encoders(gld):
+    logging.info("Comparing generated encoders with the generic one")
+    server = Server.from_dict(dump(gld))
+    assert json.dumps(server.to_dict()) == json.dumps(Record.to_dict(server))
+    for record in server.roles + server.categories + server.members:
+        assert type(record).to_dict is not Record.to_dict
+        assert record.to_dict() == Record.to_dict(record)
+    logging.info("OK")
+
+
+def test_records_match_schemas():
+    logging.info("Checking the record fields against the schemas")
+    registry = SchemaRegistry()
+    for cls, (name, pointer) in record_schemas.items():
+        schema = registry.schemas[name]
+        for part in pointer.split("/")[1:]:
+            schema = schema[part]
+        fields = {field[0] for field in cls._fields}
+        # The text channel schema requires "news" without describing it
+        known = set(schema["properties"]) | set(schema.get("required", ()))
+        assert fields == known, (cls.__name__, fields ^ known)
+        for field, _, omitted in cls._fields:
+            if field in schema.get("required", ()):
+                assert not omitted, (cls.__name__, field)
+    logging.info("OK")
+
+
+def test_validation_throughput(gld):
+    logging.info("Measuring member validation throughput")
+    members = dump(gld)["members"]
+    rates = {}
+    for label, registry in (
+        ("jsonschema", SchemaRegistry(generated=False)),
+        ("generated", SchemaRegistry(generated=True)),
+    ):
+        registry.validate(members[0], "member_schema")
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            for member in members:
+                registry.validate(member, "member_schema")
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        rates[label] = len(members) / best
+        logging.info(f"{label}: {rates[label]:.0f} members/s")
+    assert rates["generated"] > 2 * rates["jsonschema"]
+    logging.info("OK")
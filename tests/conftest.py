@@ -0,0 +1,46 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# When run with pytest, the schema tests get a synthetic guild instead of a
+# live one.  `python -m tests` still runs them against a real guild.
+
+import pytest
+
+from ds_fixtures import generate_guild
+
+
+@pytest.fixture(scope="session")
+def synthetic_guild(tmp_path_factory):
+    return generate_guild(
+        roles=30,
+        categories=6,
+        text_channels=40,
+        voice_channels=15,
+        members=500,
+        emojis=12,
+        role_overrides=4,
+        user_overrides=2,
+        asset_dir=str(tmp_path_factory.mktemp("emoji_assets")),
+    )
+
+
+@pytest.fixture
+def gld(synthetic_guild, tmp_path, monkeypatch):
+    # dump_server writes its files relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    return synthetic_guild
@@ -0,0 +1,142 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+
+import discord_server_exporter as dse
+from ds_container import (
+    ContainerReader,
+    write_container,
+    is_container,
+    load_server,
+    load_servers,
+    iter_export_events,
+)
+from ds_diff import diff_files
+from ds_fixtures import generate_guild
+from ds_permissions import PermissionMatrix
+
+
+def dump(gld):
+    # Members are only exported to the schema file
+    dse.dump_server(
+        gld, export_emojis=False, export_server_icon=False, export_members=True
+    )
+    with open(f"exported/schemas/{gld.id}.json") as f:
+        return json.load(f)
+
+
+def two_servers(gld):
+    other = generate_guild(members=20, emojis=0, seed=1)
+    other.id += 1
+    return [dump(gld), dump(other)]
+
+
+def test_random_access(gld, tmp_path):
+    logging.info("Reading single sections of a container")
+    servers = two_servers(gld)
+    path = str(tmp_path / "servers.dsx")
+    write_container(servers, path, member_shard_size=64)
+    assert is_container(path)
+
+    with ContainerReader(path) as reader:
+        assert reader.guilds() == [(s["id"], s["name"]) for s in servers]
+        first, second = servers
+        assert reader.section("roles", second["id"]) == second["roles"]
+        assert reader.header()["name"] == first["name"]
+        assert "roles" not in reader.header()
+        channel = first["categories"][2]["voice_channels"][0]
+        assert reader.channel(channel["id"]) == channel
+        assert reader.member_count() == len(first["members"])
+        assert list(reader.members()) == first["members"]
+        for server in servers:
+            assert reader.server(server["id"]) == server
+            assert json.dumps(reader.server(server["id"])) == json.dumps(server)
+        assert "members" not in reader.server(members=False)
+    logging.info("OK")
+
+
+def test_tools_open_containers(gld, tmp_path):
+    logging.info("Using a container with the loaders, diff and analysis")
+    servers = two_servers(gld)
+    path = str(tmp_path / "servers.dsx")
+    json_path = tmp_path / "servers.json"
+    write_container(servers, path)
+    json_path.write_text(json.dumps(servers))
+
+    assert load_servers(path) == load_servers(str(json_path)) == servers
+    assert load_server(path, servers[1]["id"], members=False) == load_server(
+        str(json_path), servers[1]["id"], members=False
+    )
+    # The events match those of the JSON stream
+    single = tmp_path / "server.json"
+    single.write_text(json.dumps(servers[0]))
+    assert list(iter_export_events(path)) == list(iter_export_events(str(single)))
+
+    assert list(diff_files(path, str(single), 4)) == []
+    assert len(list(diff_files(path, path, 4, guild_id=servers[1]["id"]))) == 0
+    matrix = PermissionMatrix.from_file(path, servers[1]["id"])
+    assert len(matrix.roles) == len(servers[1]["roles"])
+    logging.info("OK")
+
+
+def test_json_list_events(gld, tmp_path):
+    logging.info("Streaming one server of a JSON list of servers")
+    servers = two_servers(gld)
+    path = str(tmp_path / "servers.dsx")
+    json_path = str(tmp_path / "servers.json")
+    write_container(servers, path)
+    with open(json_path, "w") as f:
+        json.dump(servers, f)
+
+    second = servers[1]["id"]
+    assert list(iter_export_events(json_path, second)) == list(
+        iter_export_events(path, second)
+    )
+    assert list(iter_export_events(json_path)) == list(iter_export_events(path))
+    assert len(list(diff_files(path, json_path, 4, guild_id=second))) == 0
+
+    # A JSON file of one server is only read if it is the one asked for
+    single = str(tmp_path / "server.json")
+    with open(single, "w") as f:
+        json.dump(servers[0], f)
+    assert list(iter_export_events(single, servers[0]["id"])) == list(
+        iter_export_events(single)
+    )
+    try:
+        list(iter_export_events(single, second))
+    except KeyError:
+        pass
+    else:
+        assert False, "read the wrong server"
+    logging.info("OK")
+
+
+def test_not_a_container(tmp_path):
+    logging.info("Rejecting files that are not containers")
+    path = tmp_path / "server.json"
+    path.write_text("{}")
+    assert not is_container(str(path))
+    try:
+        ContainerReader(str(path))
+    except ValueError:
+        pass
+    else:
+        assert False, "a JSON file is not a container"
+    logging.info("OK")
@@ -0,0 +1,115 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import copy
+import json
+import logging
+
+import ds_diff
+import ds_store
+import discord_server_exporter as dse
+from ds_diff import diff_servers, diff_files
+
+
+def dump(gld):
+    # Members are only exported to the schema file
+    dse.dump_server(
+        gld, export_emojis=False, export_server_icon=False, export_members=True
+    )
+    with open(f"exported/schemas/{gld.id}.json") as f:
+        return json.load(f)
+
+
+def changed_copy(server):
+    new = copy.deepcopy(server)
+    # Reordering lists is not a change
+    new["roles"].reverse()
+    new["members"].reverse()
+    new["categories"][1:] = reversed(new["categories"][1:])
+
+    role = next(r for r in new["roles"] if r["name"] == "Role 3")
+    role["name"] = "Renamed"
+    role["permission_value"] = str(int(role["permission_value"]) ^ 8)
+    # Moving a channel to another category
+    channel = new["categories"][1]["text_channels"].pop(0)
+    new["categories"][2]["text_channels"].append(channel)
+    override = channel["role_permission_overrides"][0]
+    # Unset a permission of the override
+    override["permissions"].pop(next(iter(override["permissions"])))
+    del new["members"][0]
+    new["members"][1]["roles"] = new["members"][1]["roles"][:-1]
+    new["emojis"].append(
+        {"name": "new", "url": "https://cdn.discordapp.com/emojis/1.png"}
+    )
+    return new, role, channel, override
+
+
+def summary(changes):
+    return sorted((c.kind, c.entity_id, c.change) for c in changes)
+
+
+def test_diff_servers(gld):
+    logging.info("Diffing a server against a changed copy of it")
+    old = dump(gld)
+    assert list(diff_servers(old, copy.deepcopy(old))) == []
+
+    new, role, channel, override = changed_copy(old)
+    changes = list(diff_servers(old, new))
+    by_type = {(c.kind, c.change): c for c in changes}
+
+    renamed = by_type[ds_store.ROLE, ds_diff.RENAMED]
+    assert renamed.entity_id == role["id"]
+    assert renamed.detail == {"name": ("Role 3", "Renamed")}
+    permissions = by_type[ds_store.ROLE, ds_diff.PERMISSIONS]
+    assert list(permissions.detail) == ["administrator"]
+
+    moved = by_type[ds_store.TEXT_CHANNEL, ds_diff.MOVED]
+    assert moved.entity_id == channel["id"]
+    assert moved.detail["parent"][0] != moved.detail["parent"][1]
+    override_change = by_type[ds_store.ROLE_OVERRIDE, ds_diff.PERMISSIONS]
+    assert override_change.entity_id == f"{channel['id']}/{override['id']}"
+    assert [after for before, after in override_change.detail.values()] == [None]
+
+    assert by_type[ds_store.MEMBER, ds_diff.REMOVED].after is None
+    assert list(by_type[ds_store.MEMBER, ds_diff.CHANGED].detail) == ["roles"]
+    assert by_type[ds_store.EMOJI, ds_diff.ADDED].entity_id == "1"
+    # Nothing else, in particular nothing for the reordered lists
+    assert len(changes) == 7
+    logging.info("OK")
+
+
+def test_diff_files_sharded(gld, tmp_path):
+    logging.info("Diffing export files through member shards")
+    old = dump(gld)
+    new = changed_copy(old)[0]
+    old_path, new_path = tmp_path / "old.json", tmp_path / "new.json"
+    old_path.write_text(json.dumps(old))
+    new_path.write_text(json.dumps(new))
+
+    expected = summary(diff_servers(old, new))
+    for shards in (1, 4):
+        changes = list(diff_files(str(old_path), str(new_path), shards, str(tmp_path)))
+        assert summary(changes) == expected
+        assert all(json.dumps(c.as_dict()) and str(c) for c in changes)
+    # The shard files are cleaned up
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "exported",
+        "new.json",
+        "old.json",
+    ]
+    logging.info("OK")
@@ -0,0 +1,164 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import asyncio
+import logging
+import tempfile
+
+import discord_server_importer as dsi
+from ds_common_funcs import emoji_size_limit, RateLimiter
+
+
+class _Guild:
+    def __init__(self):
+        self.id = 1
+        self.name = "emoji import test"
+        self.emojis = []
+        self.premium_tier = 0
+        self.created = []
+
+    async def create_custom_emoji(self, name, image, reason=None):
+        self.created.append((name, image))
+
+
+def test_emoji_import_pipeline():
+    logging.info("Running emoji import pipeline test")
+
+    with tempfile.TemporaryDirectory() as folder:
+        emoji_dir = f"{folder}/emojis/42"
+        os.makedirs(emoji_dir)
+        files = {"a": b"a" * 10, "b": b"b" * 20, "big": b"c" * (emoji_size_limit + 1)}
+        for name, data in files.items():
+            with open(f"{emoji_dir}/{name}.png", "wb") as f:
+                f.write(data)
+
+        index = dsi.index_emoji_folder(emoji_dir)
+        assert set(index["by_name"]) == {"a", "b", "big"}
+        assert len(index["by_hash"]) == 3
+
+        emojis = [{"name": n, "url": ""} for n in ("b", "missing", "big", "a")]
+        guild = _Guild()
+        asyncio.run(
+            dsi.append_emojis(
+                guild,
+                emojis,
+                folder,
+                append_prompt=False,
+                source_guild_id=42,
+                rate_limiter=RateLimiter(1000, 1.0),
+            )
+        )
+
+    # order is kept, missing and oversized emojis are skipped
+    assert guild.created == [("b", files["b"]), ("a", files["a"])]
+
+    logging.info("OK")
+
+
+class _Emoji:
+    def __init__(self, emoji_id, name):
+        self.id = emoji_id
+        self.name = name
+
+
+def test_emoji_sync_plan():
+    logging.info("Running emoji sync plan test")
+
+    kept = _Emoji(1, "kept")
+    renamed = _Emoji(2, "old_name")
+    stale = _Emoji(3, "stale")
+    existing = [(kept, "h1"), (renamed, "h2"), (stale, "h3")]
+    wanted = [
+        ({"name": "kept"}, "h1"),
+        ({"name": "new_name"}, "h2"),
+        ({"name": "fresh"}, "h4"),
+    ]
+
+    plan = dsi.plan_emoji_sync(existing, wanted)
+
+    assert plan["keep"] == [kept]
+    assert plan["rename"] == [(renamed, "new_name")]
+    assert plan["delete"] == [stale]
+    assert [e["name"] for e in plan["upload"]] == ["fresh"]
+
+    logging.info("OK")
+
+
+class _ExistingEmoji(_Emoji):
+    def __init__(self, guild, emoji_id, name, url):
+        super().__init__(emoji_id, name)
+        self.guild = guild
+        self.url = url
+
+    async def delete(self, reason=None):
+        self.guild.emojis.remove(self)
+        self.guild.deleted.append(self.name)
+
+    async def edit(self, name, reason=None):
+        self.name = name
+
+
+def test_write_emojis_failed_fetch():
+    logging.info("Syncing emojis when some images cannot be fetched")
+
+    with tempfile.TemporaryDirectory() as folder:
+        emoji_dir = f"{folder}/emojis/42"
+        os.makedirs(emoji_dir)
+        images = {
+            name: name.encode() for name in ("same", "gone", "broken", "stale", "new")
+        }
+        for name, data in images.items():
+            with open(f"{folder}/{name}.png", "wb") as f:
+                f.write(data)
+        # The export lost the image of "gone"
+        for name in ("same", "broken", "new"):
+            with open(f"{emoji_dir}/{name}.png", "wb") as f:
+                f.write(images[name])
+
+        guild = _Guild()
+        guild.deleted = []
+        for idx, name in enumerate(("same", "gone", "stale")):
+            guild.emojis.append(
+                _ExistingEmoji(guild, idx, name, f"file://{folder}/{name}.png")
+            )
+        # The guild's copy of this one cannot be downloaded
+        guild.emojis.append(
+            _ExistingEmoji(guild, 3, "broken", f"file://{folder}/nowhere.png")
+        )
+
+        emojis = [
+            {"name": name, "url": ""} for name in ("same", "gone", "broken", "new")
+        ]
+        res = asyncio.run(
+            dsi.write_emojis(
+                guild,
+                emojis,
+                folder,
+                overwrite_prompt=False,
+                source_guild_id=42,
+                rate_limiter=RateLimiter(1000, 1.0),
+            )
+        )
+
+    # Only the emoji that is really not in the export any more is deleted
+    assert guild.deleted == ["stale"]
+    assert guild.created == [("new", images["new"])]
+    assert res["untouched"] == 2
+    assert res["kept"] == 1
+    logging.info("OK")
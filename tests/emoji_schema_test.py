@@ -16,29 +16,21 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os
-import json
-import jsonschema
 import logging
 
 import discord
 import discord_server_exporter as dse
+from ds_validation import get_registry
 
 
 def test_emoji_schema_validation(gld: discord.Guild):
     logging.info("Running emoji schema validation test")
 
-    emoji_schema_path = "schemas/emoji_schema.json"
-    with open(emoji_schema_path) as f:
-        emoji_schema = json.load(f)
-
-    resolver = jsonschema.RefResolver(
-        "file:///" + os.getcwd() + "/schemas/", emoji_schema
-    )
+    registry = get_registry()
 
     biswas = dse.dump_emojis(gld)
 
     for emoji in biswas:
-        jsonschema.validate(emoji, emoji_schema, resolver=resolver)
+        registry.validate(emoji, "emoji_schema")
 
     logging.info("OK")
@@ -0,0 +1,100 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+
+import discord
+import discord_server_exporter as dse
+
+
+class _Guild:
+    id = 1234
+    name = "export test"
+    emojis = []
+
+
+class _Member(discord.Member):
+    # A member without the gateway state behind it
+    def __init__(self, member_id):
+        self._user = discord.Object(member_id)
+
+
+class _Colour:
+    value = 0
+
+
+class _Role:
+    name = "Member"
+    color = _Colour()
+    mentionable = False
+    position = 1
+    id = 11
+    hoist = False
+    guild = _Guild()
+
+
+class _TextChannel:
+    name = "general"
+    slowmode_delay = 0
+    topic = None
+    id = 20
+    guild = _Guild()
+
+    def __init__(self, news, overwrites):
+        self.news = news
+        self.overwrites = overwrites
+
+    def is_nsfw(self):
+        return False
+
+    def is_news(self):
+        return self.news
+
+
+def test_member_overrides():
+    logging.info("Exporting permission overrides of members")
+    member = _Member(50)
+    channel = _TextChannel(
+        True, {member: discord.PermissionOverwrite(send_messages=False)}
+    )
+
+    res = dse.conv_text_channel_obj(channel)
+
+    # Members are not discord.User, but their overrides are exported all the same
+    assert res["user_permission_overrides"] == [
+        {"id": "50", "permissions": {"send_messages": False}}
+    ]
+    assert res["news"] is True
+    assert dse.conv_text_channel_obj(_TextChannel(False, {}))["news"] is False
+    logging.info("OK")
+
+
+def test_role_without_permissions():
+    logging.info("Exporting a role without its permissions")
+    res = dse.conv_role_obj(_Role(), export_perms=False)
+    # Required by the schema, so the role is imported without permissions
+    assert res["permission_value"] == "0"
+    logging.info("OK")
+
+
+def test_write_emojis_twice(tmp_path):
+    logging.info("Writing the emojis of a server to the same folder twice")
+    dse.write_emojis_to_dir(_Guild(), str(tmp_path))
+    dse.write_emojis_to_dir(_Guild(), str(tmp_path))
+    assert (tmp_path / "emojis" / "1234").is_dir()
+    logging.info("OK")
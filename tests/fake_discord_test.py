@@ -0,0 +1,58 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import logging
+
+import discord_server_importer as dsi
+from bench_import import generate_server_dict
+from ds_fake_discord import FakeDiscordAPI, fake_discord
+
+
+def test_create_server_against_fake_api():
+    logging.info("Running create_server against the fake API")
+
+    # Tiny windows so rate limits are hit but cost no time
+    api = FakeDiscordAPI(
+        route_limits={"POST /api/v7/guilds/{guild_id}/channels": (3, 10.0)},
+        window_scale=0.001,
+    )
+
+    async def run():
+        async with fake_discord(api) as bot:
+            server = generate_server_dict(
+                api, roles=6, categories=2, channels=4, emojis=0, overrides=2
+            )
+            api.reset_stats()
+            guild = await dsi.create_server(bot, server, add_emojis=False)
+            return server, api.guilds[str(guild.id)]
+
+    server, guild = asyncio.run(run())
+
+    roles = sorted(guild["roles"], key=lambda role: role["position"])
+    assert [role["name"] for role in roles] == [
+        role["name"] for role in server["roles"]
+    ]
+    # 3 categories worth of channels plus 2 real categories
+    assert len(guild["channels"]) == 3 * 4 + 2
+    for channel in guild["channels"]:
+        if channel["name"] != "category 1" and channel["name"] != "category 2":
+            assert len(channel["permission_overwrites"]) == 2
+    assert api.stats["routes"]["POST /api/v7/guilds"] == 1
+
+    logging.info("OK")
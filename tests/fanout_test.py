@@ -0,0 +1,233 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import logging
+
+import discord
+
+import ds_fanout
+from bench_import import generate_server_dict
+from ds_common_funcs import RateLimiter, limit_client_requests
+from ds_fake_discord import FakeDiscordAPI, fake_discord
+
+
+def _channel(cls, name, channel_id, category_id=None):
+    # discord.py channels without a guild state behind them
+    channel = cls.__new__(cls)
+    channel.name = name
+    channel.id = channel_id
+    if cls is not discord.CategoryChannel:
+        channel.category_id = category_id
+    return channel
+
+
+def test_missing_categories():
+    logging.info("Finding the categories and channels a guild does not have")
+    categories = [
+        {"name": "", "text_channels": [{"name": "loose"}], "voice_channels": []},
+        {
+            "name": "Info",
+            "text_channels": [{"name": "rules"}, {"name": "news"}],
+            "voice_channels": [{"name": "rules"}],
+        },
+        {"name": "New", "text_channels": [{"name": "chat"}], "voice_channels": []},
+    ]
+    # What the Discord client creates with a guild, and part of "Info"
+    channels = [
+        _channel(discord.CategoryChannel, "Text Channels", 1),
+        _channel(discord.TextChannel, "general", 2, 1),
+        _channel(discord.CategoryChannel, "Info", 3),
+        _channel(discord.TextChannel, "rules", 4, 3),
+        _channel(discord.TextChannel, "loose", 5, 3),
+    ]
+
+    missing, parents = ds_fanout.missing_categories(categories, channels)
+    assert [category["name"] for category in missing] == ["", "Info", "New"]
+    # "loose" exists, but not without a category
+    assert missing[0] == categories[0]
+    assert [c["name"] for c in missing[1]["text_channels"]] == ["news"]
+    # Same name, other type
+    assert [c["name"] for c in missing[1]["voice_channels"]] == ["rules"]
+    assert missing[2] == categories[2]
+    assert parents == {"Info": channels[2]}
+
+    # Once everything is there, nothing is missing
+    channels += [
+        _channel(discord.TextChannel, "loose", 6),
+        _channel(discord.TextChannel, "news", 7, 3),
+        _channel(discord.VoiceChannel, "rules", 8, 3),
+        _channel(discord.CategoryChannel, "New", 9),
+        _channel(discord.TextChannel, "chat", 10, 9),
+    ]
+    assert ds_fanout.missing_categories(categories, channels) == ([], {})
+    logging.info("OK")
+
+
+def _summary(guild: dict) -> dict:
+    return {
+        "roles": sorted(role["name"] for role in guild["roles"]),
+        "channels": sorted(channel["name"] for channel in guild["channels"]),
+        "emojis": sorted(emoji["name"] for emoji in guild["emojis"]),
+    }
+
+
+def test_clone_to_guilds():
+    logging.info("Cloning one server into two guilds, twice")
+    api = FakeDiscordAPI(window_scale=0.001)
+
+    async def run():
+        async with fake_discord(api) as bot:
+            server = generate_server_dict(
+                api, roles=5, categories=2, channels=2, emojis=3, overrides=1
+            )
+            target_ids = [api.add_guild(f"target {i}")["id"] for i in range(2)]
+            first = await ds_fanout.clone_to_guilds(bot, server, target_ids, rate=1000)
+            after_first = {t: _summary(api.guilds[t]) for t in target_ids}
+            api.reset_stats()
+            second = await ds_fanout.clone_to_guilds(bot, server, target_ids, rate=1000)
+            after_second = {t: _summary(api.guilds[t]) for t in target_ids}
+            return server, first, second, after_first, after_second, api.stats
+
+    server, first, second, after_first, after_second, stats = asyncio.run(run())
+
+    for progress in first.values():
+        assert progress["status"] == "ok"
+        assert progress["done"] == list(ds_fanout.stamp_steps)
+    summary = next(iter(after_first.values()))
+    assert summary["roles"] == sorted(role["name"] for role in server["roles"])
+    assert summary["emojis"] == sorted(emoji["name"] for emoji in server["emojis"])
+    # 2 real categories, 3 categories worth of channels
+    assert len(summary["channels"]) == 2 + 3 * 2
+    assert all(s == summary for s in after_first.values())
+
+    # Running again changes nothing
+    for progress in second.values():
+        assert progress["status"] == "ok"
+    assert after_second == after_first
+    assert stats["routes"]["POST /api/v7/guilds/{guild_id}/channels"] == 0
+    assert stats["routes"]["POST /api/v7/guilds/{guild_id}/emojis"] == 0
+    logging.info("OK")
+
+
+def test_clone_to_new_guild():
+    logging.info("Cloning into a guild that has the default channels")
+    api = FakeDiscordAPI(window_scale=0.001)
+
+    async def run():
+        async with fake_discord(api) as bot:
+            server = generate_server_dict(
+                api, roles=2, categories=2, channels=2, emojis=0
+            )
+            target = api.add_guild("target")["id"]
+            # What the Discord client creates with a guild
+            text = api.add_channel(target, "Text Channels", 4)
+            voice = api.add_channel(target, "Voice Channels", 4)
+            api.add_channel(target, "general", 0, text["id"])
+            api.add_channel(target, "General", 2, voice["id"])
+            # A channel of the dict made by hand, in a category of the dict
+            category = server["categories"][1]
+            made = api.add_channel(target, category["name"], 4)
+            api.add_channel(target, category["text_channels"][0]["name"], 0, made["id"])
+
+            progress = await ds_fanout.clone_to_guilds(bot, server, [target], rate=1000)
+            return server, progress[target], api.guilds[target]["channels"]
+
+    server, progress, channels = asyncio.run(run())
+    assert progress["status"] == "ok"
+    names = [channel["name"] for channel in channels]
+    # The defaults stay, everything in the dict is there exactly once
+    assert {"Text Channels", "Voice Channels", "general", "General"} <= set(names)
+    expected = [
+        category["name"] for category in server["categories"] if category["name"]
+    ]
+    for category in server["categories"]:
+        expected += [
+            c["name"] for c in category["text_channels"] + category["voice_channels"]
+        ]
+    assert len(names) == 4 + len(expected)
+    assert sorted(names) == sorted(
+        ["Text Channels", "Voice Channels", "general", "General"] + expected
+    )
+    # The hand made category got the rest of its channels
+    category = server["categories"][1]
+    made = next(c for c in channels if c["name"] == category["name"])
+    children = sorted(c["name"] for c in channels if c["parent_id"] == made["id"])
+    assert children == sorted(
+        c["name"] for c in category["text_channels"] + category["voice_channels"]
+    )
+    logging.info("OK")
+
+
+def test_prepare_shared_assets():
+    logging.info("Fetching the emojis of a clone once")
+    api = FakeDiscordAPI()
+
+    async def run():
+        async with fake_discord(api):
+            server = generate_server_dict(
+                api, roles=2, categories=0, channels=0, emojis=4
+            )
+            api.reset_stats()
+            assets = await asyncio.get_event_loop().run_in_executor(
+                None, ds_fanout.prepare_shared_assets, server
+            )
+            return server, assets, api.stats
+
+    server, assets, stats = asyncio.run(run())
+    assert assets["icon"] is None
+    assert set(assets["emojis"]) == {emoji["url"] for emoji in server["emojis"]}
+    assert stats["routes"]["GET /cdn"] == 4
+    logging.info("OK")
+
+
+class _HTTP:
+    async def request(self, route, **kwargs):
+        return route
+
+
+class _Bot:
+    def __init__(self):
+        self.http = _HTTP()
+
+
+class _CountingLimiter(RateLimiter):
+    def __init__(self):
+        super().__init__(1000, 1.0)
+        self.waits = 0
+
+    async def wait(self):
+        self.waits += 1
+        await super().wait()
+
+
+def test_limit_client_requests():
+    logging.info("Sending every request of a client through one rate limiter")
+    bot = _Bot()
+    limiter = _CountingLimiter()
+    original = bot.http.request
+
+    async def run():
+        with limit_client_requests(bot, limiter):
+            await bot.http.request("GET /guilds/1")
+            await bot.http.request("GET /guilds/1/roles")
+
+    asyncio.run(run())
+    assert limiter.waits == 2
+    assert bot.http.request == original
+    logging.info("OK")
@@ -0,0 +1,190 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gzip
+import time
+import asyncio
+import logging
+import multiprocessing
+
+import pytest
+from aiohttp import web
+
+from ds_http import HTTPClient, FetchError, ResponseTooLarge
+
+
+# Runs `check(base_url, client)` with a small asset server, in a coroutine
+def run_with_server(check, **client_args):
+    state = {"flaky": 0, "slow": 0, "peers": set()}
+
+    async def asset(request):
+        state["peers"].add(request.transport.get_extra_info("peername"))
+        return web.Response(body=b"x" * 100)
+
+    async def flaky(request):
+        state["flaky"] += 1
+        if state["flaky"] < 3:
+            return web.Response(status=503)
+        return web.Response(body=b"finally")
+
+    async def missing(request):
+        return web.Response(status=404)
+
+    async def compressed(request):
+        return web.Response(
+            body=gzip.compress(b"a" * 1000), headers={"Content-Encoding": "gzip"}
+        )
+
+    async def slow_first(request):
+        state["slow"] += 1
+        if state["slow"] == 1:
+            await asyncio.sleep(2)
+        return web.Response(body=b"fast")
+
+    async def hang(request):
+        await asyncio.sleep(5)
+        return web.Response(body=b"late")
+
+    app = web.Application()
+    app.router.add_get("/asset", asset)
+    app.router.add_get("/flaky", flaky)
+    app.router.add_get("/missing", missing)
+    app.router.add_get("/compressed", compressed)
+    app.router.add_get("/slow_first", slow_first)
+    app.router.add_get("/hang", hang)
+
+    client = HTTPClient(backoff=0.01, **client_args)
+
+    async def run():
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            await check(f"http://127.0.0.1:{port}", client)
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(run())
+    finally:
+        client.close()
+    return state, client
+
+
+def test_retries_and_errors():
+    logging.info("Retrying a flaky asset and failing on a missing one")
+
+    async def check(base, client):
+        resp = await client.fetch_async(f"{base}/flaky")
+        assert resp.body == b"finally"
+
+        with pytest.raises(FetchError) as e:
+            await client.fetch_async(f"{base}/missing")
+        assert e.value.status == 404
+        # Still an OSError for callers that caught urllib errors
+        assert isinstance(e.value, OSError)
+
+        with pytest.raises(ResponseTooLarge):
+            await client.fetch_async(f"{base}/asset", max_size=10)
+
+        resp = await client.fetch_async(f"{base}/compressed")
+        assert resp.body == b"a" * 1000
+
+    state, client = run_with_server(check)
+    assert state["flaky"] == 3
+    # 404s are not retried
+    assert client.stats["retries"] == 2
+    logging.info("OK")
+
+
+def test_connections_are_reused():
+    logging.info("Downloading many assets over a small pool")
+
+    async def check(base, client):
+        responses = await asyncio.get_event_loop().run_in_executor(
+            None, client.fetch_all, [f"{base}/asset"] * 20
+        )
+        assert all(resp.body == b"x" * 100 for resp in responses)
+
+    state, _ = run_with_server(check, per_host=2)
+    assert len(state["peers"]) <= 2
+    logging.info("OK")
+
+
+def test_hedging_and_timeouts():
+    logging.info("Hedging a slow request and timing out a hanging one")
+
+    async def check(base, client):
+        start = time.perf_counter()
+        resp = await client.fetch_async(f"{base}/slow_first", hedge_after=0.1)
+        assert resp.body == b"fast"
+        assert time.perf_counter() - start < 1.5
+
+        with pytest.raises(FetchError):
+            await client.fetch_async(f"{base}/hang", hedge_after=None)
+
+    _, client = run_with_server(check, timeout=0.2, retries=1)
+    assert client.stats["hedged"] == 1
+    assert client.stats["hedge_wins"] == 1
+    logging.info("OK")
+
+
+def test_file_urls(tmp_path):
+    logging.info("Reading a file URL")
+    path = tmp_path / "emoji.png"
+    path.write_bytes(b"png")
+    client = HTTPClient()
+    try:
+        assert client.fetch(path.as_uri()).body == b"png"
+        with pytest.raises(ResponseTooLarge):
+            client.fetch(path.as_uri(), max_size=1)
+    finally:
+        client.close()
+    logging.info("OK")
+
+
+def _fetch_in_child(client, url, results):
+    results.put(client.fetch(url).body)
+
+
+def test_client_after_fork(tmp_path):
+    logging.info("Using a started client in a forked process")
+    path = tmp_path / "emoji.png"
+    path.write_bytes(b"png")
+    client = HTTPClient()
+    try:
+        assert client.fetch(path.as_uri()).body == b"png"
+        # Like the workers of a process pool: the loop thread is not forked
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        child = context.Process(
+            target=_fetch_in_child, args=(client, path.as_uri(), results)
+        )
+        child.start()
+        child.join(10)
+        if child.is_alive():
+            child.terminate()
+        assert child.exitcode == 0
+        assert results.get(timeout=1) == b"png"
+        # The parent's loop still works
+        assert client.fetch(path.as_uri()).body == b"png"
+    finally:
+        client.close()
+    logging.info("OK")
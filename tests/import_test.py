@@ -0,0 +1,113 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import logging
+
+import discord
+import discord_server_importer as dsi
+
+
+class _Role:
+    def __init__(self, name, position):
+        self.name = name
+        self.position = position
+        self.edits = []
+
+    async def edit(self, reason=None, **kwargs):
+        self.edits.append(kwargs)
+
+
+class _Guild:
+    name = "import test"
+    bitrate_limit = 96000
+
+    def __init__(self, roles=()):
+        self.roles = list(roles)
+        self.default_role = self.roles[0] if self.roles else None
+        self.created_roles = []
+        self.created_channels = []
+
+    async def fetch_roles(self):
+        # The API does not return the roles in order
+        return list(reversed(self.roles[1:])) + self.roles[:1]
+
+    async def create_role(self, reason=None, **kwargs):
+        self.created_roles.append(kwargs)
+
+    async def create_text_channel(self, **kwargs):
+        self.created_channels.append(("text", kwargs))
+
+    async def create_voice_channel(self, **kwargs):
+        self.created_channels.append(("voice", kwargs))
+
+
+def _role(name, position, permission_value):
+    return {
+        "name": name,
+        "color": 0,
+        "hoist": False,
+        "mentionable": False,
+        "position": position,
+        "permission_value": str(permission_value),
+    }
+
+
+def test_write_roles_everyone():
+    logging.info("Writing @everyone from the role at position 0")
+    guild = _Guild([_Role("@everyone", 0)])
+    roles = [_role("@everyone", 0, 1024), _role("admin", 1, 8)]
+    asyncio.run(dsi.write_roles(guild, roles, overwrite_prompt=False))
+
+    (edit,) = guild.default_role.edits
+    assert edit["permissions"] == discord.Permissions(1024)
+    assert [role["name"] for role in guild.created_roles] == ["admin"]
+    logging.info("OK")
+
+
+def test_role_overrides_by_position():
+    logging.info("Looking up override roles by position")
+    guild = _Guild([_Role("@everyone", 0), _Role("member", 1), _Role("mod", 2)])
+    channel = {
+        "name": "general",
+        "role_permission_overrides": [
+            {"name": "mod", "position": 2, "permissions": {"send_messages": True}},
+            {"name": "member", "position": 1, "permissions": {"send_messages": False}},
+        ],
+    }
+    overrides = asyncio.run(dsi.get_dpy_overrides(None, guild, channel))
+    assert {role.name: o.send_messages for role, o in overrides.items()} == {
+        "mod": True,
+        "member": False,
+    }
+    logging.info("OK")
+
+
+def test_append_uncategorized_channels():
+    logging.info("Appending channels that have no category")
+    guild = _Guild()
+    textchannel = {"name": "text", "topic": None, "slowmode": 0}
+    voicechannel = {"name": "voice", "bitrate": 64000, "user_limit": 0}
+    asyncio.run(dsi.append_textchannel(None, textchannel, None, False, None, guild))
+    asyncio.run(dsi.append_voicechannel(None, voicechannel, None, False, None, guild))
+
+    assert [
+        (kind, kwargs["name"], kwargs["category"])
+        for kind, kwargs in guild.created_channels
+    ] == [("text", "text", None), ("voice", "voice", None)]
+    logging.info("OK")
@@ -0,0 +1,96 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import logging
+
+import numpy as np
+
+import discord_server_exporter as dse
+from ds_members import MemberArchive, MemberArchiveWriter, write_member_archive
+
+
+def test_archive_round_trip(gld, tmp_path):
+    logging.info("Writing members to a columnar archive and reading them back")
+    members = dse.dump_members(gld)
+    roles = [str(role.id) for role in gld.roles]
+    directory = str(tmp_path / "archive")
+    assert write_member_archive(members, directory, roles) == len(members)
+
+    archive = MemberArchive(directory)
+    assert len(archive) == len(members)
+    assert archive.ids.dtype == np.dtype("<u8")
+    assert [str(i) for i in archive.ids.tolist()] == [m["id"] for m in members]
+    assert archive.strings("names") == [m["name"] for m in members]
+    assert archive.strings("nicknames") == [m.get("nickname") for m in members]
+    for member, loaded in zip(members, archive):
+        assert {**member, "roles": sorted(member["roles"])} == {
+            **loaded,
+            "roles": sorted(loaded["roles"]),
+        }
+    logging.info("OK")
+
+
+def test_role_queries(gld, tmp_path):
+    logging.info("Counting role members straight from the bitmap")
+    members = dse.dump_members(gld)
+    roles = [str(role.id) for role in gld.roles]
+    directory = str(tmp_path / "archive")
+    # Small chunks so the members are written in several parts
+    with MemberArchiveWriter(directory, roles, chunk_size=64) as writer:
+        writer.add_all(members)
+    archive = MemberArchive(directory)
+
+    expected = {role_id: 0 for role_id in roles}
+    for member in members:
+        for role_id in member["roles"]:
+            expected[role_id] += 1
+    assert archive.role_counts(chunk_size=100) == expected
+    role_id = roles[3]
+    assert archive.role_count(role_id) == expected[role_id]
+    holders = [m["id"] for m in members if role_id in m["roles"]]
+    assert [str(i) for i in archive.members_with(role_id).tolist()] == holders
+    assert archive.has_role(holders[0], role_id)
+    outsider = next(m for m in members if role_id not in m["roles"])
+    assert not archive.has_role(outsider["id"], role_id)
+    logging.info("OK")
+
+
+def test_exporter_writes_archive(gld):
+    logging.info("Exporting a server with a member archive")
+    dse.dump_server(
+        gld,
+        export_emojis=False,
+        export_server_icon=False,
+        export_schemas=False,
+        export_member_archive=True,
+    )
+    archive = MemberArchive(os.path.join("exported", "members", str(gld.id)))
+    assert len(archive) == len(gld.members)
+    assert sum(archive.role_counts().values()) == sum(len(m.roles) for m in gld.members)
+    logging.info("OK")
+
+
+def test_empty_archive(tmp_path):
+    logging.info("Reading an archive without members")
+    directory = str(tmp_path / "archive")
+    write_member_archive([], directory, ["1"])
+    archive = MemberArchive(directory)
+    assert len(archive) == 0 and list(archive) == []
+    assert archive.role_counts() == {"1": 0}
+    logging.info("OK")
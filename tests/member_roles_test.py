@@ -0,0 +1,128 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import logging
+
+import discord_server_importer as dsi
+from ds_common_funcs import RateLimiter
+
+
+class _Role:
+    def __init__(self, name, managed=False):
+        self.name = name
+        self.managed = managed
+
+    def __repr__(self):
+        return self.name
+
+
+class _Member:
+    def __init__(self, guild, member_id, roles):
+        self.guild = guild
+        self.id = member_id
+        self.roles = [guild.default_role] + roles
+        self.edits = 0
+
+    async def edit(self, roles, reason=None):
+        self.edits += 1
+        self.roles = [self.guild.default_role] + list(roles)
+
+
+class _Guild:
+    def __init__(self):
+        self.name = "member roles test"
+        self.default_role = _Role("@everyone")
+        self.admin = _Role("Admin")
+        self.member = _Role("Member")
+        self.bot = _Role("Bot", managed=True)
+        self.roles = [self.default_role, self.bot, self.member, self.admin]
+        self.members = {}
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+
+def test_write_member_roles():
+    logging.info("Running member role writing test")
+
+    guild = _Guild()
+    source_roles = [
+        {"id": "10", "name": "@everyone", "position": 0},
+        {"id": "11", "name": "Member", "position": 1},
+        {"id": "12", "name": "Admin", "position": 2},
+    ]
+    for i in range(1000):
+        # every other member already has the right roles
+        guild.members[i] = _Member(guild, i, [guild.member] if i % 2 else [])
+    guild.members[0].roles.append(guild.bot)
+
+    members = [{"id": str(i), "roles": ["10", "11"]} for i in range(1000)]
+    members.append({"id": "5000", "roles": ["11"]})
+    # Admin taken away, Member given
+    guild.members[1].roles.append(guild.admin)
+
+    stats = asyncio.run(
+        dsi.write_member_roles(
+            guild, members, source_roles, rate_limiter=RateLimiter(100000, 1.0)
+        )
+    )
+
+    assert stats == {"updated": 501, "unchanged": 499, "missing": 1, "failed": 0}
+    for member in guild.members.values():
+        assert guild.member in member.roles
+        assert guild.admin not in member.roles
+    # managed roles are never touched
+    assert guild.bot in guild.members[0].roles
+
+    logging.info("OK")
+
+
+class _BrokenMember(_Member):
+    async def edit(self, roles, reason=None):
+        raise RuntimeError("not a member any more")
+
+
+def test_write_member_roles_failures():
+    logging.info("Running member role writing test with failing edits")
+
+    guild = _Guild()
+    source_roles = [
+        {"id": "10", "name": "@everyone", "position": 0},
+        {"id": "11", "name": "Member", "position": 1},
+    ]
+    for i in range(100):
+        guild.members[i] = _BrokenMember(guild, i, [])
+    members = [{"id": str(i), "roles": ["11"]} for i in range(100)]
+
+    # More members than the queue holds; a stopped worker would block forever
+    stats = asyncio.run(
+        asyncio.wait_for(
+            dsi.write_member_roles(
+                guild,
+                members,
+                source_roles,
+                concurrency=1,
+                rate_limiter=RateLimiter(100000, 1.0),
+            ),
+            10,
+        )
+    )
+
+    assert stats == {"updated": 0, "unchanged": 0, "missing": 0, "failed": 100}
+    logging.info("OK")
@@ -16,50 +16,42 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os
-import json
-import jsonschema
 import logging
 
 import discord
 import discord_server_exporter as dse
+from ds_validation import get_registry
 
 
 def test_member_schema_validation(gld: discord.Guild):
     logging.info("Running member schema validation test")
 
-    member_schema_path = "schemas/member_schema.json"
-    with open(member_schema_path) as f:
-        member_schema = json.load(f)
-
-    resolver = jsonschema.RefResolver(
-        "file:///" + os.getcwd() + "/schemas/", member_schema
-    )
+    registry = get_registry()
 
     biswas = dse.dump_members(gld)
 
     for member in biswas:
-        jsonschema.validate(member, member_schema, resolver=resolver)
+        registry.validate(member, "member_schema")
 
     logging.info("OK")
     logging.info("Validate members foregoing nickname export")
 
     biswas = dse.dump_members(gld, False, True)
     for member in biswas:
-        jsonschema.validate(member, member_schema, resolver=resolver)
+        registry.validate(member, "member_schema")
 
     logging.info("OK")
     logging.info("Validate members foregoing roles export")
 
     biswas = dse.dump_members(gld, True, False)
     for member in biswas:
-        jsonschema.validate(member, member_schema, resolver=resolver)
+        registry.validate(member, "member_schema")
 
     logging.info("OK")
     logging.info("Validate members foregoing both export")
 
     biswas = dse.dump_members(gld, False, False)
     for member in biswas:
-        jsonschema.validate(member, member_schema, resolver=resolver)
+        registry.validate(member, "member_schema")
 
     logging.info("OK")
@@ -0,0 +1,127 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import socket
+import asyncio
+import logging
+
+import aiohttp
+
+import ds_metrics
+import discord_server_exporter as dse
+from ds_fake_discord import FakeDiscordAPI, fake_discord
+
+
+def test_render_exposition_format():
+    logging.info("Rendering a registry in the text exposition format")
+    registry = ds_metrics.Registry()
+    counter = registry.counter("test_total", "A counter", ("kind",))
+    histogram = registry.histogram("test_seconds", "A histogram", (), buckets=(1, 2))
+    counter.inc(kind='say "hi"')
+    counter.inc(2, kind='say "hi"')
+    histogram.observe(0.5)
+    histogram.observe(1.5)
+    histogram.observe(5)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE test_total counter" in lines
+    assert 'test_total{kind="say \\"hi\\""} 3' in lines
+    assert "# TYPE test_seconds histogram" in lines
+    assert 'test_seconds_bucket{le="1"} 1' in lines
+    assert 'test_seconds_bucket{le="2"} 2' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 3' in lines
+    assert "test_seconds_sum 7" in lines
+    assert "test_seconds_count 3" in lines
+    logging.info("OK")
+
+
+def test_dump_server_counts_entities(gld):
+    logging.info("Counting the entities exported by dump_server")
+    before = ds_metrics.entities_exported.value(type="members")
+    exports_before = ds_metrics.guild_export_duration.count(guild=gld.id)
+
+    dse.dump_server(
+        gld, export_emojis=False, export_server_icon=False, export_members=True
+    )
+
+    assert ds_metrics.entities_exported.value(type="members") - before == len(
+        gld.members
+    )
+    assert ds_metrics.guild_export_duration.count(guild=gld.id) == exports_before + 1
+    assert ds_metrics.bytes_written.value(kind="schema") > 0
+    logging.info("OK")
+
+
+def test_metrics_endpoint_and_client_instrumentation():
+    logging.info("Scraping the metrics endpoint after requests that hit 429s")
+    # discord.py waits out exhausted route buckets on its own, so concurrent
+    # requests over a small global limit are what gets 429s
+    api = FakeDiscordAPI(global_limit=(3, 1.0), window_scale=0.01)
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    async def run():
+        runner = await ds_metrics.start_metrics_server(port)
+        try:
+            async with fake_discord(api) as bot:
+                guild_ids = [api.add_guild(f"guild {i}")["id"] for i in range(8)]
+                api.reset_stats()
+                with ds_metrics.instrument_client(bot):
+                    await asyncio.gather(
+                        *(bot.fetch_guild(int(guild_id)) for guild_id in guild_ids)
+                    )
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}/metrics") as resp:
+                    return resp.headers["Content-Type"], await resp.text()
+        finally:
+            await runner.cleanup()
+
+    before = ds_metrics.http_rate_limited.value(route="global")
+    content_type, text = asyncio.run(run())
+    assert content_type.startswith("text/plain")
+
+    assert api.stats["rate_limited"] > 0
+    assert (
+        ds_metrics.http_rate_limited.value(route="global") - before
+        == api.stats["rate_limited"]
+    )
+    route = "GET /guilds/{guild_id}"
+    assert f'ds_http_requests_total{{route="{route}",status="ok"}} 8' in text
+    assert f'ds_http_request_duration_seconds_count{{route="{route}"}} 8' in text
+    logging.info("OK")
+
+
+def test_rate_limit_counter_log_records():
+    logging.info("Counting 429s from discord.http log records of any kind")
+    handler = ds_metrics._RateLimitCounter(logging.WARNING)
+
+    def record(msg, *args):
+        return logging.LogRecord(
+            "discord.http", logging.WARNING, __file__, 0, msg, args, None
+        )
+
+    before = ds_metrics.http_rate_limited.value(route="global")
+    # Not every record has a string message
+    handler.emit(record(RuntimeError("connection reset")))
+    handler.emit(
+        record("Global rate limit has been hit. Retrying in %.2f seconds.", 1.5)
+    )
+    assert ds_metrics.http_rate_limited.value(route="global") - before == 1
+    logging.info("OK")
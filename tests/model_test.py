@@ -0,0 +1,126 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import json
+import logging
+import tracemalloc
+
+import discord_server_exporter as dse
+from ds_fixtures import generate_guild
+from ds_model import Member, Role, Server
+from ds_validation import get_registry
+
+
+def test_server_round_trip(gld):
+    logging.info("Turning a server dict into records and back")
+    dse.dump_server(
+        gld, export_emojis=False, export_server_icon=False, export_members=True
+    )
+    with open(f"exported/schemas/{gld.id}.json") as f:
+        server = json.load(f)
+    record = Server.from_dict(server)
+    assert isinstance(record.roles[0], Role)
+    assert isinstance(record.id, int)
+    # Same keys in the same order, so the JSON is byte for byte the same
+    assert json.dumps(record.to_dict()) == json.dumps(server)
+    get_registry().validate_server(record)
+
+    members = record.members
+    record.members = None
+    text = "".join(dse.encode_server(record.to_dict(), iter(members)))
+    assert text == json.dumps(server)
+    assert "".join(dse.encode_server(record.to_dict())) == json.dumps(record.to_dict())
+    logging.info("OK")
+
+
+def test_mapping_view():
+    logging.info("Reading a record like a member dict")
+    member = Member(name="name", discrim="0001", id=1234, roles=(1, 2))
+    assert member["id"] == "1234"
+    assert member["roles"] == ["1", "2"]
+    assert "nickname" not in member
+    assert member.get("nickname") is None
+    assert dict(member) == member.to_dict()
+    assert member == {
+        "name": "name",
+        "discrim": "0001",
+        "id": "1234",
+        "roles": ["1", "2"],
+    }
+    assert member == Member.from_dict(member.to_dict())
+    assert Member.coerce(member) is member
+    logging.info("OK")
+
+
+def _allocated(build) -> tuple:
+    # Captured log records would be counted too
+    logging.disable(logging.INFO)
+    tracemalloc.start()
+    try:
+        value = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+        logging.disable(logging.NOTSET)
+    return value, size
+
+
+def test_member_memory(gld):
+    logging.info("Comparing the memory of member records and member dicts")
+    records, record_size = _allocated(lambda: dse.dump_members(gld))
+    dicts, dict_size = _allocated(lambda: [member.to_dict() for member in records])
+    assert len(records) == len(dicts) == len(gld.members)
+    logging.info(
+        f"{record_size / len(records):.0f} bytes per member record, {dict_size / len(dicts):.0f} per dict"
+    )
+    assert record_size * 2 < dict_size
+    logging.info("OK")
+
+
+def test_dump_server_memory(tmp_path):
+    logging.info("Measuring the memory peak of dump_server with members")
+    guild = generate_guild(members=5000)
+    records, record_size = _allocated(lambda: dse.dump_members(guild))
+    del records
+
+    peaks = []
+    for export_members in (False, True):
+        logging.disable(logging.INFO)
+        tracemalloc.start()
+        try:
+            server = dse.dump_server(
+                guild,
+                export_emojis=False,
+                export_server_icon=False,
+                export_files_dir=str(tmp_path),
+                export_members=export_members,
+            )
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+            logging.disable(logging.NOTSET)
+    assert "members" not in server
+    with open(tmp_path / "schemas" / f"{guild.id}.json") as f:
+        assert len(json.load(f)["members"]) == 5000
+    logging.info(
+        f"Members add {(peaks[1] - peaks[0]) / 5000:.0f} bytes per member to the peak"
+    )
+    # Members are written as they are converted, not held until the end
+    assert peaks[1] - peaks[0] < record_size / 10
+    logging.info("OK")
@@ -0,0 +1,126 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import logging
+
+import discord_server_importer as dsi
+
+
+class _User:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+
+
+class _Bot:
+    def get_user(self, user_id):
+        return _User(user_id) if user_id < 10 else None
+
+
+class _Guild:
+    name = "override users test"
+
+    def __init__(self):
+        self.queries = []
+
+    def get_member(self, user_id):
+        return None
+
+    async def query_members(self, limit, user_ids, cache=True):
+        self.queries.append(len(user_ids))
+        # IDs over 200 are not in the server
+        return [_User(user_id) for user_id in user_ids if user_id < 200]
+
+
+def _override(user_id):
+    return {"id": str(user_id), "permissions": {"read_messages": True}}
+
+
+def test_resolve_override_users():
+    logging.info("Running override user resolution test")
+
+    categories = [
+        {
+            "name": "",
+            "text_channels": [
+                {"name": "a", "user_permission_overrides": [_override(i)]}
+                for i in range(250)
+            ],
+            "voice_channels": [
+                {"name": "b", "user_permission_overrides": [_override(1)]}
+            ],
+        },
+        {"name": "c", "user_permission_overrides": [_override(3)]},
+    ]
+
+    user_ids = dsi.collect_override_user_ids(categories)
+    assert len(user_ids) == 250
+
+    guild = _Guild()
+    index = asyncio.run(dsi.resolve_override_users(_Bot(), guild, user_ids))
+
+    assert set(index) == {str(i) for i in range(200)}
+    # 10 from the cache, the other 240 in chunks of at most 100
+    assert sorted(guild.queries) == [40, 100, 100]
+
+    logging.info("OK")
+
+
+class _TextChannel:
+    category = None
+
+    def __init__(self, guild):
+        self.guild = guild
+        self.edits = []
+
+    async def edit(self, **kwargs):
+        self.edits.append(kwargs)
+
+
+class _Everyone:
+    name = "@everyone"
+    position = 0
+
+
+class _RolesGuild(_Guild):
+    async def fetch_roles(self):
+        return [_Everyone()]
+
+
+def test_write_textchannel_user_index():
+    logging.info("Syncing an existing text channel with resolved override users")
+    channel = _TextChannel(_RolesGuild())
+    textchannel = {
+        "name": "general",
+        "topic": None,
+        "slowmode": 0,
+        "role_permission_overrides": [],
+        "user_permission_overrides": [_override(150)],
+    }
+    user_index = {"150": _User(150)}
+    asyncio.run(
+        dsi.write_textchannel(_Bot(), textchannel, channel, user_index=user_index)
+    )
+
+    (edit,) = channel.edits
+    assert edit["name"] == "general"
+    assert edit["category"] is None
+    # Not in the client cache, only in the index
+    assert [user.id for user in edit["overwrites"]] == [150]
+    logging.info("OK")
@@ -0,0 +1,144 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+
+import discord
+
+import discord_server_exporter as dse
+from ds_permissions import PermissionMatrix, VOICE
+
+
+# The rules of discord.py's permissions_for, one role and channel at a time
+def reference(server, role, channel, kind):
+    everyone = server["roles"][0]
+    base = discord.Permissions(
+        int(everyone["permission_value"]) | int(role["permission_value"])
+    )
+    if base.administrator:
+        return discord.Permissions.all().value
+
+    overrides = {
+        o["id"]: o["permissions"] for o in channel["role_permission_overrides"]
+    }
+    for role_id in dict.fromkeys((everyone["id"], role["id"])):
+        if role_id in overrides:
+            allow = discord.Permissions(
+                **{k: True for k, v in overrides[role_id].items() if v}
+            )
+            deny = discord.Permissions(
+                **{k: True for k, v in overrides[role_id].items() if v is False}
+            )
+            base.handle_overwrite(allow.value, deny.value)
+
+    if not base.send_messages:
+        base.update(
+            send_tts_messages=False,
+            mention_everyone=False,
+            embed_links=False,
+            attach_files=False,
+        )
+    if kind == VOICE:
+        if not base.connect:
+            base.value &= ~discord.Permissions.voice().value
+            base.update(manage_channels=False, manage_roles=False)
+    else:
+        base.value &= ~discord.Permissions.voice().value
+    if not base.read_messages:
+        base.value &= ~discord.Permissions.all_channel().value
+    return base.value
+
+
+def channels_of(server):
+    for category in server["categories"]:
+        for channel in category["text_channels"]:
+            yield channel, 0
+        for channel in category["voice_channels"]:
+            yield channel, VOICE
+
+
+def test_matrix_matches_reference(gld):
+    logging.info("Comparing the permission matrix with a per pair computation")
+    server = dse.dump_server(
+        gld, export_emojis=False, export_server_icon=False, export_schemas=False
+    )
+    perms = PermissionMatrix.from_server(server)
+    assert perms.matrix.shape == (len(perms.channels), len(server["roles"]))
+
+    for channel, kind in channels_of(server):
+        for role in server["roles"]:
+            assert perms.permissions(role["id"], channel["id"]).value == reference(
+                server, role, channel, kind
+            ), (role["name"], channel["name"])
+    logging.info("OK")
+
+
+def test_queries():
+    logging.info("Asking which roles can send messages where")
+    send = discord.Permissions(send_messages=True, view_channel=True).value
+    server = {
+        "id": "1",
+        "name": "Server",
+        "roles": [
+            {"id": "1", "name": "@everyone", "permission_value": str(send)},
+            {"id": "2", "name": "Muted", "permission_value": "0"},
+            {"id": "3", "name": "Admin", "permission_value": "8"},
+        ],
+        "categories": [
+            {
+                "name": "",
+                "text_channels": [
+                    {
+                        "id": "10",
+                        "name": "general",
+                        "role_permission_overrides": [
+                            {"id": "2", "permissions": {"send_messages": False}}
+                        ],
+                    },
+                    {
+                        "id": "11",
+                        "name": "staff",
+                        "role_permission_overrides": [
+                            {"id": "1", "permissions": {"view_channel": False}}
+                        ],
+                    },
+                ],
+                "voice_channels": [],
+            }
+        ],
+    }
+    perms = PermissionMatrix.from_server(server)
+    assert perms.roles_with("10", "send_messages") == ["1", "3"]
+    assert perms.roles_with("11", "read_messages") == ["3"]
+    assert perms.channels_with("1", "send_messages") == ["10"]
+    assert perms.has("3", 11, "manage_guild")
+    assert not perms.has("2", "10", "attach_files")
+    # A member with both roles is muted but still an admin
+    member = perms.for_member(["2", "3"])
+    assert int(member[0]) == discord.Permissions.all().value
+    assert list(perms.for_member(["2"]) & send) == [
+        send & ~discord.Permissions(send_messages=True).value,
+        0,
+    ]
+    try:
+        perms.has("1", "10", "fly")
+    except ValueError:
+        pass
+    else:
+        assert False, "unknown permissions are an error"
+    logging.info("OK")
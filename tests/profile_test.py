@@ -0,0 +1,123 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import asyncio
+import logging
+
+import discord_server_exporter as dse
+from ds_fixtures import generate_guild
+from ds_profile import Profiler, stage
+
+
+def test_dump_server_profile(tmp_path):
+    logging.info("Profiling dump_server on a synthetic guild")
+    guild = generate_guild(categories=3, text_channels=12, voice_channels=4)
+
+    profiler = Profiler()
+    with profiler.active():
+        res = dse.dump_server(
+            guild,
+            export_emojis=False,
+            export_server_icon=False,
+            export_files_dir=str(tmp_path),
+            export_members=True,
+        )
+
+    stages = {record["name"]: record for record in profiler.report()["stages"]}
+    assert stages["roles"]["objects"] == len(res["roles"])
+    # Members are converted while the schema file is written
+    assert stages["schema_file/members"]["objects"] == len(guild.members)
+    assert stages["categories/overrides"]["calls"] == 12 + 4 + 3
+    assert stages["categories/overrides"]["mem_peak"] > 0
+    # The outer stage saw at least as much memory as the nested one
+    assert (
+        stages["categories"]["mem_peak"] >= stages["categories/overrides"]["mem_peak"]
+    )
+    with open(tmp_path / "schemas" / f"{guild.id}.json") as f:
+        assert stages["schema_file"]["bytes_written"] == len(f.read())
+
+    profiler.write_json(str(tmp_path / "profile.json"))
+    with open(tmp_path / "profile.json") as f:
+        assert len(json.load(f)["stages"]) == len(stages)
+    assert "categories/overrides" in profiler.format_table()
+    logging.info("OK")
+
+
+def test_stage_without_profiler():
+    logging.info("Entering a stage with no profiler active")
+    with stage("roles") as st:
+        st.objects += 1
+
+    profiler = Profiler(trace_memory=False)
+    with profiler.active():
+        pass
+    assert profiler.stages == {}
+    logging.info("OK")
+
+
+def test_emoji_download_stage(tmp_path):
+    logging.info("Profiling the emoji downloads of dump_server")
+    guild = generate_guild(emojis=4, members=0, asset_dir=str(tmp_path / "assets"))
+
+    profiler = Profiler()
+    with profiler.active():
+        dse.dump_server(
+            guild,
+            export_emojis=True,
+            export_server_icon=False,
+            export_files_dir=str(tmp_path / "export"),
+        )
+
+    # Recorded by dump_server once the download thread is joined, not by the
+    # thread itself under the emojis stage
+    stages = {record["name"]: record for record in profiler.report()["stages"]}
+    assert "emojis/emoji_downloads" not in stages
+    downloads = stages["emoji_downloads"]
+    assert downloads["calls"] == 1
+    assert downloads["objects"] == 4
+    assert downloads["bytes_written"] > 0
+    assert downloads["seconds"] > 0
+    assert downloads["mem_peak"] == 0
+    logging.info("OK")
+
+
+def test_overlapping_stages():
+    logging.info("Leaving the memory of concurrent stages out")
+
+    async def target():
+        with stage("target") as st:
+            data = [bytes(1000) for _ in range(100)]
+            await asyncio.sleep(0.01)
+            st.objects += len(data)
+
+    async def run():
+        await asyncio.gather(target(), target())
+        # Alone again
+        await target()
+
+    profiler = Profiler()
+    with profiler.active():
+        asyncio.run(run())
+
+    record = profiler.stages["target"]
+    assert record.calls == 3
+    assert record.mem_overlapped == 2
+    assert record.mem_peak > 100 * 1000
+    assert "*" in profiler.format_table()
+    logging.info("OK")
@@ -16,36 +16,28 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os
-import json
-import jsonschema
 import logging
 
 import discord
 import discord_server_exporter as dse
+from ds_validation import get_registry
 
 
 def test_role_schema_validation(gld: discord.Guild):
     logging.info("Running role schema validation test")
 
-    role_schema_path = "schemas/role_schema.json"
-    with open(role_schema_path) as f:
-        role_schema = json.load(f)
-
-    resolver = jsonschema.RefResolver(
-        "file:///" + os.getcwd() + "/schemas/", role_schema
-    )
+    registry = get_registry()
 
     biswas = dse.dump_roles(gld)
 
     for role in biswas:
-        jsonschema.validate(role, role_schema, resolver=resolver)
+        registry.validate(role, "role_schema")
 
     logging.info("OK")
     logging.info("Validate roles foregoing permissions export")
 
     biswas = dse.dump_roles(gld, False)
     for role in biswas:
-        jsonschema.validate(role, role_schema, resolver=resolver)
+        registry.validate(role, "role_schema")
 
     logging.info("OK")
@@ -0,0 +1,189 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import datetime
+import threading
+import http.server
+
+from ds_fixtures import generate_guild
+from ds_scheduler import (
+    SnapshotScheduler,
+    RetentionPolicy,
+    apply_retention,
+    snapshot_name,
+    write_snapshot,
+)
+
+
+class _SlowAssetHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(0.5)
+        body = b"\x89PNG\r\n\x1a\n" + self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_write_snapshot_waits_for_emojis(tmp_path):
+    logging.info("Writing a snapshot while the emoji downloads are slow")
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _SlowAssetHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        guild = generate_guild(emojis=3, members=5)
+        for emoji in guild.emojis:
+            emoji.url = f"http://127.0.0.1:{server.server_port}/emojis/{emoji.id}.png"
+        path = write_snapshot(guild, str(tmp_path), {"export_server_icon": False})
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    emoji_dir = os.path.join(path, "emojis", str(guild.id))
+    assert sorted(os.listdir(emoji_dir)) == sorted(
+        f"{e.name}.png" for e in guild.emojis
+    )
+    # Nothing was written after the snapshot was renamed
+    assert os.listdir(tmp_path / str(guild.id)) == [os.path.basename(path)]
+    logging.info("OK")
+
+
+class FakeBot:
+    def __init__(self, guilds):
+        self.guilds = guilds
+
+    def get_guild(self, guild_id):
+        return next((g for g in self.guilds if g.id == guild_id), None)
+
+
+def test_retention_policy():
+    logging.info("Selecting expired snapshots")
+    now = datetime.datetime(2021, 3, 1, 12, tzinfo=datetime.timezone.utc)
+    # Every 6 hours for 60 days
+    times = [now - datetime.timedelta(hours=6 * i) for i in range(240)]
+
+    policy = RetentionPolicy(keep_last=4, keep_daily=7, keep_weekly=4)
+    expired = set(policy.expired(times, now))
+    kept = sorted(set(times) - expired, reverse=True)
+
+    assert kept[:4] == times[:4]
+    # The newest of each of the last days and weeks, which overlap
+    recent_days = {when.date() for when in times[:29]}
+    assert recent_days <= {when.date() for when in kept}
+    recent_weeks = {when.isocalendar()[:2] for when in times[:113]}
+    assert recent_weeks == {when.isocalendar()[:2] for when in kept}
+    assert all(now - when <= datetime.timedelta(weeks=4) for when in kept)
+    logging.info("OK")
+
+
+def test_apply_retention(tmp_path):
+    logging.info("Deleting expired and partial snapshot folders")
+    now = datetime.datetime(2021, 3, 1, 12, tzinfo=datetime.timezone.utc)
+    for hours in range(0, 48, 6):
+        os.mkdir(tmp_path / snapshot_name(now - datetime.timedelta(hours=hours)))
+    os.mkdir(tmp_path / (snapshot_name(now) + ".partial"))
+    os.mkdir(tmp_path / "not a snapshot")
+
+    deleted = apply_retention(str(tmp_path), RetentionPolicy(2, 0, 0), now)
+    assert deleted == 7
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [
+            "not a snapshot",
+            snapshot_name(now),
+            snapshot_name(now - datetime.timedelta(hours=6)),
+        ]
+    )
+    logging.info("OK")
+
+
+def test_write_snapshot(tmp_path):
+    logging.info("Writing a snapshot of a synthetic guild")
+    guild = generate_guild(emojis=0)
+    path = write_snapshot(guild, str(tmp_path), {"export_server_icon": False})
+
+    assert os.path.dirname(path) == str(tmp_path / str(guild.id))
+    with open(os.path.join(path, "server.json")) as f:
+        assert json.load(f)["id"] == str(guild.id)
+    assert not any(
+        name.endswith(".partial") for name in os.listdir(os.path.dirname(path))
+    )
+    logging.info("OK")
+
+
+def test_scheduler_caps_and_prioritizes(tmp_path):
+    logging.info("Running the scheduler on a few synthetic guilds")
+    guilds = [generate_guild(members=5, emojis=0, seed=i) for i in range(6)]
+    for idx, guild in enumerate(guilds):
+        guild.id += idx  # generate_guild starts every guild at the same ID
+    exports = []
+    running = [0, 0]
+    lock = threading.Lock()
+
+    def export(guild, snapshot_dir, dump_kwargs):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        exports.append((time.monotonic(), guild.id))
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return os.path.join(snapshot_dir, str(guild.id))
+
+    scheduler = SnapshotScheduler(
+        FakeBot(guilds),
+        str(tmp_path),
+        interval=1.0,
+        jitter=0.1,
+        change_delay=0.0,
+        max_concurrent=2,
+        export=export,
+    )
+
+    async def run():
+        task = asyncio.ensure_future(scheduler.run())
+        await asyncio.sleep(0)
+        # Everything is spread over the first interval, but a change jumps ahead
+        scheduler.mark_changed(guilds[-1].id)
+        scheduler.mark_changed(guilds[-1].id)
+        await asyncio.sleep(1.5)
+        scheduler.stop()
+        await task
+
+    start = time.monotonic()
+    asyncio.run(run())
+
+    assert running[1] <= 2
+    assert scheduler.stats["max_running"] <= 2
+    assert scheduler.stats["failures"] == 0
+    # The changed guild went first, and only once for both events
+    assert exports[0][1] == guilds[-1].id
+    assert exports[0][0] - start < 0.5
+    # Every guild got its first snapshot within the first interval
+    first = {}
+    for when, guild_id in exports:
+        first.setdefault(guild_id, when)
+    assert set(first) == {guild.id for guild in guilds}
+    assert all(when - start < 1.2 for when in first.values())
+    logging.info("OK")
@@ -16,33 +16,30 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os
 import json
-import jsonschema
 import logging
 
 import discord
 import discord_server_exporter as dse
+from ds_validation import get_registry
 
 
 def test_server_schema_validation(gld: discord.Guild):
     logging.info("Running server schema validation test")
 
-    server_schema_path = "schemas/server_schema.json"
-    with open(server_schema_path) as f:
-        server_schema = json.load(f)
-
-    resolver = jsonschema.RefResolver(
-        "file:///" + os.getcwd() + "/schemas/", server_schema
-    )
+    registry = get_registry()
 
     server = dse.dump_server(gld)
 
-    jsonschema.validate(server, server_schema, resolver=resolver)
+    registry.validate_server(server)
 
     logging.info("OK")
     logging.info("Validate server with member export")
 
-    server = dse.dump_server(gld, True)
+    dse.dump_server(gld, export_members=True)
+    # Members are only in the schema file
+    with open(f"exported/schemas/{gld.id}.json") as f:
+        server = json.load(f)
+    assert len(server["members"]) == len(gld.members)
 
-    jsonschema.validate(server, server_schema, resolver=resolver)
+    registry.validate_server(server)
@@ -0,0 +1,220 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import json
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from ds_fixtures import generate_guild
+from ds_scheduler import write_snapshot
+from ds_shards import (
+    shard_of,
+    shard_ranges,
+    export_guilds,
+    merge_manifests,
+    export_sharded,
+    manifest_path,
+    IdentifyGate,
+)
+
+shard_count = 4
+
+
+def small_guild(n: int):
+    # Guild n is on shard n % shard_count
+    return generate_guild(
+        roles=5,
+        categories=2,
+        text_channels=4,
+        voice_channels=2,
+        members=20,
+        emojis=0,
+        seed=n,
+        first_id=n << 22,
+    )
+
+
+def test_shard_ranges():
+    logging.info("Splitting shards over workers")
+    assert shard_ranges(10, 3) == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert shard_ranges(2, 8) == [[0], [1]]
+    assert shard_ranges(5, 1) == [[0, 1, 2, 3, 4]]
+    assert shard_of(5 << 22, 4) == 1
+    assert shard_of((5 << 22) + 12345, 4) == 1
+    logging.info("OK")
+
+
+def test_export_guilds(tmp_path):
+    logging.info("Exporting the guilds of a shard range")
+    snapshot_dir = str(tmp_path)
+    guilds = [small_guild(n) for n in (1, 2, 5, 6)]
+
+    def export(guild, directory, dump_kwargs):
+        if guild.id == 5 << 22:
+            raise RuntimeError("no access")
+        return write_snapshot(guild, directory, dump_kwargs)
+
+    # Shards 1 and 2; guild 6 is on shard 2 too, guild 5 on shard 1
+    manifest = export_guilds(guilds, snapshot_dir, [2, 1], shard_count, export=export)
+    assert manifest["shard_ids"] == [1, 2]
+    entries = {entry["id"]: entry for entry in manifest["guilds"]}
+    assert set(entries) == {str(n << 22) for n in (1, 2, 5, 6)}
+    assert entries[str(5 << 22)]["error"] == "RuntimeError: no access"
+    snapshot = os.path.join(
+        snapshot_dir, entries[str(1 << 22)]["snapshot"], "server.json"
+    )
+    with open(snapshot) as f:
+        assert json.load(f)["id"] == str(1 << 22)
+
+    with open(manifest_path(snapshot_dir, [1, 2])) as f:
+        assert json.load(f) == manifest
+    logging.info("OK")
+
+
+def test_merge_manifests(tmp_path):
+    logging.info("Merging shard manifests into one index")
+    snapshot_dir = str(tmp_path)
+    export_guilds([small_guild(1), small_guild(4)], snapshot_dir, [0, 1], shard_count)
+    index = merge_manifests(snapshot_dir)
+    assert index["missing_shards"] == [2, 3]
+    assert set(index["guilds"]) == {str(1 << 22), str(4 << 22)}
+    assert index["shards"]["1"]["servers"] == 1
+
+    def failing(guild, directory, dump_kwargs):
+        raise RuntimeError("gone")
+
+    # A later run of the same range replaces its entries
+    export_guilds([small_guild(1)], snapshot_dir, [0, 1], shard_count, export=failing)
+    export_guilds([small_guild(2)], snapshot_dir, [2, 3], shard_count)
+    index = merge_manifests(snapshot_dir)
+    assert index["missing_shards"] == []
+    assert set(index["guilds"]) == {str(2 << 22)}
+    assert set(index["failed"]) == {str(1 << 22)}
+    assert index["shards"]["0"]["servers"] == 0
+    with open(tmp_path / "index.json") as f:
+        assert json.load(f) == index
+    logging.info("OK")
+
+
+# Stands in for run_worker, which connects to Discord
+def fake_worker(token, shard_ids, count, snapshot_dir, dump_kwargs, gate):
+    assert gate.max_concurrency == 1
+    guilds = [small_guild(n) for n in range(8) if shard_of(n << 22, count) in shard_ids]
+    export_guilds(guilds, snapshot_dir, shard_ids, count, dump_kwargs)
+    return manifest_path(snapshot_dir, shard_ids)
+
+
+def test_export_sharded(tmp_path):
+    logging.info("Exporting shard ranges in worker processes")
+    snapshot_dir = str(tmp_path)
+    index = export_sharded(
+        "token",
+        snapshot_dir,
+        shard_count=shard_count,
+        workers=2,
+        dump_kwargs={"export_members": True},
+        worker=fake_worker,
+    )
+    assert index["missing_shards"] == []
+    assert set(index["guilds"]) == {str(n << 22) for n in range(8)}
+    assert {index["guilds"][str(n << 22)]["shard"] for n in range(8)} == set(range(4))
+
+    pids = set()
+    for shard_ids in shard_ranges(shard_count, 2):
+        with open(manifest_path(snapshot_dir, shard_ids)) as f:
+            pids.add(json.load(f)["pid"])
+    assert len(pids) == 2 and os.getpid() not in pids
+    logging.info("OK")
+
+
+def emoji_worker(token, shard_ids, count, snapshot_dir, dump_kwargs, gate):
+    guilds = [
+        generate_guild(
+            roles=2,
+            categories=1,
+            text_channels=1,
+            voice_channels=1,
+            members=2,
+            emojis=3,
+            seed=n,
+            first_id=n << 22,
+            asset_dir=os.path.join(snapshot_dir, "assets", str(n)),
+        )
+        for n in range(4)
+        if shard_of(n << 22, count) in shard_ids
+    ]
+    export_guilds(guilds, snapshot_dir, shard_ids, count, dump_kwargs)
+    return manifest_path(snapshot_dir, shard_ids)
+
+
+def test_export_sharded_emojis(tmp_path):
+    logging.info("Exporting emojis from worker processes")
+    snapshot_dir = str(tmp_path)
+    index = export_sharded(
+        "token",
+        snapshot_dir,
+        shard_count=shard_count,
+        workers=2,
+        dump_kwargs={"export_server_icon": False},
+        worker=emoji_worker,
+    )
+    assert len(index["guilds"]) == 4
+    for guild_id, entry in index["guilds"].items():
+        # Every snapshot the manifests call done has its emojis
+        emoji_dir = os.path.join(snapshot_dir, entry["snapshot"], "emojis", guild_id)
+        assert len(os.listdir(emoji_dir)) == 3
+    logging.info("OK")
+
+
+def identify_shards(gate, shard_ids):
+    starts = []
+    for shard_id in shard_ids:
+        gate.wait(shard_id)
+        starts.append((shard_id, time.time()))
+    return starts
+
+
+def test_identify_gate():
+    logging.info("Spacing identifies of worker processes")
+    interval = 0.3
+    with multiprocessing.Manager() as manager, ProcessPoolExecutor(
+        max_workers=4
+    ) as pool:
+        gate = IdentifyGate(manager, max_concurrency=2, interval=interval)
+        futures = [
+            pool.submit(identify_shards, gate, shard_ids)
+            for shard_ids in shard_ranges(8, 4)
+        ]
+        starts = [start for future in futures for start in future.result()]
+
+    for bucket in range(2):
+        times = sorted(t for shard_id, t in starts if shard_id % 2 == bucket)
+        assert len(times) == 4
+        # Small margin for the clocks of the processes
+        assert all(b - a >= interval - 0.01 for a, b in zip(times, times[1:]))
+    # The buckets start sessions at the same time
+    first = [
+        min(t for shard_id, t in starts if shard_id % 2 == bucket)
+        for bucket in range(2)
+    ]
+    assert abs(first[0] - first[1]) < interval
+    logging.info("OK")
@@ -0,0 +1,122 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import copy
+import json
+import logging
+
+import ds_store
+import discord_server_exporter as dse
+from ds_store import SnapshotStore, flatten_server, assemble_server, assign_ordinals
+from ds_validation import get_registry
+
+
+def dump(gld):
+    # Members are only exported to the schema file
+    dse.dump_server(
+        gld, export_emojis=False, export_server_icon=False, export_members=True
+    )
+    with open(f"exported/schemas/{gld.id}.json") as f:
+        return json.load(f)
+
+
+def test_flatten_round_trip(gld):
+    logging.info("Splitting a server into entities and back")
+    server = dump(gld)
+    rows = flatten_server(server)
+    kinds = {row[0] for row in rows}
+    assert {ds_store.ROLE, ds_store.TEXT_CHANNEL, ds_store.ROLE_OVERRIDE} <= kinds
+    assert assemble_server(copy.deepcopy(rows)) == server
+    logging.info("OK")
+
+
+def test_assign_ordinals():
+    logging.info("Keeping ordinals of entities that did not move")
+    # 3 moved to the front, 5 is new
+    res = assign_ordinals([3.0, 0.0, 1.0, None, 2.0, 4.0])
+    assert res[1:3] == [0.0, 1.0] and res[4:] == [2.0, 4.0]
+    assert res == sorted(res) and len(set(res)) == len(res)
+    assert assign_ordinals([None, None]) == [0.0, 1.0]
+    assert assign_ordinals([]) == []
+    logging.info("OK")
+
+
+def test_store_versions_and_history(gld, tmp_path):
+    logging.info("Storing three snapshots with a few changes between them")
+    store = SnapshotStore(str(tmp_path / "snapshots.db"))
+    first = dump(gld)
+
+    second = copy.deepcopy(first)
+    role = second["roles"][3]
+    role["permission_value"] = "8"
+    del second["members"][0]
+    second["categories"][1]["text_channels"][0]["topic"] = "changed"
+
+    third = copy.deepcopy(second)
+    role_id = role["id"]
+    third["roles"][3]["permission_value"] = first["roles"][3]["permission_value"]
+
+    ids = [
+        store.add_snapshot(first, 100.0),
+        store.add_snapshot(second, 200.0),
+        store.add_snapshot(copy.deepcopy(second), 300.0),
+        store.add_snapshot(third, 400.0),
+    ]
+
+    # Unchanged entities were not written again
+    changed = dict(store._db.execute("SELECT id, changed FROM snapshots").fetchall())
+    assert changed[ids[0]] == len(flatten_server(first))
+    # role, member, channel, and nothing for the identical snapshot
+    assert changed[ids[1]] == 1 * 2 + 1 + 1 * 2
+    assert changed[ids[2]] == 0
+
+    for snapshot_id, server in zip(ids, (first, second, second, third)):
+        loaded = store.load_snapshot(snapshot_id)
+        assert loaded == server
+        get_registry().validate_server(loaded)
+
+    assert store.snapshot_at(gld.id, 250) == ids[1]
+    assert store.snapshot_at(gld.id, 50) is None
+
+    history = store.entity_history(gld.id, ds_store.ROLE, role_id)
+    assert [(h["taken_at"], h["value"]["permission_value"]) for h in history] == [
+        (100.0, first["roles"][3]["permission_value"]),
+        (200.0, "8"),
+        (400.0, first["roles"][3]["permission_value"]),
+    ]
+    member_history = store.entity_history(
+        gld.id, ds_store.MEMBER, first["members"][0]["id"]
+    )
+    assert [h["taken_at"] for h in member_history] == [100.0, 200.0]
+    assert member_history[-1]["value"] is None
+    store.close()
+    logging.info("OK")
+
+
+def test_add_file(gld, tmp_path):
+    logging.info("Adding a dumpall.py style file of several servers")
+    path = tmp_path / "servers.json"
+    server = dump(gld)
+    path.write_text(json.dumps([server, server]))
+
+    store = SnapshotStore(str(tmp_path / "snapshots.db"))
+    ids = store.add_file(str(path))
+    assert len(ids) == 2
+    assert store.load_snapshot(ids[1]) == server
+    store.close()
+    logging.info("OK")
@@ -0,0 +1,173 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import io
+import json
+import asyncio
+import logging
+import tempfile
+
+import ds_stream
+import discord_server_importer as dsi
+from ds_container import write_container
+
+
+def _server(member_count: int) -> dict:
+    return {
+        "name": "stream test",
+        "id": "1",
+        "icon_url": "",
+        "voice_region": "us-west",
+        "join_broadcast": True,
+        "boost_broadcast": True,
+        "default_notifications": False,
+        "verification_level": 0,
+        "content_filter": 0,
+        "emojis": [],
+        "roles": [
+            {
+                "name": name,
+                "color": 0,
+                "mentionable": False,
+                "permission_value": "0",
+                "position": pos,
+                "id": str(pos + 10),
+                "hoist": False,
+            }
+            for pos, name in enumerate(("@everyone", "Member", "Admin"))
+        ],
+        "categories": [],
+        "members": [
+            {"name": f"user{i}", "discrim": "0001", "id": str(100 + i), "roles": []}
+            for i in range(member_count)
+        ],
+    }
+
+
+def test_stream_server_events():
+    logging.info("Running server stream parser test")
+
+    server = _server(50)
+    text = json.dumps(server, indent=1)
+
+    # A tiny chunk size makes values straddle chunk boundaries
+    rebuilt = {}
+    for kind, key, value in ds_stream.iter_server_events(io.StringIO(text), 7):
+        if kind == ds_stream.FIELD:
+            rebuilt[key] = value
+        elif kind == ds_stream.SECTION_START:
+            rebuilt[key] = []
+        elif kind == ds_stream.ITEM:
+            rebuilt[key].append(value)
+        elif kind == ds_stream.SECTION_END:
+            assert value == len(rebuilt[key])
+
+    assert rebuilt == server
+
+    logging.info("OK")
+
+
+class _Guild:
+    def __init__(self, name):
+        self.name = name
+        self.roles = [None]
+        self.created_roles = []
+
+    async def create_role(self, **kwargs):
+        self.created_roles.append(kwargs["name"])
+
+
+class _Bot:
+    def __init__(self):
+        self.guild = None
+
+    async def create_guild(self, name, region=None, icon=None):
+        self.guild = _Guild(name)
+        return self.guild
+
+
+def test_create_server_from_file():
+    logging.info("Running streaming import test")
+
+    seen = []
+
+    async def member_handler(guild, member):
+        seen.append(member["id"])
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as f:
+        json.dump(_server(3000), f)
+        f.flush()
+        bot = _Bot()
+        guild = asyncio.run(
+            dsi.create_server_from_file(
+                bot, f.name, member_handler=member_handler, queue_size=16
+            )
+        )
+
+    assert guild is bot.guild
+    # @everyone is not created, the rest are created top down
+    assert guild.created_roles == ["Admin", "Member"]
+    assert len(seen) == 3000
+
+    logging.info("OK")
+
+
+def test_create_server_from_sorted_file(tmp_path):
+    logging.info("Running streaming import test with the header after the sections")
+
+    seen = []
+
+    async def member_handler(guild, member):
+        seen.append(member["id"])
+
+    # Sorted keys put "name" and "voice_region" after every section
+    path = tmp_path / "sorted.json"
+    path.write_text(json.dumps(_server(200), sort_keys=True))
+    bot = _Bot()
+    guild = asyncio.run(
+        dsi.create_server_from_file(bot, str(path), member_handler=member_handler)
+    )
+
+    assert guild is bot.guild
+    assert guild.name == "stream test"
+    assert guild.created_roles == ["Admin", "Member"]
+    assert seen == [str(100 + i) for i in range(200)]
+
+    logging.info("OK")
+
+
+def test_create_server_from_container(tmp_path):
+    logging.info("Running streaming import test from a container")
+
+    seen = []
+
+    async def member_handler(guild, member):
+        seen.append(member["id"])
+
+    path = str(tmp_path / "server.dsx")
+    write_container(_server(300), path, member_shard_size=64)
+    bot = _Bot()
+    guild = asyncio.run(
+        dsi.create_server_from_file(bot, path, member_handler=member_handler)
+    )
+
+    assert guild is bot.guild
+    assert guild.created_roles == ["Admin", "Member"]
+    assert seen == [str(100 + i) for i in range(300)]
+
+    logging.info("OK")
@@ -16,30 +16,22 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os
-import json
-import jsonschema
 import logging
 
 import discord
 import discord_server_exporter as dse
+from ds_validation import get_registry
 
 
 def test_text_channel_schema_validation(gld: discord.Guild):
     logging.info("Running text channel schema validation test")
 
-    text_channel_schema_path = "schemas/text_channel_schema.json"
-    with open(text_channel_schema_path) as f:
-        text_channel_schema = json.load(f)
-
-    resolver = jsonschema.RefResolver(
-        "file:///" + os.getcwd() + "/schemas/", text_channel_schema
-    )
+    registry = get_registry()
 
     biswas = dse.dump_text_channels(gld)
 
     for text_channel in biswas:
-        jsonschema.validate(text_channel, text_channel_schema, resolver=resolver)
+        registry.validate(text_channel, "text_channel_schema")
 
     logging.info("OK")
     logging.info("Validate text channels foregoing role permissions export")
@@ -47,7 +39,7 @@ def test_text_channel_schema_validation(gld: discord.Guild):
     biswas = dse.dump_text_channels(gld, False, True)
 
     for text_channel in biswas:
-        jsonschema.validate(text_channel, text_channel_schema, resolver=resolver)
+        registry.validate(text_channel, "text_channel_schema")
 
     logging.info("OK")
     logging.info("Validate text channels foregoing user permissions export")
@@ -55,7 +47,7 @@ def test_text_channel_schema_validation(gld: discord.Guild):
     biswas = dse.dump_text_channels(gld, True, False)
 
     for text_channel in biswas:
-        jsonschema.validate(text_channel, text_channel_schema, resolver=resolver)
+        registry.validate(text_channel, "text_channel_schema")
 
     logging.info("OK")
     logging.info("Validate text channels foregoing both permissions export")
@@ -63,6 +55,6 @@ def test_text_channel_schema_validation(gld: discord.Guild):
     biswas = dse.dump_text_channels(gld, False, False)
 
     for text_channel in biswas:
-        jsonschema.validate(text_channel, text_channel_schema, resolver=resolver)
+        registry.validate(text_channel, "text_channel_schema")
 
     logging.info("OK")
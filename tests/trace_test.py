@@ -0,0 +1,86 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import asyncio
+import logging
+
+import discord_server_exporter as dse
+import discord_server_importer as dsi
+from bench_import import generate_server_dict
+from ds_fake_discord import FakeDiscordAPI, fake_discord
+from ds_trace import Tracer
+
+
+def test_export_trace(gld, tmp_path):
+    logging.info("Tracing dump_server on a synthetic guild")
+    tracer = Tracer()
+    with tracer.active():
+        dse.write_emojis_to_dir(gld, str(tmp_path))
+        dse.dump_server(gld, export_emojis=False, export_server_icon=False)
+
+    path = tmp_path / "trace.json"
+    tracer.write_json(str(path))
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+
+    spans = [event for event in events if event["ph"] == "X"]
+    names = {event["name"] for event in spans}
+    assert {"dump_server", "dump_categories", "conv_text_channel_obj"} <= names
+    assert {"get_permission_overrides", "write schema"} <= names
+    assert sum(event["name"] == "GET emoji" for event in spans) == len(gld.emojis)
+    assert sum(event["name"] == "write emoji" for event in spans) == len(gld.emojis)
+    for event in spans:
+        assert event["dur"] >= 0
+
+    # dump_server encloses everything it calls
+    outer = next(event for event in spans if event["name"] == "dump_server")
+    inner = next(event for event in spans if event["name"] == "dump_roles")
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    logging.info("OK")
+
+
+def test_import_trace():
+    logging.info("Tracing create_server against the fake API")
+    api = FakeDiscordAPI(window_scale=0.001)
+    tracer = Tracer()
+
+    async def run():
+        async with fake_discord(api) as bot:
+            server = generate_server_dict(
+                api, roles=4, categories=1, channels=2, emojis=2, overrides=1
+            )
+            api.reset_stats()
+            with tracer.active(), tracer.trace_client(bot):
+                await dsi.create_server(bot, server)
+
+    asyncio.run(run())
+
+    spans = [event for event in tracer.events if event["ph"] == "X"]
+    http = [event for event in spans if event["cat"] == "http"]
+    assert len(http) == api.stats["requests"]
+    assert any(event["name"] == "POST /guilds" for event in http)
+    assert sum(event["name"] == "fetch_emoji_bytes" for event in spans) == 2
+    assert {"roles", "categories", "emojis"} <= {
+        event["name"] for event in spans if event["cat"] == "stage"
+    }
+    # Lanes are named after their thread or task
+    lanes = [event for event in tracer.events if event["ph"] == "M"]
+    assert len(lanes) == len({event["tid"] for event in tracer.events})
+    logging.info("OK")
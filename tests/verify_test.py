@@ -0,0 +1,133 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import zipfile
+
+import discord_server_exporter as dse
+from ds_archive import ExportArchive, write_export_file, checksums_file, parse_checksums
+from ds_verify import verify_export, Problem
+
+
+def _export(gld, target):
+    dse.dump_server(
+        gld, export_emojis=True, export_server_icon=False, export_files_dir=target
+    )
+    write_export_file(target, f"icons/{gld.id}.png", b"icon")
+
+
+def test_checksums(gld, tmp_path):
+    logging.info("Listing written files in the checksum file")
+    write_export_file("exported", "icons/1.png", b"first")
+    write_export_file("exported", "icons/1.png", b"second")
+    with open(os.path.join("exported", checksums_file)) as f:
+        text = f.read()
+    # The format of sha256sum, the last line of a file counts
+    assert (
+        text.splitlines()[0] == hashlib.sha256(b"first").hexdigest() + "  icons/1.png"
+    )
+    assert parse_checksums(text) == {
+        "icons/1.png": hashlib.sha256(b"second").hexdigest()
+    }
+    logging.info("OK")
+
+
+def test_verify_folder(gld, tmp_path):
+    logging.info("Finding invalid, corrupt and missing files in an export folder")
+    _export(gld, "exported")
+    assert verify_export("exported") == []
+
+    emojis = [f"emojis/{gld.id}/{emoji.name}.png" for emoji in gld.emojis]
+    with open(os.path.join("exported", emojis[0]), "wb") as f:
+        f.write(b"not the emoji")
+    os.remove(os.path.join("exported", emojis[1]))
+    schema = os.path.join("exported", "schemas", f"{gld.id}.json")
+    with open(schema) as f:
+        server = json.load(f)
+    server["verification_level"] = "high"
+    with open(schema, "w") as f:
+        json.dump(server, f)
+
+    problems = verify_export("exported", workers=2, batch_size=4)
+    assert {(p.kind, p.path) for p in problems} == {
+        ("corrupt", emojis[0]),
+        ("missing", emojis[1]),
+        ("corrupt", f"schemas/{gld.id}.json"),
+        ("invalid", f"schemas/{gld.id}.json"),
+    }
+    invalid = [p for p in problems if p.kind == "invalid"][0]
+    assert invalid.detail == "'high' is not of type 'integer' at 'verification_level'"
+    # Serial and parallel runs agree
+    assert verify_export("exported", batch_size=4) == problems
+    logging.info("OK")
+
+
+def test_verify_missing_icon(gld, tmp_path):
+    logging.info("Finding an icon a schema references that is not exported")
+    _export(gld, "exported")
+    os.remove(os.path.join("exported", "icons", f"{gld.id}.png"))
+    schema = f"schemas/{gld.id}.json"
+    with open(os.path.join("exported", schema)) as f:
+        server = json.load(f)
+    server["icon_url"] = f"https://cdn.discordapp.com/icons/{gld.id}/icon.png"
+    # Written like the exporter does, so the schema itself is intact
+    write_export_file("exported", schema, json.dumps(server))
+
+    assert verify_export("exported") == [
+        Problem("missing", f"icons/{gld.id}", f"icon of '{schema}'"),
+        Problem("missing", f"icons/{gld.id}.png", f"listed in {checksums_file}"),
+    ]
+    logging.info("OK")
+
+
+def test_verify_without_sections(gld, tmp_path):
+    logging.info("Verifying a schema that leaves out the optional sections")
+    _export(gld, "exported")
+    schema = f"schemas/{gld.id}.json"
+    with open(os.path.join("exported", schema)) as f:
+        server = json.load(f)
+    for section in ("emojis", "roles", "categories"):
+        del server[section]
+    write_export_file("exported", schema, json.dumps(server))
+
+    # The emoji files are still checked against the checksum file
+    assert verify_export("exported") == []
+    logging.info("OK")
+
+
+def test_verify_archive(gld, tmp_path):
+    logging.info("Verifying an export archive in place")
+    path = str(tmp_path / "export.zip")
+    with ExportArchive(path) as archive:
+        _export(gld, archive)
+    assert verify_export(path, workers=2) == []
+
+    # Copy the archive without one emoji
+    emoji = f"emojis/{gld.id}/{gld.emojis[0].name}.png"
+    broken = str(tmp_path / "broken.zip")
+    with zipfile.ZipFile(path) as src, zipfile.ZipFile(broken, "w") as dst:
+        for info in src.infolist():
+            if info.filename != emoji:
+                dst.writestr(info, src.read(info))
+    assert verify_export(broken) == [
+        Problem("missing", emoji, "referenced by a schema")
+    ]
+    logging.info("OK")
@@ -16,30 +16,22 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os
-import json
-import jsonschema
 import logging
 
 import discord
 import discord_server_exporter as dse
+from ds_validation import get_registry
 
 
 def test_voice_channel_schema_validation(gld: discord.Guild):
     logging.info("Running voice channel schema validation test")
 
-    voice_channel_schema_path = "schemas/voice_channel_schema.json"
-    with open(voice_channel_schema_path) as f:
-        voice_channel_schema = json.load(f)
-
-    resolver = jsonschema.RefResolver(
-        "file:///" + os.getcwd() + "/schemas/", voice_channel_schema
-    )
+    registry = get_registry()
 
     biswas = dse.dump_voice_channels(gld)
 
     for voice_channel in biswas:
-        jsonschema.validate(voice_channel, voice_channel_schema, resolver=resolver)
+        registry.validate(voice_channel, "voice_channel_schema")
 
     logging.info("OK")
     logging.info("Validate voice_channels foregoing role permissions export")
@@ -47,7 +39,7 @@ def test_voice_channel_schema_validation(gld: discord.Guild):
     biswas = dse.dump_voice_channels(gld, False, True)
 
     for voice_channel in biswas:
-        jsonschema.validate(voice_channel, voice_channel_schema, resolver=resolver)
+        registry.validate(voice_channel, "voice_channel_schema")
 
     logging.info("OK")
     logging.info("Validate voice_channels foregoing user permissions export")
@@ -55,7 +47,7 @@ def test_voice_channel_schema_validation(gld: discord.Guild):
     biswas = dse.dump_voice_channels(gld, True, False)
 
     for voice_channel in biswas:
-        jsonschema.validate(voice_channel, voice_channel_schema, resolver=resolver)
+        registry.validate(voice_channel, "voice_channel_schema")
 
     logging.info("OK")
     logging.info("Validate voice_channels foregoing both permissions export")
@@ -63,6 +55,6 @@ def test_voice_channel_schema_validation(gld: discord.Guild):
     biswas = dse.dump_voice_channels(gld, False, False)
 
     for voice_channel in biswas:
-        jsonschema.validate(voice_channel, voice_channel_schema, resolver=resolver)
+        registry.validate(voice_channel, "voice_channel_schema")
 
     logging.info("OK")
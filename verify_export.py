@@ -0,0 +1,75 @@
+"""
+    Discord Server Exporter - exports and import servers as json
+    Copyright (C) 2021 telugu_boy
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Checks finished exports of dumpall.py: every schema file still validates,
+# and every icon and emoji it references, and every file in the export's
+# SHA256SUMS, is there and intact.  Without arguments every `exported_*`
+# folder and archive in the current folder is checked:
+#
+#     python verify_export.py [exported_<timestamp> ...] [--workers 8]
+
+import os
+import sys
+import glob
+import json
+import logging
+import argparse
+
+from ds_verify import verify_export
+
+LOG_LEVEL = logging.WARNING
+LOG_FORMAT = "[%(levelname)s] %(asctime)s %(name)s: %(message)s"
+LOG_DATE_FORMAT = "[%Y/%m/%d %H:%M:%S]"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify server exports")
+    parser.add_argument(
+        "exports", nargs="*", help="export folders or archives, defaults to exported_*"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="processes to verify with",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=64, help="files hashed per task"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="print one JSON object per problem"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+    exports = args.exports or sorted(glob.glob("exported_*"))
+    count = 0
+    for export in exports:
+        for problem in verify_export(export, args.workers, args.batch_size):
+            count += 1
+            if args.json:
+                print(json.dumps({"export": export, **problem._asdict()}))
+            else:
+                print(f"{export}: {problem.kind} {problem.path}: {problem.detail}")
+    # Exit with 1 if anything is wrong, like diff_servers.py
+    sys.exit(1 if count else 0)
+
+
+if __name__ == "__main__":
+    main()